@@ -2,7 +2,6 @@ from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 from pymongo import MongoClient
 from dotenv import load_dotenv
-from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, jwt_required, decode_token
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import os
@@ -17,6 +16,15 @@ import datetime
 import math
 import stripe
 import slugify
+from services.search_service import search_fields_update, refresh_search_terms
+from utils.http_cache import cached_response, invalidate_tags
+from utils.export_stream import export_response, EXPORT_FORMATS
+from utils.json_utils import json_response
+from utils.geo_utils import refresh_vehicle_coverage
+from utils.auth import role_claims, setup_collections as setup_auth_collections
+from services import password_service, booking_session_store, stripe_webhook_service, fleet_roster_service, association_service, busy_time_service, availability_bitmap_service, next_available_service, coverage_tiles_service
+password_service.start_pool()  # Antes de conectar a MongoDB y lanzar hilos
+from models.slot_claims import claim_slots, release_slots, RELEASED_STATUSES
 
 # Cargar variables de entorno
 load_dotenv()
@@ -24,7 +32,6 @@ load_dotenv()
 app = Flask(__name__)
 # Configurar CORS para permitir solicitudes desde el frontend
 CORS(app, resources={r"/*": {"origins": "*"}})
-bcrypt = Bcrypt(app)
 
 # Importar blueprints
 from routes.users import users_bp
@@ -76,6 +83,34 @@ reservation_incidents_collection = db['reservation_incidents']
 reservation_changes_collection = db['reservation_changes']
 communication_logs_collection = db['communication_logs']
 
+# Caché de roles para la autorización de administradores
+setup_auth_collections(db)
+
+# Sesiones del asistente de reserva (índice único y caducidad TTL)
+booking_session_store.setup_collection(db)
+
+# Bandeja de entrada de eventos de Stripe y workers que la procesan
+stripe_webhook_service.setup_collections(db)
+stripe_webhook_service.start_workers()
+
+# Modelo de lectura de la flota (vehículo + chófer principal) para rutas fijas
+fleet_roster_service.setup_collections(db)
+
+# Asociaciones atómicas entre colaboradores, vehículos y chóferes
+association_service.setup_collections(db)
+
+# Índices de la consulta canónica de solapamiento (reservas y horarios extra)
+busy_time_service.setup_collections(db)
+
+# Mapas de bits de disponibilidad por chófer y día (mapas de calor por zona)
+availability_bitmap_service.setup_collections(db)
+
+# Índice de próximas ventanas libres por chófer (horarios alternativos)
+next_available_service.setup_collections(db)
+
+# Índice de cobertura por celdas geohash (zonas y vehículos flexibles por celda)
+coverage_tiles_service.setup_collections(db)
+
 # Configuración de Stripe
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 stripe_webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
@@ -122,6 +157,11 @@ app.register_blueprint(routes_bp, url_prefix='/api/admin/routes')
 from models.reservations import setup_collections as setup_reservations_collections
 setup_reservations_collections(db)  # Inicializar colecciones de reservas avanzadas
 
+# Franjas reclamadas por chofer/vehículo (protección contra dobles reservas)
+from models.slot_claims import setup_collection as setup_slot_claims_collection, backfill_reservation_claims
+setup_slot_claims_collection(db)
+backfill_reservation_claims(db['reservations'])
+
 # Importar y registrar el blueprint de reservas
 from routes.bookings import bookings_bp, setup_collections as setup_bookings_collections
 setup_bookings_collections(db)  # Inicializar colecciones
@@ -271,8 +311,11 @@ def register():
     if existing_user:
         return jsonify({"error": "El usuario ya existe"}), 409
     
-    # Hashear la contraseña
-    hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+    # Hashear la contraseña (fuera del proceso web)
+    try:
+        hashed_password = password_service.hash_password(data['password'])
+    except password_service.PasswordServiceBusy as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
     
     # Crear nuevo usuario
     new_user = {
@@ -291,11 +334,13 @@ def register():
         }
     }
     
+    new_user.update(search_fields_update('users', new_user))
+    
     # Guardar usuario en la base de datos
     result = users_collection.insert_one(new_user)
     
     # Generar token de acceso
-    access_token = create_access_token(identity=str(result.inserted_id))
+    access_token = create_access_token(identity=str(result.inserted_id), additional_claims=role_claims(new_user))
     
     return jsonify({
         "message": "Usuario registrado exitosamente",
@@ -323,12 +368,24 @@ def login():
     if not user:
         return jsonify({"error": "Usuario no encontrado"}), 404
     
-    # Verificar contraseña
-    if not bcrypt.check_password_hash(user['password'], data['password']):
+    # Verificar contraseña (fuera del proceso web y con límite de intentos simultáneos por cuenta)
+    try:
+        with password_service.account_slot(data['email']):
+            password_ok = password_service.verify_password(user.get('password', ''), data['password'])
+    except password_service.TooManyConcurrentAttempts as e:
+        return jsonify({"error": str(e)}), 429, {'Retry-After': '1'}
+    except password_service.PasswordServiceBusy as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
+    
+    if not password_ok:
         return jsonify({"error": "Contraseña incorrecta"}), 401
     
+    # Actualizar el coste del hash si ha cambiado la configuración
+    if password_service.needs_rehash(user['password']):
+        password_service.rehash_in_background(users_collection, user['_id'], user['password'], data['password'])
+    
     # Generar token de acceso
-    access_token = create_access_token(identity=str(user['_id']))
+    access_token = create_access_token(identity=str(user['_id']), additional_claims=role_claims(user))
     
     return jsonify({
         "message": "Inicio de sesión exitoso",
@@ -408,6 +465,7 @@ def google_login():
                     'country_code': '',
                 }
             }
+            new_user.update(search_fields_update('users', new_user))
             result = users_collection.insert_one(new_user)
             user_id = result.inserted_id
             user = new_user
@@ -417,7 +475,7 @@ def google_login():
             user_id = user['_id']
 
         # Generar token de acceso
-        access_token = create_access_token(identity=str(user_id))
+        access_token = create_access_token(identity=str(user_id), additional_claims=role_claims(user))
 
         return jsonify({
             'message': 'Inicio de sesión con Google exitoso',
@@ -468,6 +526,7 @@ def complete_profile():
             'name': f"{data['first_name']} {data['last_name']}"
         }}
     )
+    refresh_search_terms(users_collection, 'users', ObjectId(current_user_id))
     
     if result.modified_count == 0:
         return jsonify({"error": "No se pudo actualizar el perfil"}), 400
@@ -546,6 +605,8 @@ def update_profile():
             {'_id': ObjectId(current_user_id)},
             {'$set': profile_update}
         )
+        if 'name' in profile_update:
+            refresh_search_terms(users_collection, 'users', ObjectId(current_user_id))
         
         if result.modified_count == 0:
             return jsonify({"error": "No se pudo actualizar el perfil"}), 400
@@ -706,22 +767,9 @@ def create_booking_session():
         if not all(k in data for k in ('from', 'duration', 'date', 'time')):
             return jsonify({"error": "Se requieren origen, duración, fecha y hora"}), 400
     
-    # Crear un ID único para la sesión
-    session_id = str(uuid.uuid4())
-    
-    # Agregar datos adicionales a la sesión
-    session_data = {
-        'session_id': session_id,
-        'created_at': datetime.datetime.utcnow(),
-        'expires_at': datetime.datetime.utcnow() + datetime.timedelta(hours=24),
-        'user_id': None,  # Puede ser anónimo o asociarse a un usuario más tarde
-        'booking_data': data,
-        'current_step': 'vehicle_selection',
-        'completed': False
-    }
-    
-    # Guardar la sesión en la base de datos
-    booking_sessions_collection.insert_one(session_data)
+    # Crear la sesión (con caducidad renovada en cada paso)
+    session = booking_session_store.create_session(data)
+    session_id = session['session_id']
     
     return jsonify({
         "message": "Sesión de reserva creada",
@@ -737,91 +785,33 @@ def update_booking_session(session_id):
     if not data:
         return jsonify({"error": "No se recibieron datos"}), 400
     
-    # Verificar si la sesión existe
-    session = booking_sessions_collection.find_one({'session_id': session_id})
-    if not session:
+    # Fusionar booking_data con $set por rutas y devolver la sesión en la misma operación
+    try:
+        updated_session = booking_session_store.update_session(
+            session_id,
+            booking_data=data.get('booking_data'),
+            current_step=data.get('current_step')
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if not updated_session:
         return jsonify({"error": "Sesión no encontrada"}), 404
     
-    # Actualizar los datos de la sesión
-    current_step = data.get('current_step', session.get('current_step'))
+    # Siguiente paso (útil para el frontend)
+    updated_session['next_step'] = booking_session_store.next_step(updated_session.get('current_step'))
     
-    # Crear el diccionario base para la actualización
-    update_fields = {
-        'current_step': current_step,
-        'updated_at': datetime.datetime.utcnow()
-    }
-
-    # Fusionar booking_data
-    existing_booking_data = session.get('booking_data', {})
-    if not isinstance(existing_booking_data, dict):
-        existing_booking_data = {} 
-        
-    new_booking_data = data.get('booking_data', {})
-    if isinstance(new_booking_data, dict):
-        update_fields['booking_data'] = {**existing_booking_data, **new_booking_data}
-    else:
-        # Si new_booking_data no es un dict, se mantienen los datos existentes sin cambios.
-        # Podrías añadir un log aquí si es un caso inesperado.
-        update_fields['booking_data'] = existing_booking_data
-
-    # Si es el último paso, marcar como completado
-    if current_step == 'payment_confirmation':
-        update_fields['completed'] = True
-    
-    # Actualizar la sesión en la base de datos
-    result = booking_sessions_collection.update_one(
-        {'session_id': session_id},
-        {'$set': update_fields}
-    )
-
-    if result.matched_count == 0:
-        return jsonify({"error": "Sesión no encontrada durante la actualización final"}), 404
-
-    # Después de actualizar, obtener la sesión completa para devolverla
-    updated_session = booking_sessions_collection.find_one({'session_id': session_id})
-    if not updated_session:
-        return jsonify({"error": "Error al recuperar la sesión después de actualizar"}), 500
-
-    # Formatear la sesión para la respuesta JSON
-    # Asegurarse de que _id es un string
-    if '_id' in updated_session:
-        updated_session['_id'] = str(updated_session['_id'])
-    
-    # Formatear campos de fecha a ISO string si son objetos datetime
-    for date_field in ['created_at', 'expires_at', 'updated_at']:
-        if date_field in updated_session and isinstance(updated_session[date_field], datetime.datetime):
-            updated_session[date_field] = updated_session[date_field].isoformat()
-    
-    # Determinar el siguiente paso (opcional, pero útil para el frontend)
-    next_step = None
-    steps = ['vehicle_selection', 'passenger_details', 'payment', 'payment_confirmation']
-    current_step_value = updated_session.get('current_step')
-    if current_step_value in steps:
-        current_index = steps.index(current_step_value)
-        if current_index < len(steps) - 1:
-            next_step = steps[current_index + 1]
-    updated_session['next_step'] = next_step
-    
-    return jsonify(updated_session), 200
+    return json_response(updated_session)
 
 @app.route('/api/booking/get-session/<session_id>', methods=['GET'])
 def get_booking_session(session_id):
     """Obtiene los datos de una sesión de reserva"""
-    # Verificar si la sesión existe
-    session = booking_sessions_collection.find_one({'session_id': session_id})
+    # Verificar si la sesión existe y no ha caducado
+    session = booking_session_store.get_session(session_id)
     if not session:
         return jsonify({"error": "Sesión no encontrada"}), 404
     
-    # Convertir ObjectId a string para serialización JSON
-    session['_id'] = str(session['_id'])
-    
-    # Formatear fechas para serialización JSON
-    session['created_at'] = session['created_at'].isoformat()
-    session['expires_at'] = session['expires_at'].isoformat()
-    if 'updated_at' in session:
-        session['updated_at'] = session['updated_at'].isoformat()
-    
-    return jsonify(session), 200
+    return json_response(session)
 
 @app.route('/api/booking/vehicle-options', methods=['GET'])
 def get_vehicle_options():
@@ -833,7 +823,7 @@ def get_vehicle_options():
     
     # Si no se proporciona ubicación pero sí un session_id, intentar obtener la ubicación de la sesión
     if (not lat or not lng) and session_id:
-        session = booking_sessions_collection.find_one({'session_id': session_id})
+        session = booking_session_store.get_session(session_id)
         if session and 'booking_data' in session:
             # Obtener detalles del lugar de origen si existe
             origin_place_id = session['booking_data'].get('from', {}).get('place_id')
@@ -1003,6 +993,7 @@ def get_vehicle_options():
         return jsonify({"error": f"Error inesperado: {str(e)}"}), 500
 
 @app.route('/api/vehicles/details/<vehicle_id>', methods=['GET'])
+@cached_response(tags=lambda vehicle_id: [f'vehicle:{vehicle_id}'], cache_control='public, max-age=300')
 def get_vehicle_details(vehicle_id):
     """Obtiene los detalles completos de un vehículo por su ID"""
     try:
@@ -1456,8 +1447,9 @@ def confirm_booking():
     session_id = data['session_id']
     
     try:
-        # Buscar la sesión en la base de datos
-        session = booking_sessions_collection.find_one({'session_id': session_id})
+        # Buscar la sesión (escribiendo antes los cambios pendientes en memoria)
+        booking_session_store.flush_session(session_id)
+        session = booking_session_store.get_session(session_id)
         if not session:
             return jsonify({"error": "Sesión no encontrada"}), 404
         
@@ -1642,20 +1634,44 @@ def confirm_booking():
             "updated_at": datetime.datetime.utcnow()
         }
         
+        # Duración estimada del servicio para reservar las franjas
+        trip_minutes = 60
+        if new_booking['trip_type'] == 'horas' and new_booking.get('duration'):
+            try:
+                trip_minutes = int(str(new_booking['duration']).split()[0]) * 60
+            except ValueError:
+                pass
+        
+        # Reclamar atómicamente las franjas del vehículo y del chofer antes de insertar
+        conflict = claim_slots(
+            'booking',
+            new_booking['booking_id'],
+            [('vehicle', new_booking['vehicle']['id']), ('driver', assigned_driver['id'] if assigned_driver else None)],
+            pickup_datetime,
+            pickup_datetime + datetime.timedelta(minutes=trip_minutes)
+        )
+        if conflict:
+            return jsonify({
+                "error": "El vehículo o el chofer ya no está disponible para el horario seleccionado",
+                "resource_type": conflict['resource_type'],
+                "conflicting_slot": conflict['bucket'].isoformat()
+            }), 409
+        
         # Insertar la reserva en la base de datos
-        result = bookings_collection.insert_one(new_booking)
+        try:
+            result = bookings_collection.insert_one(new_booking)
+        except Exception:
+            release_slots(new_booking['booking_id'])
+            raise
         
         # Actualizar la sesión para marcarla como completada y asociarla a la reserva
-        booking_sessions_collection.update_one(
-            {'session_id': session_id},
-            {'$set': {
-                'completed': True,
-                'booking_id': new_booking['booking_id'],
-                'payment_status': payment_status,
-                'stripe_payment_id': stripe_payment_intent_id,
-                'updated_at': datetime.datetime.utcnow()
-            }}
-        )
+        booking_session_store.update_session(session_id, extra_fields={
+            'completed': True,
+            'booking_id': new_booking['booking_id'],
+            'payment_status': payment_status,
+            'stripe_payment_id': stripe_payment_intent_id
+        })
+        booking_session_store.flush_session(session_id)
         
         # Devolver los detalles de la reserva
         return jsonify({
@@ -1760,7 +1776,44 @@ def get_user_bookings():
     except Exception as e:
         return jsonify({"error": f"Error al obtener reservas: {str(e)}"}), 500
 
+# Columnas de la exportación CSV de reservas del asistente
+BOOKING_EXPORT_COLUMNS = [
+    'booking_id', 'status', 'trip_type', 'pickup.datetime', 'pickup.location', 'dropoff',
+    'duration', 'vehicle.id', 'vehicle.name', 'driver.id',
+    'payment.method', 'payment.status', 'payment.amount', 'payment.currency',
+    'created_at', 'updated_at'
+]
+
+@app.route('/api/bookings/export', methods=['GET'])
+@jwt_required()
+def export_user_bookings():
+    """
+    Exporta en streaming (CSV o NDJSON) todas las reservas del usuario autenticado
+    Parámetros de consulta: format (csv | ndjson), gzip (1 para comprimir), status
+    """
+    try:
+        user_id = get_jwt_identity()
+        
+        export_format = request.args.get('format', 'ndjson').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": "Formato no soportado. Use 'csv' o 'ndjson'"}), 400
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+        
+        query = {"user_id": user_id}
+        status = request.args.get('status')
+        if status:
+            query["status"] = status
+        
+        cursor = bookings_collection.find(query, {"session_id": 0}).sort("created_at", -1)
+        
+        filename = f"reservas_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+        return export_response(cursor, export_format, filename, BOOKING_EXPORT_COLUMNS, compress)
+    
+    except Exception as e:
+        return jsonify({"error": f"Error al exportar reservas: {str(e)}"}), 500
+
 @app.route('/api/bookings/public/<booking_id>', methods=['GET'])
+@cached_response(tags=lambda booking_id: [f'booking:{booking_id}'])
 def get_public_booking_details(booking_id):
     """Obtiene detalles públicos de una reserva sin requerir autenticación (para compartir)"""
     try:
@@ -1868,6 +1921,9 @@ def cancel_booking(booking_id):
         if update_result.modified_count == 0:
             return jsonify({"error": "No se pudo cancelar la reserva"}), 500
         
+        invalidate_tags(f'booking:{booking_id}')
+        release_slots(booking_id)
+        
         # Devolver confirmación de cancelación
         return jsonify({
             "message": "Reserva cancelada correctamente",
@@ -1952,6 +2008,10 @@ def update_booking_status(booking_id):
         if update_result.modified_count == 0:
             return jsonify({"error": "No se pudo actualizar el estado de la reserva"}), 500
         
+        invalidate_tags(f'booking:{booking_id}')
+        if new_status in RELEASED_STATUSES:
+            release_slots(booking_id)
+        
         # Devolver confirmación
         return jsonify({
             "message": f"Estado de reserva actualizado a '{new_status}'",
@@ -2254,6 +2314,9 @@ def update_trip_location(booking_id):
                         'last_location_update': datetime.datetime.utcnow()
                     }}
                 )
+                refresh_vehicle_coverage(db, [vehicle_id])
+                coverage_tiles_service.on_vehicles_changed([vehicle_id])
+                invalidate_tags(f'vehicle:{vehicle_id}')
             except Exception as e:
                 print(f"Error al actualizar ubicación del vehículo: {e}")
         
@@ -2400,7 +2463,7 @@ def create_payment_intent():
 
 @app.route('/api/payment/webhook', methods=['POST'])
 def stripe_webhook():
-    """Maneja los webhooks de Stripe"""
+    """Recibe los webhooks de Stripe: verifica la firma, registra el evento y responde sin esperar a procesarlo"""
     payload = request.get_data(as_text=True)
     sig_header = request.headers.get('Stripe-Signature')
     
@@ -2421,69 +2484,12 @@ def stripe_webhook():
             # Otro error
             return jsonify({"error": str(e)}), 400
         
-        # Manejar los eventos
-        if event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-            session_id = payment_intent['metadata'].get('session_id')
-            
-            # Actualizar el estado de la reserva si el pago es exitoso
-            if session_id:
-                # Buscar la sesión en la base de datos
-                session = booking_sessions_collection.find_one({'session_id': session_id})
-                if session:
-                    # Actualizar la sesión con el ID de pago de Stripe
-                    booking_sessions_collection.update_one(
-                        {'session_id': session_id},
-                        {'$set': {
-                            'payment_status': 'succeeded',
-                            'stripe_payment_id': payment_intent['id'],
-                            'updated_at': datetime.datetime.utcnow()
-                        }}
-                    )
-                    
-                    # Si hay una reserva asociada, actualizarla también
-                    if 'booking_id' in session:
-                        bookings_collection.update_one(
-                            {'booking_id': session['booking_id']},
-                            {'$set': {
-                                'payment.status': 'succeeded',
-                                'payment.stripe_payment_id': payment_intent['id'],
-                                'payment.payment_method_details': payment_intent['payment_method_details'],
-                                'updated_at': datetime.datetime.utcnow()
-                            }}
-                        )
-        
-        elif event['type'] == 'payment_intent.payment_failed':
-            payment_intent = event['data']['object']
-            session_id = payment_intent['metadata'].get('session_id')
-            
-            # Actualizar el estado de la reserva si el pago falla
-            if session_id:
-                # Buscar la sesión en la base de datos
-                session = booking_sessions_collection.find_one({'session_id': session_id})
-                if session:
-                    # Actualizar la sesión con el error de pago
-                    booking_sessions_collection.update_one(
-                        {'session_id': session_id},
-                        {'$set': {
-                            'payment_status': 'failed',
-                            'payment_error': payment_intent['last_payment_error'],
-                            'updated_at': datetime.datetime.utcnow()
-                        }}
-                    )
-                    
-                    # Si hay una reserva asociada, actualizarla también
-                    if 'booking_id' in session:
-                        bookings_collection.update_one(
-                            {'booking_id': session['booking_id']},
-                            {'$set': {
-                                'payment.status': 'failed',
-                                'payment.error': payment_intent['last_payment_error'],
-                                'updated_at': datetime.datetime.utcnow()
-                            }}
-                        )
+        # Registrar el evento en la bandeja de entrada y confirmar de inmediato;
+        # los efectos se aplican en segundo plano (los reintentos de Stripe se descartan por id)
+        # (se guarda el JSON original ya verificado, como documento plano)
+        is_new = stripe_webhook_service.record_event(json.loads(payload))
         
-        return jsonify({'status': 'success'}), 200
+        return jsonify({'status': 'received' if is_new else 'duplicate'}), 200
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
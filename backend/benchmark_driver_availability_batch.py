@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la verificación de disponibilidad de chóferes por lotes.
+
+Construye el plan de un día del despachador: hasta 200 chóferes con agenda x 48
+franjas de 30 minutos de mañana (UTC). Compara la verificación anterior (una
+llamada a check_driver_availability por pareja: una consulta a la agenda más
+un recorrido de sus slots) con check_driver_availability_batch (una consulta
+$in de agendas y otra de reservas, y evaluación en memoria).
+
+Comprueba también que ninguna pareja rechazada por la agenda en la
+verificación anterior aparece como disponible en la verificación por lotes
+(la de lotes además descarta bloqueos de agenda y reservas).
+
+Uso:
+    python benchmark_driver_availability_batch.py [choferes] [franjas]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from models.drivers_agenda import setup_collection, check_driver_availability
+from services import busy_time_service
+from services.availability import check_driver_availability_batch
+
+# Cargar variables de entorno
+load_dotenv()
+
+MONGO_URI = os.getenv('MONGO_URI')
+
+if not MONGO_URI:
+    print("Error: Se requiere la variable de entorno MONGO_URI")
+    sys.exit(1)
+
+print("Conectando a MongoDB...")
+client = MongoClient(MONGO_URI)
+db = client['operiq']
+setup_collection(db)
+busy_time_service.setup_collections(db)
+
+
+def build_checks(driver_ids, slots):
+    """Parejas (chófer, franja de 30 minutos) del día siguiente"""
+    day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return [
+        {'driver_id': driver_id, 'start': day + timedelta(minutes=30 * i), 'end': day + timedelta(minutes=30 * (i + 1))}
+        for driver_id in driver_ids
+        for i in range(slots)
+    ]
+
+
+def run(drivers=200, slots=48):
+    driver_ids = [str(agenda['driver_id']) for agenda in db['drivers_agenda'].find({}, {'driver_id': 1}).limit(drivers)]
+    if not driver_ids:
+        print("❌ No hay agendas de chóferes en la base de datos")
+        return False
+
+    checks = build_checks(driver_ids, slots)
+    print(f"📦 {len(driver_ids)} chóferes x {slots} franjas = {len(checks)} verificaciones")
+
+    # check_driver_availability imprime el detalle de cada slot: se descarta la salida en ambos casos
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        legacy = [check_driver_availability(check['driver_id'], check['start'], check['end']) for check in checks]
+        legacy_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = check_driver_availability_batch(db, checks)
+        batch_elapsed = time.perf_counter() - start
+
+    reasons = {}
+    for result in batch['results']:
+        reasons[result['reason']] = reasons.get(result['reason'], 0) + 1
+    inconsistent = sum(1 for old, new in zip(legacy, batch['results']) if new['available'] and not old)
+
+    print(f"🐢 Una verificación por pareja: {legacy_elapsed * 1000:.0f} ms ({sum(legacy)} disponibles según la agenda)")
+    print(f"⚡ Verificación por lotes: {batch_elapsed * 1000:.0f} ms ({reasons.get(None, 0)} disponibles)")
+    print(f"📈 Mejora: x{legacy_elapsed / batch_elapsed:.1f}")
+    print("📋 Motivos: " + ", ".join(f"{reason or 'disponible'}: {count}" for reason, count in sorted(reasons.items(), key=lambda item: str(item[0]))))
+
+    if inconsistent:
+        print(f"❌ {inconsistent} parejas disponibles en lotes que la agenda rechaza")
+        return False
+
+    print("✅ Resultados coherentes con la verificación anterior")
+    return True
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    sys.exit(0 if run(*args) else 1)
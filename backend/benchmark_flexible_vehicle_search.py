@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la búsqueda de vehículos de ruta flexible.
+
+Crea en una base de datos aparte (operiq_benchmark) una flota sintética de
+vehículos flexibles alrededor de Madrid, con radios de disponibilidad de 5 a
+60 km, y compara para una serie de puntos de recogida:
+
+- La búsqueda anterior en dos fases: $nearSphere con un max_distance_km fijo
+  y filtro posterior en Python por availability_radius. Se mide con 10 km (el
+  valor por defecto, que pierde vehículos de radio grande) y con el radio
+  máximo de la flota (el único valor con el que encuentra todos).
+- find_nearby_vehicles: una consulta $geoIntersects sobre 'coverage_area'.
+
+Comprueba que la búsqueda nueva devuelve exactamente los vehículos cuyo
+radio cubre el punto (calculado por fuerza bruta).
+
+Uso:
+    python benchmark_flexible_vehicle_search.py [vehiculos] [busquedas]
+"""
+
+import os
+import random
+import sys
+import time
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from utils.geo_utils import FLEXIBLE_ROUTE_TYPE, calculate_distance, vehicle_coverage_area, find_nearby_vehicles
+
+# Cargar variables de entorno
+load_dotenv()
+
+MONGO_URI = os.getenv('MONGO_URI')
+
+if not MONGO_URI:
+    print("Error: Se requiere la variable de entorno MONGO_URI")
+    sys.exit(1)
+
+print("Conectando a MongoDB...")
+client = MongoClient(MONGO_URI)
+db = client['operiq_benchmark']
+
+CENTER = [-3.7038, 40.4168]  # Madrid
+SPREAD_DEGREES = 1.5
+MAX_RADIUS_KM = 60
+
+
+def random_point(rng):
+    return [CENTER[0] + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES),
+            CENTER[1] + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES)]
+
+
+def build_fleet(count, rng):
+    """Reemplaza la colección de vehículos de la base de datos de benchmark"""
+    db['vehicles'].drop()
+    db['vehicles'].create_index([('location', '2dsphere')])
+    db['vehicles'].create_index([('coverage_area', '2dsphere')])
+
+    vehicles = []
+    for index in range(count):
+        vehicle = {
+            'name': f'Vehículo {index}',
+            'location': {'type': 'Point', 'coordinates': random_point(rng)},
+            'availability_radius': float(rng.randint(5, MAX_RADIUS_KM)),
+            'available': True,
+            'availabilityType': FLEXIBLE_ROUTE_TYPE
+        }
+        vehicle['coverage_area'] = vehicle_coverage_area(vehicle)
+        vehicles.append(vehicle)
+    db['vehicles'].insert_many(vehicles)
+    return vehicles
+
+
+def legacy_search(coordinates, max_distance_km):
+    """Reproduce find_nearby_vehicles antes del cambio ($nearSphere + filtro en Python)"""
+    vehicles = list(db['vehicles'].find({
+        'location': {'$nearSphere': {'$geometry': {'type': 'Point', 'coordinates': coordinates},
+                                     '$maxDistance': max_distance_km * 1000}},
+        'available': True,
+        'availabilityType': FLEXIBLE_ROUTE_TYPE
+    }))
+    for vehicle in vehicles:
+        vehicle['distance_calculated'] = calculate_distance(coordinates, vehicle['location']['coordinates'])
+    return vehicles, [v for v in vehicles if v['distance_calculated'] <= v.get('availability_radius', max_distance_km)]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(count=10000, searches=200):
+    rng = random.Random(42)
+    print(f"📦 Creando {count} vehículos flexibles...")
+    fleet = build_fleet(count, rng)
+    points = [random_point(rng) for _ in range(searches)]
+
+    totals = {'legacy_10': 0.0, 'legacy_max': 0.0, 'coverage': 0.0}
+    fetched = {'legacy_10': 0, 'legacy_max': 0}
+    missed_10 = 0
+    mismatches = 0
+    returned = 0
+
+    for point in points:
+        expected = {v['name'] for v in fleet
+                    if calculate_distance(point, v['location']['coordinates']) <= v['availability_radius']}
+
+        (raw_10, found_10), elapsed = timed(legacy_search, point, 10)
+        totals['legacy_10'] += elapsed
+        fetched['legacy_10'] += len(raw_10)
+        missed_10 += len(expected - {v['name'] for v in found_10})
+
+        (raw_max, _), elapsed = timed(legacy_search, point, MAX_RADIUS_KM)
+        totals['legacy_max'] += elapsed
+        fetched['legacy_max'] += len(raw_max)
+
+        found, elapsed = timed(find_nearby_vehicles, db, point)
+        totals['coverage'] += elapsed
+        returned += len(found)
+        if {v['name'] for v in found} != expected:
+            mismatches += 1
+
+    print(f"🔎 {searches} búsquedas | vehículos que cubren el punto: {returned / searches:.0f} de media")
+    print(f"🐢 Dos fases con 10 km: {totals['legacy_10'] / searches * 1000:.1f} ms/búsqueda, "
+          f"{fetched['legacy_10'] / searches:.0f} leídos, {missed_10 / searches:.0f} perdidos de media")
+    print(f"🐢 Dos fases con {MAX_RADIUS_KM} km: {totals['legacy_max'] / searches * 1000:.1f} ms/búsqueda, "
+          f"{fetched['legacy_max'] / searches:.0f} leídos")
+    print(f"⚡ $geoIntersects sobre coverage_area: {totals['coverage'] / searches * 1000:.1f} ms/búsqueda")
+    print(f"📈 Mejora frente a dos fases con {MAX_RADIUS_KM} km: x{totals['legacy_max'] / totals['coverage']:.1f}")
+
+    db['vehicles'].drop()
+
+    if mismatches:
+        print(f"❌ {mismatches} búsquedas con resultados distintos de la fuerza bruta")
+        return False
+
+    print("✅ La búsqueda por área de cobertura devuelve exactamente los vehículos que cubren el punto")
+    return True
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    sys.exit(0 if run(*args) else 1)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memoria de la exportación de reservas en streaming.
+
+Recorre una exportación sintética de 1.000.000 de reservas (CSV o NDJSON,
+opcionalmente con gzip) consumiendo los bloques igual que lo haría el servidor
+WSGI, y mide con tracemalloc la memoria en uso cada 100.000 filas. Con el
+streaming la memoria debe mantenerse plana independientemente del número de
+filas. No necesita MongoDB ni arrancar la aplicación: solo importa
+utils.export_stream y los helpers del benchmark de serialización (que a su vez
+usan bson y flask, de requirements.txt).
+
+Uso:
+    python benchmark_reservations_export.py [filas] [csv|ndjson] [gzip]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from benchmark_reservations_serializer import build_reservation
+from utils.export_stream import export_chunks, RESERVATION_EXPORT_COLUMNS
+
+SAMPLE_EVERY = 100000
+
+
+def synthetic_cursor(rows, samples):
+    """Generador que simula un cursor de MongoDB y toma muestras de memoria"""
+    for i in range(rows):
+        if i % SAMPLE_EVERY == 0:
+            current, _ = tracemalloc.get_traced_memory()
+            samples.append((i, current))
+        yield build_reservation(i)
+
+
+def run(rows=1000000, export_format='csv', compress=False):
+    print(f"📦 Exportando {rows} reservas sintéticas ({export_format}{', gzip' if compress else ''})...")
+
+    samples = []
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    total_bytes = 0
+    for chunk in export_chunks(synthetic_cursor(rows, samples), export_format, RESERVATION_EXPORT_COLUMNS, compress):
+        total_bytes += len(chunk)
+
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for row, current in samples:
+        print(f"   fila {row:>9}: {current / 1024:8.1f} KiB en uso")
+
+    print(f"⏱️  Tiempo total: {elapsed:.1f} s ({rows / elapsed:.0f} filas/s)")
+    print(f"📄 Tamaño generado: {total_bytes / (1024 * 1024):.1f} MiB")
+    print(f"📈 Pico de memoria: {peak / 1024:.1f} KiB")
+
+    # Tras el arranque, la memoria no debe crecer con las filas exportadas
+    steady = [current for row, current in samples if row > 0]
+    if len(steady) > 1:
+        growth = max(steady) - min(steady)
+        print(f"🔁 Variación de memoria entre muestras: {growth / 1024:.1f} KiB")
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    export_format = sys.argv[2] if len(sys.argv) > 2 else 'csv'
+    compress = len(sys.argv) > 3 and sys.argv[3] == 'gzip'
+    run(rows, export_format, compress)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark de serialización del listado de reservas.
+
+Compara la conversión anterior (función recursiva por reserva + formateo manual
+de fechas + jsonify) con el codificador de una sola pasada de utils.json_utils
+sobre páginas sintéticas de 10.000 documentos. No necesita conexión a MongoDB.
+
+Uso:
+    python benchmark_reservations_serializer.py [documentos] [repeticiones]
+"""
+
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from utils.json_utils import dumps
+
+
+def build_reservation(i):
+    """Crea una reserva sintética con la forma de RESERVATION_EXAMPLE"""
+    now = datetime.utcnow()
+    return {
+        "_id": ObjectId(),
+        "code": f"B{1001 + i}",
+        "user_id": ObjectId(),
+        "service_type": "one_way",
+        "status": "pending",
+        "pickup": {
+            "location": "Aeropuerto Madrid Barajas T4",
+            "coordinates": [-3.5675, 40.4839],
+            "date": now + timedelta(hours=i),
+        },
+        "dropoff": {
+            "location": "Hotel Ritz Madrid",
+            "coordinates": [-3.6922, 40.4168],
+            "estimated_date": now + timedelta(hours=i, minutes=45),
+        },
+        "vehicle_id": ObjectId(),
+        "driver_id": ObjectId(),
+        "collaborator_id": ObjectId(),
+        "passengers": 2,
+        "special_requests": ["Agua embotellada", "Asistencia con equipaje"],
+        "payment": {"method": "credit_card", "status": "pending", "amount": 150.0, "currency": "EUR"},
+        "incident_history": [{"reported_by": {"type": "driver", "id": ObjectId()}, "created_at": now}],
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def legacy_serialize(reservations):
+    """Reproduce la conversión que hacía get_all_reservations antes del cambio"""
+    for reservation in reservations:
+        def convert_objectids(obj):
+            if isinstance(obj, ObjectId):
+                return str(obj)
+            elif isinstance(obj, dict):
+                return {k: convert_objectids(v) for k, v in obj.items()}
+            elif isinstance(obj, list):
+                return [convert_objectids(item) for item in obj]
+            else:
+                return obj
+
+        for key, value in list(reservation.items()):
+            reservation[key] = convert_objectids(value)
+
+        for date_field in ['created_at', 'updated_at']:
+            if date_field in reservation and isinstance(reservation[date_field], datetime):
+                reservation[date_field] = reservation[date_field].isoformat()
+
+        if 'pickup' in reservation and 'date' in reservation['pickup']:
+            if isinstance(reservation['pickup']['date'], datetime):
+                reservation['pickup']['date'] = reservation['pickup']['date'].isoformat()
+
+        if 'dropoff' in reservation and 'estimated_date' in reservation['dropoff']:
+            if reservation['dropoff']['estimated_date'] and isinstance(reservation['dropoff']['estimated_date'], datetime):
+                reservation['dropoff']['estimated_date'] = reservation['dropoff']['estimated_date'].isoformat()
+
+    # El formato anterior no convertía fechas anidadas como incident_history.created_at
+    return json.dumps({"reservations": reservations}, default=str)
+
+
+def run(documents=10000, repetitions=5):
+    print(f"📦 Generando {documents} reservas sintéticas...")
+    page = [build_reservation(i) for i in range(documents)]
+
+    legacy_times = []
+    single_pass_times = []
+
+    for _ in range(repetitions):
+        copy = [dict(r, pickup=dict(r["pickup"]), dropoff=dict(r["dropoff"])) for r in page]
+        start = time.perf_counter()
+        legacy_serialize(copy)
+        legacy_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        dumps({"reservations": page})
+        single_pass_times.append(time.perf_counter() - start)
+
+    legacy_best = min(legacy_times) * 1000
+    single_best = min(single_pass_times) * 1000
+
+    print(f"🐢 Conversión recursiva anterior: {legacy_best:.1f} ms")
+    print(f"⚡ Codificador de una sola pasada: {single_best:.1f} ms")
+    print(f"📈 Mejora: x{legacy_best / single_best:.1f}")
+
+
+if __name__ == '__main__':
+    docs = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    reps = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run(docs, reps)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark de conversión de agendas a hora local.
+
+Compara la conversión anterior (convert_utc_to_local por fecha, que resolvía la
+zona desde la dirección y creaba el objeto pytz en cada llamada) con
+TimezoneService.get_driver_availability_in_local_time, que resuelve la zona una
+vez y convierte todas las fechas en una pasada sobre la tabla de transiciones.
+Comprueba además que ambas dan exactamente el mismo resultado. No necesita
+conexión a MongoDB.
+
+Uso:
+    python benchmark_timezone_conversion.py [slots] [repeticiones]
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from services.timezone_service import TimezoneService
+
+ADDRESSES = [
+    "Paseo de la Castellana 259, Madrid, España",
+    "Avenida Reforma 222, Ciudad de México, CDMX, México",
+    "5th Avenue 350, New York, USA",
+]
+
+
+def build_agenda(slots):
+    """Crea una agenda sintética con slots de 4 horas que cruzan los cambios de horario"""
+    start = datetime(2026, 1, 1, 6, 0)
+    return {
+        "driver_id": "benchmark",
+        "availability": [
+            {
+                "start_date": start + timedelta(hours=9 * i),
+                "end_date": start + timedelta(hours=9 * i + 4),
+                "status": "available"
+            }
+            for i in range(slots)
+        ]
+    }
+
+
+def legacy_convert(utc_datetime, address):
+    """Reproduce convert_utc_to_local antes del cambio"""
+    timezone = pytz.timezone(TimezoneService.get_timezone_from_address(address))
+    if utc_datetime.tzinfo is None:
+        utc_datetime = pytz.UTC.localize(utc_datetime)
+    return utc_datetime.astimezone(timezone)
+
+
+def legacy_local_agenda(agenda, address):
+    """Reproduce get_driver_availability_in_local_time antes del cambio"""
+    local_agenda = agenda.copy()
+    local_agenda['availability'] = []
+    for slot in agenda['availability']:
+        local_slot = slot.copy()
+        local_slot['start_date'] = legacy_convert(slot['start_date'], address)
+        local_slot['end_date'] = legacy_convert(slot['end_date'], address)
+        local_agenda['availability'].append(local_slot)
+    return local_agenda
+
+
+def same_result(legacy, batch):
+    for old, new in zip(legacy['availability'], batch['availability']):
+        for field in ('start_date', 'end_date'):
+            if old[field] != new[field] or old[field].utcoffset() != new[field].utcoffset() \
+                    or old[field].tzname() != new[field].tzname():
+                return False
+    return len(legacy['availability']) == len(batch['availability'])
+
+
+def run(slots=1000, repetitions=20):
+    print(f"📦 Generando una agenda de {slots} slots...")
+    agenda = build_agenda(slots)
+    ok = True
+
+    for address in ADDRESSES:
+        legacy_times = []
+        batch_times = []
+
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            legacy = legacy_local_agenda(agenda, address)
+            legacy_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            batch = TimezoneService.get_driver_availability_in_local_time(agenda, address)
+            batch_times.append(time.perf_counter() - start)
+
+        legacy_best = min(legacy_times) * 1000
+        batch_best = min(batch_times) * 1000
+        matches = same_result(legacy, batch)
+        ok = ok and matches
+
+        print(f"\n🌍 {TimezoneService.resolve_timezone(address).zone}")
+        print(f"🐢 Conversión por fecha anterior: {legacy_best:.2f} ms")
+        print(f"⚡ Conversión en una pasada: {batch_best:.2f} ms")
+        print(f"📈 Mejora: x{legacy_best / batch_best:.1f} | {'✅ mismo resultado' if matches else '❌ resultados distintos'}")
+
+    return ok
+
+
+if __name__ == '__main__':
+    slots = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    reps = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    sys.exit(0 if run(slots, reps) else 1)
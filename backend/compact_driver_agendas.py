@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Compacta las agendas de chóferes convirtiendo slots repetidos en reglas semanales.
+
+Agrupa los slots de 'availability' por (día de la semana, hora de inicio,
+hora de fin, estado). Los grupos que se repiten cada semana durante al menos
+MIN_WEEKS semanas (con un mínimo de MIN_COVERAGE de las semanas cubiertas)
+pasan a ser una regla de 'recurrence.weekly'. Las semanas en que faltan se
+guardan en 'skip_dates' de esa regla, que solo la desactivan a ella (las
+excepciones de 'recurrence.exceptions' afectarían a todas las reglas del día).
+El resto de slots se quedan como slots explícitos, igual que los de los días
+que las excepciones o la vigencia ya existentes de la recurrencia recortarían.
+
+En las agendas con cubos diarios (storage='days') los slots se leen de
+drivers_agenda_days y los restantes se vuelven a escribir en sus cubos; los
+horarios extra no se compactan y se conservan tal cual.
+
+Las horas se conservan en UTC (igual que los slots), así que la expansión de
+las reglas reproduce exactamente los slots eliminados. Las agendas cuya
+recurrencia ya usa una zona horaria local con reglas o excepciones no se
+compactan: las reglas nuevas en UTC no pueden mezclarse con ellas.
+
+Uso:
+    python compact_driver_agendas.py            # Solo muestra el resultado
+    python compact_driver_agendas.py --apply    # Guarda las agendas compactadas
+"""
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+from pymongo import MongoClient
+
+MIN_WEEKS = 3
+MIN_COVERAGE = 0.75
+
+if not os.getenv('MONGO_URI'):
+    print("Error: Se requiere la variable de entorno MONGO_URI")
+    sys.exit(1)
+
+# Conectar a MongoDB
+client = MongoClient(os.getenv('MONGO_URI'))
+db = client['operiq']
+drivers_agenda_collection = db['drivers_agenda']
+
+# Lectura y escritura de los cubos diarios igual que la app (el script no importa la app Flask)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from models import drivers_agenda as agenda_model  # noqa: E402
+agenda_model.setup_collection(db)
+
+
+def slot_key(slot):
+    """Clave de agrupación de un slot, o None si no puede formar parte de una regla semanal"""
+    start, end = slot.get('start_date'), slot.get('end_date')
+    if not start or not end or end <= start or end - start >= timedelta(days=1):
+        return None
+    if start.second or start.microsecond or end.second or end.microsecond:
+        return None
+    return (start.weekday(), start.strftime('%H:%M'), end.strftime('%H:%M'), slot.get('status', 'available'))
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _window(day, start_time, end_time):
+    """Intervalo de una franja HH:MM en un día (las nocturnas terminan al día siguiente)"""
+    start = datetime.combine(day, datetime.strptime(start_time, '%H:%M').time())
+    end = datetime.combine(day, datetime.strptime(end_time, '%H:%M').time())
+    if end <= start:
+        end += timedelta(days=1)
+    return start, end
+
+
+def rule_blocked(recurrence, day, start_time, end_time):
+    """Indica si la vigencia o las excepciones de la recurrencia recortarían la franja ese día"""
+    if recurrence.get('valid_from') and day < _as_date(recurrence['valid_from']):
+        return True
+    if recurrence.get('valid_until') and day > _as_date(recurrence['valid_until']):
+        return True
+
+    start, end = _window(day, start_time, end_time)
+    for exception in recurrence.get('exceptions', []):
+        if _as_date(exception['date']) != day:
+            continue
+        if 'start_time' not in exception:
+            return True
+        cut_start, cut_end = _window(day, exception['start_time'], exception['end_time'])
+        if cut_start < end and cut_end > start:
+            return True
+    return False
+
+
+def compact_agenda(agenda):
+    """
+    Calcula la versión compactada de una agenda
+
+    Returns:
+        tuple: (recurrence, availability) resultantes, o None si la agenda no se puede compactar
+    """
+    recurrence = dict(agenda.get('recurrence') or {})
+    if recurrence.get('timezone'):
+        if recurrence.get('weekly') or recurrence.get('exceptions'):
+            return None
+        # Sin reglas previas, la recurrencia compactada queda en UTC como los slots
+        recurrence.pop('timezone')
+    weekly = list(recurrence.get('weekly', []))
+
+    groups = {}
+    remaining = []
+    for slot in agenda.get('availability', []):
+        key = slot_key(slot)
+        if key is None:
+            remaining.append(slot)
+        else:
+            groups.setdefault(key, []).append(slot)
+
+    for (weekday, start_time, end_time, status), slots in groups.items():
+        days = sorted({slot['start_date'].date() for slot in slots})
+        if len(days) != len(slots):
+            remaining.extend(slots)
+            continue
+
+        # Los días que la recurrencia existente recortaría se quedan como slots explícitos
+        usable = [day for day in days if not rule_blocked(recurrence, day, start_time, end_time)]
+        expected_weeks = (usable[-1] - usable[0]).days // 7 + 1 if usable else 0
+        if len(usable) < MIN_WEEKS or len(usable) < expected_weeks * MIN_COVERAGE:
+            remaining.extend(slots)
+            continue
+
+        present = set(usable)
+        remaining.extend(slot for slot in slots if slot['start_date'].date() not in present)
+        skip_dates = [
+            (usable[0] + timedelta(weeks=week)).isoformat()
+            for week in range(expected_weeks)
+            if usable[0] + timedelta(weeks=week) not in present
+        ]
+        rule = {
+            'days': [weekday],
+            'start_time': start_time,
+            'end_time': end_time,
+            'status': status,
+            'valid_from': usable[0].isoformat(),
+            'valid_until': usable[-1].isoformat()
+        }
+        if skip_dates:
+            rule['skip_dates'] = skip_dates
+        weekly.append(rule)
+
+    recurrence['weekly'] = weekly
+    recurrence.setdefault('exceptions', [])
+    remaining.sort(key=lambda slot: slot.get('start_date') or datetime.min)
+    return recurrence, remaining
+
+
+def load_agenda(agenda):
+    """
+    Agenda con los slots a compactar en 'availability'
+
+    En las agendas con cubos diarios se leen los slots de sus cubos y se dejan
+    fuera los horarios extra, que replace_bucket_slots conserva al escribir.
+    """
+    if agenda.get('storage') != agenda_model.BUCKETED_STORAGE:
+        return agenda
+    agenda = agenda_model.get_driver_agenda(str(agenda['driver_id']))
+    if agenda is None:
+        return None
+    agenda['availability'] = [slot for slot in agenda.get('availability', []) if slot.get('type') != 'extra']
+    return agenda
+
+
+def run(apply=False):
+    total_before = total_after = 0
+    compacted = 0
+
+    for agenda in drivers_agenda_collection.find({'$or': [
+        {'availability.0': {'$exists': True}},
+        {'storage': agenda_model.BUCKETED_STORAGE}
+    ]}):
+        agenda = load_agenda(agenda)
+        if agenda is None or not agenda.get('availability'):
+            continue
+        before = len(agenda.get('availability', []))
+        compacted_agenda = compact_agenda(agenda)
+        if compacted_agenda is None:
+            print(f"⚠️  Conductor {agenda['driver_id']}: recurrencia con zona horaria "
+                  f"{agenda['recurrence']['timezone']}, no se compacta")
+            total_before += before
+            total_after += before
+            continue
+        recurrence, availability = compacted_agenda
+        after = len(availability)
+        total_before += before
+        total_after += after
+
+        if after == before:
+            continue
+
+        compacted += 1
+        print(f"👤 Conductor {agenda['driver_id']}: {before} slots → {after} slots + "
+              f"{len(recurrence['weekly'])} reglas")
+
+        if apply:
+            fields = {'recurrence': recurrence, 'updated_at': datetime.utcnow()}
+            if agenda.get('storage') == agenda_model.BUCKETED_STORAGE:
+                agenda_model.replace_bucket_slots(agenda['driver_id'], availability)
+            else:
+                fields['availability'] = availability
+            drivers_agenda_collection.update_one({'_id': agenda['_id']}, {'$set': fields})
+
+    print(f"\n📊 Agendas compactadas: {compacted} | slots explícitos: {total_before} → {total_after}")
+    if not apply:
+        print("ℹ️  Ejecución de prueba: use --apply para guardar los cambios")
+
+
+if __name__ == '__main__':
+    run(apply='--apply' in sys.argv[1:])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Migra los slots explícitos de las agendas de chóferes a cubos diarios.
+
+Cada agenda que todavía guarda sus slots en el array 'availability' pasa a
+guardarlos en drivers_agenda_days (un documento por chófer y día, con índice
+único (driver_id, day)), se marca con storage='days' y se elimina el array.
+Las reglas de recurrencia se quedan en la agenda.
+
+También convierte los documentos sueltos por fecha que dejaba el flujo de
+horarios extra (driver_id como cadena, 'date' y 'available_time_slots' con
+'start_time'/'end_time' en HH:MM) en slots de los cubos y los elimina de
+drivers_agenda.
+
+Uso:
+    python migrate_agenda_buckets.py                  # Solo muestra el resultado
+    python migrate_agenda_buckets.py --apply          # Migra las agendas
+    python migrate_agenda_buckets.py --apply --keep-legacy
+                                                      # Conserva una copia en 'legacy_availability'
+"""
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+if not os.getenv('MONGO_URI'):
+    print("Error: Se requiere la variable de entorno MONGO_URI")
+    sys.exit(1)
+
+# Conectar a MongoDB
+client = MongoClient(os.getenv('MONGO_URI'))
+db = client['operiq']
+drivers_agenda_collection = db['drivers_agenda']
+drivers_agenda_days_collection = db['drivers_agenda_days']
+
+# Mismas reglas que models.drivers_agenda (el script no importa la app Flask)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from models.drivers_agenda import BUCKETED_STORAGE, slot_bucket_operations  # noqa: E402
+
+
+def legacy_day_slots(document):
+    """Convierte un documento suelto por fecha en slots con el formato de la agenda"""
+    slots = []
+    day = str(document.get('date'))[:10]
+    for time_slot in document.get('available_time_slots', []):
+        try:
+            start = datetime.strptime(f"{day} {time_slot['start_time']}", "%Y-%m-%d %H:%M")
+            end = datetime.strptime(f"{day} {time_slot['end_time']}", "%Y-%m-%d %H:%M")
+        except (KeyError, TypeError, ValueError):
+            continue
+        if end <= start:
+            continue
+        slot = {
+            'start_date': start,
+            'end_date': end,
+            'status': 'available',
+            'type': time_slot.get('type', 'extra'),
+            'created_by_admin': time_slot.get('created_by_admin', True)
+        }
+        if time_slot.get('extra_schedule_id'):
+            slot['extra_schedule_id'] = time_slot['extra_schedule_id']
+        slots.append(slot)
+    return slots
+
+
+def run(apply=False, keep_legacy=False):
+    drivers_agenda_days_collection.create_index([('driver_id', 1), ('day', 1)], unique=True)
+
+    migrated = slots_moved = buckets_touched = 0
+    for agenda in drivers_agenda_collection.find({'storage': {'$ne': BUCKETED_STORAGE}, 'date': {'$exists': False}}):
+        availability = [slot for slot in agenda.get('availability', [])
+                        if slot.get('start_date') and slot.get('end_date')]
+        operations = slot_bucket_operations(agenda['driver_id'], availability)
+
+        migrated += 1
+        slots_moved += len(availability)
+        buckets_touched += len(operations)
+        print(f"👤 Conductor {agenda['driver_id']}: {len(availability)} slots → {len(operations)} cubos diarios")
+
+        if apply:
+            if operations:
+                drivers_agenda_days_collection.bulk_write(operations, ordered=False)
+            update = {
+                '$set': {'storage': BUCKETED_STORAGE, 'updated_at': datetime.utcnow()},
+                '$unset': {'availability': ''}
+            }
+            if keep_legacy:
+                update['$set']['legacy_availability'] = agenda.get('availability', [])
+            drivers_agenda_collection.update_one({'_id': agenda['_id']}, update)
+
+    # Documentos sueltos por fecha del flujo antiguo de horarios extra
+    legacy_docs = 0
+    for document in drivers_agenda_collection.find({'date': {'$exists': True}, 'available_time_slots': {'$exists': True}}):
+        driver_id = document.get('driver_id')
+        if not ObjectId.is_valid(str(driver_id)):
+            print(f"⚠️  Documento {document['_id']} con driver_id no válido: {driver_id}")
+            continue
+
+        slots = legacy_day_slots(document)
+        operations = slot_bucket_operations(ObjectId(str(driver_id)), slots)
+        legacy_docs += 1
+        slots_moved += len(slots)
+        buckets_touched += len(operations)
+        print(f"📅 Documento por fecha {document['_id']} ({driver_id}): {len(slots)} slots")
+
+        if apply:
+            if operations:
+                drivers_agenda_days_collection.bulk_write(operations, ordered=False)
+            drivers_agenda_collection.delete_one({'_id': document['_id']})
+
+    print(f"\n📊 Agendas migradas: {migrated} | documentos por fecha: {legacy_docs} | "
+          f"slots: {slots_moved} | operaciones sobre cubos: {buckets_touched}")
+    if not apply:
+        print("ℹ️  Ejecución de prueba: use --apply para guardar los cambios")
+
+
+if __name__ == '__main__':
+    run(apply='--apply' in sys.argv[1:], keep_legacy='--keep-legacy' in sys.argv[1:])
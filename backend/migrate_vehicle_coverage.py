@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Calcula el área de cobertura ('coverage_area') de los vehículos existentes.
+
+find_nearby_vehicles busca los vehículos de ruta flexible con $geoIntersects
+sobre el polígono que circunscribe su círculo de disponibilidad (ubicación +
+availability_radius). Este script crea el índice 2dsphere y guarda el polígono
+en los vehículos flexibles que todavía no lo tienen (o en todos con --all), y
+lo elimina de los vehículos que ya no son flexibles.
+
+Uso:
+    python migrate_vehicle_coverage.py                # Solo muestra el resultado
+    python migrate_vehicle_coverage.py --apply        # Guarda las áreas de cobertura
+    python migrate_vehicle_coverage.py --apply --all  # Recalcula también las existentes
+"""
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+
+from pymongo import MongoClient
+
+if not os.getenv('MONGO_URI'):
+    print("Error: Se requiere la variable de entorno MONGO_URI")
+    sys.exit(1)
+
+# Conectar a MongoDB
+client = MongoClient(os.getenv('MONGO_URI'))
+db = client['operiq']
+vehicles_collection = db['vehicles']
+
+# Mismas reglas que la app (el script no importa la app Flask)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.geo_utils import FLEXIBLE_ROUTE_TYPE, refresh_vehicle_coverage  # noqa: E402
+
+BATCH_SIZE = 500
+
+
+def run(apply=False, recompute_all=False):
+    query = {'$or': [
+        {'availabilityType': FLEXIBLE_ROUTE_TYPE} if recompute_all
+        else {'availabilityType': FLEXIBLE_ROUTE_TYPE, 'coverage_area': {'$exists': False}},
+        {'availabilityType': {'$ne': FLEXIBLE_ROUTE_TYPE}, 'coverage_area': {'$exists': True}}
+    ]}
+
+    vehicle_ids = [vehicle['_id'] for vehicle in vehicles_collection.find(query, {'_id': 1})]
+    without_location = vehicles_collection.count_documents({
+        'availabilityType': FLEXIBLE_ROUTE_TYPE, 'location.coordinates': {'$exists': False}
+    })
+    print(f"🚗 Vehículos a actualizar: {len(vehicle_ids)} | flexibles sin ubicación: {without_location}")
+
+    if not apply:
+        print("ℹ️  Ejecución de prueba: use --apply para guardar los cambios")
+        return
+
+    vehicles_collection.create_index([('coverage_area', '2dsphere')])
+    updated = 0
+    for index in range(0, len(vehicle_ids), BATCH_SIZE):
+        updated += refresh_vehicle_coverage(db, vehicle_ids[index:index + BATCH_SIZE])
+    print(f"✅ Áreas de cobertura actualizadas: {updated}")
+
+
+if __name__ == '__main__':
+    run(apply='--apply' in sys.argv[1:], recompute_all='--all' in sys.argv[1:])
@@ -1,19 +1,37 @@
 from flask import current_app
+from pymongo import DeleteOne, UpdateOne
 from pymongo.collection import Collection
 from bson import ObjectId
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+import pytz
 from services.timezone_service import TimezoneService
+from utils.cache import TTLCache
 
-# Variable para la colección, se inicializará en setup_collection
+# Variables para las colecciones, se inicializarán en setup_collection
 drivers_agenda_collection: Optional[Collection] = None
+# Slots explícitos en cubos de un documento por chofer y día (ver add_slots_to_buckets)
+drivers_agenda_days_collection: Optional[Collection] = None
+
+# Marca de las agendas cuyos slots explícitos viven en drivers_agenda_days
+BUCKETED_STORAGE = 'days'
+
+# Relecturas de los cubos si cambian mientras se sustituyen sus slots
+REPLACE_BUCKETS_ATTEMPTS = 3
+
+# Estados válidos de un slot o de una regla de la agenda
+AGENDA_STATUSES = ['available', 'busy', 'off']
+
+# Expansiones de reglas de recurrencia ya calculadas, por agenda, versión y rango de días
+_expansion_cache = TTLCache(ttl_seconds=600, max_entries=4096)
 
 def setup_collection(db):
-    """Inicializa la colección drivers_agenda y sus índices"""
-    global drivers_agenda_collection
+    """Inicializa las colecciones drivers_agenda y drivers_agenda_days y sus índices"""
+    global drivers_agenda_collection, drivers_agenda_days_collection
     
-    # Inicializar la colección
+    # Inicializar las colecciones
     drivers_agenda_collection = db['drivers_agenda']
+    drivers_agenda_days_collection = db['drivers_agenda_days']
     
     # Crear índices
     drivers_agenda_collection.create_index("driver_id")
@@ -21,24 +39,135 @@ def setup_collection(db):
         ("availability.start_date", 1),
         ("availability.end_date", 1)
     ])
+    # Un cubo por chofer y día; las ventanas se leen con un rango sobre 'day'
+    drivers_agenda_days_collection.create_index([("driver_id", 1), ("day", 1)], unique=True)
     
     return drivers_agenda_collection
 
-def validate_driver_agenda(data: Dict[str, Any]) -> tuple[bool, str]:
-    """Valida los datos de una agenda de chofer"""
-    required_fields = ['driver_id', 'availability']
+def bucket_day(moment: datetime) -> datetime:
+    """Día (medianoche) del cubo que contiene moment"""
+    return datetime(moment.year, moment.month, moment.day)
+
+def bucket_days(start: datetime, end: datetime) -> List[datetime]:
+    """Días de los cubos que toca el intervalo [start, end]"""
+    days = []
+    day = bucket_day(start)
+    while day <= end:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def _slots_by_day(slots: List[Dict[str, Any]]) -> Dict[datetime, List[Dict[str, Any]]]:
+    """Reparte los slots en sus cubos diarios, con un slot_id común por slot"""
+    by_day: Dict[datetime, List[Dict[str, Any]]] = {}
+    for slot in slots:
+        slot = {**slot, "slot_id": slot.get("slot_id") or ObjectId()}
+        for day in bucket_days(slot["start_date"], slot["end_date"]):
+            by_day.setdefault(day, []).append(slot)
+    return by_day
+
+def slot_bucket_operations(driver_id_obj: ObjectId, slots: List[Dict[str, Any]]) -> List[UpdateOne]:
+    """
+    Operaciones que añaden slots a sus cubos diarios
+
+    Un slot que abarca varios días se guarda completo en cada cubo que toca,
+    con un slot_id común para no duplicarlo al leer una ventana de varios días.
+    """
+    return _bucket_push_operations(driver_id_obj, _slots_by_day(slots))
+
+def _bucket_push_operations(driver_id_obj: ObjectId, by_day: Dict[datetime, List[Dict[str, Any]]]) -> List[UpdateOne]:
+    now = datetime.utcnow()
+    return [
+        UpdateOne(
+            {"driver_id": driver_id_obj, "day": day},
+            {"$push": {"slots": {"$each": day_slots}},
+             "$set": {"updated_at": now},
+             "$setOnInsert": {"created_at": now}},
+            upsert=True
+        )
+        for day, day_slots in by_day.items()
+    ]
+
+def add_slots_to_buckets(driver_id_obj: ObjectId, slots: List[Dict[str, Any]]):
+    """Guarda slots explícitos en drivers_agenda_days con un único bulk_write"""
+    operations = slot_bucket_operations(driver_id_obj, slots)
+    if operations:
+        drivers_agenda_days_collection.bulk_write(operations, ordered=False)
+
+def replace_bucket_slots(driver_id_obj: ObjectId, slots: List[Dict[str, Any]]):
+    """
+    Sustituye los slots explícitos (salvo los horarios extra) de los cubos de un chofer
+
+    Cada cubo se reescribe con un único $set de su array de slots, así que un
+    lector nunca ve un día vacío a mitad de la sustitución. Los cubos se
+    filtran por el updated_at leído: si otro proceso los cambia entre la
+    lectura y la escritura (p. ej. un horario extra nuevo) se vuelven a leer.
+    """
+    by_day = _slots_by_day(slots)
+    for _ in range(REPLACE_BUCKETS_ATTEMPTS):
+        now = datetime.utcnow()
+        operations = []
+        existing_days = set()
+        for bucket in drivers_agenda_days_collection.find(
+            {"driver_id": driver_id_obj}, {"day": 1, "slots": 1, "updated_at": 1}
+        ):
+            existing_days.add(bucket["day"])
+            day_slots = [slot for slot in bucket.get("slots", []) if slot.get("type") == "extra"]
+            day_slots += by_day.get(bucket["day"], [])
+            bucket_filter = {"_id": bucket["_id"], "updated_at": bucket.get("updated_at")}
+            if day_slots:
+                operations.append(UpdateOne(bucket_filter, {"$set": {"slots": day_slots, "updated_at": now}}))
+            else:
+                operations.append(DeleteOne(bucket_filter))
+        
+        applied = 0
+        if operations:
+            result = drivers_agenda_days_collection.bulk_write(operations, ordered=False)
+            applied = result.matched_count + result.deleted_count
+        
+        # Días nuevos: $push con upsert no pisa un cubo creado entre medias
+        new_days = {day: day_slots for day, day_slots in by_day.items() if day not in existing_days}
+        if new_days:
+            drivers_agenda_days_collection.bulk_write(_bucket_push_operations(driver_id_obj, new_days), ordered=False)
+        if applied == len(operations):
+            return
+    raise Exception("Los cubos de la agenda han cambiado durante la actualización; inténtelo de nuevo")
+
+def get_bucket_slots(driver_ids: List[ObjectId], window_start: datetime,
+                     window_end: datetime) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Lee los slots de los cubos de varios choferes en una ventana con una consulta por rango
+
+    Returns:
+        Dict[str, List[Dict[str, Any]]]: Slots (sin duplicados) por ID de chofer como string
+    """
+    if drivers_agenda_days_collection is None or not driver_ids:
+        return {}
     
+    slots: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+    for bucket in drivers_agenda_days_collection.find(
+        {"driver_id": {"$in": driver_ids}, "day": {"$gte": bucket_day(window_start), "$lte": window_end}},
+        {"driver_id": 1, "slots": 1}
+    ):
+        driver_slots = slots.setdefault(str(bucket["driver_id"]), {})
+        for slot in bucket.get("slots", []):
+            driver_slots.setdefault(slot.get("slot_id") or id(slot), slot)
+    return {driver_id: list(driver_slots.values()) for driver_id, driver_slots in slots.items()}
+
+def validate_driver_agenda(data: Dict[str, Any]) -> tuple[bool, str]:
+    """Valida los datos de una agenda de chofer (slots explícitos y/o reglas de recurrencia)"""
     # Verificar campos requeridos
-    for field in required_fields:
-        if field not in data:
-            return False, f"El campo '{field}' es requerido"
+    if 'driver_id' not in data:
+        return False, "El campo 'driver_id' es requerido"
+    if 'availability' not in data and 'recurrence' not in data:
+        return False, "Se requiere el campo 'availability' o 'recurrence'"
     
     # Validar que availability sea una lista
-    if not isinstance(data['availability'], list):
+    if not isinstance(data.get('availability', []), list):
         return False, "El campo 'availability' debe ser una lista"
     
     # Validar cada elemento de availability
-    for slot in data['availability']:
+    for slot in data.get('availability', []):
         if not isinstance(slot, dict):
             return False, "Cada elemento de 'availability' debe ser un objeto"
         
@@ -49,24 +178,333 @@ def validate_driver_agenda(data: Dict[str, Any]) -> tuple[bool, str]:
                 return False, f"Cada elemento de 'availability' debe tener el campo '{field}'"
         
         # Validar status
-        valid_statuses = ['available', 'busy', 'off']
-        if slot['status'] not in valid_statuses:
-            return False, f"El status debe ser uno de: {', '.join(valid_statuses)}"
+        if slot['status'] not in AGENDA_STATUSES:
+            return False, f"El status debe ser uno de: {', '.join(AGENDA_STATUSES)}"
+    
+    if 'recurrence' in data:
+        return validate_recurrence(data['recurrence'])
+    
+    return True, ""
+
+def validate_recurrence(recurrence: Any) -> tuple[bool, str]:
+    """
+    Valida las reglas de recurrencia de una agenda
+
+    Formato:
+        {
+            "timezone": "Europe/Madrid",          # Opcional; sin él las horas son UTC
+            "valid_from": "2025-01-01",           # Opcional
+            "valid_until": "2025-12-31",          # Opcional
+            "weekly": [                           # Patrón semanal (0 = lunes ... 6 = domingo)
+                {"days": [0, 1, 2, 3, 4], "start_time": "08:00", "end_time": "12:00", "status": "available"},
+                {"days": [5], "start_time": "09:00", "end_time": "13:00", "valid_until": "2025-06-30",
+                 "skip_dates": ["2025-03-15"]}    # Días en que solo esta regla no se aplica
+            ],
+            "exceptions": [                       # Días (o franjas de un día) sin las reglas semanales
+                {"date": "2025-12-25"},
+                {"date": "2025-12-24", "start_time": "14:00", "end_time": "18:00"}
+            ]
+        }
+
+    Los slots puntuales (extras o bloqueos) siguen en 'availability'.
+    """
+    if not isinstance(recurrence, dict):
+        return False, "El campo 'recurrence' debe ser un objeto"
+    
+    try:
+        if recurrence.get('timezone'):
+            pytz.timezone(recurrence['timezone'])
+        for field in ('valid_from', 'valid_until'):
+            if recurrence.get(field):
+                _as_date(recurrence[field])
+        
+        weekly = recurrence.get('weekly', [])
+        if not isinstance(weekly, list):
+            return False, "El campo 'recurrence.weekly' debe ser una lista"
+        for rule in weekly:
+            if not isinstance(rule, dict):
+                return False, "Cada regla de 'recurrence.weekly' debe ser un objeto"
+            days = rule.get('days')
+            if not isinstance(days, list) or not days or any(day not in range(7) for day in days):
+                return False, "Cada regla semanal debe tener 'days' con valores de 0 (lunes) a 6 (domingo)"
+            _parse_time(rule['start_time'])
+            _parse_time(rule['end_time'])
+            for field in ('valid_from', 'valid_until'):
+                if rule.get(field):
+                    _as_date(rule[field])
+            skip_dates = rule.get('skip_dates', [])
+            if not isinstance(skip_dates, list):
+                return False, "El campo 'skip_dates' de una regla semanal debe ser una lista"
+            for skip_date in skip_dates:
+                _as_date(skip_date)
+            if rule.get('status', 'available') not in AGENDA_STATUSES:
+                return False, f"El status debe ser uno de: {', '.join(AGENDA_STATUSES)}"
+        
+        exceptions = recurrence.get('exceptions', [])
+        if not isinstance(exceptions, list):
+            return False, "El campo 'recurrence.exceptions' debe ser una lista"
+        for exception in exceptions:
+            if not isinstance(exception, dict):
+                return False, "Cada excepción de 'recurrence.exceptions' debe ser un objeto"
+            _as_date(exception['date'])
+            if 'start_time' in exception or 'end_time' in exception:
+                _parse_time(exception['start_time'])
+                _parse_time(exception['end_time'])
+    except (KeyError, TypeError, ValueError) as e:
+        return False, f"Reglas de recurrencia no válidas: {str(e)}"
+    except pytz.UnknownTimeZoneError:
+        return False, f"Zona horaria no válida: {recurrence.get('timezone')}"
     
     return True, ""
 
 def get_driver_agenda(driver_id: str) -> Optional[Dict[str, Any]]:
-    """Obtiene la agenda de un chofer específico"""
+    """
+    Obtiene la agenda de un chofer específico
+
+    En las agendas con cubos diarios, 'availability' se rellena con los slots
+    de todos sus cubos (sin duplicar los que abarcan varios días), como en las
+    agendas que aún guardan los slots en el documento.
+    """
     if drivers_agenda_collection is None:
         raise Exception("La colección drivers_agenda no está inicializada")
     
     try:
         driver_id_obj = ObjectId(driver_id)
-        return drivers_agenda_collection.find_one({"driver_id": driver_id_obj})
+        agenda = drivers_agenda_collection.find_one({"driver_id": driver_id_obj})
+        if agenda and agenda.get("storage") == BUCKETED_STORAGE:
+            slots: Dict[Any, Dict[str, Any]] = {}
+            for bucket in drivers_agenda_days_collection.find({"driver_id": driver_id_obj}, {"slots": 1}).sort("day", 1):
+                for slot in bucket.get("slots", []):
+                    slots.setdefault(slot.get("slot_id") or id(slot), slot)
+            agenda["availability"] = list(agenda.get("availability", [])) + list(slots.values())
+        return agenda
     except Exception as e:
         print(f"Error al obtener agenda del chofer: {str(e)}")
         return None
 
+def get_driver_agendas(driver_ids: List[Any], window_start: Optional[datetime] = None,
+                       window_end: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Obtiene las agendas de varios choferes con una sola consulta
+
+    Args:
+        driver_ids: IDs de chofer (str u ObjectId)
+        window_start: Inicio de la ventana a evaluar (para incluir los cubos diarios)
+        window_end: Fin de la ventana a evaluar
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Agendas indexadas por el ID del chofer como string
+    """
+    if drivers_agenda_collection is None:
+        raise Exception("La colección drivers_agenda no está inicializada")
+    
+    object_ids = []
+    for driver_id in set(driver_ids):
+        try:
+            object_ids.append(driver_id if isinstance(driver_id, ObjectId) else ObjectId(driver_id))
+        except Exception:
+            continue
+    
+    if not object_ids:
+        return {}
+    
+    agendas = {
+        str(agenda["driver_id"]): agenda
+        for agenda in drivers_agenda_collection.find({"driver_id": {"$in": object_ids}})
+    }
+    
+    if window_start is not None and window_end is not None:
+        for driver_id, slots in get_bucket_slots(object_ids, window_start, window_end).items():
+            agenda = agendas.setdefault(driver_id, {"driver_id": ObjectId(driver_id), "availability": []})
+            agenda["availability"] = list(agenda.get("availability", [])) + slots
+    
+    return agendas
+
+def _parse_time(value: str) -> time:
+    return datetime.strptime(value, "%H:%M").time()
+
+def _as_date(value: Any) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+def _to_utc_naive(local: datetime, tz: Optional[Any]) -> datetime:
+    """Convierte una hora local de la regla a UTC naive (como los slots guardados)"""
+    if tz is None:
+        return local
+    return tz.localize(local).astimezone(pytz.utc).replace(tzinfo=None)
+
+def _subtract_window(windows: List[Tuple[datetime, datetime]], cut_start: datetime,
+                     cut_end: datetime) -> List[Tuple[datetime, datetime]]:
+    remaining = []
+    for start, end in windows:
+        if cut_end <= start or cut_start >= end:
+            remaining.append((start, end))
+            continue
+        if start < cut_start:
+            remaining.append((start, cut_start))
+        if cut_end < end:
+            remaining.append((cut_end, end))
+    return remaining
+
+def _expand_recurrence(recurrence: Dict[str, Any], first_day: date, last_day: date) -> List[Dict[str, Any]]:
+    """Genera los slots de las reglas semanales entre first_day y last_day (días locales)"""
+    tz = pytz.timezone(recurrence['timezone']) if recurrence.get('timezone') else None
+    valid_from = _as_date(recurrence['valid_from']) if recurrence.get('valid_from') else None
+    valid_until = _as_date(recurrence['valid_until']) if recurrence.get('valid_until') else None
+    
+    exceptions = {}
+    for exception in recurrence.get('exceptions', []):
+        exceptions.setdefault(_as_date(exception['date']), []).append(exception)
+    
+    skip_dates = [{_as_date(value) for value in rule.get('skip_dates', [])} for rule in recurrence.get('weekly', [])]
+    
+    slots = []
+    day = first_day
+    while day <= last_day:
+        if (valid_from is None or day >= valid_from) and (valid_until is None or day <= valid_until):
+            for rule, rule_skip_dates in zip(recurrence.get('weekly', []), skip_dates):
+                if day.weekday() not in rule['days'] or day in rule_skip_dates:
+                    continue
+                if rule.get('valid_from') and day < _as_date(rule['valid_from']):
+                    continue
+                if rule.get('valid_until') and day > _as_date(rule['valid_until']):
+                    continue
+                start = datetime.combine(day, _parse_time(rule['start_time']))
+                end = datetime.combine(day, _parse_time(rule['end_time']))
+                if end <= start:
+                    # Franja nocturna: termina al día siguiente
+                    end += timedelta(days=1)
+                
+                windows = [(start, end)]
+                for exception in exceptions.get(day, []):
+                    if 'start_time' in exception:
+                        cut_start = datetime.combine(day, _parse_time(exception['start_time']))
+                        cut_end = datetime.combine(day, _parse_time(exception['end_time']))
+                        if cut_end <= cut_start:
+                            cut_end += timedelta(days=1)
+                        windows = _subtract_window(windows, cut_start, cut_end)
+                    else:
+                        windows = []
+                
+                for window_start, window_end in windows:
+                    slots.append({
+                        "start_date": _to_utc_naive(window_start, tz),
+                        "end_date": _to_utc_naive(window_end, tz),
+                        "status": rule.get('status', 'available'),
+                        "recurring": True
+                    })
+        day += timedelta(days=1)
+    return slots
+
+def expand_agenda(agenda: Optional[Dict[str, Any]], window_start: datetime, window_end: datetime) -> List[Dict[str, Any]]:
+    """
+    Devuelve los slots de la agenda que se solapan con [window_start, window_end]
+
+    Combina los slots explícitos de 'availability' con la expansión de las
+    reglas de recurrencia, que solo se calcula para los días de la ventana y se
+    guarda en caché por agenda y versión (updated_at).
+
+    Returns:
+        List[Dict[str, Any]]: Slots {start_date, end_date, status} ordenados por inicio (UTC naive)
+    """
+    if not agenda:
+        return []
+    
+    slots = [
+        slot for slot in agenda.get("availability", [])
+        if slot.get("start_date") and slot.get("end_date")
+        and slot["start_date"] <= window_end and slot["end_date"] >= window_start
+    ]
+    
+    recurrence = agenda.get("recurrence")
+    if recurrence and recurrence.get("weekly"):
+        tz = pytz.timezone(recurrence['timezone']) if recurrence.get('timezone') else None
+        local_start = pytz.utc.localize(window_start).astimezone(tz).replace(tzinfo=None) if tz else window_start
+        local_end = pytz.utc.localize(window_end).astimezone(tz).replace(tzinfo=None) if tz else window_end
+        # Un día antes para incluir las franjas nocturnas que empiezan la víspera
+        first_day = local_start.date() - timedelta(days=1)
+        last_day = local_end.date()
+        
+        def expand():
+            return _expand_recurrence(recurrence, first_day, last_day)
+        
+        if agenda.get("_id") is not None:
+            key = (str(agenda["_id"]), agenda.get("updated_at"), first_day, last_day)
+            expanded = _expansion_cache.get_or_set(key, expand)
+        else:
+            expanded = expand()
+        
+        slots.extend(
+            dict(slot) for slot in expanded
+            if slot["start_date"] <= window_end and slot["end_date"] >= window_start
+        )
+    
+    slots.sort(key=lambda slot: (slot["start_date"], slot["end_date"]))
+    return slots
+
+def merge_available_slots(slots: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Une los slots disponibles contiguos o solapados (p. ej. 08-12 y 12-16 de reglas distintas)"""
+    merged = []
+    for slot in sorted((slot for slot in slots if slot.get("status") == "available"),
+                       key=lambda slot: slot["start_date"]):
+        if merged and slot["start_date"] <= merged[-1]["end_date"]:
+            merged[-1]["end_date"] = max(merged[-1]["end_date"], slot["end_date"])
+        else:
+            merged.append({"start_date": slot["start_date"], "end_date": slot["end_date"], "status": "available"})
+    return merged
+
+def find_agenda_for_window(driver_id_obj: ObjectId, window_start: datetime, window_end: datetime) -> Optional[Dict[str, Any]]:
+    """
+    Lee la agenda de un chofer trayendo solo los slots explícitos que tocan la ventana
+
+    Combina el formato antiguo ('availability' dentro del documento, filtrado en
+    el servidor) con los cubos diarios de drivers_agenda_days, leídos con una
+    consulta por rango de días: el coste depende de los días de la ventana y no
+    del tamaño de la agenda.
+    """
+    pipeline = [
+        {"$match": {"driver_id": driver_id_obj}},
+        {"$limit": 1},
+        {"$project": {
+            "driver_id": 1,
+            "recurrence": 1,
+            "updated_at": 1,
+            "availability": {"$filter": {
+                "input": {"$ifNull": ["$availability", []]},
+                "as": "slot",
+                "cond": {"$and": [
+                    {"$lte": ["$$slot.start_date", window_end]},
+                    {"$gte": ["$$slot.end_date", window_start]}
+                ]}
+            }}
+        }}
+    ]
+    agenda = next(iter(drivers_agenda_collection.aggregate(pipeline)), None)
+    
+    # Slots de los cubos diarios de la ventana (agendas migradas y horarios extra)
+    bucket_slots = get_bucket_slots([driver_id_obj], window_start, window_end).get(str(driver_id_obj))
+    if bucket_slots:
+        if agenda is None:
+            agenda = {"driver_id": driver_id_obj, "availability": []}
+        agenda["availability"] = list(agenda.get("availability") or []) + bucket_slots
+    
+    return agenda
+
+def agenda_covers_interval(agenda: Optional[Dict[str, Any]], start_date: datetime, end_date: datetime) -> bool:
+    """
+    Comprueba en memoria si la disponibilidad de la agenda cubre [start_date, end_date]
+
+    Equivale a check_driver_availability sin conversión de zona horaria, para
+    evaluar muchas solicitudes sobre agendas ya cargadas.
+    """
+    for slot in merge_available_slots(expand_agenda(agenda, start_date, end_date)):
+        if slot["start_date"] <= start_date and slot["end_date"] >= end_date:
+            return True
+    return False
+
 def create_driver_agenda(data: Dict[str, Any]) -> tuple[bool, str, Optional[str]]:
     """Crea una nueva agenda para un chofer"""
     if drivers_agenda_collection is None:
@@ -84,6 +522,7 @@ def create_driver_agenda(data: Dict[str, Any]) -> tuple[bool, str, Optional[str]
         return False, "ID de chofer inválido", None
     
     # Convertir fechas de string a datetime si son string
+    data.setdefault('availability', [])
     for slot in data['availability']:
         for date_field in ['start_date', 'end_date']:
             if isinstance(slot[date_field], str):
@@ -94,13 +533,26 @@ def create_driver_agenda(data: Dict[str, Any]) -> tuple[bool, str, Optional[str]
     data['created_at'] = current_time
     data['updated_at'] = current_time
     
+    # Los slots explícitos se guardan en los cubos diarios, no en el documento
+    slots = data.pop('availability')
+    data['storage'] = BUCKETED_STORAGE
+    
     # Insertar en la base de datos
     try:
         result = drivers_agenda_collection.insert_one(data)
+        add_slots_to_buckets(data['driver_id'], slots)
+        _on_agenda_written(data['driver_id'])
         return True, "Agenda de chofer creada con éxito", str(result.inserted_id)
     except Exception as e:
         return False, f"Error al crear agenda de chofer: {str(e)}", None
 
+def _on_agenda_written(driver_id_obj: ObjectId):
+    """Recalcula los mapas de disponibilidad y las próximas ventanas libres del chofer"""
+    # Importación diferida: ambos servicios dependen de este módulo
+    from services import availability_bitmap_service, next_available_service
+    availability_bitmap_service.on_agenda_changed(driver_id_obj)
+    next_available_service.on_drivers_changed([driver_id_obj])
+
 def update_driver_agenda(driver_id: str, data: Dict[str, Any]) -> tuple[bool, str]:
     """Actualiza la agenda de un chofer existente"""
     if drivers_agenda_collection is None:
@@ -114,7 +566,12 @@ def update_driver_agenda(driver_id: str, data: Dict[str, Any]) -> tuple[bool, st
         if not existing:
             return False, "Agenda de chofer no encontrada"
         
-        # Actualizar fecha de modificación
+        if 'recurrence' in data:
+            is_valid, message = validate_recurrence(data['recurrence'])
+            if not is_valid:
+                return False, message
+        
+        # Actualizar fecha de modificación (también invalida la expansión en caché)
         data['updated_at'] = datetime.utcnow()
         
         # Convertir fechas de string a datetime si son string
@@ -124,15 +581,22 @@ def update_driver_agenda(driver_id: str, data: Dict[str, Any]) -> tuple[bool, st
                     if date_field in slot and isinstance(slot[date_field], str):
                         slot[date_field] = datetime.fromisoformat(slot[date_field].replace('Z', '+00:00'))
         
+        # Agendas con cubos diarios: sustituir los slots explícitos (salvo horarios extra)
+        replaced_slots = False
+        if 'availability' in data and existing.get('storage') == BUCKETED_STORAGE:
+            replace_bucket_slots(driver_id_obj, data.pop('availability'))
+            replaced_slots = True
+        
         # Actualizar en la base de datos
         result = drivers_agenda_collection.update_one(
             {"driver_id": driver_id_obj},
             {"$set": data}
         )
         
-        if result.modified_count == 0:
+        if result.modified_count == 0 and not replaced_slots:
             return False, "No se realizaron cambios"
         
+        _on_agenda_written(driver_id_obj)
         return True, "Agenda de chofer actualizada con éxito"
     except Exception as e:
         return False, f"Error al actualizar agenda de chofer: {str(e)}"
@@ -164,13 +628,6 @@ def check_driver_availability(driver_id: str, start_date: datetime, end_date: da
         else:
             driver_id_obj = driver_id
         
-        # Obtener la agenda del conductor
-        agenda = drivers_agenda_collection.find_one({"driver_id": driver_id_obj})
-        
-        if not agenda:
-            print(f"❌ No se encontró agenda para el conductor {driver_id}")
-            return False
-        
         # 🔍 LOGGING DETALLADO PARA DEBUGGING
         print(f"\n🔍 === DEBUG VERIFICACIÓN DISPONIBILIDAD ===")
         print(f"📋 Conductor: {driver_id}")
@@ -197,11 +654,21 @@ def check_driver_availability(driver_id: str, start_date: datetime, end_date: da
             start_date_naive = start_date
             end_date_naive = end_date
         
-        print(f"📊 Número de slots en agenda: {len(agenda.get('availability', []))}")
+        # Obtener solo la parte de la agenda que toca el intervalo solicitado
+        agenda = find_agenda_for_window(driver_id_obj, start_date_naive, end_date_naive)
+        
+        if not agenda:
+            print(f"❌ No se encontró agenda para el conductor {driver_id}")
+            return False
+        
+        # Slots explícitos + reglas de recurrencia expandidas, con las franjas contiguas unidas
+        slots = merge_available_slots(expand_agenda(agenda, start_date_naive, end_date_naive))
+        
+        print(f"📊 Número de slots en agenda: {len(slots)}")
         
         # Buscar en los slots de disponibilidad
         slot_number = 1
-        for slot in agenda.get("availability", []):
+        for slot in slots:
             slot_start = slot.get("start_date")
             slot_end = slot.get("end_date")
             status = slot.get("status")
@@ -278,22 +745,8 @@ def get_driver_available_time_slots(driver_id: str, date_start: datetime, date_e
         else:
             driver_id_obj = driver_id
         
-        # Buscar agenda del chofer
-        agenda = drivers_agenda_collection.find_one({"driver_id": driver_id_obj})
-        
-        if not agenda:
-            return []
-        
         available_slots = []
         
-        # Si tenemos dirección, convertir la agenda a tiempo local
-        if address:
-            print(f"🌍 Convirtiendo horarios a zona horaria local para: {address}")
-            local_agenda = TimezoneService.get_driver_availability_in_local_time(agenda, address)
-        else:
-            print("⚠️ Obteniendo horarios sin conversión de zona horaria")
-            local_agenda = agenda
-        
         # Normalizar fechas de entrada para comparación
         if address:
             # Si se usa zona horaria, convertir fechas de entrada a UTC naive para comparar
@@ -306,8 +759,14 @@ def get_driver_available_time_slots(driver_id: str, date_start: datetime, date_e
             date_start_naive = date_start
             date_end_naive = date_end
         
-        # Verificar cada slot de disponibilidad  
-        for slot in agenda.get("availability", []):  # Usar agenda original, no local_agenda
+        # Buscar agenda del chofer (solo los slots explícitos de la ventana)
+        agenda = find_agenda_for_window(driver_id_obj, date_start_naive, date_end_naive)
+        
+        if not agenda:
+            return []
+        
+        # Verificar cada slot de disponibilidad (explícitos y de reglas de recurrencia)
+        for slot in expand_agenda(agenda, date_start_naive, date_end_naive):
             slot_start = slot.get("start_date")
             slot_end = slot.get("end_date")
             status = slot.get("status")
@@ -335,17 +794,18 @@ def get_driver_available_time_slots(driver_id: str, date_start: datetime, date_e
                 else:
                     # Convertir las fechas del slot a horas locales
                     if address:
-                        # Convertir fechas UTC a zona horaria local
-                        slot_start_local = TimezoneService.convert_utc_to_local(slot_start, address)
-                        slot_end_local = TimezoneService.convert_utc_to_local(slot_end, address)
+                        # Convertir fechas UTC a zona horaria local (zona resuelta una vez por dirección)
+                        slot_start_local, slot_end_local = TimezoneService.convert_utc_to_local_many(
+                            [slot_start, slot_end], address
+                        )
                         
                         # Usar las horas convertidas a tiempo local
                         start_time = slot_start_local.strftime("%H:%M")
                         end_time = slot_end_local.strftime("%H:%M")
                         
                         # Para display, formatear con zona horaria
-                        start_time_display = TimezoneService.format_time_for_display(slot_start, address)
-                        end_time_display = TimezoneService.format_time_for_display(slot_end, address)
+                        start_time_display = slot_start_local.strftime("%H:%M %Z")
+                        end_time_display = slot_end_local.strftime("%H:%M %Z")
                         
                         available_slots.append({
                             "start_time": start_time,
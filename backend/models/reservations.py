@@ -7,8 +7,9 @@ Incluye:
 - communication_logs
 """
 
-from pymongo import MongoClient, GEOSPHERE
+from pymongo import MongoClient, GEOSPHERE, ReturnDocument
 from datetime import datetime
+import threading
 from bson import ObjectId
 import os
 from dotenv import load_dotenv
@@ -21,18 +22,26 @@ reservations_collection = None
 reservation_incidents_collection = None
 reservation_changes_collection = None
 communication_logs_collection = None
+counters_collection = None
+
+# Secuencia de códigos de reserva ('B1001', 'B1002', ...)
+RESERVATION_CODE_PREFIX = "B"
+RESERVATION_CODE_START = 1001
+RESERVATION_CODE_COUNTER_ID = "reservation_code"
 
 
 def setup_collections(db):
     """Inicializa las colecciones y crea los índices necesarios"""
     global reservations_collection, reservation_incidents_collection
     global reservation_changes_collection, communication_logs_collection
+    global counters_collection
 
     # Inicializar colecciones
     reservations_collection = db['reservations']
     reservation_incidents_collection = db['reservation_incidents']
     reservation_changes_collection = db['reservation_changes']
     communication_logs_collection = db['communication_logs']
+    counters_collection = db['counters']
 
     # Crear índices
     reservations_collection.create_index("code", unique=True)
@@ -41,7 +50,12 @@ def setup_collections(db):
     reservations_collection.create_index([("pickup.coordinates", GEOSPHERE)])
     reservations_collection.create_index([("dropoff.coordinates", GEOSPHERE)])
     reservations_collection.create_index("created_at")
+    # Índice para la paginación keyset del listado (created_at desc, _id desc)
+    reservations_collection.create_index([("created_at", -1), ("_id", -1)])
     reservations_collection.create_index("pickup.date")
+
+    # Contador atómico para los códigos de reserva
+    seed_reservation_code_counter()
     
     reservation_incidents_collection.create_index("reservation_id")
     reservation_incidents_collection.create_index("type")
@@ -188,26 +202,90 @@ def validate_communication_log(data):
 
 
 # Funciones para generar ID de reserva
+def seed_reservation_code_counter(counter_id=RESERVATION_CODE_COUNTER_ID):
+    """
+    Inicializa el contador de códigos con el mayor código numérico existente
+
+    Usa $max, por lo que es seguro ejecutarlo en cada arranque y desde varios
+    procesos: el contador nunca retrocede.
+    """
+    pipeline = [
+        {"$match": {"code": {"$regex": f"^{RESERVATION_CODE_PREFIX}[0-9]+$"}}},
+        {"$group": {"_id": None, "max_number": {"$max": {
+            "$toLong": {"$substrCP": ["$code", len(RESERVATION_CODE_PREFIX), 20]}
+        }}}}
+    ]
+    result = next(reservations_collection.aggregate(pipeline), None)
+    last_number = result["max_number"] if result and result.get("max_number") else 0
+
+    counters_collection.update_one(
+        {"_id": counter_id},
+        {"$max": {"seq": max(last_number, RESERVATION_CODE_START - 1)}},
+        upsert=True
+    )
+
+
+def reserve_reservation_numbers(count, counter_id=RESERVATION_CODE_COUNTER_ID):
+    """
+    Reserva de forma atómica un bloque de números consecutivos
+
+    Args:
+        count: Cantidad de números a reservar
+        counter_id: Identificador del contador en la colección counters
+
+    Returns:
+        range: Números reservados (exclusivos de quien los pidió)
+    """
+    counter = counters_collection.find_one_and_update(
+        {"_id": counter_id},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    last = counter["seq"]
+    return range(last - count + 1, last + 1)
+
+
+class ReservationCodeAllocator:
+    """
+    Asignador de códigos de reserva basado en un contador con $inc
+
+    Con block_size > 1 cada proceso reserva bloques de números y los reparte
+    en memoria, evitando un viaje a la base de datos por reserva. Los números
+    no usados de un bloque se pierden al reiniciar el proceso y los códigos de
+    distintos workers pueden intercalarse, pero nunca se repiten.
+    """
+
+    def __init__(self, block_size=1, counter_id=RESERVATION_CODE_COUNTER_ID):
+        self.block_size = max(1, int(block_size))
+        self.counter_id = counter_id
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def next_number(self):
+        """Devuelve el siguiente número de reserva libre"""
+        with self._lock:
+            if self._next >= self._end:
+                block = reserve_reservation_numbers(self.block_size, self.counter_id)
+                self._next, self._end = block.start, block.stop
+            number = self._next
+            self._next += 1
+            return number
+
+    def next_code(self):
+        """Devuelve el siguiente código de reserva (p. ej. 'B1001')"""
+        return f"{RESERVATION_CODE_PREFIX}{self.next_number()}"
+
+
+_code_allocator = ReservationCodeAllocator(
+    block_size=int(os.getenv("RESERVATION_CODE_BLOCK_SIZE", 1))
+)
+
+
 def generate_reservation_code():
     """Genera un código único para una reserva en formato 'B1001'"""
-    # Buscar el último código utilizado
-    last_reservation = reservations_collection.find_one(
-        sort=[("code", -1)]
-    )
-    
-    if last_reservation and "code" in last_reservation:
-        try:
-            # Extraer el número del código y aumentarlo en 1
-            last_number = int(last_reservation["code"][1:])
-            new_number = last_number + 1
-        except (ValueError, IndexError):
-            # Si hay error al parsear, empezar desde 1001
-            new_number = 1001
-    else:
-        # Si no hay reservas previas, empezar desde 1001
-        new_number = 1001
-    
-    return f"B{new_number}"
+    return _code_allocator.next_code()
 
 
 # Ejemplo de documento para cada colección (para documentación)
@@ -0,0 +1,337 @@
+"""
+Reclamaciones de franjas horarias (slot claims) para choferes y vehículos.
+
+Cada reserva ocupa, para cada recurso asignado (chofer o vehículo), un
+documento por franja de BUCKET_MINUTES minutos con el tramo exacto que ocupa
+dentro de ella ('start', 'end'). Un índice único sobre (resource_type,
+resource_id, bucket, lane) hace que la comprobación de conflicto y la reserva
+de la franja sean una única operación atómica en MongoDB: si dos reservas
+compiten por la misma franja, solo una inserción tiene éxito y la otra recibe
+un DuplicateKeyError, sin necesidad de bloqueos globales.
+
+Dos servicios seguidos que no se solapan (10:00-10:20 y 10:20-10:40) comparten
+la franja de las 10:15: ante un DuplicateKeyError se compara el tramo exacto
+del ocupante y, si no se solapa, la franja se reclama en el siguiente carril
+('lane'). Al terminar se comprueban los tramos exactos de los demás
+propietarios de las franjas reclamadas, de modo que dos reservas simultáneas
+en carriles distintos no pueden solaparse.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+# Tamaño de la franja mínima reservable
+BUCKET_MINUTES = 15
+
+# Tiempo que se conservan las reclamaciones una vez pasada la franja
+CLAIM_RETENTION = timedelta(days=1)
+
+# Carriles máximos por franja (servicios distintos que comparten una franja sin solaparse)
+MAX_LANES = 8
+
+# Estados de reserva que ya no ocupan al chofer ni al vehículo (también para el motor de tiempo ocupado)
+RELEASED_STATUSES = ['cancelled', 'rejected', 'completed', 'no_show']
+
+slot_claims_collection: Optional[Collection] = None
+
+
+def setup_collection(db):
+    """Inicializa la colección slot_claims y sus índices"""
+    global slot_claims_collection
+
+    slot_claims_collection = db['slot_claims']
+
+    # Índice anterior sin carril: las reclamaciones existentes pasan al carril 0
+    if "resource_type_1_resource_id_1_bucket_1" in slot_claims_collection.index_information():
+        slot_claims_collection.update_many({"lane": {"$exists": False}}, {"$set": {"lane": 0}})
+        slot_claims_collection.drop_index("resource_type_1_resource_id_1_bucket_1")
+    
+    # La unicidad por recurso, franja y carril es lo que impide la doble reserva
+    slot_claims_collection.create_index(
+        [("resource_type", 1), ("resource_id", 1), ("bucket", 1), ("lane", 1)],
+        unique=True
+    )
+    slot_claims_collection.create_index("owner_id")
+    # Las reclamaciones de franjas pasadas se eliminan solas
+    slot_claims_collection.create_index("expires_at", expireAfterSeconds=0)
+
+    return slot_claims_collection
+
+
+def _to_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.replace(tzinfo=None) - value.utcoffset()
+
+
+def bucket_starts(start: datetime, end: datetime) -> List[datetime]:
+    """
+    Devuelve el inicio de cada franja que se solapa con [start, end)
+
+    Args:
+        start: Inicio del servicio
+        end: Fin del servicio
+
+    Returns:
+        List[datetime]: Inicios de franja alineados a BUCKET_MINUTES
+    """
+    # Las franjas se guardan en UTC sin zona horaria, como el resto de fechas en MongoDB
+    start = _to_naive_utc(start)
+    end = _to_naive_utc(end)
+
+    bucket = start.replace(minute=start.minute - start.minute % BUCKET_MINUTES, second=0, microsecond=0)
+    buckets = []
+    while bucket < end:
+        buckets.append(bucket)
+        bucket += timedelta(minutes=BUCKET_MINUTES)
+    return buckets
+
+
+def reservation_window(reservation: Dict[str, Any]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Calcula el intervalo [inicio, fin) que ocupa una reserva de la colección reservations
+
+    Returns:
+        Tuple: (pickup.date, dropoff.estimated_date o inicio + estimated_duration), o (None, None)
+    """
+    start = (reservation.get('pickup') or {}).get('date')
+    if not isinstance(start, datetime):
+        return None, None
+    end = (reservation.get('dropoff') or {}).get('estimated_date')
+    if not isinstance(end, datetime):
+        end = start + timedelta(minutes=reservation.get('estimated_duration', 60))
+    return start, end
+
+
+def reservation_resources(reservation: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """Devuelve los recursos (chofer y vehículo) que ocupa una reserva"""
+    return [('driver', reservation.get('driver_id')), ('vehicle', reservation.get('vehicle_id'))]
+
+
+def _normalize_resources(resources: List[Tuple[str, Any]]) -> List[Tuple[str, str]]:
+    return [(resource_type, str(resource_id)) for resource_type, resource_id in resources if resource_id]
+
+
+def _bucket_span(bucket: datetime, start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+    """Tramo de [start, end) dentro de una franja"""
+    return max(start, bucket), min(end, bucket + timedelta(minutes=BUCKET_MINUTES))
+
+
+def _claim_span(claim: Dict[str, Any]) -> Tuple[datetime, datetime]:
+    """Tramo ocupado por una reclamación (las antiguas, sin tramo, ocupan la franja completa)"""
+    bucket = claim['bucket']
+    return claim.get('start') or bucket, claim.get('end') or bucket + timedelta(minutes=BUCKET_MINUTES)
+
+
+def _overlaps(span: Tuple[datetime, datetime], other: Tuple[datetime, datetime]) -> bool:
+    return span[0] < other[1] and other[0] < span[1]
+
+
+def claim_slots(owner_type: str, owner_id: Any, resources: List[Tuple[str, Any]],
+                start: datetime, end: datetime) -> Optional[Dict[str, Any]]:
+    """
+    Reclama atómicamente las franjas de [start, end) para todos los recursos
+
+    Cada franja se reclama con un upsert condicionado al propietario: si la
+    franja está libre se crea, si ya pertenece a owner_id no cambia, y si
+    pertenece a otro propietario el índice único rechaza la operación. Si el
+    ocupante no se solapa de verdad (servicios seguidos en la misma franja) se
+    prueba el siguiente carril. Ante un conflicto se deshacen las franjas
+    creadas en este intento. Si el propietario ya tenía otras franjas (p. ej.
+    al mover una reserva) se liberan las que ya no correspondan.
+
+    Args:
+        owner_type: Tipo de propietario ('reservation' o 'booking')
+        owner_id: Identificador de la reserva propietaria
+        resources: Lista de (tipo, id) de recursos, p. ej. [('driver', id), ('vehicle', id)]
+        start: Inicio del servicio
+        end: Fin del servicio
+
+    Returns:
+        Optional[Dict[str, Any]]: None si se reclamaron todas las franjas, o la
+        información del conflicto (recurso, franja y reserva que la ocupa)
+    """
+    owner_id = str(owner_id)
+    resources = _normalize_resources(resources)
+    start, end = _to_naive_utc(start), _to_naive_utc(end)
+    buckets = bucket_starts(start, end)
+    if not resources or not buckets:
+        return None
+
+    attempt = uuid.uuid4().hex
+    now = datetime.utcnow()
+    keys = [(resource_type, resource_id, bucket) for resource_type, resource_id in resources for bucket in buckets]
+    lanes = [0] * len(keys)
+
+    def operation(index):
+        resource_type, resource_id, bucket = keys[index]
+        span_start, span_end = _bucket_span(bucket, start, end)
+        return UpdateOne(
+            {
+                'resource_type': resource_type,
+                'resource_id': resource_id,
+                'bucket': bucket,
+                'lane': lanes[index],
+                'owner_id': owner_id
+            },
+            {'$setOnInsert': {
+                'owner_type': owner_type,
+                'attempt': attempt,
+                'start': span_start,
+                'end': span_end,
+                'created_at': now,
+                'expires_at': bucket + timedelta(minutes=BUCKET_MINUTES) + CLAIM_RETENTION
+            }},
+            upsert=True
+        )
+
+    def conflict(index, holder):
+        # Deshacer solo lo insertado en este intento
+        slot_claims_collection.delete_many({'owner_id': owner_id, 'attempt': attempt})
+        resource_type, resource_id, bucket = keys[index]
+        return {
+            'resource_type': resource_type,
+            'resource_id': resource_id,
+            'bucket': bucket,
+            'held_by': holder.get('owner_id') if holder else None
+        }
+
+    first = 0
+    while first < len(keys):
+        try:
+            slot_claims_collection.bulk_write([operation(index) for index in range(first, len(keys))], ordered=True)
+            break
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            if not write_errors or write_errors[0].get('code') != 11000:
+                slot_claims_collection.delete_many({'owner_id': owner_id, 'attempt': attempt})
+                raise
+
+            index = first + write_errors[0]['index']
+            resource_type, resource_id, bucket = keys[index]
+            holder = slot_claims_collection.find_one({
+                'resource_type': resource_type,
+                'resource_id': resource_id,
+                'bucket': bucket,
+                'lane': lanes[index]
+            })
+            if holder and _overlaps(_bucket_span(bucket, start, end), _claim_span(holder)):
+                return conflict(index, holder)
+            if lanes[index] + 1 >= MAX_LANES:
+                return conflict(index, holder)
+
+            # El ocupante no se solapa: probar el siguiente carril de la misma franja
+            lanes[index] += 1
+            first = index
+
+    # Comprobación final con los tramos exactos de los demás propietarios de estas franjas
+    spans = {bucket: _bucket_span(bucket, start, end) for bucket in buckets}
+    for claim in slot_claims_collection.find({
+        'owner_id': {'$ne': owner_id},
+        '$or': [
+            {'resource_type': resource_type, 'resource_id': resource_id, 'bucket': {'$in': buckets}}
+            for resource_type, resource_id in resources
+        ]
+    }):
+        if _overlaps(spans[claim['bucket']], _claim_span(claim)):
+            return conflict(keys.index((claim['resource_type'], claim['resource_id'], claim['bucket'])), claim)
+
+    # Liberar franjas antiguas del mismo propietario que ya no forman parte de la reserva
+    slot_claims_collection.delete_many({
+        'owner_id': owner_id,
+        '$nor': [
+            {
+                'resource_type': resource_type,
+                'resource_id': resource_id,
+                'bucket': keys[index][2],
+                'lane': lanes[index]
+            }
+            for index, (resource_type, resource_id, _) in enumerate(keys)
+        ]
+    })
+    # Las franjas que ya eran suyas pasan a guardar el tramo del nuevo horario
+    slot_claims_collection.bulk_write([
+        UpdateOne(
+            {'resource_type': keys[index][0], 'resource_id': keys[index][1], 'bucket': keys[index][2],
+             'lane': lanes[index], 'owner_id': owner_id, 'attempt': {'$ne': attempt}},
+            {'$set': dict(zip(('start', 'end'), _bucket_span(keys[index][2], start, end)))}
+        )
+        for index in range(len(keys))
+    ], ordered=False)
+    return None
+
+
+def release_slots(owner_id: Any) -> int:
+    """
+    Libera todas las franjas de una reserva (cancelación, finalización o borrado)
+
+    Returns:
+        int: Número de franjas liberadas
+    """
+    result = slot_claims_collection.delete_many({'owner_id': str(owner_id)})
+    return result.deleted_count
+
+
+def backfill_reservation_claims(reservations_collection: Collection, batch_size: int = 500):
+    """
+    Crea las franjas de las reservas futuras activas que aún no las tienen
+
+    Es idempotente: las franjas ya existentes se ignoran gracias al índice único.
+    """
+    now = datetime.utcnow()
+    cursor = reservations_collection.find(
+        {
+            'status': {'$nin': RELEASED_STATUSES},
+            'pickup.date': {'$gte': now}
+        },
+        {'pickup.date': 1, 'dropoff.estimated_date': 1, 'estimated_duration': 1, 'driver_id': 1, 'vehicle_id': 1}
+    )
+
+    operations = []
+    for reservation in cursor:
+        start, end = reservation_window(reservation)
+        if not start:
+            continue
+        resources = _normalize_resources(reservation_resources(reservation))
+        for resource_type, resource_id in resources:
+            for bucket in bucket_starts(start, end):
+                span_start, span_end = _bucket_span(bucket, _to_naive_utc(start), _to_naive_utc(end))
+                operations.append(UpdateOne(
+                    {
+                        'resource_type': resource_type,
+                        'resource_id': resource_id,
+                        'bucket': bucket,
+                        'lane': 0,
+                        'owner_id': str(reservation['_id'])
+                    },
+                    {'$setOnInsert': {
+                        'owner_type': 'reservation',
+                        'attempt': 'backfill',
+                        'start': span_start,
+                        'end': span_end,
+                        'created_at': now,
+                        'expires_at': bucket + timedelta(minutes=BUCKET_MINUTES) + CLAIM_RETENTION
+                    }},
+                    upsert=True
+                ))
+        if len(operations) >= batch_size:
+            _flush_backfill(operations)
+            operations = []
+
+    if operations:
+        _flush_backfill(operations)
+
+
+def _flush_backfill(operations):
+    try:
+        slot_claims_collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Reservas antiguas solapadas: se conserva la primera reclamación
+        conflicts = [error for error in e.details.get('writeErrors', []) if error.get('code') == 11000]
+        if conflicts:
+            print(f"[SLOT_CLAIMS] {len(conflicts)} franjas ya ocupadas durante el backfill")
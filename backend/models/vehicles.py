@@ -11,4 +11,7 @@ def setup_collection(db):
     # Añadir índice geoespacial para consultas espaciales
     vehicles_collection.create_index([("location", "2dsphere")])
     
+    # Área de cobertura de los vehículos de ruta flexible
+    vehicles_collection.create_index([("coverage_area", "2dsphere")])
+    
     return vehicles_collection 
\ No newline at end of file
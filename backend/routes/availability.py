@@ -1,9 +1,10 @@
 from flask import Blueprint, request, jsonify
-from datetime import datetime
+from datetime import datetime, timezone
 import json
 import requests
 from bson import ObjectId
-from services.availability import check_vehicle_availability_for_location
+from flask_jwt_extended import jwt_required
+from services.availability import check_vehicle_availability_for_location, check_driver_availability_batch, MAX_BATCH_CHECKS
 from services.contact_service import (
     get_driver_contact_info,
     get_client_contact_info,
@@ -20,6 +21,10 @@ from services.extra_schedule_service import (
     get_driver_extra_schedules,
     cancel_extra_schedule
 )
+from services import availability_bitmap_service, coverage_tiles_service
+from models.drivers_agenda import bucket_day
+from utils.auth import admin_required
+from utils.json_utils import json_response
 
 # Crear el blueprint para las rutas de disponibilidad
 availability_bp = Blueprint('availability', __name__)
@@ -576,4 +581,160 @@ def cancel_extra_schedule_endpoint(extra_schedule_id):
         
     except Exception as e:
         print(f"Error en cancel_extra_schedule: {str(e)}")
-        return jsonify({'error': 'Error interno del servidor'}), 500 
\ No newline at end of file
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+
+@availability_bp.route('/api/admin/availability/drivers/batch', methods=['POST'])
+@jwt_required()
+@admin_required
+def check_drivers_availability_batch():
+    """
+    Verifica la disponibilidad de muchas parejas (chofer, intervalo) en una llamada
+    Espera recibir:
+    - checks: Lista de {driver_id, start, end} con fechas en formato ISO
+    - address: Dirección para interpretar las fechas sin zona horaria (opcional)
+    """
+    try:
+        data = request.get_json() or {}
+        checks = data.get('checks')
+        
+        if not isinstance(checks, list) or not checks:
+            return jsonify({"error": "Se requiere una lista 'checks' con al menos un elemento"}), 400
+        if len(checks) > MAX_BATCH_CHECKS:
+            return jsonify({"error": f"Máximo {MAX_BATCH_CHECKS} verificaciones por solicitud"}), 400
+        
+        parsed = []
+        for check in checks:
+            check = check if isinstance(check, dict) else {}
+            item = {"driver_id": check.get("driver_id")}
+            for field in ("start", "end"):
+                try:
+                    item[field] = datetime.fromisoformat(str(check.get(field)).replace('Z', '+00:00'))
+                except ValueError:
+                    item[field] = None
+            parsed.append(item)
+        
+        result = check_driver_availability_batch(get_db(), parsed, data.get('address'))
+        result["total"] = len(parsed)
+        result["available_count"] = sum(1 for item in result["results"] if item["available"])
+        
+        return json_response(result)
+        
+    except Exception as e:
+        print(f"Error en check_drivers_availability_batch: {str(e)}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@availability_bp.route('/api/admin/availability/heatmap/<zone_id>', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_zone_heatmap(zone_id):
+    """
+    Mapa de calor de capacidad de una zona (ruta fija) en franjas de 15 minutos
+    
+    Parámetros:
+    - start: Primer día (YYYY-MM-DD, UTC). Por defecto hoy
+    - days: Número de días (1-31, por defecto 7)
+    """
+    try:
+        zone = availability_bitmap_service.get_zone(zone_id)
+        if not zone:
+            return jsonify({'error': 'Zona no encontrada'}), 404
+        
+        start = request.args.get('start')
+        start_day = datetime.strptime(start, "%Y-%m-%d") if start else bucket_day(datetime.utcnow())
+        days = min(max(int(request.args.get('days', 7)), 1), availability_bitmap_service.MAX_HEATMAP_DAYS)
+        
+        driver_ids = availability_bitmap_service.zone_driver_ids(zone)
+        heatmap = availability_bitmap_service.capacity_heatmap(driver_ids, start_day, days)
+        for day in heatmap:
+            if day['first_available']:
+                day['first_available'] = day['first_available'].isoformat()
+        
+        return jsonify({
+            'zone_id': zone_id,
+            'zone_name': zone.get('name', ''),
+            'slot_minutes': availability_bitmap_service.SLOT_MINUTES,
+            'driver_count': len(driver_ids),
+            'days': heatmap
+        }), 200
+        
+    except ValueError:
+        return jsonify({'error': 'Parámetros start o days inválidos'}), 400
+    except Exception as e:
+        print(f"Error en get_zone_heatmap: {str(e)}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@availability_bp.route('/api/admin/availability/next-available/<zone_id>', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_zone_next_available(zone_id):
+    """
+    Próximo momento con algún chófer libre en una zona
+    
+    Parámetros:
+    - after: Fecha y hora desde la que buscar (ISO; sin zona horaria se toma como UTC). Por defecto ahora
+    - duration: Minutos libres seguidos necesarios (por defecto 15)
+    """
+    try:
+        zone = availability_bitmap_service.get_zone(zone_id)
+        if not zone:
+            return jsonify({'error': 'Zona no encontrada'}), 404
+        
+        after = request.args.get('after')
+        after_dt = datetime.fromisoformat(after.replace('Z', '+00:00')) if after else datetime.utcnow()
+        if after_dt.tzinfo is not None:
+            # Los slots se guardan en UTC naive: '...+02:00' se convierte antes de comparar
+            after_dt = after_dt.astimezone(timezone.utc).replace(tzinfo=None)
+        duration = int(request.args.get('duration', availability_bitmap_service.SLOT_MINUTES))
+        
+        result = availability_bitmap_service.next_available(
+            availability_bitmap_service.zone_driver_ids(zone), after_dt, duration_minutes=duration
+        )
+        
+        return jsonify({
+            'zone_id': zone_id,
+            'next_available': result['start'].isoformat() if result else None,
+            'driver_id': result['driver_id'] if result else None
+        }), 200
+        
+    except ValueError:
+        return jsonify({'error': 'Parámetros after o duration inválidos'}), 400
+    except Exception as e:
+        print(f"Error en get_zone_next_available: {str(e)}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@availability_bp.route('/api/admin/availability/coverage/tiles', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_coverage_tiles():
+    """
+    Celdas del índice de cobertura en un rectángulo, como GeoJSON para el mapa de cobertura
+    
+    Parámetros:
+    - bbox: lon_min,lat_min,lon_max,lat_max
+    """
+    try:
+        lon_min, lat_min, lon_max, lat_max = [float(value) for value in request.args.get('bbox', '').split(',')]
+    except ValueError:
+        return jsonify({'error': 'Parámetro bbox inválido (lon_min,lat_min,lon_max,lat_max)'}), 400
+    
+    try:
+        return jsonify(coverage_tiles_service.export_tiles(lon_min, lat_min, lon_max, lat_max)), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error en get_coverage_tiles: {str(e)}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@availability_bp.route('/api/admin/availability/coverage/rebuild', methods=['POST'])
+@jwt_required()
+@admin_required
+def rebuild_coverage_tiles():
+    """Reconstruye el índice de cobertura completo a partir de las zonas y los vehículos"""
+    try:
+        return jsonify(coverage_tiles_service.rebuild_all()), 200
+        
+    except Exception as e:
+        print(f"Error en rebuild_coverage_tiles: {str(e)}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
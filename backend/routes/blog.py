@@ -3,11 +3,15 @@ from bson import ObjectId
 from datetime import datetime
 import slugify
 import os
+import time
 from werkzeug.utils import secure_filename
 import uuid
 import openai
 import json
 from dotenv import load_dotenv
+from pymongo import TEXT
+from utils.cache import TTLCache
+from utils.http_cache import cached_response, invalidate_tags
 
 # Cargar variables de entorno para OpenAI
 load_dotenv()
@@ -19,8 +23,53 @@ openai.api_key = os.getenv('OPENAI_API_KEY')
 
 def get_db():
     from app import db
+    if not _indexes_ready:
+        ensure_blog_indexes(db)
     return db
 
+# Caché de las respuestas públicas del blog (listados, categorías, etiquetas y destacados)
+PUBLIC_CACHE_TTL_SECONDS = 60
+blog_cache = TTLCache(ttl_seconds=PUBLIC_CACHE_TTL_SECONDS, max_entries=256)
+
+# Con ?fields=summary (blog público) los listados no incluyen el cuerpo del artículo;
+# el panel de administración sigue recibiéndolo para editar
+SUMMARY_FIELDS = 'summary'
+SUMMARY_PROJECTION = {'content': 0}
+
+def list_projection():
+    """Proyección de los listados según el parámetro 'fields' de la petición"""
+    return dict(SUMMARY_PROJECTION) if request.args.get('fields') == SUMMARY_FIELDS else None
+
+_indexes_ready = False
+
+# Tras un fallo, no reintentar la creación de índices en cada petición
+INDEX_RETRY_SECONDS = 300
+_indexes_retry_at = 0.0
+
+def ensure_blog_indexes(db):
+    """Crea (una vez por proceso) los índices de búsqueda y listado del blog"""
+    global _indexes_ready, _indexes_retry_at
+    if _indexes_ready or time.monotonic() < _indexes_retry_at:
+        return
+    try:
+        db.blog_posts.create_index(
+            [('title', TEXT), ('excerpt', TEXT), ('tags', TEXT), ('author', TEXT), ('content', TEXT)],
+            weights={'title': 10, 'excerpt': 5, 'tags': 3, 'author': 2, 'content': 1},
+            default_language='spanish',
+            name='blog_text_search'
+        )
+        db.blog_posts.create_index([('status', 1), ('publishDate', -1)])
+        db.blog_posts.create_index('slug')
+        _indexes_ready = True
+    except Exception as e:
+        _indexes_retry_at = time.monotonic() + INDEX_RETRY_SECONDS
+        print(f"Error creando índices del blog: {str(e)}")
+
+def invalidate_blog_cache():
+    """Invalida las respuestas públicas en caché tras crear, editar o eliminar artículos"""
+    blog_cache.clear()
+    invalidate_tags('blog')
+
 # Configuración para subida de imágenes
 UPLOAD_FOLDER = 'uploads/blog'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
@@ -163,6 +212,11 @@ def upload_image():
     return jsonify({'error': 'Tipo de archivo no permitido'}), 400
 
 @blog_bp.route('/posts', methods=['GET'])
+@cached_response(
+    tags=lambda **kwargs: ['blog'],
+    cache_control='public, max-age=60',
+    bypass=lambda: request.args.get('status') not in (None, '', 'published')
+)
 def get_all_posts():
     """Obtener todos los artículos publicados del blog con paginación"""
     db = get_db()
@@ -175,64 +229,73 @@ def get_all_posts():
     limit = int(request.args.get('limit', 10))
     
     # Solo traer posts publicados si no se indica un estado específico
-    status = request.args.get('status')
-    
-    # Construir la consulta base
-    query = {}
-    
-    # Filtrar por estado solo si se especifica
-    if status:
-        query['status'] = status
-    else:
-        query['status'] = 'published'
-    
-    # Añadir filtros adicionales si están presentes
-    if category:
-        query['categories'] = category
-    if tag:
-        query['tags'] = tag
-    if search:
-        query['$or'] = [
-            {'title': {'$regex': search, '$options': 'i'}},
-            {'content': {'$regex': search, '$options': 'i'}},
-            {'excerpt': {'$regex': search, '$options': 'i'}},
-            {'author': {'$regex': search, '$options': 'i'}}
-        ]
-    
-    # Calcular total de documentos y páginas
-    total_posts = db.blog_posts.count_documents(query)
-    total_pages = (total_posts + limit - 1) // limit  # Redondear hacia arriba
+    status = request.args.get('status') or 'published'
+    summary = request.args.get('fields') == SUMMARY_FIELDS
+    
+    def load_page():
+        # Construir la consulta base
+        query = {'status': status}
+        projection = list_projection()
+        sort = [('publishDate', -1)]
+        
+        # Añadir filtros adicionales si están presentes
+        if category:
+            query['categories'] = category
+        if tag:
+            query['tags'] = tag
+        if search:
+            # Búsqueda de texto completo con ranking por relevancia
+            query['$text'] = {'$search': search}
+            projection = {**(projection or {}), 'score': {'$meta': 'textScore'}}
+            sort = [('score', {'$meta': 'textScore'}), ('publishDate', -1)]
+        
+        # Calcular total de documentos y páginas
+        total_posts = db.blog_posts.count_documents(query)
+        total_pages = (total_posts + limit - 1) // limit  # Redondear hacia arriba
+        
+        # Ejecutar la consulta con paginación
+        posts = list(db.blog_posts.find(query, projection)
+                     .sort(sort)
+                     .skip((page - 1) * limit)
+                     .limit(limit))
+        
+        # Convertir ObjectId a string para serialización JSON; la relevancia solo sirve para ordenar
+        for post in posts:
+            post['_id'] = str(post['_id'])
+            post.pop('score', None)
+        
+        return {
+            'posts': posts,
+            'page': page,
+            'totalPages': total_pages,
+            'totalPosts': total_posts
+        }
     
-    # Ejecutar la consulta con paginación
-    posts = list(db.blog_posts.find(query)
-                 .sort('publishDate', -1)
-                 .skip((page - 1) * limit)
-                 .limit(limit))
+    # Solo se cachean los listados públicos; los borradores del panel se leen siempre de la base de datos
+    if status != 'published':
+        return jsonify(load_page()), 200
     
-    # Convertir ObjectId a string para serialización JSON
-    for post in posts:
-        post['_id'] = str(post['_id'])
-    
-    return jsonify({
-        'posts': posts,
-        'page': page,
-        'totalPages': total_pages,
-        'totalPosts': total_posts
-    }), 200
+    cache_key = ('posts', category, tag, search, page, limit, summary)
+    return jsonify(blog_cache.get_or_set(cache_key, load_page)), 200
 
 @blog_bp.route('/posts/<slug>', methods=['GET'])
+@cached_response(tags=lambda slug: ['blog', f'blog:{slug}'], cache_control='public, max-age=60')
 def get_post_by_slug(slug):
     """Obtener un artículo del blog por su slug"""
     db = get_db()
     
-    post = db.blog_posts.find_one({'slug': slug, 'status': 'published'})
+    def load_post():
+        post = db.blog_posts.find_one({'slug': slug, 'status': 'published'})
+        if post:
+            # Convertir ObjectId a string para serialización JSON
+            post['_id'] = str(post['_id'])
+        return post
+    
+    post = blog_cache.get_or_set(('post', slug), load_post)
     
     if not post:
         return jsonify({'error': 'Artículo no encontrado'}), 404
     
-    # Convertir ObjectId a string para serialización JSON
-    post['_id'] = str(post['_id'])
-    
     return jsonify(post), 200
 
 @blog_bp.route('/categories', methods=['GET'])
@@ -248,7 +311,10 @@ def get_all_categories():
         {'$sort': {'_id': 1}}
     ]
     
-    categories = [cat['_id'] for cat in db.blog_posts.aggregate(pipeline)]
+    categories = blog_cache.get_or_set(
+        ('categories',),
+        lambda: [cat['_id'] for cat in db.blog_posts.aggregate(pipeline)]
+    )
     
     return jsonify(categories), 200
 
@@ -265,7 +331,10 @@ def get_all_tags():
         {'$sort': {'_id': 1}}
     ]
     
-    tags = [tag['_id'] for tag in db.blog_posts.aggregate(pipeline)]
+    tags = blog_cache.get_or_set(
+        ('tags',),
+        lambda: [tag['_id'] for tag in db.blog_posts.aggregate(pipeline)]
+    )
     
     return jsonify(tags), 200
 
@@ -274,12 +343,18 @@ def get_featured_posts():
     """Obtener artículos destacados"""
     db = get_db()
     
-    # Obtener artículos destacados
-    posts = list(db.blog_posts.find({'status': 'published', 'featured': True}).sort('publishDate', -1))
+    projection = list_projection()
     
-    # Convertir ObjectId a string para serialización JSON
-    for post in posts:
-        post['_id'] = str(post['_id'])
+    def load_featured():
+        # Obtener artículos destacados (sin el cuerpo del artículo con ?fields=summary)
+        posts = list(db.blog_posts.find({'status': 'published', 'featured': True}, projection).sort('publishDate', -1))
+        
+        # Convertir ObjectId a string para serialización JSON
+        for post in posts:
+            post['_id'] = str(post['_id'])
+        return posts
+    
+    posts = blog_cache.get_or_set(('featured', projection is not None), load_featured)
     
     return jsonify(posts), 200
 
@@ -328,6 +403,7 @@ def create_post():
     
     # Insertar el artículo en la base de datos
     result = db.blog_posts.insert_one(post)
+    invalidate_blog_cache()
     
     # Devolver el artículo creado
     post['_id'] = str(result.inserted_id)
@@ -378,6 +454,7 @@ def update_post(post_id):
     
     # Actualizar el artículo
     db.blog_posts.update_one({'_id': ObjectId(post_id)}, update_data)
+    invalidate_blog_cache()
     
     # Obtener el artículo actualizado
     updated_post = db.blog_posts.find_one({'_id': ObjectId(post_id)})
@@ -397,11 +474,13 @@ def delete_post(post_id):
     
     # Eliminar el artículo
     db.blog_posts.delete_one({'_id': ObjectId(post_id)})
+    invalidate_blog_cache()
     
     return jsonify({'message': 'Artículo eliminado correctamente'}), 200
 
 # Ruta para obtener un solo artículo por su ID (para edición)
-@blog_bp.route('/posts/<post_id>', methods=['GET'])
+# '/posts/<post_id>' coincidiría con la ruta por slug, que se registra antes
+@blog_bp.route('/posts/id/<post_id>', methods=['GET'])
 def get_post_by_id(post_id):
     """Obtener un artículo del blog por su ID"""
     db = get_db()
@@ -1,9 +1,10 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from bson import ObjectId
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import io
 import json
 from pymongo.errors import PyMongoError
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from models.reservations import (
     reservations_collection, 
     validate_reservation, 
@@ -11,6 +12,15 @@ from models.reservations import (
 )
 from services.availability import check_vehicle_availability_for_location
 from utils.geo_utils import get_coordinates_from_address
+from utils.json_utils import json_response
+from utils.export_stream import export_response, EXPORT_FORMATS, RESERVATION_EXPORT_COLUMNS
+from utils.auth import admin_required, get_current_user_id
+from utils.pagination import encode_cursor, decode_cursor, keyset_filter, merge_filters
+from services import booking_stats_service, reservation_import_service, busy_time_service, availability_bitmap_service, next_available_service, auto_dispatch_service
+from models.slot_claims import (
+    claim_slots, release_slots, reservation_window, reservation_resources, RELEASED_STATUSES
+)
+from services.search_service import search_filter, search_fields_update, refresh_search_terms, ensure_search_index, EXCLUDE_SEARCH_TERMS
 
 # Crear el blueprint para las rutas de reservas
 bookings_bp = Blueprint('bookings', __name__)
@@ -22,151 +32,199 @@ def setup_collections(db):
     """Inicializa las colecciones necesarias para este módulo"""
     global admin_users_collection
     admin_users_collection = db['users']  # Colección de usuarios admin
+    booking_stats_service.setup_collections(db)
+    booking_stats_service.start_stats_reconciler()
+    ensure_search_index(db['reservations'], 'reservations')
+
+# Límite de conteo cuando se pide un total aproximado con filtros
+APPROX_TOTAL_LIMIT = 10000
+
+def claim_reservation_slots(reservation_id, reservation):
+    """
+    Reclama las franjas de chofer y vehículo de una reserva
+    
+    Args:
+        reservation_id: _id de la reserva (propietaria de las franjas)
+        reservation: Documento de la reserva con pickup, dropoff, driver_id y vehicle_id
+    
+    Returns:
+        tuple | None: Respuesta de error 409 si alguna franja ya está ocupada, o None
+    """
+    start, end = reservation_window(reservation)
+    if not start:
+        return None
+    
+    conflict = claim_slots('reservation', reservation_id, reservation_resources(reservation), start, end)
+    if not conflict:
+        return None
+    
+    resource_name = "chofer" if conflict['resource_type'] == 'driver' else "vehículo"
+    return jsonify({
+        "error": f"El {resource_name} seleccionado ya tiene una reserva para el horario solicitado",
+        "resource_type": conflict['resource_type'],
+        "resource_id": conflict['resource_id'],
+        "conflicting_slot": conflict['bucket'].isoformat(),
+        "conflicting_reservation_id": conflict['held_by']
+    }), 409
+
+def build_reservation_query(args):
+    """
+    Construye la consulta de MongoDB a partir de los filtros del listado de reservas
+    
+    Args:
+        args: Parámetros de consulta (status, search, from_date, to_date)
+    
+    Returns:
+        dict: Filtro de MongoDB
+    """
+    status = args.get('status')
+    search = args.get('search')
+    from_date = args.get('from_date')
+    to_date = args.get('to_date')
+    
+    query = {}
+    
+    # Filtrar por estado
+    if status:
+        # Handle comma-separated statuses for filtering multiple states
+        if ',' in status:
+            status_list = [s.strip() for s in status.split(',')]
+            query['status'] = {'$in': status_list}
+        else:
+            query['status'] = status
+    
+    # Buscar por código o cliente (índice de prefijos search_terms)
+    if search:
+        terms_filter = search_filter(search)
+        if terms_filter:
+            query.update(terms_filter)
+    
+    # Filtrar por rango de fechas
+    date_filter = {}
+    if from_date:
+        date_filter['$gte'] = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
+    if to_date:
+        date_filter['$lte'] = datetime.fromisoformat(to_date.replace('Z', '+00:00'))
+    if date_filter:
+        query['pickup.date'] = date_filter
+    
+    return query
 
 # Endpoint para obtener todas las reservas (con paginación y filtros)
 @bookings_bp.route('/list', methods=['GET'])
 @jwt_required()
+@admin_required
 def get_all_reservations():
     """
     Obtiene todas las reservas con paginación y filtros
     Parámetros de consulta:
-    - page: número de página (default 1)
+    - cursor: cursor devuelto en pagination.next_cursor (paginación keyset, recomendada)
+    - page: número de página (default 1, ignorado si se envía cursor)
     - per_page: resultados por página (default 10)
+    - total: exact | approx | none (default exact con page, none con cursor)
     - status: filtrar por estado
     - search: buscar por código o nombre del cliente
     - from_date: filtrar desde fecha
     - to_date: filtrar hasta fecha
     """
-    try:
-        # Get JWT identity
-        current_user_id = get_jwt_identity()
-        print(f"[DEBUG] get_all_reservations - JWT identity type: {type(current_user_id)}")
-        print(f"[DEBUG] get_all_reservations - JWT identity value: {current_user_id}")
-        
-        # Handle different JWT identity formats
-        if isinstance(current_user_id, dict):
-            # If JWT identity is a dict, try to get 'id' or '_id' or 'sub'
-            user_id = current_user_id.get('id') or current_user_id.get('_id') or current_user_id.get('sub')
-            print(f"[DEBUG] Extracted user_id from dict: {user_id}")
-        else:
-            user_id = current_user_id
-            print(f"[DEBUG] Using JWT identity as is: {user_id}")
-        
-        # Verificar si el usuario es administrador
-        admin_user = admin_users_collection.find_one({
-            '_id': ObjectId(user_id),
-            'role': 'admin'
-        })
-        
-        if not admin_user:
-            print(f"[DEBUG] User {user_id} not found or not admin")
-            return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-        
-        print(f"[DEBUG] Admin user found: {admin_user.get('email')}")
-    except Exception as e:
-        print(f"[DEBUG] Authentication error: {str(e)}")
-        print(f"[DEBUG] Error type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': 'Error de autenticación', 'details': str(e)}), 422
-    
     try:
         # Parámetros de paginación
-        page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
-        skip = (page - 1) * per_page
-        
-        # Parámetros de filtrado
-        status = request.args.get('status')
-        search = request.args.get('search')
-        from_date = request.args.get('from_date')
-        to_date = request.args.get('to_date')
-        
-        # Construir la consulta
-        query = {}
-        
-        # Filtrar por estado
-        if status:
-            # Handle comma-separated statuses for filtering multiple states
-            if ',' in status:
-                status_list = [s.strip() for s in status.split(',')]
-                query['status'] = {'$in': status_list}
-            else:
-                query['status'] = status
-        
-        # Buscar por código o cliente
-        if search:
-            query['$or'] = [
-                {'code': {'$regex': search, '$options': 'i'}},
-                {'client_name': {'$regex': search, '$options': 'i'}}
-            ]
-        
-        # Filtrar por rango de fechas
-        date_filter = {}
-        if from_date:
-            date_filter['$gte'] = datetime.fromisoformat(from_date.replace('Z', '+00:00'))
-        if to_date:
-            date_filter['$lte'] = datetime.fromisoformat(to_date.replace('Z', '+00:00'))
-        if date_filter:
-            query['pickup.date'] = date_filter
-        
-        # Contar total de resultados para la paginación
-        total_reservations = reservations_collection.count_documents(query)
-        
-        # Obtener resultados paginados y ordenados por fecha de creación (más recientes primero)
-        reservations = list(reservations_collection.find(query)
-                          .sort('created_at', -1)
-                          .skip(skip)
-                          .limit(per_page))
-        
-        # Convertir ObjectId a string para la serialización JSON
-        for reservation in reservations:
-            # Función recursiva para convertir ObjectIds
-            def convert_objectids(obj):
-                if isinstance(obj, ObjectId):
-                    return str(obj)
-                elif isinstance(obj, dict):
-                    return {k: convert_objectids(v) for k, v in obj.items()}
-                elif isinstance(obj, list):
-                    return [convert_objectids(item) for item in obj]
-                else:
-                    return obj
-            
-            # Convertir todos los ObjectIds del documento
-            for key, value in list(reservation.items()):
-                reservation[key] = convert_objectids(value)
-            
-            # Formatear fechas para JSON
-            for date_field in ['created_at', 'updated_at']:
-                if date_field in reservation and isinstance(reservation[date_field], datetime):
-                    reservation[date_field] = reservation[date_field].isoformat()
-            
-            # Formatear fechas anidadas
-            if 'pickup' in reservation and 'date' in reservation['pickup']:
-                if isinstance(reservation['pickup']['date'], datetime):
-                    reservation['pickup']['date'] = reservation['pickup']['date'].isoformat()
-            
-            if 'dropoff' in reservation and 'estimated_date' in reservation['dropoff']:
-                if reservation['dropoff']['estimated_date'] and isinstance(reservation['dropoff']['estimated_date'], datetime):
-                    reservation['dropoff']['estimated_date'] = reservation['dropoff']['estimated_date'].isoformat()
+        cursor = request.args.get('cursor')
+        page = int(request.args.get('page', 1))
         
-        # Crear respuesta con metadatos de paginación
-        response = {
-            "reservations": reservations,
-            "pagination": {
-                "total": total_reservations,
-                "page": page,
-                "per_page": per_page,
-                "pages": (total_reservations + per_page - 1) // per_page  # Redondear hacia arriba
-            }
+        # Modo de cálculo del total: exact (por defecto en paginación por página),
+        # approx (estimación barata) o none (por defecto en paginación por cursor)
+        total_mode = request.args.get('total', 'none' if cursor else 'exact')
+        
+        # Construir la consulta a partir de los filtros
+        query = build_reservation_query(request.args)
+        
+        # Obtener una página ordenada por fecha de creación (más recientes primero)
+        find_query = query
+        if cursor:
+            try:
+                cursor_created_at, cursor_id = decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            find_query = merge_filters(query, keyset_filter(cursor_created_at, cursor_id))
+        
+        results = reservations_collection.find(find_query, EXCLUDE_SEARCH_TERMS).sort([('created_at', -1), ('_id', -1)])
+        if not cursor:
+            # Compatibilidad con la paginación por número de página
+            results = results.skip((page - 1) * per_page)
+        
+        # Pedir un documento extra para saber si hay más resultados
+        reservations = list(results.limit(per_page + 1))
+        has_more = len(reservations) > per_page
+        reservations = reservations[:per_page]
+        
+        pagination = {
+            "per_page": per_page,
+            "has_more": has_more,
+            "next_cursor": encode_cursor(reservations[-1]) if has_more else None
         }
         
-        return jsonify(response), 200
+        if not cursor:
+            pagination["page"] = page
+        
+        # Contar total de resultados solo cuando se solicita
+        if total_mode == 'exact':
+            total_reservations = reservations_collection.count_documents(query)
+            pagination["total"] = total_reservations
+            pagination["pages"] = (total_reservations + per_page - 1) // per_page  # Redondear hacia arriba
+        elif total_mode == 'approx':
+            if query:
+                # Con filtros, contar hasta un límite para acotar el coste
+                total_reservations = reservations_collection.count_documents(query, limit=APPROX_TOTAL_LIMIT)
+            else:
+                # Sin filtros, usar los metadatos de la colección
+                total_reservations = reservations_collection.estimated_document_count()
+            pagination["total"] = total_reservations
+            pagination["total_is_estimate"] = True
+            pagination["pages"] = (total_reservations + per_page - 1) // per_page
+        
+        # La serialización de ObjectId y fechas se hace al codificar la respuesta
+        return json_response({
+            "reservations": reservations,
+            "pagination": pagination
+        })
     
     except Exception as e:
         print(f"Error al obtener reservas: {str(e)}")
         return jsonify({"error": f"Error al obtener reservas: {str(e)}"}), 500
 
+
+# Endpoint para exportar reservas en streaming (CSV o NDJSON)
+@bookings_bp.route('/export', methods=['GET'])
+@jwt_required()
+@admin_required
+def export_reservations():
+    """
+    Exporta las reservas que cumplen los filtros del listado sin paginar
+    Parámetros de consulta:
+    - format: csv | ndjson (default ndjson)
+    - gzip: 1 para comprimir la respuesta
+    - status, search, from_date, to_date: mismos filtros que /list
+    """
+    try:
+        export_format = request.args.get('format', 'ndjson').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": "Formato no soportado. Use 'csv' o 'ndjson'"}), 400
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+        
+        query = build_reservation_query(request.args)
+        
+        # Mismo orden que /list, resuelto con el índice (created_at, _id)
+        cursor = reservations_collection.find(query, EXCLUDE_SEARCH_TERMS).sort([('created_at', -1), ('_id', -1)])
+        
+        filename = f"reservas_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+        return export_response(cursor, export_format, filename, RESERVATION_EXPORT_COLUMNS, compress)
+    
+    except Exception as e:
+        print(f"Error al exportar reservas: {str(e)}")
+        return jsonify({"error": f"Error al exportar reservas: {str(e)}"}), 500
+
 # Endpoint para crear una nueva reserva
 @bookings_bp.route('/create', methods=['POST'])
 @jwt_required()
@@ -243,14 +301,14 @@ def create_reservation():
                 dropoff_date
             )
             
-            # Verificar conflictos con reservas existentes
-            from utils.geo_utils import check_reservation_conflicts
-            has_conflicts = check_reservation_conflicts(
-                reservations_collection.database,  # Pasar la base de datos actual
-                str(data['driver_id']), 
-                str(data['vehicle_id']), 
-                pickup_date, 
-                dropoff_date
+            # Verificar conflictos con reservas y bloqueos de agenda (todos, no solo el primero)
+            conflicts = busy_time_service.find_conflicts(
+                reservations_collection.database,
+                pickup_date,
+                dropoff_date,
+                driver_id=data['driver_id'],
+                vehicle_id=data['vehicle_id'],
+                sources=[busy_time_service.SOURCE_RESERVATIONS, busy_time_service.SOURCE_AGENDA_BLOCKS]
             )
             
             # Si el chofer no está disponible o hay conflictos, devolver error
@@ -262,50 +320,46 @@ def create_reservation():
                     "dropoff_date": dropoff_date.isoformat()
                 }), 400
             
-            if has_conflicts:
+            if conflicts:
                 return jsonify({
                     "error": "El chofer o vehículo seleccionado ya tiene una reserva para el horario solicitado",
                     "driver_id": str(data['driver_id']),
                     "vehicle_id": str(data['vehicle_id']),
                     "pickup_date": pickup_date.isoformat(),
-                    "dropoff_date": dropoff_date.isoformat()
+                    "dropoff_date": dropoff_date.isoformat(),
+                    "conflicts": [
+                        {**conflict, "start": conflict["start"].isoformat(), "end": conflict["end"].isoformat()}
+                        for conflict in conflicts
+                    ]
                 }), 400
         
+        # Términos de búsqueda indexados (código y cliente)
+        data.update(search_fields_update('reservations', data))
+        
+        # Reclamar atómicamente las franjas del chofer y del vehículo antes de insertar
+        data['_id'] = ObjectId()
+        claim_error = claim_reservation_slots(data['_id'], data)
+        if claim_error:
+            return claim_error
+        
         # Insertar la reserva en la base de datos
-        result = reservations_collection.insert_one(data)
+        try:
+            result = reservations_collection.insert_one(data)
+        except Exception:
+            release_slots(data['_id'])
+            raise
         
         # Obtener la reserva recién creada
-        new_reservation = reservations_collection.find_one({"_id": result.inserted_id})
-        
-        # Preparar respuesta
-        new_reservation['_id'] = str(new_reservation['_id'])
-        if 'user_id' in new_reservation and new_reservation['user_id']:
-            new_reservation['user_id'] = str(new_reservation['user_id'])
-        if 'driver_id' in new_reservation and new_reservation['driver_id']:
-            new_reservation['driver_id'] = str(new_reservation['driver_id'])
-        if 'vehicle_id' in new_reservation and new_reservation['vehicle_id']:
-            new_reservation['vehicle_id'] = str(new_reservation['vehicle_id'])
-        if 'created_by' in new_reservation and new_reservation['created_by']:
-            new_reservation['created_by'] = str(new_reservation['created_by'])
-        
-        # Formatear fechas para JSON
-        for date_field in ['created_at', 'updated_at']:
-            if date_field in new_reservation and isinstance(new_reservation[date_field], datetime):
-                new_reservation[date_field] = new_reservation[date_field].isoformat()
-        
-        # Formatear fechas anidadas
-        if 'pickup' in new_reservation and 'date' in new_reservation['pickup']:
-            if isinstance(new_reservation['pickup']['date'], datetime):
-                new_reservation['pickup']['date'] = new_reservation['pickup']['date'].isoformat()
-        
-        if 'dropoff' in new_reservation and 'estimated_date' in new_reservation['dropoff']:
-            if new_reservation['dropoff']['estimated_date'] and isinstance(new_reservation['dropoff']['estimated_date'], datetime):
-                new_reservation['dropoff']['estimated_date'] = new_reservation['dropoff']['estimated_date'].isoformat()
+        new_reservation = reservations_collection.find_one({"_id": result.inserted_id}, EXCLUDE_SEARCH_TERMS)
+        booking_stats_service.record_reservation_change(None, new_reservation)
+        availability_bitmap_service.on_reservation_changed(None, new_reservation)
+        next_available_service.on_reservation_changed(None, new_reservation)
         
-        return jsonify({
+        # La serialización de ObjectId y fechas se hace al codificar la respuesta
+        return json_response({
             "message": "Reserva creada con éxito",
             "reservation": new_reservation
-        }), 201
+        }, 201)
     
     except PyMongoError as e:
         print(f"Error de MongoDB al crear reserva: {str(e)}")
@@ -314,6 +368,93 @@ def create_reservation():
         print(f"Error al crear reserva: {str(e)}")
         return jsonify({"error": f"Error al crear reserva: {str(e)}"}), 500
 
+# Endpoint para importar reservas en bloque (CSV o NDJSON)
+@bookings_bp.route('/import', methods=['POST'])
+@jwt_required()
+@admin_required
+def import_reservations():
+    """
+    Crea reservas en bloque a partir de un manifiesto CSV o NDJSON
+
+    El fichero puede enviarse como multipart (campo 'file') o en el cuerpo.
+    El formato se toma del parámetro ?format= o del Content-Type. La respuesta
+    es NDJSON en streaming: una línea por fila y un resumen final.
+    """
+    try:
+        upload = request.files.get('file')
+        if upload:
+            raw = upload.read()
+            content_type = upload.mimetype or ''
+        else:
+            raw = request.get_data()
+            content_type = request.mimetype or ''
+
+        if not raw:
+            return jsonify({"error": "No se recibieron datos"}), 400
+
+        file_format = request.args.get('format')
+        if not file_format:
+            file_format = 'csv' if 'csv' in content_type else 'ndjson'
+
+        try:
+            rows = reservation_import_service.parse_import_rows(
+                io.StringIO(raw.decode('utf-8-sig')), file_format.lower()
+            )
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({"error": str(e)}), 400
+
+        created_by = get_current_user_id()
+
+        def generate():
+            yield from reservation_import_service.import_reservations(reservations_collection, rows, created_by)
+            # Un solo recálculo de estadísticas para todo el lote
+            booking_stats_service.reconcile_booking_stats(notify=True)
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        print(f"Error al importar reservas: {str(e)}")
+        return jsonify({"error": f"Error al importar reservas: {str(e)}"}), 500
+
+# Endpoint para asignar chóferes automáticamente a las reservas sin asignar
+@bookings_bp.route('/dispatch/auto', methods=['POST'])
+@jwt_required()
+@admin_required
+def auto_dispatch_reservations():
+    """
+    Asigna chóferes a las reservas sin chófer de una ventana minimizando el
+    coste total (km en vacío, encaje en la agenda y reparto de carga)
+
+    Cuerpo JSON: window_start, window_end (ISO 8601, UTC) y dry_run (por
+    defecto true: solo devuelve el plan sin guardarlo).
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            window_start = datetime.fromisoformat(str(data['window_start']).replace('Z', '+00:00'))
+            window_end = datetime.fromisoformat(str(data['window_end']).replace('Z', '+00:00'))
+        except (KeyError, ValueError):
+            return jsonify({"error": "Se requieren window_start y window_end en formato ISO 8601"}), 400
+        if window_start.tzinfo is not None:
+            window_start = window_start.astimezone(timezone.utc).replace(tzinfo=None)
+        if window_end.tzinfo is not None:
+            window_end = window_end.astimezone(timezone.utc).replace(tzinfo=None)
+
+        dry_run = data.get('dry_run', True) not in (False, 'false', '0', 0)
+        try:
+            plan = auto_dispatch_service.auto_dispatch(reservations_collection.database, window_start, window_end, dry_run)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if not dry_run and plan.get('applied'):
+            booking_stats_service.reconcile_booking_stats(notify=True)
+
+        return json_response(plan)
+
+    except Exception as e:
+        print(f"Error en la asignación automática: {str(e)}")
+        return jsonify({"error": f"Error en la asignación automática: {str(e)}"}), 500
+
 # Endpoint para obtener una reserva específica
 @bookings_bp.route('/<reservation_id>', methods=['GET'])
 @jwt_required()
@@ -322,40 +463,15 @@ def get_reservation(reservation_id):
     try:
         # Buscar reserva por ID
         try:
-            reservation = reservations_collection.find_one({"_id": ObjectId(reservation_id)})
+            reservation = reservations_collection.find_one({"_id": ObjectId(reservation_id)}, EXCLUDE_SEARCH_TERMS)
         except:
             # Si el ID no es un ObjectId válido, buscar por código
-            reservation = reservations_collection.find_one({"code": reservation_id})
+            reservation = reservations_collection.find_one({"code": reservation_id}, EXCLUDE_SEARCH_TERMS)
         
         if not reservation:
             return jsonify({"error": "Reserva no encontrada"}), 404
         
-        # Convertir ObjectId a string para la serialización JSON
-        reservation['_id'] = str(reservation['_id'])
-        if 'user_id' in reservation and reservation['user_id']:
-            reservation['user_id'] = str(reservation['user_id'])
-        if 'driver_id' in reservation and reservation['driver_id']:
-            reservation['driver_id'] = str(reservation['driver_id'])
-        if 'vehicle_id' in reservation and reservation['vehicle_id']:
-            reservation['vehicle_id'] = str(reservation['vehicle_id'])
-        if 'created_by' in reservation and reservation['created_by']:
-            reservation['created_by'] = str(reservation['created_by'])
-        
-        # Formatear fechas para JSON
-        for date_field in ['created_at', 'updated_at']:
-            if date_field in reservation and isinstance(reservation[date_field], datetime):
-                reservation[date_field] = reservation[date_field].isoformat()
-        
-        # Formatear fechas anidadas
-        if 'pickup' in reservation and 'date' in reservation['pickup']:
-            if isinstance(reservation['pickup']['date'], datetime):
-                reservation['pickup']['date'] = reservation['pickup']['date'].isoformat()
-        
-        if 'dropoff' in reservation and 'estimated_date' in reservation['dropoff']:
-            if reservation['dropoff']['estimated_date'] and isinstance(reservation['dropoff']['estimated_date'], datetime):
-                reservation['dropoff']['estimated_date'] = reservation['dropoff']['estimated_date'].isoformat()
-        
-        return jsonify(reservation), 200
+        return json_response(reservation)
     
     except Exception as e:
         print(f"Error al obtener reserva: {str(e)}")
@@ -406,6 +522,13 @@ def update_reservation(reservation_id):
         if 'dropoff' in data and 'estimated_date' in data['dropoff'] and data['dropoff']['estimated_date'] and isinstance(data['dropoff']['estimated_date'], str):
             data['dropoff']['estimated_date'] = datetime.fromisoformat(data['dropoff']['estimated_date'].replace('Z', '+00:00'))
         
+        # Si cambian chofer, vehículo u horario, reclamar las nuevas franjas antes de guardar
+        slot_fields = ('driver_id', 'vehicle_id', 'pickup', 'dropoff', 'estimated_duration')
+        if any(field in data for field in slot_fields) and existing.get('status') not in RELEASED_STATUSES:
+            claim_error = claim_reservation_slots(existing['_id'], {**existing, **data})
+            if claim_error:
+                return claim_error
+        
         # Actualizar la reserva en la base de datos
         result = reservations_collection.update_one(
             {"_id": existing['_id']},
@@ -415,38 +538,19 @@ def update_reservation(reservation_id):
         if result.modified_count == 0:
             return jsonify({"message": "No se realizaron cambios"}), 200
         
+        if 'client_name' in data:
+            refresh_search_terms(reservations_collection, 'reservations', existing['_id'])
+        
         # Obtener la reserva actualizada
-        updated_reservation = reservations_collection.find_one({"_id": existing['_id']})
-        
-        # Preparar respuesta
-        updated_reservation['_id'] = str(updated_reservation['_id'])
-        if 'user_id' in updated_reservation and updated_reservation['user_id']:
-            updated_reservation['user_id'] = str(updated_reservation['user_id'])
-        if 'driver_id' in updated_reservation and updated_reservation['driver_id']:
-            updated_reservation['driver_id'] = str(updated_reservation['driver_id'])
-        if 'vehicle_id' in updated_reservation and updated_reservation['vehicle_id']:
-            updated_reservation['vehicle_id'] = str(updated_reservation['vehicle_id'])
-        if 'created_by' in updated_reservation and updated_reservation['created_by']:
-            updated_reservation['created_by'] = str(updated_reservation['created_by'])
-        
-        # Formatear fechas para JSON
-        for date_field in ['created_at', 'updated_at']:
-            if date_field in updated_reservation and isinstance(updated_reservation[date_field], datetime):
-                updated_reservation[date_field] = updated_reservation[date_field].isoformat()
-        
-        # Formatear fechas anidadas
-        if 'pickup' in updated_reservation and 'date' in updated_reservation['pickup']:
-            if isinstance(updated_reservation['pickup']['date'], datetime):
-                updated_reservation['pickup']['date'] = updated_reservation['pickup']['date'].isoformat()
-        
-        if 'dropoff' in updated_reservation and 'estimated_date' in updated_reservation['dropoff']:
-            if updated_reservation['dropoff']['estimated_date'] and isinstance(updated_reservation['dropoff']['estimated_date'], datetime):
-                updated_reservation['dropoff']['estimated_date'] = updated_reservation['dropoff']['estimated_date'].isoformat()
+        updated_reservation = reservations_collection.find_one({"_id": existing['_id']}, EXCLUDE_SEARCH_TERMS)
+        booking_stats_service.record_reservation_change(existing, updated_reservation)
+        availability_bitmap_service.on_reservation_changed(existing, updated_reservation)
+        next_available_service.on_reservation_changed(existing, updated_reservation)
         
-        return jsonify({
+        return json_response({
             "message": "Reserva actualizada con éxito",
             "reservation": updated_reservation
-        }), 200
+        })
     
     except PyMongoError as e:
         print(f"Error de MongoDB al actualizar reserva: {str(e)}")
@@ -484,6 +588,12 @@ def update_reservation_status(reservation_id):
         if not existing:
             return jsonify({"error": "Reserva no encontrada"}), 404
         
+        # Una reserva reactivada vuelve a reclamar las franjas del chofer y del vehículo
+        if new_status not in RELEASED_STATUSES and existing.get('status') in RELEASED_STATUSES:
+            claim_error = claim_reservation_slots(existing['_id'], existing)
+            if claim_error:
+                return claim_error
+        
         # Datos para la actualización
         update_data = {
             'status': new_status,
@@ -532,6 +642,14 @@ def update_reservation_status(reservation_id):
         if result.modified_count == 0:
             return jsonify({"message": "No se realizaron cambios"}), 200
         
+        booking_stats_service.record_reservation_change(existing, {**existing, **update_data})
+        
+        # Las reservas canceladas, completadas o no presentadas liberan sus franjas
+        if new_status in RELEASED_STATUSES:
+            release_slots(existing['_id'])
+        availability_bitmap_service.on_reservation_changed(existing, None)
+        next_available_service.on_reservation_changed(existing, None)
+        
         return jsonify({
             "message": f"Estado de reserva actualizado a '{new_status}'",
             "reservation_id": str(existing['_id']),
@@ -566,6 +684,11 @@ def delete_reservation(reservation_id):
         if result.deleted_count == 0:
             return jsonify({"error": "No se pudo eliminar la reserva"}), 500
         
+        booking_stats_service.record_reservation_change(existing, None)
+        release_slots(existing['_id'])
+        availability_bitmap_service.on_reservation_changed(existing, None)
+        next_available_service.on_reservation_changed(existing, None)
+        
         return jsonify({
             "message": f"Reserva {existing['code']} eliminada con éxito"
         }), 200
@@ -577,70 +700,12 @@ def delete_reservation(reservation_id):
 # Endpoint para obtener estadísticas de reservas
 @bookings_bp.route('/stats', methods=['GET'])
 @jwt_required()
+@admin_required
 def get_booking_stats():
     """Obtiene estadísticas generales de reservas"""
     try:
-        # Get JWT identity and verify admin role
-        current_user_id = get_jwt_identity()
-        
-        # Handle different JWT identity formats
-        if isinstance(current_user_id, dict):
-            user_id = current_user_id.get('id') or current_user_id.get('_id') or current_user_id.get('sub')
-        else:
-            user_id = current_user_id
-        
-        # Verificar si el usuario es administrador
-        admin_user = admin_users_collection.find_one({
-            '_id': ObjectId(user_id),
-            'role': 'admin'
-        })
-        
-        if not admin_user:
-            return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-
-        # Obtener estadísticas generales
-        total_reservations = reservations_collection.count_documents({})
-        
-        # Contar por estado
-        status_counts = {}
-        statuses = ['pending', 'confirmed', 'in_progress', 'completed', 'cancelled', 'no_show']
-        
-        for status in statuses:
-            count = reservations_collection.count_documents({'status': status})
-            status_counts[status] = count
-        
-        # Contar reservas activas (no completadas ni canceladas)
-        active_statuses = ['pending', 'confirmed', 'in_progress']
-        active_count = reservations_collection.count_documents({'status': {'$in': active_statuses}})
-        
-        # Contar historial (completadas, canceladas, no show)
-        history_statuses = ['completed', 'cancelled', 'no_show']
-        history_count = reservations_collection.count_documents({'status': {'$in': history_statuses}})
-        
-        # Reservas de hoy
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = today_start + timedelta(days=1)
-        
-        today_count = reservations_collection.count_documents({
-            'pickup.date': {
-                '$gte': today_start,
-                '$lt': today_end
-            }
-        })
-        
-        # Contar incidencias (reservas con incident_history)
-        incidents_count = reservations_collection.count_documents({
-            'incident_history': {'$exists': True, '$ne': []}
-        })
-        
-        return jsonify({
-            'total': total_reservations,
-            'active': active_count,
-            'history': history_count,
-            'today': today_count,
-            'incidents': incidents_count,
-            'by_status': status_counts
-        }), 200
+        # Lectura O(1) del resumen mantenido incrementalmente
+        return jsonify(booking_stats_service.get_booking_stats()), 200
         
     except Exception as e:
         print(f"Error al obtener estadísticas de reservas: {str(e)}")
@@ -5,6 +5,8 @@ import os
 from dotenv import load_dotenv
 import datetime
 import json
+from services import association_service
+from services.search_service import search_filter, search_fields_update, refresh_search_terms, ensure_search_index, rank_documents, EXCLUDE_SEARCH_TERMS
 
 # Cargar variables de entorno
 load_dotenv()
@@ -14,6 +16,7 @@ MONGO_URI = os.getenv('MONGO_URI')
 client = MongoClient(MONGO_URI)
 db = client['operiq']
 collaborators_collection = db['collaborators']
+ensure_search_index(collaborators_collection, 'collaborators')
 
 # Convertir ObjectId a string para JSON
 class JSONEncoder(json.JSONEncoder):
@@ -45,17 +48,15 @@ def get_collaborators():
             filter_params['status'] = status_filter
             
         if search_query:
-            # Buscar en varios campos
-            filter_params['$or'] = [
-                {'name': {'$regex': search_query, '$options': 'i'}},
-                {'contactName': {'$regex': search_query, '$options': 'i'}},
-                {'contactEmail': {'$regex': search_query, '$options': 'i'}},
-                {'city': {'$regex': search_query, '$options': 'i'}},
-                {'country': {'$regex': search_query, '$options': 'i'}}
-            ]
+            # Buscar en varios campos (índice de prefijos search_terms)
+            terms_filter = search_filter(search_query)
+            if terms_filter:
+                filter_params.update(terms_filter)
         
         # Obtener colaboradores según los filtros
-        collaborators = list(collaborators_collection.find(filter_params))
+        collaborators = list(collaborators_collection.find(filter_params, EXCLUDE_SEARCH_TERMS))
+        if search_query:
+            collaborators = rank_documents('collaborators', collaborators, search_query)
         
         # Convertir ObjectId a string para serialización JSON
         for collaborator in collaborators:
@@ -80,11 +81,14 @@ def add_collaborator():
         # Añadir fecha de creación
         collaborator_data['created_at'] = datetime.datetime.now()
         
+        # Términos de búsqueda indexados
+        collaborator_data.update(search_fields_update('collaborators', collaborator_data))
+        
         # Insertar en la base de datos
         result = collaborators_collection.insert_one(collaborator_data)
         
         # Obtener el colaborador recién creado
-        new_collaborator = collaborators_collection.find_one({'_id': result.inserted_id})
+        new_collaborator = collaborators_collection.find_one({'_id': result.inserted_id}, EXCLUDE_SEARCH_TERMS)
         new_collaborator['id'] = str(new_collaborator.pop('_id'))
         
         return jsonify({
@@ -119,8 +123,10 @@ def update_collaborator(collaborator_id):
                 'message': 'Colaborador no encontrado'
             }), 404
         
+        refresh_search_terms(collaborators_collection, 'collaborators', ObjectId(collaborator_id))
+        
         # Obtener el colaborador actualizado
-        updated_collaborator = collaborators_collection.find_one({'_id': ObjectId(collaborator_id)})
+        updated_collaborator = collaborators_collection.find_one({'_id': ObjectId(collaborator_id)}, EXCLUDE_SEARCH_TERMS)
         updated_collaborator['id'] = str(updated_collaborator.pop('_id'))
         
         return jsonify({
@@ -162,7 +168,7 @@ def delete_collaborator(collaborator_id):
 def get_collaborator_detail(collaborator_id):
     try:
         # Buscar el colaborador por ID
-        collaborator = collaborators_collection.find_one({'_id': ObjectId(collaborator_id)})
+        collaborator = collaborators_collection.find_one({'_id': ObjectId(collaborator_id)}, EXCLUDE_SEARCH_TERMS)
         
         if not collaborator:
             return jsonify({
@@ -188,11 +194,13 @@ def get_collaborator_detail(collaborator_id):
 def update_collaborator_associations(collaborator_id):
     try:
         data = request.json
-        vehicle_id = data.get('vehicleId')
+        vehicle_ids = list(data.get('vehicleIds', []))
+        if data.get('vehicleId'):
+            vehicle_ids.append(data['vehicleId'])
         driver_ids = data.get('driverIds', [])
         
-        # Buscar el colaborador
-        collaborator = collaborators_collection.find_one({'_id': ObjectId(collaborator_id)})
+        # Añadir asociaciones de forma atómica ($addToSet)
+        collaborator = association_service.link_collaborator(collaborator_id, vehicle_ids, driver_ids)
         
         if not collaborator:
             return jsonify({
@@ -200,39 +208,45 @@ def update_collaborator_associations(collaborator_id):
                 'message': 'Colaborador no encontrado'
             }), 404
         
-        # Inicializar arrays si no existen
-        if 'associatedVehicles' not in collaborator:
-            collaborator['associatedVehicles'] = []
-        
-        if 'associatedDrivers' not in collaborator:
-            collaborator['associatedDrivers'] = []
-            
-        # Actualizar vehículo asociado si se proporciona
-        if vehicle_id and vehicle_id not in collaborator['associatedVehicles']:
-            collaborator['associatedVehicles'].append(vehicle_id)
+        return jsonify({
+            'status': 'success',
+            'message': 'Asociaciones actualizadas correctamente',
+            'collaborator': {
+                'id': str(collaborator['_id']),
+                'associatedVehicles': collaborator.get('associatedVehicles', []),
+                'associatedDrivers': collaborator.get('associatedDrivers', [])
+            }
+        }), 200
         
-        # Actualizar conductores asociados
-        for driver_id in driver_ids:
-            if driver_id not in collaborator['associatedDrivers']:
-                collaborator['associatedDrivers'].append(driver_id)
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@collaborators_bp.route('/<collaborator_id>/remove-associations', methods=['POST'])
+def remove_collaborator_associations(collaborator_id):
+    try:
+        data = request.json
         
-        # Guardar cambios
-        collaborators_collection.update_one(
-            {'_id': ObjectId(collaborator_id)},
-            {'$set': {
-                'associatedVehicles': collaborator['associatedVehicles'],
-                'associatedDrivers': collaborator['associatedDrivers'],
-                'updated_at': datetime.datetime.now()
-            }}
+        # Quitar asociaciones de forma atómica ($pull)
+        collaborator = association_service.unlink_collaborator(
+            collaborator_id, data.get('vehicleIds', []), data.get('driverIds', [])
         )
         
+        if not collaborator:
+            return jsonify({
+                'status': 'error',
+                'message': 'Colaborador no encontrado'
+            }), 404
+        
         return jsonify({
             'status': 'success',
-            'message': 'Asociaciones actualizadas correctamente',
+            'message': 'Asociaciones eliminadas correctamente',
             'collaborator': {
                 'id': str(collaborator['_id']),
-                'associatedVehicles': collaborator['associatedVehicles'],
-                'associatedDrivers': collaborator['associatedDrivers']
+                'associatedVehicles': collaborator.get('associatedVehicles', []),
+                'associatedDrivers': collaborator.get('associatedDrivers', [])
             }
         }), 200
         
@@ -240,4 +254,4 @@ def update_collaborator_associations(collaborator_id):
         return jsonify({
             'status': 'error',
             'message': str(e)
-        }), 500 
\ No newline at end of file
+        }), 500
@@ -2,7 +2,10 @@ from flask import Blueprint, request, jsonify
 from bson import ObjectId
 from datetime import datetime
 import uuid
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+from utils.auth import admin_required
+from services import fleet_roster_service
+from services.search_service import search_filter, search_fields_update, refresh_search_terms, ensure_search_index, rank_documents
 
 # Crear blueprint para las rutas de chóferes
 drivers_bp = Blueprint("drivers", __name__)
@@ -18,22 +21,13 @@ def setup_collections(db):
     users_collection = db['users']
     drivers_collection = db['drivers']
     driver_vehicle_assignments_collection = db['driver_vehicle_assignments']
+    ensure_search_index(drivers_collection, 'drivers')
 
 # Obtener todos los chóferes (solo para administradores)
 @drivers_bp.route('/list', methods=['GET'])
 @jwt_required()
+@admin_required
 def get_drivers():
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Obtener parámetros de consulta para filtrado
     status_filter = request.args.get('status', '')
     search_query = request.args.get('search', '')
@@ -62,17 +56,16 @@ def get_drivers():
             query['company_id'] = {'$exists': True}
     
     if search_query:
-        # Búsqueda por nombre, email, teléfono o ID
-        query['$or'] = [
-            {'first_name': {'$regex': search_query, '$options': 'i'}},
-            {'last_name': {'$regex': search_query, '$options': 'i'}},
-            {'email': {'$regex': search_query, '$options': 'i'}},
-            {'phone': {'$regex': search_query, '$options': 'i'}}
-        ]
+        # Búsqueda por nombre, email o teléfono (índice de prefijos search_terms)
+        terms_filter = search_filter(search_query)
+        if terms_filter:
+            query.update(terms_filter)
     
     try:
         # Obtener chóferes filtrados
         drivers_cursor = drivers_collection.find(query)
+        if search_query:
+            drivers_cursor = rank_documents('drivers', drivers_cursor, search_query)
         
         # Convertir a formato esperado por el frontend
         drivers_list = []
@@ -123,18 +116,8 @@ def get_drivers():
 # Obtener detalles de un chófer específico
 @drivers_bp.route('/<driver_id>', methods=['GET'])
 @jwt_required()
+@admin_required
 def get_driver_details(driver_id):
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     try:
         # Buscar chófer por ID
         driver = drivers_collection.find_one({'_id': ObjectId(driver_id)})
@@ -196,18 +179,8 @@ def get_driver_details(driver_id):
 # Crear nuevo chófer (solo administradores)
 @drivers_bp.route('/create', methods=['POST'])
 @jwt_required()
+@admin_required
 def create_driver():
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Obtener datos del request
     data = request.get_json()
     
@@ -281,6 +254,9 @@ def create_driver():
         if data.get('type') == 'company' and data.get('companyName'):
             new_driver['company_name'] = data.get('companyName')
         
+        # Términos de búsqueda indexados
+        new_driver.update(search_fields_update('drivers', new_driver))
+        
         # Insertar en la base de datos
         result = drivers_collection.insert_one(new_driver)
         
@@ -299,18 +275,8 @@ def create_driver():
 # Actualizar chófer existente
 @drivers_bp.route('/<driver_id>/update', methods=['PUT'])
 @jwt_required()
+@admin_required
 def update_driver(driver_id):
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Obtener datos del request
     data = request.get_json()
     
@@ -445,6 +411,13 @@ def update_driver(driver_id):
         if result.modified_count == 0:
             return jsonify({'message': 'No se realizaron cambios'}), 200
             
+        if any(field in data for field in ('name', 'email', 'phone')):
+            refresh_search_terms(drivers_collection, 'drivers', ObjectId(driver_id))
+            
+        # Nombre y foto forman parte de la instantánea incrustada en vehículos y rutas
+        if 'name' in data or 'photo' in data:
+            fleet_roster_service.on_driver_changed(driver_id)
+            
         return jsonify({'message': 'Chófer actualizado exitosamente'}), 200
     
     except Exception as e:
@@ -453,18 +426,8 @@ def update_driver(driver_id):
 # Eliminar chófer
 @drivers_bp.route('/<driver_id>/delete', methods=['DELETE'])
 @jwt_required()
+@admin_required
 def delete_driver(driver_id):
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Buscar chófer por ID
     driver = drivers_collection.find_one({'_id': ObjectId(driver_id)})
     
@@ -481,6 +444,8 @@ def delete_driver(driver_id):
         if result.deleted_count == 0:
             return jsonify({'error': 'No se pudo eliminar el chófer'}), 500
         
+        fleet_roster_service.on_driver_changed(driver_id)
+        
         return jsonify({'message': 'Chófer eliminado exitosamente'}), 200
     except Exception as e:
         return jsonify({'error': f'Error al eliminar el chófer: {str(e)}'}), 500
@@ -488,18 +453,8 @@ def delete_driver(driver_id):
 # Obtener chóferes filtrados por collaborator_id
 @drivers_bp.route('/by-collaborator/<collaborator_id>', methods=['GET'])
 @jwt_required()
+@admin_required
 def get_drivers_by_collaborator(collaborator_id):
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     try:
         # Buscar chóferes por collaborator_id
         drivers_cursor = drivers_collection.find({'collaborator_id': collaborator_id})
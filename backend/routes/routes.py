@@ -3,6 +3,12 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from bson import ObjectId
 import datetime
 import uuid
+from utils.http_cache import cached_response, invalidate_tags
+from services.fleet_roster_service import (
+    attach_roster_to_vehicles, DRIVERS_SOURCE_FIELD, DRIVERS_SOURCE_ROSTER, DRIVERS_SOURCE_MANUAL
+)
+from services import coverage_tiles_service
+from services.search_service import search_filter, search_fields_update, refresh_search_terms, ensure_search_index, rank_documents, EXCLUDE_SEARCH_TERMS
 
 # Colecciones de MongoDB
 fixed_routes_collection = None
@@ -22,6 +28,7 @@ def setup_collections(db):
     fixed_routes_collection.create_index([("origin.location", "2dsphere")])
     fixed_routes_collection.create_index([("destination.location", "2dsphere")])
     flexible_zones_collection.create_index([("center.location", "2dsphere")])
+    ensure_search_index(fixed_routes_collection, 'fixed_routes')
 
 # Función auxiliar para convertir ObjectId a str en documentos
 def convert_objectids(doc):
@@ -37,69 +44,19 @@ def convert_objectids(doc):
                         convert_objectids(item)
     return doc
 
-# Función auxiliar para obtener datos de un conductor por ID
-def get_driver_by_id(driver_id):
+# Función auxiliar para adjuntar conductores a vehículos en rutas
+def attach_drivers_to_vehicles(vehicles_data):
+    """Adjunta el conductor principal de cada vehículo desde el modelo de lectura de la flota"""
     try:
-        # Obtener la colección de conductores
-        from app import drivers_collection
-        
-        # Si el driver_id es una cadena, convertirlo a ObjectId
-        if isinstance(driver_id, str):
-            driver_id = ObjectId(driver_id)
-            
-        # Buscar el conductor en la base de datos
-        driver = drivers_collection.find_one({'_id': driver_id})
-        
-        if not driver:
-            print(f"Conductor no encontrado para ID: {driver_id}")
-            return None
-        
-        # Convertir a formato para incluir en respuesta
-        # Crear nombre completo a partir de first_name y last_name
-        full_name = f"{driver.get('first_name', '')} {driver.get('last_name', '')}".strip()
-        
-        return {
-            "id": str(driver['_id']),
-            "name": full_name or 'Sin nombre',
-            "photo": driver.get('profile_image', '')
-        }
-        
+        return attach_roster_to_vehicles(vehicles_data)
     except Exception as e:
-        print(f"Error al obtener conductor {driver_id}: {str(e)}")
-        return None
-
-# Función auxiliar para buscar y adjuntar conductores a vehículos en rutas
-def attach_drivers_to_vehicles(vehicles_data):
-    """Busca y adjunta información de conductor a cada vehículo usando associatedDrivers"""
-    from app import vehicles_collection
-    
-    for vehicle in vehicles_data:
-        if 'id' not in vehicle:
-            continue
-            
-        try:
-            # Obtener el vehículo completo para acceder a associatedDrivers
-            db_vehicle = vehicles_collection.find_one({'_id': ObjectId(vehicle['id'])})
-            
-            if not db_vehicle or 'associatedDrivers' not in db_vehicle or not db_vehicle['associatedDrivers']:
-                continue
-                
-            # Tomar el primer conductor asociado
-            driver_id = db_vehicle['associatedDrivers'][0]
-            driver_data = get_driver_by_id(driver_id)
-            
-            if driver_data:
-                # Adjuntar datos del conductor al vehículo
-                vehicle['driver'] = driver_data
-                
-        except Exception as e:
-            print(f"Error al adjuntar conductor a vehículo {vehicle['id']}: {str(e)}")
-            
-    return vehicles_data
+        print(f"Error al adjuntar conductores a vehículos: {str(e)}")
+        return vehicles_data
 
 # RUTAS FIJAS
 @routes_bp.route('/fixed/list', methods=['GET'])
 @jwt_required()
+@cached_response(tags=lambda **kwargs: ['fixed_routes'], cache_control='private, no-cache')
 def list_fixed_routes():
     try:
         # Obtener parámetros de filtro opcionales
@@ -113,7 +70,7 @@ def list_fixed_routes():
             filters['collaborator_id'] = collaborator_id
             
         # Obtener todas las rutas fijas que coincidan con los filtros
-        routes = list(fixed_routes_collection.find(filters))
+        routes = list(fixed_routes_collection.find(filters, EXCLUDE_SEARCH_TERMS))
         
         # Convertir ObjectId a string
         routes = [convert_objectids(route) for route in routes]
@@ -133,7 +90,7 @@ def list_fixed_routes():
 def get_fixed_route(route_id):
     try:
         # Buscar la ruta por ID
-        route = fixed_routes_collection.find_one({"_id": ObjectId(route_id)})
+        route = fixed_routes_collection.find_one({"_id": ObjectId(route_id)}, EXCLUDE_SEARCH_TERMS)
         
         if not route:
             return jsonify({
@@ -236,6 +193,8 @@ def create_fixed_route():
                 new_route["drivers"] = drivers
                 # Para compatibilidad, usar el primer conductor
                 new_route["driver"] = drivers[0]
+            # Los conductores se mantienen sincronizados con los vehículos
+            new_route[DRIVERS_SOURCE_FIELD] = DRIVERS_SOURCE_ROSTER
         
         # Añadir campo de conductor individual si está presente explícitamente
         elif 'driver' in data and data['driver']:
@@ -244,10 +203,12 @@ def create_fixed_route():
                 "name": data['driver']['name'],
                 "photo": data['driver'].get('photo', "")
             }
+            new_route[DRIVERS_SOURCE_FIELD] = DRIVERS_SOURCE_MANUAL
             
         # Añadir array de conductores si está presente explícitamente
         elif 'drivers' in data and isinstance(data['drivers'], list) and data['drivers']:
             new_route["drivers"] = data['drivers']
+            new_route[DRIVERS_SOURCE_FIELD] = DRIVERS_SOURCE_MANUAL
         
         # Añadir collaboratorId si está presente
         if 'collaboratorId' in data:
@@ -259,8 +220,13 @@ def create_fixed_route():
         if 'estimatedTime' in data:
             new_route["estimatedTime"] = data['estimatedTime']
             
+        # Términos de búsqueda indexados (nombre, origen y destino)
+        new_route.update(search_fields_update('fixed_routes', new_route))
+        
         # Insertar la nueva ruta en la base de datos
         result = fixed_routes_collection.insert_one(new_route)
+        invalidate_tags('fixed_routes')
+        coverage_tiles_service.on_zones_changed([result.inserted_id])
         
         # Obtener el ID de la ruta creada
         new_route_id = str(result.inserted_id)
@@ -349,10 +315,12 @@ def update_fixed_route(route_id):
                 "name": data['driver']['name'],
                 "photo": data['driver'].get('photo', "")
             }
+            update_data[DRIVERS_SOURCE_FIELD] = DRIVERS_SOURCE_MANUAL
             
         # Actualizar array de conductores si está presente
         if 'drivers' in data and isinstance(data['drivers'], list):
             update_data["drivers"] = data['drivers']
+            update_data[DRIVERS_SOURCE_FIELD] = DRIVERS_SOURCE_MANUAL
         
         # Actualizar array de vehículos si está presente
         if 'vehicles' in data and isinstance(data['vehicles'], list):
@@ -379,6 +347,10 @@ def update_fixed_route(route_id):
                 update_data["drivers"] = drivers
                 # Para compatibilidad, usar el primer conductor
                 update_data["driver"] = drivers[0]
+                update_data[DRIVERS_SOURCE_FIELD] = DRIVERS_SOURCE_ROSTER
+            elif DRIVERS_SOURCE_FIELD not in update_data:
+                # Sin conductores explícitos, los de la ruta siguen a los vehículos
+                update_data[DRIVERS_SOURCE_FIELD] = DRIVERS_SOURCE_ROSTER
                 
         # Actualizar collaboratorId si está presente
         if 'collaboratorId' in data:
@@ -395,6 +367,9 @@ def update_fixed_route(route_id):
             {"_id": ObjectId(route_id)},
             {"$set": update_data}
         )
+        refresh_search_terms(fixed_routes_collection, 'fixed_routes', ObjectId(route_id))
+        invalidate_tags('fixed_routes')
+        coverage_tiles_service.on_zones_changed([route_id])
         
         return jsonify({
             "status": "success",
@@ -422,6 +397,8 @@ def delete_fixed_route(route_id):
             
         # Eliminar la ruta de la base de datos
         fixed_routes_collection.delete_one({"_id": ObjectId(route_id)})
+        invalidate_tags('fixed_routes')
+        coverage_tiles_service.on_zones_changed([route_id])
         
         return jsonify({
             "status": "success",
@@ -455,6 +432,7 @@ def toggle_fixed_route_status(route_id):
             {"_id": ObjectId(route_id)},
             {"$set": {"status": new_status, "updated_at": datetime.datetime.utcnow()}}
         )
+        invalidate_tags('fixed_routes')
         
         return jsonify({
             "status": "success",
@@ -779,6 +757,7 @@ def toggle_flexible_zone_status(zone_id):
         }), 500
 
 @routes_bp.route('/fixed/search', methods=['GET'])
+@cached_response(tags=lambda **kwargs: ['fixed_routes'], cache_control='public, max-age=60')
 def search_fixed_routes():
     try:
         # Obtener el término de búsqueda
@@ -790,21 +769,21 @@ def search_fixed_routes():
                 "message": "El término de búsqueda debe tener al menos 2 caracteres"
             }), 400
         
-        # Crear consulta para MongoDB
-        # Buscar coincidencias en nombre, origen.name o destino.name
-        query = {
-            "$or": [
-                {"name": {"$regex": search_query, "$options": "i"}},
-                {"origin.name": {"$regex": search_query, "$options": "i"}},
-                {"destination.name": {"$regex": search_query, "$options": "i"}}
-            ]
-        }
+        # Buscar coincidencias en nombre, origen.name o destino.name (índice de prefijos search_terms)
+        query = search_filter(search_query)
+        if not query:
+            return jsonify({
+                "status": "success",
+                "message": "No se encontraron rutas",
+                "routes": []
+            }), 200
         
         # Filtrar solo rutas activas
         query["status"] = "active"
         
-        # Ejecutar búsqueda
-        routes = list(fixed_routes_collection.find(query).limit(10))
+        # Ejecutar búsqueda: se acota el conjunto candidato y se devuelven las 10 más relevantes
+        candidates = fixed_routes_collection.find(query, EXCLUDE_SEARCH_TERMS).limit(100)
+        routes = rank_documents('fixed_routes', candidates, search_query)[:10]
         
         if not routes:
             return jsonify({
@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+from utils.auth import admin_required, invalidate_user_role
+from services import password_service
+from services.search_service import search_filter, search_fields_update, refresh_search_terms, ensure_search_index, rank_documents
 import datetime
 
 # Crear blueprint para las rutas de usuarios
@@ -13,22 +16,13 @@ users_collection = None
 def setup_collections(db):
     global users_collection
     users_collection = db['users']
+    ensure_search_index(users_collection, 'users')
 
 # Obtener todos los usuarios (sólo para administradores)
 @users_bp.route('/list', methods=['GET'])
 @jwt_required()
+@admin_required
 def get_users():
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Obtener parámetros de consulta para filtrado
     role_filter = request.args.get('role', '')
     status_filter = request.args.get('status', '')
@@ -48,15 +42,18 @@ def get_users():
         query['tags'] = tag_filter
     
     if search_query:
-        # Búsqueda por nombre, email o ID
-        query['$or'] = [
-            {'name': {'$regex': search_query, '$options': 'i'}},
-            {'email': {'$regex': search_query, '$options': 'i'}},
-            {'_id': {'$regex': search_query, '$options': 'i'} if ObjectId.is_valid(search_query) else ''}
-        ]
+        # Búsqueda por ID exacto o por nombre/email (índice de prefijos search_terms)
+        if ObjectId.is_valid(search_query):
+            query['_id'] = ObjectId(search_query)
+        else:
+            terms_filter = search_filter(search_query)
+            if terms_filter:
+                query.update(terms_filter)
     
     # Obtener usuarios filtrados
     users_cursor = users_collection.find(query)
+    if search_query:
+        users_cursor = rank_documents('users', users_cursor, search_query)
     
     # Convertir a formato esperado por el frontend
     users_list = []
@@ -89,18 +86,8 @@ def get_users():
 # Obtener detalles de un usuario específico
 @users_bp.route('/<user_id>', methods=['GET'])
 @jwt_required()
+@admin_required
 def get_user_details(user_id):
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Buscar usuario por ID
     user = users_collection.find_one({'_id': ObjectId(user_id)})
     
@@ -140,18 +127,8 @@ def get_user_details(user_id):
 # Crear nuevo usuario (sólo administradores)
 @users_bp.route('/create', methods=['POST'])
 @jwt_required()
+@admin_required
 def create_user():
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Obtener datos del request
     data = request.get_json()
     
@@ -167,9 +144,10 @@ def create_user():
     # Generar contraseña aleatoria temporal si se proporciona
     password = data.get('password', '')
     if password:
-        from flask_bcrypt import Bcrypt
-        bcrypt = Bcrypt()
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        try:
+            hashed_password = password_service.hash_password(password)
+        except password_service.PasswordServiceBusy as e:
+            return jsonify({'error': str(e)}), 503
     else:
         hashed_password = ''
     
@@ -232,6 +210,9 @@ def create_user():
         if data.get('companyName') and data.get('phoneNumber'):
             new_user['profile_completed'] = True
     
+    # Términos de búsqueda indexados
+    new_user.update(search_fields_update('users', new_user))
+    
     # Guardar en la base de datos
     result = users_collection.insert_one(new_user)
     
@@ -258,18 +239,8 @@ def create_user():
 # Actualizar usuario existente
 @users_bp.route('/<user_id>/update', methods=['PUT'])
 @jwt_required()
+@admin_required
 def update_user(user_id):
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Obtener datos del request
     data = request.get_json()
     
@@ -299,6 +270,11 @@ def update_user(user_id):
     if 'status' in data:
         update_data['status'] = data['status']
     
+    if 'role' in data and data['role'] != user.get('role'):
+        if data['role'] not in ('user', 'company', 'admin'):
+            return jsonify({'error': 'Rol no válido'}), 400
+        update_data['role'] = data['role']
+    
     # Manejo para usuarios regulares
     if user.get('role') == 'user':
         # Actualizar campos de perfil
@@ -353,6 +329,13 @@ def update_user(user_id):
         
         if result.modified_count == 0:
             return jsonify({'error': 'No se pudo actualizar el usuario'}), 500
+        
+        if 'name' in update_data or 'email' in update_data:
+            refresh_search_terms(users_collection, 'users', ObjectId(user_id))
+        
+        # El rol en caché y los tokens emitidos antes del cambio dejan de ser válidos
+        if 'role' in update_data:
+            invalidate_user_role(user_id)
     
     # Obtener usuario actualizado
     updated_user = users_collection.find_one({'_id': ObjectId(user_id)})
@@ -373,18 +356,8 @@ def update_user(user_id):
 # Eliminar usuario
 @users_bp.route('/<user_id>/delete', methods=['DELETE'])
 @jwt_required()
+@admin_required
 def delete_user(user_id):
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Buscar usuario por ID
     user = users_collection.find_one({'_id': ObjectId(user_id)})
     
@@ -397,23 +370,15 @@ def delete_user(user_id):
     if result.deleted_count == 0:
         return jsonify({'error': 'No se pudo eliminar el usuario'}), 500
     
+    invalidate_user_role(user_id)
+    
     return jsonify({'message': 'Usuario eliminado exitosamente'}), 200
 
 # Asignar o eliminar etiqueta
 @users_bp.route('/<user_id>/tags', methods=['POST'])
 @jwt_required()
+@admin_required
 def manage_tags(user_id):
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     # Obtener datos del request
     data = request.get_json()
     
@@ -2,9 +2,12 @@ from flask import Blueprint, request, jsonify
 from bson import ObjectId
 import pymongo
 from datetime import datetime
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 import os
-import functools
+from utils.http_cache import invalidate_tags
+from utils.auth import admin_required
+from services import fleet_roster_service, association_service, coverage_tiles_service
+from utils.geo_utils import vehicle_coverage_area, refresh_vehicle_coverage
 
 # Crear un Blueprint para las rutas de vehículos
 vehicles_bp = Blueprint('vehicles', __name__)
@@ -18,24 +21,9 @@ def setup_collections(database):
     global db, vehicles_collection
     db = database
     vehicles_collection = db['vehicles']
-
-# Decorador para requerir rol de administrador
-def admin_required(fn):
-    @functools.wraps(fn)
-    def wrapper(*args, **kwargs):
-        # Obtener identidad del token
-        current_user_id = get_jwt_identity()
-        
-        # Buscar usuario en la base de datos
-        from app import users_collection
-        user = users_collection.find_one({'_id': ObjectId(current_user_id)})
-        
-        if not user or user.get('role') != 'admin':
-            return jsonify({"error": "Se requiere rol de administrador"}), 403
-        
-        return fn(*args, **kwargs)
     
-    return wrapper
+    # Búsqueda de vehículos flexibles por área de cobertura ($geoIntersects)
+    vehicles_collection.create_index([("coverage_area", "2dsphere")])
 
 # Rutas para la gestión de vehículos
 @vehicles_bp.route('/api/admin/vehicles/list', methods=['GET'])
@@ -126,8 +114,14 @@ def create_vehicle():
                     'message': f'Campo requerido: {field}'
                 }), 400
         
+        # Área de cobertura precalculada para la búsqueda de rutas flexibles
+        coverage_area = vehicle_coverage_area(vehicle_data)
+        if coverage_area:
+            vehicle_data['coverage_area'] = coverage_area
+        
         # Insertar en la base de datos
         result = vehicles_collection.insert_one(vehicle_data)
+        coverage_tiles_service.on_vehicles_changed([result.inserted_id])
         
         return jsonify({
             'status': 'success',
@@ -164,6 +158,13 @@ def update_vehicle(vehicle_id):
                 'message': 'Vehículo no encontrado'
             }), 404
         
+        if {'location', 'availability_radius', 'availabilityType'} & set(vehicle_data):
+            refresh_vehicle_coverage(db, [vehicle_id])
+            coverage_tiles_service.on_vehicles_changed([vehicle_id])
+        
+        invalidate_tags(f'vehicle:{vehicle_id}')
+        fleet_roster_service.on_vehicles_changed([vehicle_id])
+        
         return jsonify({
             'status': 'success',
             'message': 'Vehículo actualizado exitosamente'
@@ -189,6 +190,10 @@ def delete_vehicle(vehicle_id):
                 'message': 'Vehículo no encontrado'
             }), 404
         
+        invalidate_tags(f'vehicle:{vehicle_id}')
+        fleet_roster_service.on_vehicles_changed([vehicle_id])
+        coverage_tiles_service.on_vehicles_changed([vehicle_id])
+        
         return jsonify({
             'status': 'success',
             'message': 'Vehículo eliminado exitosamente'
@@ -225,6 +230,7 @@ def toggle_vehicle_availability(vehicle_id):
                 'updated_at': datetime.utcnow()
             }}
         )
+        invalidate_tags(f'vehicle:{vehicle_id}')
         
         return jsonify({
             'status': 'success',
@@ -254,45 +260,26 @@ def assign_driver_to_vehicle(vehicle_id):
             }), 400
         
         # Verificar si el vehículo existe
-        vehicle = vehicles_collection.find_one({'_id': ObjectId(vehicle_id)})
-        if not vehicle:
+        if not ObjectId.is_valid(vehicle_id) or not vehicles_collection.count_documents({'_id': ObjectId(vehicle_id)}, limit=1):
             return jsonify({
                 'status': 'error',
                 'message': 'Vehículo no encontrado'
             }), 404
         
-        # Verificar si el conductor existe
-        from app import drivers_collection
-        driver = drivers_collection.find_one({'_id': ObjectId(driver_id)})
-        if not driver:
+        # Vincular de forma atómica ($addToSet) junto con su asignación
+        try:
+            result = association_service.link_drivers_to_vehicles([vehicle_id], [driver_id])
+        except ValueError:
             return jsonify({
                 'status': 'error',
                 'message': 'Conductor no encontrado'
             }), 404
-        
-        # Actualizar la lista de conductores asignados al vehículo
-        associated_drivers = vehicle.get('associatedDrivers', [])
-        
-        # Convertir ObjectId a string si es necesario
-        driver_id_str = str(driver_id) if isinstance(driver_id, ObjectId) else driver_id
-        
-        # Añadir conductor solo si no está ya asignado
-        if driver_id_str not in associated_drivers:
-            associated_drivers.append(driver_id_str)
-            
-            # Actualizar el vehículo
-            vehicles_collection.update_one(
-                {'_id': ObjectId(vehicle_id)},
-                {'$set': {
-                    'associatedDrivers': associated_drivers,
-                    'updated_at': datetime.utcnow()
-                }}
-            )
+        invalidate_tags(f'vehicle:{vehicle_id}')
         
         return jsonify({
             'status': 'success',
             'message': 'Conductor asignado al vehículo exitosamente',
-            'associatedDrivers': associated_drivers
+            'associatedDrivers': result['associatedDrivers'].get(vehicle_id, [])
         }), 200
     except Exception as e:
         return jsonify({
@@ -317,36 +304,104 @@ def remove_driver_from_vehicle(vehicle_id):
             }), 400
         
         # Verificar si el vehículo existe
-        vehicle = vehicles_collection.find_one({'_id': ObjectId(vehicle_id)})
-        if not vehicle:
+        if not ObjectId.is_valid(vehicle_id) or not vehicles_collection.count_documents({'_id': ObjectId(vehicle_id)}, limit=1):
             return jsonify({
                 'status': 'error',
                 'message': 'Vehículo no encontrado'
             }), 404
         
-        # Actualizar la lista de conductores asignados al vehículo
-        associated_drivers = vehicle.get('associatedDrivers', [])
+        # Desvincular de forma atómica ($pull) y desactivar la asignación
+        result = association_service.unlink_drivers_from_vehicles([vehicle_id], [driver_id])
+        invalidate_tags(f'vehicle:{vehicle_id}')
         
-        # Convertir ObjectId a string si es necesario
-        driver_id_str = str(driver_id) if isinstance(driver_id, ObjectId) else driver_id
+        return jsonify({
+            'status': 'success',
+            'message': 'Conductor eliminado del vehículo exitosamente',
+            'associatedDrivers': result['associatedDrivers'].get(vehicle_id, [])
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@vehicles_bp.route('/api/admin/vehicles/drivers/bulk-assign', methods=['POST'])
+@jwt_required()
+@admin_required
+def bulk_assign_drivers():
+    """Vincular varios conductores con varios vehículos en una sola llamada"""
+    try:
+        data = request.json or {}
+        vehicle_ids = data.get('vehicle_ids')
+        driver_ids = data.get('driver_ids')
         
-        # Eliminar conductor si está asignado
-        if driver_id_str in associated_drivers:
-            associated_drivers.remove(driver_id_str)
-            
-            # Actualizar el vehículo
-            vehicles_collection.update_one(
-                {'_id': ObjectId(vehicle_id)},
-                {'$set': {
-                    'associatedDrivers': associated_drivers,
-                    'updated_at': datetime.utcnow()
-                }}
+        if not isinstance(vehicle_ids, list) or not isinstance(driver_ids, list):
+            return jsonify({
+                'status': 'error',
+                'message': 'Se requieren las listas vehicle_ids y driver_ids'
+            }), 400
+        
+        try:
+            result = association_service.link_drivers_to_vehicles(
+                vehicle_ids,
+                driver_ids,
+                primary_driver_id=data.get('primary_driver_id'),
+                schedule=data.get('schedule'),
+                collaborator_id=data.get('collaborator_id')
             )
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        
+        for vehicle_id in result['vehicles']:
+            invalidate_tags(f'vehicle:{vehicle_id}')
         
         return jsonify({
             'status': 'success',
-            'message': 'Conductor eliminado del vehículo exitosamente',
-            'associatedDrivers': associated_drivers
+            'message': 'Conductores asignados a los vehículos exitosamente',
+            **result
+        }), 200
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@vehicles_bp.route('/api/admin/vehicles/drivers/bulk-remove', methods=['POST'])
+@jwt_required()
+@admin_required
+def bulk_remove_drivers():
+    """Desvincular varios conductores de varios vehículos en una sola llamada"""
+    try:
+        data = request.json or {}
+        vehicle_ids = data.get('vehicle_ids')
+        driver_ids = data.get('driver_ids')
+        
+        if not isinstance(vehicle_ids, list) or not isinstance(driver_ids, list):
+            return jsonify({
+                'status': 'error',
+                'message': 'Se requieren las listas vehicle_ids y driver_ids'
+            }), 400
+        
+        try:
+            result = association_service.unlink_drivers_from_vehicles(
+                vehicle_ids, driver_ids, reason=data.get('reason', 'No especificado')
+            )
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        
+        for vehicle_id in result['vehicles']:
+            invalidate_tags(f'vehicle:{vehicle_id}')
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Conductores eliminados de los vehículos exitosamente',
+            **result
         }), 200
     except Exception as e:
         return jsonify({
@@ -356,27 +411,19 @@ def remove_driver_from_vehicle(vehicle_id):
 
 @vehicles_bp.route('/api/admin/vehicles/by-collaborator/<collaborator_id>', methods=['GET'])
 @jwt_required()
+@admin_required
 def get_vehicles_by_collaborator(collaborator_id):
     """Obtener vehículos asociados a un colaborador específico por ID"""
-    current_user_id = get_jwt_identity()
-    
-    # Verificar si el usuario es administrador
-    from app import users_collection
-    admin_user = users_collection.find_one({
-        '_id': ObjectId(current_user_id),
-        'role': 'admin'
-    })
-    
-    if not admin_user:
-        return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
-    
     try:
         # Buscar vehículos por collaboratorId
-        vehicles_cursor = vehicles_collection.find({'collaboratorId': collaborator_id})
+        vehicles = list(vehicles_collection.find({'collaboratorId': collaborator_id}))
+        
+        # Conductores asociados desde el modelo de lectura de la flota (una consulta)
+        roster = fleet_roster_service.get_roster(vehicle['_id'] for vehicle in vehicles)
         
         # Convertir a formato esperado por el frontend
         vehicles_list = []
-        for vehicle in vehicles_cursor:
+        for vehicle in vehicles:
             # Extraer detalles de modelo y año
             details = vehicle.get('details', {})
             brand = details.get('brand', '')
@@ -407,20 +454,10 @@ def get_vehicles_by_collaborator(collaborator_id):
                 'details': details  # Enviamos todos los detalles por si se necesitan más adelante
             }
             
-            # Buscar conductor asociado si existe
-            if 'associatedDrivers' in vehicle and vehicle['associatedDrivers']:
-                try:
-                    from app import drivers_collection
-                    driver_id = vehicle['associatedDrivers'][0]  # Tomar el primer conductor
-                    driver = drivers_collection.find_one({'_id': ObjectId(driver_id)})
-                    if driver:
-                        vehicle_data['associatedDriver'] = {
-                            'id': str(driver['_id']),
-                            'name': driver.get('name', ''),
-                            'photo': driver.get('photo', '')
-                        }
-                except Exception as driver_error:
-                    print(f"Error al obtener conductor: {str(driver_error)}")
+            # Conductor asociado (el primero de associatedDrivers)
+            roster_entry = roster.get(str(vehicle['_id']))
+            if roster_entry and roster_entry.get('driver'):
+                vehicle_data['associatedDriver'] = roster_entry['driver']
             
             vehicles_list.append(vehicle_data)
         
@@ -0,0 +1,312 @@
+"""
+Asociaciones entre colaboradores, vehículos y chóferes.
+
+Todas las altas y bajas se hacen con operadores atómicos (``$addToSet`` con
+``$each`` y ``$pull`` con ``$in``) en lugar de leer el documento, modificar la
+lista en Python y escribirla entera con ``$set``: dos peticiones simultáneas ya
+no se pisan y cada cambio cuesta una sola ida y vuelta por colección.
+
+Las variantes en bloque vinculan muchos chóferes con muchos vehículos en una
+llamada y mantienen ``driver_vehicle_assignments`` en la misma operación (un
+upsert por pareja en un único ``bulk_write``). Si el despliegue de MongoDB
+admite transacciones (replica set o sharding) todo se aplica en una
+transacción; en un servidor independiente las escrituras siguen siendo
+idempotentes y pueden repetirse sin efectos duplicados.
+"""
+
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+
+from services import fleet_roster_service
+
+# Horario por defecto de una asignación nueva (igual que /api/assignments)
+DEFAULT_SCHEDULE = {
+    "days": ["lunes", "martes", "miércoles", "jueves", "viernes"],
+    "hours": "08:00-20:00"
+}
+
+# Límite de vehículos y chóferes por llamada en bloque
+MAX_BULK_ITEMS = 500
+
+vehicles_collection: Optional[Collection] = None
+drivers_collection: Optional[Collection] = None
+collaborators_collection: Optional[Collection] = None
+assignments_collection: Optional[Collection] = None
+
+
+def setup_collections(db):
+    """Inicializa las colecciones y los índices de asignaciones"""
+    global vehicles_collection, drivers_collection, collaborators_collection, assignments_collection
+
+    vehicles_collection = db['vehicles']
+    drivers_collection = db['drivers']
+    collaborators_collection = db['collaborators']
+    assignments_collection = db['driver_vehicle_assignments']
+
+    try:
+        # Mismo índice que crea init_assignments.py: una asignación por pareja
+        assignments_collection.create_index([('driver_id', 1), ('vehicle_id', 1)], unique=True)
+    except Exception as e:
+        print(f"[ASSOCIATIONS] No se pudo crear el índice único de asignaciones: {str(e)}")
+    assignments_collection.create_index([('vehicle_id', 1), ('status', 1)])
+
+
+def _unique_ids(ids: Iterable[Any]) -> List[str]:
+    """Normaliza una lista de ids a cadenas sin duplicados, conservando el orden"""
+    seen = []
+    for value in ids or []:
+        value = str(value).strip() if value is not None else ''
+        if value and value not in seen:
+            seen.append(value)
+    return seen
+
+
+def _transactions_supported() -> bool:
+    topology = vehicles_collection.database.client.topology_description.topology_type_name
+    return topology in ('ReplicaSetWithPrimary', 'Sharded')
+
+
+def _run_atomically(callback: Callable[[Any], Any]) -> Any:
+    """Ejecuta callback(session) en una transacción si el despliegue lo admite"""
+    if _transactions_supported():
+        with vehicles_collection.database.client.start_session() as session:
+            return session.with_transaction(callback)
+    return callback(None)
+
+
+def _existing_ids(collection: Collection, ids: List[str]) -> List[str]:
+    object_ids = [ObjectId(value) for value in ids if ObjectId.is_valid(value)]
+    if not object_ids:
+        return []
+    found = {str(doc['_id']) for doc in collection.find({'_id': {'$in': object_ids}}, {'_id': 1})}
+    return [value for value in ids if value in found]
+
+
+def _associated_drivers(vehicle_ids: List[str], session=None) -> Dict[str, List[str]]:
+    return {
+        str(vehicle['_id']): vehicle.get('associatedDrivers', [])
+        for vehicle in vehicles_collection.find(
+            {'_id': {'$in': [ObjectId(value) for value in vehicle_ids]}},
+            {'associatedDrivers': 1},
+            session=session
+        )
+    }
+
+
+def _check_bulk_size(*groups: List[str]):
+    for group in groups:
+        if len(group) > MAX_BULK_ITEMS:
+            raise ValueError(f"Se admiten como máximo {MAX_BULK_ITEMS} elementos por llamada")
+
+
+def link_drivers_to_vehicles(vehicle_ids: Iterable[Any], driver_ids: Iterable[Any],
+                             primary_driver_id: Optional[str] = None,
+                             schedule: Optional[Dict[str, Any]] = None,
+                             collaborator_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Vincula cada chófer con cada vehículo (producto cartesiano)
+
+    Args:
+        vehicle_ids: Vehículos a vincular
+        driver_ids: Chóferes a vincular
+        primary_driver_id: Chófer que pasa a ser el principal de los vehículos
+        schedule: Horario de las asignaciones nuevas (por defecto DEFAULT_SCHEDULE)
+        collaborator_id: Colaborador al que se asocian también vehículos y chóferes
+
+    Returns:
+        Dict[str, Any]: Vehículos y chóferes vinculados, ids inexistentes,
+            asignaciones creadas y associatedDrivers resultante de cada vehículo
+
+    Raises:
+        ValueError: Si no hay ningún vehículo o chófer válido o se supera MAX_BULK_ITEMS
+    """
+    vehicle_ids = _unique_ids(vehicle_ids)
+    driver_ids = _unique_ids(driver_ids)
+    _check_bulk_size(vehicle_ids, driver_ids)
+
+    found_vehicles = _existing_ids(vehicles_collection, vehicle_ids)
+    found_drivers = _existing_ids(drivers_collection, driver_ids)
+    if not found_vehicles or not found_drivers:
+        raise ValueError('Se requiere al menos un vehículo y un chófer existentes')
+    if collaborator_id and not ObjectId.is_valid(collaborator_id):
+        raise ValueError('ID de colaborador no válido')
+    if primary_driver_id is not None and str(primary_driver_id) not in found_drivers:
+        raise ValueError('El chófer principal debe estar entre los chóferes vinculados')
+
+    now = datetime.utcnow()
+
+    def apply(session):
+        vehicles_collection.update_many(
+            {'_id': {'$in': [ObjectId(value) for value in found_vehicles]}},
+            {'$addToSet': {'associatedDrivers': {'$each': found_drivers}}, '$set': {'updated_at': now}},
+            session=session
+        )
+
+        operations = [
+            UpdateOne(
+                {'driver_id': driver_id, 'vehicle_id': vehicle_id},
+                {
+                    '$set': {'status': 'active', 'updated_at': now},
+                    '$setOnInsert': {
+                        'assigned_at': now,
+                        'schedule': schedule or DEFAULT_SCHEDULE,
+                        'primary_driver': False
+                    }
+                },
+                upsert=True
+            )
+            for vehicle_id in found_vehicles
+            for driver_id in found_drivers
+        ]
+        result = assignments_collection.bulk_write(operations, ordered=False, session=session)
+
+        if primary_driver_id is not None:
+            primary = str(primary_driver_id)
+            assignments_collection.update_many(
+                {'vehicle_id': {'$in': found_vehicles}, 'driver_id': {'$ne': primary}, 'primary_driver': True},
+                {'$set': {'primary_driver': False}},
+                session=session
+            )
+            assignments_collection.update_many(
+                {'vehicle_id': {'$in': found_vehicles}, 'driver_id': primary},
+                {'$set': {'primary_driver': True}},
+                session=session
+            )
+
+        if collaborator_id:
+            collaborators_collection.update_one(
+                {'_id': ObjectId(collaborator_id)},
+                {'$addToSet': {
+                    'associatedVehicles': {'$each': found_vehicles},
+                    'associatedDrivers': {'$each': found_drivers}
+                }, '$set': {'updated_at': now}},
+                session=session
+            )
+
+        return {
+            'assignments_created': result.upserted_count,
+            'associatedDrivers': _associated_drivers(found_vehicles, session)
+        }
+
+    outcome = _run_atomically(apply)
+    fleet_roster_service.on_vehicles_changed(found_vehicles)
+
+    return {
+        'vehicles': found_vehicles,
+        'drivers': found_drivers,
+        'missing_vehicles': [value for value in vehicle_ids if value not in found_vehicles],
+        'missing_drivers': [value for value in driver_ids if value not in found_drivers],
+        **outcome
+    }
+
+
+def unlink_drivers_from_vehicles(vehicle_ids: Iterable[Any], driver_ids: Iterable[Any],
+                                 reason: str = 'No especificado') -> Dict[str, Any]:
+    """
+    Desvincula los chóferes de los vehículos y desactiva sus asignaciones
+
+    Si un vehículo pierde a su chófer principal, otra asignación activa pasa a
+    serlo (como en /api/assignments/deactivate).
+
+    Returns:
+        Dict[str, Any]: Asignaciones desactivadas y associatedDrivers resultante de cada vehículo
+    """
+    vehicle_ids = [value for value in _unique_ids(vehicle_ids) if ObjectId.is_valid(value)]
+    driver_ids = _unique_ids(driver_ids)
+    _check_bulk_size(vehicle_ids, driver_ids)
+    if not vehicle_ids or not driver_ids:
+        raise ValueError('Se requiere al menos un vehículo y un chófer')
+
+    now = datetime.utcnow()
+
+    def apply(session):
+        vehicles_collection.update_many(
+            {'_id': {'$in': [ObjectId(value) for value in vehicle_ids]}},
+            {'$pull': {'associatedDrivers': {'$in': driver_ids}}, '$set': {'updated_at': now}},
+            session=session
+        )
+        result = assignments_collection.update_many(
+            {'vehicle_id': {'$in': vehicle_ids}, 'driver_id': {'$in': driver_ids}, 'status': 'active'},
+            {'$set': {
+                'status': 'inactive',
+                'primary_driver': False,
+                'updated_at': now,
+                'deactivation_reason': reason
+            }},
+            session=session
+        )
+
+        # Vehículos que se han quedado sin chófer principal
+        with_primary = set(assignments_collection.distinct(
+            'vehicle_id',
+            {'vehicle_id': {'$in': vehicle_ids}, 'status': 'active', 'primary_driver': True},
+            session=session
+        ))
+        orphans = [value for value in vehicle_ids if value not in with_primary]
+        if orphans:
+            promotions = [
+                UpdateOne({'_id': candidate['assignment_id']}, {'$set': {'primary_driver': True}})
+                for candidate in assignments_collection.aggregate([
+                    {'$match': {'vehicle_id': {'$in': orphans}, 'status': 'active'}},
+                    {'$sort': {'assigned_at': 1}},
+                    {'$group': {'_id': '$vehicle_id', 'assignment_id': {'$first': '$_id'}}}
+                ], session=session)
+            ]
+            if promotions:
+                assignments_collection.bulk_write(promotions, ordered=False, session=session)
+
+        return {
+            'assignments_deactivated': result.modified_count,
+            'associatedDrivers': _associated_drivers(vehicle_ids, session)
+        }
+
+    outcome = _run_atomically(apply)
+    fleet_roster_service.on_vehicles_changed(vehicle_ids)
+
+    return {'vehicles': vehicle_ids, 'drivers': driver_ids, **outcome}
+
+
+def link_collaborator(collaborator_id: str, vehicle_ids: Iterable[Any] = (),
+                      driver_ids: Iterable[Any] = ()) -> Optional[Dict[str, Any]]:
+    """
+    Añade vehículos y chóferes a las asociaciones de un colaborador
+
+    Returns:
+        Optional[Dict[str, Any]]: Colaborador actualizado (solo asociaciones), o None si no existe
+    """
+    return _update_collaborator(collaborator_id, '$addToSet', _unique_ids(vehicle_ids), _unique_ids(driver_ids))
+
+
+def unlink_collaborator(collaborator_id: str, vehicle_ids: Iterable[Any] = (),
+                        driver_ids: Iterable[Any] = ()) -> Optional[Dict[str, Any]]:
+    """
+    Quita vehículos y chóferes de las asociaciones de un colaborador
+
+    Returns:
+        Optional[Dict[str, Any]]: Colaborador actualizado (solo asociaciones), o None si no existe
+    """
+    return _update_collaborator(collaborator_id, '$pull', _unique_ids(vehicle_ids), _unique_ids(driver_ids))
+
+
+def _update_collaborator(collaborator_id: str, operator: str, vehicle_ids: List[str],
+                         driver_ids: List[str]) -> Optional[Dict[str, Any]]:
+    _check_bulk_size(vehicle_ids, driver_ids)
+    change = {}
+    for field, values in (('associatedVehicles', vehicle_ids), ('associatedDrivers', driver_ids)):
+        if values:
+            change[field] = {'$each': values} if operator == '$addToSet' else {'$in': values}
+
+    update = {'$set': {'updated_at': datetime.utcnow()}}
+    if change:
+        update[operator] = change
+
+    return collaborators_collection.find_one_and_update(
+        {'_id': ObjectId(collaborator_id)},
+        update,
+        projection={'associatedVehicles': 1, 'associatedDrivers': 1},
+        return_document=ReturnDocument.AFTER
+    )
@@ -0,0 +1,352 @@
+"""
+Asignación automática de chóferes a reservas sin asignar (auto-dispatch).
+
+Toma todas las reservas pendientes o confirmadas sin chófer de una ventana y
+las reparte entre los chóferes con una asignación activa en
+``driver_vehicle_assignments``, resolviendo en cada ola de WAVE_MINUTES un
+problema de emparejamiento de coste mínimo (``linear_sum_assignment``).
+
+El coste de asignar un servicio a un chófer suma:
+
+- Kilómetros en vacío desde la posición del chófer (su vehículo o el destino
+  de su servicio anterior) hasta la recogida, con haversine vectorizado.
+- Encaje en la agenda: minutos de espera entre que el chófer queda libre y
+  la recogida (se prefieren planes compactos).
+- Equidad: servicios que el chófer ya tiene en la ventana.
+
+Las parejas imposibles (fuera de agenda, bloqueadas, con otra reserva, sin
+tiempo para llegar, vehículo distinto o sin plazas) quedan excluidas. La
+disponibilidad de todas las parejas se evalúa de una vez con
+``check_driver_availability_batch``.
+"""
+
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from bson import ObjectId
+from scipy.optimize import linear_sum_assignment
+
+from models.slot_claims import claim_slots, reservation_window
+from services import availability_bitmap_service, busy_time_service, next_available_service
+from services.availability import check_driver_availability_batch
+
+# Estados de reserva que pueden recibir chófer automáticamente
+DISPATCHABLE_STATUSES = ['pending', 'confirmed']
+
+# Tamaño de cada ola de emparejamiento
+WAVE_MINUTES = 30
+
+# Ventana máxima por ejecución
+MAX_DISPATCH_WINDOW = timedelta(days=2)
+
+# Velocidad media para estimar el tiempo de llegada en vacío
+AVERAGE_SPEED_KMH = 30.0
+
+# Distancia máxima en vacío hasta la recogida
+MAX_DEADHEAD_KM = 60.0
+
+# Distancia supuesta para chóferes sin posición conocida
+UNKNOWN_POSITION_KM = 15.0
+
+# Pesos del coste (por km en vacío, por minuto de espera y por servicio ya asignado)
+DEADHEAD_WEIGHT = 1.0
+IDLE_WEIGHT = 0.05
+FAIRNESS_WEIGHT = 5.0
+
+INFEASIBLE_COST = 1e9
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_matrix(origins: Any, destinations: Any) -> np.ndarray:
+    """
+    Distancias en kilómetros entre todos los orígenes y destinos
+
+    Args:
+        origins: Coordenadas [longitud, latitud] de forma (n, 2); NaN si se desconocen
+        destinations: Coordenadas [longitud, latitud] de forma (m, 2)
+
+    Returns:
+        np.ndarray: Matriz (n, m) de distancias (NaN donde falta el origen)
+    """
+    origins = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+    destinations = np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+
+    delta_lon = destinations[None, :, 0] - origins[:, None, 0]
+    delta_lat = destinations[None, :, 1] - origins[:, None, 1]
+    a = (np.sin(delta_lat / 2) ** 2
+         + np.cos(origins[:, None, 1]) * np.cos(destinations[None, :, 1]) * np.sin(delta_lon / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _coordinates(value: Any) -> Optional[List[float]]:
+    if isinstance(value, dict):
+        value = value.get('coordinates')
+    if isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(item, (int, float)) for item in value):
+        return [float(value[0]), float(value[1])]
+    return None
+
+
+def _load_candidates(db) -> Dict[str, Dict[str, Any]]:
+    """Chóferes con asignación activa, sus vehículos, plazas y posición inicial"""
+    candidates: Dict[str, Dict[str, Any]] = {}
+    for assignment in db['driver_vehicle_assignments'].find(
+        {'status': 'active'}, {'driver_id': 1, 'vehicle_id': 1, 'primary_driver': 1}
+    ):
+        driver_id, vehicle_id = str(assignment['driver_id']), str(assignment['vehicle_id'])
+        if not ObjectId.is_valid(driver_id) or not ObjectId.is_valid(vehicle_id):
+            continue
+        candidate = candidates.setdefault(driver_id, {'vehicle_ids': [], 'primary_vehicle_id': None})
+        candidate['vehicle_ids'].append(vehicle_id)
+        if assignment.get('primary_driver') or candidate['primary_vehicle_id'] is None:
+            candidate['primary_vehicle_id'] = vehicle_id
+
+    vehicle_ids = {vehicle_id for candidate in candidates.values() for vehicle_id in candidate['vehicle_ids']}
+    vehicles = {
+        str(vehicle['_id']): vehicle
+        for vehicle in db['vehicles'].find(
+            {'_id': {'$in': [ObjectId(vehicle_id) for vehicle_id in vehicle_ids]}},
+            {'location': 1, 'details.capacity': 1, 'licensePlate': 1}
+        )
+    }
+    for candidate in candidates.values():
+        primary = vehicles.get(candidate['primary_vehicle_id']) or {}
+        candidate['position'] = _coordinates(primary.get('location'))
+        candidate['capacity'] = {
+            vehicle_id: (vehicles.get(vehicle_id) or {}).get('details', {}).get('capacity')
+            for vehicle_id in candidate['vehicle_ids']
+        }
+    return candidates
+
+
+def _pick_vehicle(trip: Dict[str, Any], candidate: Dict[str, Any]) -> Optional[str]:
+    """Vehículo con el que el chófer haría el servicio, o None si no puede hacerlo"""
+    if trip['vehicle_id']:
+        vehicle_id = trip['vehicle_id'] if trip['vehicle_id'] in candidate['vehicle_ids'] else None
+    else:
+        vehicle_id = candidate['primary_vehicle_id']
+    if vehicle_id is None:
+        return None
+    capacity = candidate['capacity'].get(vehicle_id)
+    if capacity and trip['passengers'] and trip['passengers'] > capacity:
+        return None
+    return vehicle_id
+
+
+def build_plan(db, window_start: datetime, window_end: datetime) -> Dict[str, Any]:
+    """
+    Calcula el plan de asignación de las reservas sin chófer de una ventana
+
+    Args:
+        db: Conexión a la base de datos
+        window_start: Inicio de la ventana (recogidas, UTC)
+        window_end: Fin de la ventana
+
+    Returns:
+        Dict[str, Any]: 'assignments', 'unassigned' (con motivo) y 'summary'
+    """
+    started = time.perf_counter()
+
+    trips = []
+    unassigned = []
+    for reservation in db['reservations'].find(
+        {
+            'driver_id': None,
+            'status': {'$in': DISPATCHABLE_STATUSES},
+            'pickup.date': {'$gte': window_start, '$lt': window_end}
+        },
+        {'code': 1, 'pickup': 1, 'dropoff': 1, 'vehicle_id': 1, 'passengers': 1, 'estimated_duration': 1}
+    ).sort('pickup.date', 1):
+        start, end = reservation_window(reservation)
+        pickup = _coordinates((reservation.get('pickup') or {}).get('coordinates'))
+        if start is None or pickup is None:
+            unassigned.append({'reservation_id': str(reservation['_id']), 'code': reservation.get('code'),
+                               'reason': 'Reserva sin fecha o coordenadas de recogida'})
+            continue
+        trips.append({
+            'reservation_id': str(reservation['_id']),
+            'code': reservation.get('code'),
+            'start': start,
+            'end': end,
+            'pickup': pickup,
+            'dropoff': _coordinates((reservation.get('dropoff') or {}).get('coordinates')) or pickup,
+            'vehicle_id': str(reservation['vehicle_id']) if reservation.get('vehicle_id') else None,
+            'passengers': reservation.get('passengers') or 0
+        })
+
+    candidates = _load_candidates(db)
+    driver_ids = list(candidates)
+    if not trips or not driver_ids:
+        unassigned.extend({'reservation_id': trip['reservation_id'], 'code': trip['code'],
+                           'reason': 'No hay chóferes con vehículo asignado'} for trip in trips)
+        return {'assignments': [], 'unassigned': unassigned,
+                'summary': _summary([], unassigned, started)}
+
+    # Agenda, bloqueos y reservas existentes de todas las parejas en una evaluación
+    batch = check_driver_availability_batch(db, [
+        {'driver_id': driver_id, 'start': trip['start'], 'end': trip['end']}
+        for trip in trips for driver_id in driver_ids
+    ])
+    feasible = np.array([result['available'] for result in batch['results']], dtype=bool).reshape(len(trips), len(driver_ids))
+
+    # Carga inicial: servicios que cada chófer ya tiene en la ventana
+    load = np.zeros(len(driver_ids))
+    index_by_driver = {driver_id: index for index, driver_id in enumerate(driver_ids)}
+    for entry in db['reservations'].aggregate([
+        {'$match': {
+            'driver_id': {'$in': [variant for driver_id in driver_ids for variant in busy_time_service.id_variants(driver_id)]},
+            'status': {'$nin': busy_time_service.INACTIVE_RESERVATION_STATUSES},
+            'pickup.date': {'$gte': window_start, '$lt': window_end}
+        }},
+        {'$group': {'_id': '$driver_id', 'count': {'$sum': 1}}}
+    ]):
+        load[index_by_driver[str(entry['_id'])]] = entry['count']
+
+    positions = np.array([candidates[driver_id]['position'] or [np.nan, np.nan] for driver_id in driver_ids], dtype=float)
+    free_at = np.full(len(driver_ids), np.datetime64(window_start - timedelta(days=1), 'm'))
+
+    assignments = []
+    wave_start = 0
+    while wave_start < len(trips):
+        wave_limit = trips[wave_start]['start'] + timedelta(minutes=WAVE_MINUTES)
+        wave_end = wave_start
+        while wave_end < len(trips) and trips[wave_end]['start'] < wave_limit:
+            wave_end += 1
+        wave = trips[wave_start:wave_end]
+
+        deadhead = haversine_matrix(positions, [trip['pickup'] for trip in wave]).T
+        deadhead = np.where(np.isnan(deadhead), UNKNOWN_POSITION_KM, deadhead)
+        pickups = np.array([np.datetime64(trip['start'], 'm') for trip in wave])
+        arrival = free_at[None, :] + (deadhead / AVERAGE_SPEED_KMH * 60).astype('timedelta64[m]')
+        idle = (pickups[:, None] - arrival).astype(float)
+
+        vehicles = [[_pick_vehicle(trip, candidates[driver_id]) for driver_id in driver_ids] for trip in wave]
+        possible = (feasible[wave_start:wave_end]
+                    & (idle >= 0)
+                    & (deadhead <= MAX_DEADHEAD_KM)
+                    & np.array([[vehicle is not None for vehicle in row] for row in vehicles], dtype=bool))
+
+        # La espera solo cuenta para chóferes que ya llevan un servicio de este plan
+        fresh = free_at < np.datetime64(window_start, 'm')
+        idle_cost = np.where(fresh[None, :], 0, np.minimum(idle, 24 * 60))
+        cost = DEADHEAD_WEIGHT * deadhead + IDLE_WEIGHT * idle_cost + FAIRNESS_WEIGHT * load[None, :]
+        cost = np.where(possible, cost, INFEASIBLE_COST)
+
+        rows, cols = linear_sum_assignment(cost)
+        matched = set()
+        for row, col in zip(rows, cols):
+            if not possible[row, col]:
+                continue
+            trip = wave[row]
+            matched.add(row)
+            assignments.append({
+                'reservation_id': trip['reservation_id'],
+                'code': trip['code'],
+                'pickup_date': trip['start'],
+                'end_date': trip['end'],
+                'driver_id': driver_ids[col],
+                'vehicle_id': vehicles[row][col],
+                'deadhead_km': round(float(deadhead[row, col]), 2),
+                'idle_minutes': None if fresh[col] else int(idle[row, col]),
+                'cost': round(float(cost[row, col]), 2)
+            })
+            positions[col] = trip['dropoff']
+            free_at[col] = np.datetime64(trip['end'], 'm')
+            load[col] += 1
+
+        for row, trip in enumerate(wave):
+            if row not in matched:
+                unassigned.append({'reservation_id': trip['reservation_id'], 'code': trip['code'],
+                                   'reason': 'Los chóferes compatibles tienen otro servicio a esa hora'
+                                   if possible[row].any() else 'Ningún chófer disponible puede llegar a tiempo'})
+        wave_start = wave_end
+
+    return {'assignments': assignments, 'unassigned': unassigned,
+            'summary': _summary(assignments, unassigned, started)}
+
+
+def _summary(assignments: List[Dict[str, Any]], unassigned: List[Dict[str, Any]], started: float) -> Dict[str, Any]:
+    return {
+        'trips': len(assignments) + len(unassigned),
+        'assigned': len(assignments),
+        'unassigned': len(unassigned),
+        'drivers_used': len({assignment['driver_id'] for assignment in assignments}),
+        'total_deadhead_km': round(sum(assignment['deadhead_km'] for assignment in assignments), 2),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000)
+    }
+
+
+def apply_plan(db, plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Guarda las asignaciones de un plan
+
+    Cada asignación reclama las franjas del chófer y del vehículo y solo se
+    guarda si la reserva sigue sin chófer; las que fallan (otra reserva ocupó
+    la franja o alguien asignó la reserva mientras tanto) se devuelven aparte.
+
+    Returns:
+        Dict[str, Any]: 'applied' y 'failed' ({reservation_id, reason})
+    """
+    applied = []
+    failed = []
+    now = datetime.utcnow()
+    for assignment in plan['assignments']:
+        reservation_id = ObjectId(assignment['reservation_id'])
+        conflict = claim_slots(
+            'reservation', reservation_id,
+            [('driver', assignment['driver_id']), ('vehicle', assignment['vehicle_id'])],
+            assignment['pickup_date'], assignment['end_date']
+        )
+        if conflict:
+            failed.append({'reservation_id': assignment['reservation_id'],
+                           'reason': f"Franja ocupada ({conflict['resource_type']})"})
+            continue
+
+        result = db['reservations'].update_one(
+            {'_id': reservation_id, 'driver_id': None},
+            {'$set': {
+                'driver_id': ObjectId(assignment['driver_id']),
+                'vehicle_id': ObjectId(assignment['vehicle_id']),
+                'auto_dispatched_at': now,
+                'updated_at': now
+            }}
+        )
+        if result.matched_count == 0:
+            # Asignada por otra vía mientras tanto: restaurar sus franjas reales
+            current = db['reservations'].find_one({'_id': reservation_id})
+            if current:
+                start, end = reservation_window(current)
+                if start:
+                    claim_slots('reservation', reservation_id,
+                                [('driver', current.get('driver_id')), ('vehicle', current.get('vehicle_id'))], start, end)
+            failed.append({'reservation_id': assignment['reservation_id'], 'reason': 'La reserva ya tiene chófer'})
+            continue
+        applied.append(assignment)
+
+    availability_bitmap_service.on_reservations_created(
+        {'driver_id': assignment['driver_id'], 'pickup': {'date': assignment['pickup_date']},
+         'dropoff': {'estimated_date': assignment['end_date']}}
+        for assignment in applied
+    )
+    next_available_service.on_drivers_changed(assignment['driver_id'] for assignment in applied)
+    return {'applied': applied, 'failed': failed}
+
+
+def auto_dispatch(db, window_start: datetime, window_end: datetime, dry_run: bool = True) -> Dict[str, Any]:
+    """
+    Calcula (y, si no es una prueba, aplica) la asignación automática de una ventana
+
+    Returns:
+        Dict[str, Any]: Plan calculado y, si se aplica, el resultado de guardarlo
+    """
+    if window_end <= window_start:
+        raise ValueError("El fin de la ventana debe ser posterior al inicio")
+    if window_end - window_start > MAX_DISPATCH_WINDOW:
+        raise ValueError(f"La ventana no puede superar {MAX_DISPATCH_WINDOW.days} días")
+
+    plan = build_plan(db, window_start, window_end)
+    plan['dry_run'] = dry_run
+    if not dry_run:
+        plan.update(apply_plan(db, plan))
+    return plan
@@ -1,7 +1,10 @@
+from bisect import bisect_right
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional, Tuple
+import pytz
 from bson import ObjectId
-from models.drivers_agenda import check_driver_availability, get_driver_available_time_slots
+from models.drivers_agenda import check_driver_availability, expand_agenda, get_driver_agendas, merge_available_slots
+from services import busy_time_service, next_available_service
 from services.timezone_service import TimezoneService
 from utils.geo_utils import (
     find_zones_for_location,
@@ -89,6 +92,68 @@ def get_driver_details(db, driver_id: str) -> Dict[str, Any]:
         print(f"Error obteniendo detalles del conductor {driver_id}: {str(e)}")
         return {}
 
+# Ventanas libres que se sugieren como horarios alternativos
+MAX_ALTERNATIVE_SLOTS = 10
+
+def _to_utc_naive(moment: datetime, address: str = None) -> datetime:
+    if not address:
+        return moment
+    converted = TimezoneService.convert_local_to_utc(moment, address)
+    return converted.replace(tzinfo=None) if converted.tzinfo else converted
+
+def _to_local(moments: List[datetime], address: str = None) -> List[datetime]:
+    return TimezoneService.convert_utc_to_local_many(moments, address) if address else moments
+
+def attach_alternative_schedule(alternative_info: Dict[str, Any], driver_id: str, pickup_date: datetime,
+                                estimated_duration: int, address: str = None):
+    """
+    Añade los horarios alternativos y la próxima disponibilidad de un conductor
+    
+    Lee el índice de próximas ventanas libres (una consulta por _id) desde el
+    inicio del día de la recogida, así que las sugerencias pueden estar en
+    días posteriores.
+    
+    Args:
+        alternative_info: Datos del vehículo no disponible (se modifica)
+        driver_id: ID del conductor
+        pickup_date: Fecha y hora de recogida (en zona horaria local)
+        estimated_duration: Duración estimada en minutos
+        address: Dirección para determinar zona horaria
+    """
+    pickup_utc = _to_utc_naive(pickup_date, address)
+    day_start_utc = _to_utc_naive(pickup_date.replace(hour=0, minute=0, second=0, microsecond=0), address)
+    windows = next_available_service.get_free_windows(str(driver_id), max(day_start_utc, datetime.utcnow()))
+    
+    if windows:
+        suggested = windows[:MAX_ALTERNATIVE_SLOTS]
+        local_dates = _to_local([date for window in suggested for date in (window["start"], window["end"])], address)
+        alternative_info["alternative_time_slots"] = [
+            {
+                "start_time": start_local.strftime("%H:%M"),
+                "end_time": end_local.strftime("%H:%M"),
+                "date": start_local.strftime("%Y-%m-%d")
+            }
+            for start_local, end_local in zip(local_dates[0::2], local_dates[1::2])
+        ]
+    
+    duration = timedelta(minutes=estimated_duration)
+    next_window = next((
+        window for window in windows
+        if window["end"] > pickup_utc and window["end"] - max(window["start"], pickup_utc) >= duration
+    ), None)
+    
+    if next_window:
+        next_local = _to_local([max(next_window["start"], pickup_utc)], address)[0]
+        days_ahead = (next_local.date() - pickup_date.date()).days
+        if days_ahead == 0:
+            alternative_info["next_available_time"] = f"Hoy a las {next_local.strftime('%H:%M')}"
+        elif days_ahead == 1:
+            alternative_info["next_available_time"] = f"Mañana a las {next_local.strftime('%H:%M')}"
+        else:
+            alternative_info["next_available_time"] = f"El {next_local.strftime('%d/%m')} a las {next_local.strftime('%H:%M')}"
+    else:
+        alternative_info["next_available_time"] = f"Sin disponibilidad en los próximos {next_available_service.HORIZON_DAYS} días"
+
 def get_available_vehicles_in_zones(db, coordinates: List[float], pickup_date: datetime, estimated_duration: int = 60, address: str = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     """
     Obtiene vehículos disponibles en zonas fijas que incluyen las coordenadas dadas
@@ -205,38 +270,9 @@ def get_available_vehicles_in_zones(db, coordinates: List[float], pickup_date: d
                 elif not driver_available:
                     alternative_info["unavailable_reason"] = "Fuera del horario de trabajo"
                 
-                # Obtener horarios alternativos del conductor para el día
+                # Próximas ventanas libres del conductor (índice por chófer, varios días)
                 try:
-                    date_start = pickup_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                    date_end = date_start + timedelta(days=1)
-                    
-                    print(f"🔄 [DEBUG ZONA FIJA] Obteniendo horarios alternativos para conductor {driver_id}")
-                    alternative_slots = get_driver_available_time_slots(
-                        str(driver_id),
-                        date_start,
-                        date_end,
-                        address  # Pasar la dirección para conversión de zona horaria
-                    )
-                    
-                    print(f"📊 [DEBUG ZONA FIJA] Alternative slots obtenidos: {len(alternative_slots)}")
-                    
-                    if alternative_slots:
-                        alternative_info["alternative_time_slots"] = alternative_slots
-                        print(f"✅ [DEBUG ZONA FIJA] alternative_time_slots asignado con {len(alternative_slots)} slots")
-                        
-                        # Encontrar la próxima disponibilidad
-                        future_slots = [slot for slot in alternative_slots 
-                                      if datetime.strptime(slot["start_time"], "%H:%M").time() > pickup_date.time()]
-                        
-                        if future_slots:
-                            next_slot = min(future_slots, key=lambda x: x["start_time"])
-                            alternative_info["next_available_time"] = f"Hoy a las {next_slot['start_time']}"
-                        else:
-                            alternative_info["next_available_time"] = "Mañana (consultar horarios)"
-                    else:
-                        print(f"⚠️ [DEBUG ZONA FIJA] No se obtuvieron alternative_slots para conductor {driver_id}")
-                    
-                    print(f"🔍 [DEBUG ZONA FIJA] Claves en alternative_info antes de agregar: {list(alternative_info.keys())}")
+                    attach_alternative_schedule(alternative_info, driver_id, pickup_date, estimated_duration, address)
                     alternative_schedule_vehicles.append(alternative_info)
                     
                 except Exception as e:
@@ -357,38 +393,9 @@ def get_available_vehicles_flexible(db, coordinates: List[float], pickup_date: d
                     elif not driver_available:
                         alternative_info["unavailable_reason"] = "Fuera del horario de trabajo"
                     
-                    # Obtener horarios alternativos del conductor para el día
+                    # Próximas ventanas libres del conductor (índice por chófer, varios días)
                     try:
-                        date_start = pickup_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                        date_end = date_start + timedelta(days=1)
-                        
-                        print(f"🔄 [DEBUG] Obteniendo horarios alternativos para conductor {driver_id}")
-                        alternative_slots = get_driver_available_time_slots(
-                            str(driver_id),
-                            date_start,
-                            date_end,
-                            address  # Pasar la dirección para conversión de zona horaria
-                        )
-                        
-                        print(f"📊 [DEBUG] Alternative slots obtenidos: {len(alternative_slots)}")
-                        
-                        if alternative_slots:
-                            alternative_info["alternative_time_slots"] = alternative_slots
-                            print(f"✅ [DEBUG] alternative_time_slots asignado con {len(alternative_slots)} slots")
-                            
-                            # Encontrar la próxima disponibilidad
-                            future_slots = [slot for slot in alternative_slots 
-                                          if datetime.strptime(slot["start_time"], "%H:%M").time() > pickup_date.time()]
-                            
-                            if future_slots:
-                                next_slot = min(future_slots, key=lambda x: x["start_time"])
-                                alternative_info["next_available_time"] = f"Hoy a las {next_slot['start_time']}"
-                            else:
-                                alternative_info["next_available_time"] = "Mañana (consultar horarios)"
-                        else:
-                            print(f"⚠️ [DEBUG] No se obtuvieron alternative_slots para conductor {driver_id}")
-                        
-                        print(f"🔍 [DEBUG] Claves en alternative_info antes de agregar: {list(alternative_info.keys())}")
+                        attach_alternative_schedule(alternative_info, driver_id, pickup_date, estimated_duration, address)
                         alternative_schedule_vehicles.append(alternative_info)
                         vehicle_processed = True
                         
@@ -467,4 +474,146 @@ def check_vehicle_availability_for_location(db, address: str, coordinates: List[
         result["vehicles_with_alternative_schedules"] = all_alternative_vehicles
         result["alternative_vehicles_count"] = len(all_alternative_vehicles)
     
-    return result 
\ No newline at end of file
+    return result
+
+
+# Máximo de parejas (chofer, intervalo) por verificación por lotes
+MAX_BATCH_CHECKS = 20000
+
+# Motivos de no disponibilidad de la verificación por lotes
+BATCH_REASONS = {
+    "invalid_request": "Solicitud inválida (chofer o fechas)",
+    "no_agenda": "El chofer no tiene agenda para ese periodo",
+    "outside_schedule": "Fuera del horario de trabajo",
+    "agenda_block": "Bloqueado en la agenda del chofer",
+    "reservation_conflict": "En otro viaje programado"
+}
+
+def _first_overlap(intervals: List[Dict[str, Any]], starts: List[datetime], start: datetime, end: datetime) -> Optional[Dict[str, Any]]:
+    """Intervalo (de una lista disjunta y ordenada) que se solapa con [start, end), o None"""
+    index = bisect_right(starts, start) - 1
+    for candidate in (index, index + 1):
+        if 0 <= candidate < len(intervals):
+            interval = intervals[candidate]
+            if interval["start"] < end and interval["end"] > start:
+                return interval
+    return None
+
+def check_driver_availability_batch(db, checks: List[Dict[str, Any]], address: str = None) -> Dict[str, Any]:
+    """
+    Verifica muchas parejas (chofer, intervalo) con una consulta por colección
+    
+    Carga las agendas de todos los choferes con un solo $in (más los cubos
+    diarios de la ventana completa) y las reservas activas con otra consulta,
+    y evalúa cada intervalo en memoria con búsqueda binaria sobre los slots
+    disponibles unidos y sobre los intervalos ocupados.
+    
+    Args:
+        db: Conexión a la base de datos
+        checks: Lista de {driver_id, start, end} (datetime; los naive se toman en la
+            hora local de address, o en UTC si no se da address)
+        address: Dirección para determinar zona horaria (opcional)
+    
+    Returns:
+        Dict[str, Any]: 'results' en el orden de entrada ({driver_id, start, end,
+        available, reason, message}) y 'matrix' con la disponibilidad de cada
+        chofer en el orden de sus intervalos
+    """
+    timezone = TimezoneService.resolve_timezone(address) if address else None
+    
+    def to_utc(moment):
+        if moment.tzinfo is not None:
+            return moment.astimezone(pytz.UTC).replace(tzinfo=None)
+        if timezone is None:
+            return moment
+        return timezone.localize(moment).astimezone(pytz.UTC).replace(tzinfo=None)
+    
+    # Normalizar las solicitudes y calcular la ventana de cada chofer
+    normalized = []
+    windows: Dict[str, List[datetime]] = {}
+    for check in checks:
+        driver_id = str(check.get("driver_id") or "")
+        start, end = check.get("start"), check.get("end")
+        if not ObjectId.is_valid(driver_id) or not isinstance(start, datetime) or not isinstance(end, datetime) or end <= start:
+            normalized.append((driver_id, None, None))
+            continue
+        start_utc, end_utc = to_utc(start), to_utc(end)
+        normalized.append((driver_id, start_utc, end_utc))
+        window = windows.setdefault(driver_id, [start_utc, end_utc])
+        window[0], window[1] = min(window[0], start_utc), max(window[1], end_utc)
+    
+    window_start = min((window[0] for window in windows.values()), default=None)
+    window_end = max((window[1] for window in windows.values()), default=None)
+    agendas = get_driver_agendas(list(windows), window_start, window_end) if windows else {}
+    
+    # Reservas activas de todos los choferes en la ventana, en una consulta
+    reservations: Dict[str, List[Dict[str, Any]]] = {}
+    if windows:
+        driver_variants = [variant for driver_id in windows for variant in busy_time_service.id_variants(driver_id)]
+        for reservation in db["reservations"].find(
+            {
+                "driver_id": {"$in": driver_variants},
+                "status": {"$nin": busy_time_service.INACTIVE_RESERVATION_STATUSES},
+                **busy_time_service.overlap_filter("pickup.date", "dropoff.estimated_date", window_start, window_end)
+            },
+            {"driver_id": 1, "pickup.date": 1, "dropoff.estimated_date": 1}
+        ):
+            reservations.setdefault(str(reservation["driver_id"]), []).append({
+                "start": reservation["pickup"]["date"],
+                "end": reservation["dropoff"]["estimated_date"],
+                "source": busy_time_service.SOURCE_RESERVATIONS
+            })
+    
+    # Por chofer: slots disponibles unidos, bloqueos y reservas, ordenados para bisect
+    evaluated: Dict[str, Dict[str, Any]] = {}
+    for driver_id, (start, end) in windows.items():
+        agenda = agendas.get(driver_id)
+        slots = expand_agenda(agenda, start, end)
+        available = [
+            {"start": slot["start_date"], "end": slot["end_date"]}
+            for slot in merge_available_slots(slots)
+        ]
+        blocks = busy_time_service.merge_intervals(
+            {"start": slot["start_date"], "end": slot["end_date"], "source": busy_time_service.SOURCE_AGENDA_BLOCKS}
+            for slot in slots if slot.get("status") in busy_time_service.AGENDA_BLOCK_STATUSES
+        )
+        booked = busy_time_service.merge_intervals(reservations.get(driver_id, []))
+        evaluated[driver_id] = {
+            "has_agenda": agenda is not None,
+            "available": available,
+            "available_starts": [slot["start"] for slot in available],
+            "blocks": blocks,
+            "block_starts": [block["start"] for block in blocks],
+            "booked": booked,
+            "booked_starts": [interval["start"] for interval in booked]
+        }
+    
+    results = []
+    matrix: Dict[str, List[bool]] = {}
+    for check, (driver_id, start, end) in zip(checks, normalized):
+        reason = None
+        if start is None:
+            reason = "invalid_request"
+        else:
+            data = evaluated[driver_id]
+            index = bisect_right(data["available_starts"], start) - 1
+            if not data["has_agenda"]:
+                reason = "no_agenda"
+            elif index < 0 or data["available"][index]["end"] < end:
+                reason = "outside_schedule"
+            elif _first_overlap(data["blocks"], data["block_starts"], start, end):
+                reason = "agenda_block"
+            elif _first_overlap(data["booked"], data["booked_starts"], start, end):
+                reason = "reservation_conflict"
+        
+        results.append({
+            "driver_id": driver_id,
+            "start": check.get("start"),
+            "end": check.get("end"),
+            "available": reason is None,
+            "reason": reason,
+            "message": BATCH_REASONS.get(reason)
+        })
+        matrix.setdefault(driver_id, []).append(reason is None)
+    
+    return {"results": results, "matrix": matrix}
@@ -0,0 +1,316 @@
+"""
+Mapas de bits de disponibilidad de chóferes y mapas de calor de capacidad por zona.
+
+Cada documento de ``driver_availability_bitmaps`` guarda, para un chófer y un
+día (UTC, como los slots de la agenda), 96 bits de 15 minutos: el bit ``i``
+vale 1 si la franja ``[día + 15·i, día + 15·(i+1))`` está cubierta por la
+agenda (slots explícitos, reglas de recurrencia y horarios extra) y no la
+ocupa ningún bloqueo ``busy``/``off`` ni ninguna reserva activa.
+
+Con los mapas de los chóferes de una zona, ``OR`` da las franjas con algún
+vehículo libre y la suma de bits por franja da la capacidad, de modo que un
+mapa de calor de un día o de una semana sale de una sola consulta ``$in`` en
+lugar de una búsqueda de disponibilidad por franja.
+
+Los mapas se calculan al leerlos si faltan y se recalculan al escribir
+agendas, reservas y horarios extra. Los días pasados caducan con un índice TTL.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+from pymongo.collection import Collection
+
+from models.drivers_agenda import bucket_day, expand_agenda, find_agenda_for_window
+from models.slot_claims import reservation_window
+from services import busy_time_service
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+
+# Días máximos de un mapa de calor
+MAX_HEATMAP_DAYS = 31
+
+# Los mapas de días pasados se eliminan pasado este tiempo
+BITMAP_RETENTION_SECONDS = 14 * 24 * 3600
+
+bitmaps_collection: Optional[Collection] = None
+fixed_routes_collection: Optional[Collection] = None
+_db = None
+
+
+def setup_collections(db):
+    """Inicializa la colección de mapas de bits y sus índices"""
+    global bitmaps_collection, fixed_routes_collection, _db
+
+    _db = db
+    bitmaps_collection = db['driver_availability_bitmaps']
+    fixed_routes_collection = db['fixed_routes']
+
+    bitmaps_collection.create_index([('driver_id', 1), ('day', 1)])
+    bitmaps_collection.create_index('day', expireAfterSeconds=BITMAP_RETENTION_SECONDS)
+
+
+def _bitmap_id(driver_id: str, day: datetime) -> str:
+    return f"{driver_id}:{day.strftime('%Y-%m-%d')}"
+
+
+def interval_mask(day: datetime, start: datetime, end: datetime, whole_slots: bool) -> int:
+    """
+    Bits del día que toca el intervalo [start, end)
+
+    Args:
+        whole_slots: True para marcar solo las franjas cubiertas por completo
+            (disponibilidad); False para marcar todas las que toca (ocupación)
+    """
+    step = timedelta(minutes=SLOT_MINUTES)
+    first = (start - day) / step
+    last = (end - day) / step
+    if whole_slots:
+        first, last = -int(-first // 1), int(last // 1)
+    else:
+        first, last = int(first // 1), -int(-last // 1)
+    first, last = max(first, 0), min(last, SLOTS_PER_DAY)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def compute_driver_bitmaps(driver_id: Any, days: List[datetime]) -> Dict[datetime, int]:
+    """
+    Calcula los mapas de bits de un chófer para varios días
+
+    Lee la agenda y las reservas de todo el rango una sola vez.
+
+    Returns:
+        Dict[datetime, int]: Mapa de 96 bits por día
+    """
+    if not days or not ObjectId.is_valid(str(driver_id)):
+        return {day: 0 for day in days}
+
+    window_start = min(days)
+    window_end = max(days) + timedelta(days=1)
+    agenda = find_agenda_for_window(ObjectId(str(driver_id)), window_start, window_end)
+    slots = expand_agenda(agenda, window_start, window_end)
+    reservations = busy_time_service.find_conflicts(
+        _db, window_start, window_end, driver_id=driver_id,
+        sources=(busy_time_service.SOURCE_RESERVATIONS,)
+    )
+
+    bitmaps = {}
+    for day in days:
+        day_end = day + timedelta(days=1)
+        available = blocked = 0
+        for slot in slots:
+            if slot['start_date'] >= day_end or slot['end_date'] <= day:
+                continue
+            if slot.get('status', 'available') == 'available':
+                available |= interval_mask(day, slot['start_date'], slot['end_date'], True)
+            elif slot.get('status') in busy_time_service.AGENDA_BLOCK_STATUSES:
+                blocked |= interval_mask(day, slot['start_date'], slot['end_date'], False)
+        for reservation in reservations:
+            if reservation['start'] < day_end and reservation['end'] > day:
+                blocked |= interval_mask(day, reservation['start'], reservation['end'], False)
+        bitmaps[day] = available & ~blocked & FULL_DAY
+    return bitmaps
+
+
+def _store_bitmaps(driver_id: str, bitmaps: Dict[datetime, int]):
+    if not bitmaps:
+        return
+    now = datetime.utcnow()
+    bitmaps_collection.bulk_write([
+        ReplaceOne(
+            {'_id': _bitmap_id(driver_id, day)},
+            {'driver_id': driver_id, 'day': day, 'bits': f"{bits:0{SLOTS_PER_DAY // 4}x}", 'updated_at': now},
+            upsert=True
+        )
+        for day, bits in bitmaps.items()
+    ], ordered=False)
+
+
+def get_bitmaps(driver_ids: Iterable[Any], days: List[datetime]) -> Dict[str, Dict[datetime, int]]:
+    """
+    Obtiene los mapas de bits de varios chóferes y días con una consulta
+
+    Los que faltan se calculan y se guardan en ese momento.
+
+    Returns:
+        Dict[str, Dict[datetime, int]]: Mapas por id de chófer (str) y día
+    """
+    driver_ids = list(dict.fromkeys(str(driver_id) for driver_id in driver_ids))
+    result = {driver_id: {} for driver_id in driver_ids}
+    if not driver_ids or not days:
+        return result
+
+    for document in bitmaps_collection.find(
+        {'_id': {'$in': [_bitmap_id(driver_id, day) for driver_id in driver_ids for day in days]}},
+        {'driver_id': 1, 'day': 1, 'bits': 1}
+    ):
+        result[document['driver_id']][document['day']] = int(document['bits'], 16)
+
+    for driver_id in driver_ids:
+        missing = [day for day in days if day not in result[driver_id]]
+        if missing:
+            computed = compute_driver_bitmaps(driver_id, missing)
+            _store_bitmaps(driver_id, computed)
+            result[driver_id].update(computed)
+    return result
+
+
+def refresh_driver_days(driver_id: Any, start: datetime, end: datetime):
+    """Recalcula los mapas de un chófer en los días que toca [start, end)"""
+    days = []
+    day = bucket_day(start)
+    while day < end:
+        days.append(day)
+        day += timedelta(days=1)
+    driver_id = str(driver_id)
+    _store_bitmaps(driver_id, compute_driver_bitmaps(driver_id, days))
+
+
+def on_interval_changed(driver_id: Any, start: Optional[datetime], end: Optional[datetime]):
+    """Recalcula los días afectados por un cambio de reserva u horario extra de un chófer"""
+    if not driver_id or not isinstance(start, datetime) or not isinstance(end, datetime):
+        return
+    try:
+        refresh_driver_days(driver_id, start, end)
+    except Exception as e:
+        print(f"[AVAILABILITY_BITMAP] Error al recalcular el chófer {driver_id}: {str(e)}")
+
+
+def on_reservation_changed(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+    """
+    Recalcula los días de los chóferes de una reserva antes y después del cambio
+
+    Sirve para altas (before=None), bajas (after=None) y modificaciones.
+    """
+    for reservation in (before, after):
+        if reservation and reservation.get('driver_id'):
+            on_interval_changed(reservation['driver_id'], *reservation_window(reservation))
+
+
+def on_reservations_created(reservations: Iterable[Dict[str, Any]]):
+    """Recalcula una sola vez por chófer los días de un lote de reservas nuevas"""
+    windows: Dict[str, Tuple[datetime, datetime]] = {}
+    for reservation in reservations:
+        start, end = reservation_window(reservation)
+        if not reservation.get('driver_id') or start is None:
+            continue
+        driver_id = str(reservation['driver_id'])
+        if driver_id in windows:
+            start, end = min(start, windows[driver_id][0]), max(end, windows[driver_id][1])
+        windows[driver_id] = (start, end)
+    for driver_id, (start, end) in windows.items():
+        on_interval_changed(driver_id, start, end)
+
+
+def on_agenda_changed(driver_id: Any):
+    """
+    Recalcula los mapas guardados de un chófer desde hoy tras modificar su agenda
+
+    Un cambio de reglas puede afectar a cualquier día, así que se recalculan
+    todos los ya guardados; los demás se calcularán al leerlos.
+    """
+    driver_id = str(driver_id)
+    try:
+        today = bucket_day(datetime.utcnow())
+        days = [document['day'] for document in bitmaps_collection.find(
+            {'driver_id': driver_id, 'day': {'$gte': today}}, {'day': 1}
+        )]
+        _store_bitmaps(driver_id, compute_driver_bitmaps(driver_id, days))
+    except Exception as e:
+        print(f"[AVAILABILITY_BITMAP] Error al recalcular la agenda del chófer {driver_id}: {str(e)}")
+
+
+def zone_driver_ids(zone: Dict[str, Any]) -> List[str]:
+    """Chóferes de una zona: los de drivers[] y los chóferes principales de sus vehículos"""
+    driver_ids = [driver.get('id') for driver in zone.get('drivers') or []]
+    driver_ids += [(vehicle.get('driver') or {}).get('id') for vehicle in zone.get('vehicles') or []]
+    return list(dict.fromkeys(str(driver_id) for driver_id in driver_ids if driver_id))
+
+
+def bits_to_string(bits: int) -> str:
+    """Representación '0'/'1' de un mapa, con la franja 00:00 en la primera posición"""
+    return ''.join('1' if bits >> index & 1 else '0' for index in range(SLOTS_PER_DAY))
+
+
+def slot_time(day: datetime, index: int) -> datetime:
+    return day + timedelta(minutes=SLOT_MINUTES * index)
+
+
+def capacity_heatmap(driver_ids: List[str], start_day: datetime, days: int) -> List[Dict[str, Any]]:
+    """
+    Mapa de calor de capacidad de un conjunto de chóferes
+
+    Returns:
+        List[Dict[str, Any]]: Por día, 'any_available' (OR de los mapas como
+        cadena de 96 '0'/'1'), 'capacity' (chóferes libres por franja) y
+        'first_available' (inicio de la primera franja libre o None)
+    """
+    day_list = [start_day + timedelta(days=offset) for offset in range(days)]
+    bitmaps = get_bitmaps(driver_ids, day_list)
+
+    heatmap = []
+    for day in day_list:
+        day_bitmaps = [bitmaps[driver_id].get(day, 0) for driver_id in driver_ids]
+        any_available = 0
+        for bits in day_bitmaps:
+            any_available |= bits
+        capacity = [sum(bits >> index & 1 for bits in day_bitmaps) for index in range(SLOTS_PER_DAY)]
+        first = (any_available & -any_available).bit_length() - 1 if any_available else None
+        heatmap.append({
+            'date': day.strftime('%Y-%m-%d'),
+            'any_available': bits_to_string(any_available),
+            'capacity': capacity,
+            'available_slots': bin(any_available).count('1'),
+            'first_available': slot_time(day, first) if first is not None else None
+        })
+    return heatmap
+
+
+def next_available(driver_ids: List[str], after: datetime, horizon_days: int = 7,
+                   duration_minutes: int = SLOT_MINUTES) -> Optional[Dict[str, Any]]:
+    """
+    Primer momento desde after en que algún chófer tiene libre duration_minutes seguidos
+
+    Returns:
+        Optional[Dict[str, Any]]: {'start', 'driver_id'} o None si no hay hueco en el horizonte
+    """
+    slots_needed = max(1, -(-duration_minutes // SLOT_MINUTES))
+    first_day = bucket_day(after)
+    day_list = [first_day + timedelta(days=offset) for offset in range(horizon_days)]
+    bitmaps = get_bitmaps(driver_ids, day_list)
+    first_slot = -(-(after - first_day) // timedelta(minutes=SLOT_MINUTES))
+
+    best = None
+    for driver_id in driver_ids:
+        # Mapas de todo el horizonte concatenados para encontrar huecos que cruzan la medianoche
+        timeline = 0
+        for offset, day in enumerate(day_list):
+            timeline |= bitmaps[driver_id].get(day, 0) << (offset * SLOTS_PER_DAY)
+        timeline >>= first_slot
+
+        # Franjas en las que empiezan slots_needed franjas libres seguidas
+        runs = timeline
+        for shift in range(1, slots_needed):
+            runs &= timeline >> shift
+        if runs:
+            index = (runs & -runs).bit_length() - 1 + first_slot
+            if best is None or index < best[0]:
+                best = (index, driver_id)
+
+    if best is None:
+        return None
+    return {'start': slot_time(first_day, best[0]), 'driver_id': best[1]}
+
+
+def get_zone(zone_id: str) -> Optional[Dict[str, Any]]:
+    if not ObjectId.is_valid(zone_id):
+        return None
+    return fixed_routes_collection.find_one(
+        {'_id': ObjectId(zone_id)}, {'name': 1, 'drivers': 1, 'vehicles.driver': 1}
+    )
@@ -0,0 +1,330 @@
+"""
+Almacén de sesiones del asistente de reserva (booking_sessions).
+
+Cada paso del asistente se guarda con un único ``find_one_and_update`` que
+fusiona ``booking_data`` mediante ``$set`` con rutas de puntos
+(``booking_data.vehicle``, ``booking_data.passenger_details``...) y devuelve
+la sesión ya actualizada, en lugar de leer, fusionar en Python, escribir y
+volver a leer. Cada escritura renueva ``expires_at`` y un índice TTL elimina
+las sesiones abandonadas.
+
+Opcionalmente (BOOKING_SESSION_WRITE_BEHIND=1) las escrituras se acumulan en
+memoria y se envían a MongoDB en lote cada BOOKING_SESSION_FLUSH_SECONDS, para
+absorber cambios de paso muy seguidos. Ese modo solo es seguro con un único
+worker o con afinidad de sesión en el balanceador, porque la sesión en memoria
+no se comparte entre procesos.
+"""
+
+import copy
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+
+# Duración de una sesión sin actividad
+SESSION_TTL = timedelta(hours=int(os.getenv('BOOKING_SESSION_TTL_HOURS', 24)))
+
+# Escritura diferida de sesiones (ver docstring del módulo)
+WRITE_BEHIND_ENABLED = os.getenv('BOOKING_SESSION_WRITE_BEHIND', '0').lower() in ('1', 'true', 'yes')
+FLUSH_SECONDS = float(os.getenv('BOOKING_SESSION_FLUSH_SECONDS', 2))
+
+# Segundos sin actividad tras los que una sesión sale de la memoria
+CACHE_IDLE_SECONDS = 300
+
+# Paso que marca la sesión como completada
+FINAL_STEP = 'payment_confirmation'
+
+WIZARD_STEPS = ['vehicle_selection', 'passenger_details', 'payment', 'payment_confirmation']
+
+booking_sessions_collection: Optional[Collection] = None
+_write_behind = None
+
+
+def setup_collection(db):
+    """Inicializa la colección de sesiones, sus índices y la escritura diferida si está activada"""
+    global booking_sessions_collection, _write_behind
+
+    booking_sessions_collection = db['booking_sessions']
+    booking_sessions_collection.create_index('session_id', unique=True)
+    # Las sesiones abandonadas se eliminan al pasar expires_at
+    booking_sessions_collection.create_index('expires_at', expireAfterSeconds=0)
+
+    if WRITE_BEHIND_ENABLED and _write_behind is None:
+        _write_behind = WriteBehindBuffer(booking_sessions_collection, FLUSH_SECONDS)
+        _write_behind.start()
+
+    return booking_sessions_collection
+
+
+def next_step(current_step: Optional[str]) -> Optional[str]:
+    """Devuelve el paso del asistente que sigue a current_step"""
+    if current_step in WIZARD_STEPS:
+        index = WIZARD_STEPS.index(current_step)
+        if index < len(WIZARD_STEPS) - 1:
+            return WIZARD_STEPS[index + 1]
+    return None
+
+
+def build_session_update(booking_data: Optional[Dict[str, Any]], current_step: Optional[str] = None,
+                         extra_fields: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Construye los campos de ``$set`` de una actualización de sesión
+
+    Args:
+        booking_data: Claves de booking_data a fusionar (se ignora si no es un dict)
+        current_step: Paso actual del asistente
+        extra_fields: Otros campos de primer nivel (payment_status, booking_id...)
+
+    Returns:
+        Dict[str, Any]: Campos con rutas de puntos para $set
+
+    Raises:
+        ValueError: Si alguna clave de booking_data no es válida como ruta de MongoDB
+    """
+    now = datetime.utcnow()
+    fields = {
+        'updated_at': now,
+        'expires_at': now + SESSION_TTL
+    }
+
+    if isinstance(booking_data, dict):
+        for key, value in booking_data.items():
+            if not isinstance(key, str) or not key or '.' in key or key.startswith('$'):
+                raise ValueError(f"Clave de booking_data no válida: {key!r}")
+            fields[f'booking_data.{key}'] = value
+
+    if current_step:
+        fields['current_step'] = current_step
+        if current_step == FINAL_STEP:
+            fields['completed'] = True
+
+    if extra_fields:
+        fields.update(extra_fields)
+
+    return fields
+
+
+def create_session(booking_data: Dict[str, Any], user_id: Any = None,
+                   current_step: str = 'vehicle_selection') -> Dict[str, Any]:
+    """
+    Crea una sesión de reserva
+
+    Returns:
+        Dict[str, Any]: Documento de la sesión creada
+    """
+    now = datetime.utcnow()
+    session = {
+        'session_id': str(uuid.uuid4()),
+        'created_at': now,
+        'updated_at': now,
+        'expires_at': now + SESSION_TTL,
+        'user_id': user_id,
+        'booking_data': booking_data,
+        'current_step': current_step,
+        'completed': False
+    }
+    booking_sessions_collection.insert_one(session)
+    return session
+
+
+def get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Obtiene una sesión vigente (incluidos los cambios aún no escritos en MongoDB)
+
+    Returns:
+        Optional[Dict[str, Any]]: Sesión, o None si no existe o ha caducado
+    """
+    if _write_behind is not None:
+        cached = _write_behind.get(session_id)
+        if cached is not None:
+            return cached
+
+    # El monitor TTL de MongoDB puede tardar hasta un minuto en borrar las caducadas
+    return booking_sessions_collection.find_one({
+        'session_id': session_id,
+        'expires_at': {'$gt': datetime.utcnow()}
+    })
+
+
+def update_session(session_id: str, booking_data: Optional[Dict[str, Any]] = None,
+                   current_step: Optional[str] = None,
+                   extra_fields: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Fusiona los cambios de un paso del asistente y devuelve la sesión actualizada
+
+    Args:
+        session_id: Identificador de la sesión
+        booking_data: Claves de booking_data a fusionar
+        current_step: Paso actual del asistente
+        extra_fields: Otros campos de primer nivel
+
+    Returns:
+        Optional[Dict[str, Any]]: Sesión actualizada, o None si no existe o ha caducado
+
+    Raises:
+        ValueError: Si alguna clave de booking_data no es válida
+    """
+    fields = build_session_update(booking_data, current_step, extra_fields)
+
+    if _write_behind is not None:
+        return _write_behind.apply(session_id, fields)
+
+    return booking_sessions_collection.find_one_and_update(
+        {'session_id': session_id, 'expires_at': {'$gt': datetime.utcnow()}},
+        {'$set': fields},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def flush_session(session_id: str):
+    """Escribe en MongoDB los cambios pendientes de una sesión (antes de confirmar la reserva)"""
+    if _write_behind is not None:
+        _write_behind.flush([session_id])
+
+
+def flush_sessions(session_ids: Iterable[str]):
+    """Escribe en MongoDB los cambios pendientes de varias sesiones"""
+    if _write_behind is not None:
+        _write_behind.flush(list(session_ids))
+
+
+def reload_sessions(session_ids: Iterable[str]):
+    """
+    Descarta la copia en memoria de sesiones modificadas directamente en MongoDB
+
+    Lo usa el procesamiento de webhooks de Stripe, que escribe los campos
+    payment_* en bloque: sin esto, get_session seguiría devolviendo el estado
+    de pago anterior.
+    """
+    if _write_behind is not None:
+        _write_behind.reload(list(session_ids))
+
+
+def _apply_fields(document: Dict[str, Any], fields: Dict[str, Any]):
+    """Aplica en memoria un $set con rutas de puntos"""
+    for path, value in fields.items():
+        target = document
+        parts = path.split('.')
+        for part in parts[:-1]:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        target[parts[-1]] = value
+
+
+class WriteBehindBuffer:
+    """
+    Capa de escritura diferida para las sesiones de reserva
+
+    Mantiene en memoria las sesiones activas y acumula los campos modificados;
+    un hilo los envía a MongoDB con un único bulk_write cada flush_seconds.
+    """
+
+    def __init__(self, collection: Collection, flush_seconds: float):
+        self.collection = collection
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        self._last_access: Dict[str, float] = {}
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name='booking-session-flusher')
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+                self._evict_idle()
+            except Exception as e:
+                print(f"[BOOKING_SESSIONS] Error al escribir sesiones pendientes: {str(e)}")
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.get('expires_at', datetime.min) <= datetime.utcnow():
+                return None
+            self._last_access[session_id] = time.monotonic()
+            return copy.deepcopy(session)
+
+    def apply(self, session_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+
+        if session is None:
+            # Primera escritura de la sesión en este proceso: cargarla de MongoDB
+            loaded = booking_sessions_collection.find_one({
+                'session_id': session_id,
+                'expires_at': {'$gt': datetime.utcnow()}
+            })
+            if loaded is None:
+                return None
+            with self._lock:
+                session = self._sessions.setdefault(session_id, loaded)
+
+        with self._lock:
+            _apply_fields(session, fields)
+            self._dirty.setdefault(session_id, {}).update(fields)
+            self._last_access[session_id] = time.monotonic()
+            return copy.deepcopy(session)
+
+    def flush(self, session_ids=None):
+        with self._lock:
+            if session_ids is None:
+                pending, self._dirty = self._dirty, {}
+            else:
+                pending = {sid: self._dirty.pop(sid) for sid in session_ids if sid in self._dirty}
+
+        if not pending:
+            return
+
+        operations = [
+            UpdateOne({'session_id': session_id}, {'$set': fields})
+            for session_id, fields in pending.items()
+        ]
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except Exception:
+            # Reencolar sin pisar cambios más recientes
+            with self._lock:
+                for session_id, fields in pending.items():
+                    newer = self._dirty.get(session_id, {})
+                    self._dirty[session_id] = {**fields, **newer}
+            raise
+
+    def reload(self, session_ids):
+        """Vuelve a leer de MongoDB las sesiones indicadas que estén en memoria"""
+        self.flush(session_ids)
+        with self._lock:
+            # Sin cambios pendientes basta con sacarlas de la memoria
+            for session_id in session_ids:
+                if session_id not in self._dirty:
+                    self._sessions.pop(session_id, None)
+                    self._last_access.pop(session_id, None)
+            pending = [session_id for session_id in session_ids if session_id in self._sessions]
+        if not pending:
+            return
+
+        # Con cambios llegados entre medias: documento de MongoDB más esos cambios
+        for loaded in self.collection.find({'session_id': {'$in': pending}}):
+            with self._lock:
+                if loaded['session_id'] in self._sessions:
+                    _apply_fields(loaded, self._dirty.get(loaded['session_id'], {}))
+                    self._sessions[loaded['session_id']] = loaded
+
+    def _evict_idle(self):
+        limit = time.monotonic() - CACHE_IDLE_SECONDS
+        with self._lock:
+            for session_id in [sid for sid, at in self._last_access.items() if at < limit]:
+                if session_id in self._dirty:
+                    continue
+                self._sessions.pop(session_id, None)
+                self._last_access.pop(session_id, None)
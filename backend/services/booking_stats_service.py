@@ -0,0 +1,256 @@
+"""
+Estadísticas de reservas para el panel de administración.
+
+Las estadísticas se guardan en un documento resumen (colección reservation_stats)
+que se actualiza con $inc cada vez que se crea, modifica o elimina una reserva,
+de modo que el panel las lee con una sola consulta por _id. Periódicamente (y al
+cambiar de día) el resumen se reconcilia con una única agregación $facet sobre
+la colección de reservas, que corrige cualquier desviación acumulada.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+
+STATUSES = ['pending', 'confirmed', 'in_progress', 'completed', 'cancelled', 'no_show']
+ACTIVE_STATUSES = ['pending', 'confirmed', 'in_progress']
+HISTORY_STATUSES = ['completed', 'cancelled', 'no_show']
+
+# Identificador del documento resumen
+STATS_DOCUMENT_ID = 'global'
+
+# Antigüedad máxima del resumen antes de reconciliarlo con la colección
+RECONCILE_INTERVAL_SECONDS = 600
+
+reservations_collection = None
+stats_collection = None
+
+_reconcile_lock = threading.Lock()
+_reconciler_started = False
+
+
+def setup_collections(db):
+    """Inicializa las colecciones usadas por el servicio de estadísticas"""
+    global reservations_collection, stats_collection
+    reservations_collection = db['reservations']
+    stats_collection = db['reservation_stats']
+
+
+def _day_key(value: Any) -> Optional[str]:
+    """Devuelve la clave YYYY-MM-DD de una fecha de recogida (o None si no es una fecha)"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    return None
+
+
+def _has_incidents(reservation: Dict[str, Any]) -> bool:
+    return bool(reservation.get('incident_history'))
+
+
+def _contribution(reservation: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Calcula lo que aporta una reserva a cada contador del resumen
+
+    Args:
+        reservation: Documento de reserva (o None si no existe)
+
+    Returns:
+        Dict[str, int]: Contadores afectados en notación de puntos
+    """
+    if not reservation:
+        return {}
+
+    counters = {'total': 1}
+
+    status = reservation.get('status')
+    if status in STATUSES:
+        counters[f'by_status.{status}'] = 1
+
+    if _has_incidents(reservation):
+        counters['incidents'] = 1
+
+    pickup = reservation.get('pickup') or {}
+    day = _day_key(pickup.get('date'))
+    if day:
+        counters[f'by_pickup_day.{day}'] = 1
+
+    return counters
+
+
+def compute_booking_stats() -> Dict[str, Any]:
+    """
+    Calcula las estadísticas de reservas en una sola pasada con $facet
+
+    Returns:
+        Dict[str, Any]: Documento resumen listo para guardarse en reservation_stats
+    """
+    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    today_end = today_start + timedelta(days=1)
+
+    pipeline = [
+        {'$facet': {
+            'by_status': [
+                {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+            ],
+            'today': [
+                {'$match': {'pickup.date': {'$gte': today_start, '$lt': today_end}}},
+                {'$count': 'count'}
+            ],
+            'incidents': [
+                {'$match': {'incident_history': {'$exists': True, '$ne': []}}},
+                {'$count': 'count'}
+            ]
+        }}
+    ]
+
+    result = next(reservations_collection.aggregate(pipeline), {})
+
+    by_status = {status: 0 for status in STATUSES}
+    total = 0
+    for row in result.get('by_status', []):
+        total += row['count']
+        if row['_id'] in by_status:
+            by_status[row['_id']] = row['count']
+
+    today = result['today'][0]['count'] if result.get('today') else 0
+    incidents = result['incidents'][0]['count'] if result.get('incidents') else 0
+
+    return {
+        'total': total,
+        'by_status': by_status,
+        'incidents': incidents,
+        # Solo se guarda el día actual; los demás días se descartan en cada reconciliación
+        'by_pickup_day': {today_start.strftime('%Y-%m-%d'): today},
+        'day': today_start.strftime('%Y-%m-%d'),
+        'reconciled_at': datetime.utcnow()
+    }
+
+
+def reconcile_booking_stats(notify: bool = True) -> Dict[str, Any]:
+    """
+    Recalcula el resumen desde la colección de reservas y lo sustituye
+
+    Args:
+        notify: Si es True, envía el resumen actualizado al panel por WebSocket
+
+    Returns:
+        Dict[str, Any]: Estadísticas en el formato del endpoint /stats
+    """
+    with _reconcile_lock:
+        snapshot = compute_booking_stats()
+        stats_collection.replace_one({'_id': STATS_DOCUMENT_ID}, snapshot, upsert=True)
+
+    stats = format_stats(snapshot)
+    if notify:
+        emit_stats_update(stats)
+    return stats
+
+
+def format_stats(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte el documento resumen al formato de respuesta del endpoint /stats"""
+    by_status = {status: snapshot.get('by_status', {}).get(status, 0) for status in STATUSES}
+    today_key = datetime.utcnow().strftime('%Y-%m-%d')
+
+    return {
+        'total': snapshot.get('total', 0),
+        'active': sum(by_status[status] for status in ACTIVE_STATUSES),
+        'history': sum(by_status[status] for status in HISTORY_STATUSES),
+        'today': snapshot.get('by_pickup_day', {}).get(today_key, 0),
+        'incidents': snapshot.get('incidents', 0),
+        'by_status': by_status
+    }
+
+
+def _is_stale(snapshot: Optional[Dict[str, Any]]) -> bool:
+    if not snapshot:
+        return True
+    if snapshot.get('day') != datetime.utcnow().strftime('%Y-%m-%d'):
+        return True
+    reconciled_at = snapshot.get('reconciled_at')
+    if not isinstance(reconciled_at, datetime):
+        return True
+    return datetime.utcnow() - reconciled_at > timedelta(seconds=RECONCILE_INTERVAL_SECONDS * 2)
+
+
+def get_booking_stats() -> Dict[str, Any]:
+    """
+    Devuelve las estadísticas leyendo únicamente el documento resumen
+
+    Si el resumen no existe, es de otro día o el reconciliador no ha corrido
+    en mucho tiempo, se reconcilia antes de responder.
+    """
+    snapshot = stats_collection.find_one({'_id': STATS_DOCUMENT_ID})
+    if _is_stale(snapshot):
+        return reconcile_booking_stats(notify=False)
+    return format_stats(snapshot)
+
+
+def record_reservation_change(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+    """
+    Aplica al resumen la diferencia entre el estado anterior y el nuevo de una reserva
+
+    Sirve para altas (before=None), bajas (after=None) y modificaciones. Los
+    errores se registran sin interrumpir la operación principal; la siguiente
+    reconciliación corrige el resumen.
+
+    Args:
+        before: Documento de la reserva antes del cambio
+        after: Documento de la reserva después del cambio
+    """
+    try:
+        old = _contribution(before)
+        new = _contribution(after)
+
+        increments = {}
+        for key in set(old) | set(new):
+            delta = new.get(key, 0) - old.get(key, 0)
+            if delta:
+                increments[key] = delta
+
+        if not increments:
+            return
+
+        snapshot = stats_collection.find_one_and_update(
+            {'_id': STATS_DOCUMENT_ID},
+            {'$inc': increments},
+            return_document=ReturnDocument.AFTER
+        )
+
+        # Sin resumen previo no hay nada que incrementar: se construye completo
+        if snapshot is None:
+            reconcile_booking_stats()
+            return
+
+        emit_stats_update(format_stats(snapshot))
+    except Exception as e:
+        print(f"[BOOKING_STATS] Error al actualizar estadísticas: {str(e)}")
+
+
+def emit_stats_update(stats: Dict[str, Any]):
+    """Envía las estadísticas actualizadas al namespace /admin"""
+    try:
+        from app import socketio
+        socketio.emit('booking_stats_updated', stats, namespace='/admin')
+    except Exception as e:
+        print(f"[BOOKING_STATS] Error al emitir estadísticas por WebSocket: {str(e)}")
+
+
+def _reconcile_periodically():
+    while True:
+        time.sleep(RECONCILE_INTERVAL_SECONDS)
+        try:
+            reconcile_booking_stats()
+        except Exception as e:
+            print(f"[BOOKING_STATS] Error en la reconciliación periódica: {str(e)}")
+
+
+def start_stats_reconciler():
+    """Arranca (una sola vez por proceso) el hilo de reconciliación periódica"""
+    global _reconciler_started
+    if _reconciler_started:
+        return
+    _reconciler_started = True
+    threading.Thread(target=_reconcile_periodically, name='booking-stats-reconciler', daemon=True).start()
@@ -0,0 +1,294 @@
+"""
+Motor de tiempo ocupado de chóferes y vehículos.
+
+Reúne en un único conjunto de intervalos ordenado todo lo que ocupa a un
+chófer: reservas activas, horarios extra y bloques de agenda con estado
+``busy``/``off``. Cada fuente se consulta con la condición canónica de
+solapamiento ``inicio < fin_solicitado AND fin > inicio_solicitado`` sobre un
+índice compuesto, en lugar de varias ramas ``$or`` que dejaban fuera casos
+(un intervalo que contiene por completo al solicitado) o que consultaban
+campos inexistentes.
+
+Los ids de chófer y vehículo se guardan como ObjectId en las reservas y como
+cadena en los horarios extra, así que todas las consultas buscan ambas
+variantes con ``$in``.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+from models.drivers_agenda import bucket_day, expand_agenda
+from models.slot_claims import RELEASED_STATUSES
+
+SOURCE_RESERVATIONS = 'reservation'
+SOURCE_EXTRA_SCHEDULES = 'extra_schedule'
+SOURCE_AGENDA_BLOCKS = 'agenda_block'
+ALL_SOURCES = (SOURCE_RESERVATIONS, SOURCE_EXTRA_SCHEDULES, SOURCE_AGENDA_BLOCKS)
+
+# Reservas que ya no ocupan al chófer ni al vehículo (las mismas que liberan sus franjas)
+INACTIVE_RESERVATION_STATUSES = RELEASED_STATUSES
+
+# Estados de la agenda que bloquean al chófer
+AGENDA_BLOCK_STATUSES = ['busy', 'off']
+
+
+def setup_collections(db):
+    """Crea los índices que sirven la consulta canónica de solapamiento"""
+    db['reservations'].create_index([('driver_id', 1), ('pickup.date', 1), ('dropoff.estimated_date', 1)])
+    db['reservations'].create_index([('vehicle_id', 1), ('pickup.date', 1), ('dropoff.estimated_date', 1)])
+    # drivers_agenda_days tiene su índice (driver_id, day) en models.drivers_agenda
+    db['driver_extra_schedules'].create_index([
+        ('driver_id', 1), ('status', 1), ('start_datetime', 1), ('end_datetime', 1)
+    ])
+
+
+def id_variants(value: Any) -> List[Any]:
+    """Devuelve el id como cadena y, si es válido, también como ObjectId"""
+    text = str(value)
+    return [text, ObjectId(text)] if ObjectId.is_valid(text) else [text]
+
+
+def overlap_filter(start_field: str, end_field: str, start: datetime, end: datetime) -> Dict[str, Any]:
+    """Condición canónica de solapamiento entre [start, end) y el intervalo del documento"""
+    return {start_field: {'$lt': end}, end_field: {'$gt': start}}
+
+
+def _reservation_intervals(db, start: datetime, end: datetime, driver_id: Any = None,
+                           vehicle_id: Any = None, exclude_ids: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+    owners = []
+    if driver_id is not None:
+        owners.append({'driver_id': {'$in': id_variants(driver_id)}})
+    if vehicle_id is not None:
+        owners.append({'vehicle_id': {'$in': id_variants(vehicle_id)}})
+    if not owners:
+        return []
+
+    query = {
+        **overlap_filter('pickup.date', 'dropoff.estimated_date', start, end),
+        'status': {'$nin': INACTIVE_RESERVATION_STATUSES}
+    }
+    query.update(owners[0] if len(owners) == 1 else {'$or': owners})
+    excluded = [ObjectId(str(value)) for value in exclude_ids if ObjectId.is_valid(str(value))]
+    if excluded:
+        query['_id'] = {'$nin': excluded}
+
+    intervals = []
+    projection = {'pickup.date': 1, 'dropoff.estimated_date': 1, 'code': 1, 'driver_id': 1, 'vehicle_id': 1}
+    for reservation in db['reservations'].find(query, projection):
+        intervals.append({
+            'start': reservation['pickup']['date'],
+            'end': reservation['dropoff']['estimated_date'],
+            'source': SOURCE_RESERVATIONS,
+            'id': str(reservation['_id']),
+            'code': reservation.get('code'),
+            'driver_id': str(reservation['driver_id']) if reservation.get('driver_id') else None,
+            'vehicle_id': str(reservation['vehicle_id']) if reservation.get('vehicle_id') else None
+        })
+    return intervals
+
+
+def load_reservation_intervals(db, start: datetime, end: datetime, driver_ids: Iterable[Any] = (),
+                               vehicle_ids: Iterable[Any] = ()) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """
+    Reservas activas de muchos chóferes y vehículos en una ventana, con una sola consulta
+
+    Sirve para comprobar en memoria muchos intervalos (p. ej. una importación)
+    en lugar de llamar a find_conflicts por cada uno.
+
+    Returns:
+        Dict[str, Dict[str, List[Dict[str, Any]]]]: {'drivers': {id: intervalos},
+        'vehicles': {id: intervalos}}, con el mismo formato que find_conflicts
+    """
+    result: Dict[str, Dict[str, List[Dict[str, Any]]]] = {'drivers': {}, 'vehicles': {}}
+    owners = []
+    driver_variants = [variant for driver_id in set(map(str, driver_ids)) for variant in id_variants(driver_id)]
+    vehicle_variants = [variant for vehicle_id in set(map(str, vehicle_ids)) for variant in id_variants(vehicle_id)]
+    if driver_variants:
+        owners.append({'driver_id': {'$in': driver_variants}})
+    if vehicle_variants:
+        owners.append({'vehicle_id': {'$in': vehicle_variants}})
+    if not owners:
+        return result
+
+    query = {
+        **overlap_filter('pickup.date', 'dropoff.estimated_date', start, end),
+        'status': {'$nin': INACTIVE_RESERVATION_STATUSES}
+    }
+    query.update(owners[0] if len(owners) == 1 else {'$or': owners})
+    projection = {'pickup.date': 1, 'dropoff.estimated_date': 1, 'code': 1, 'driver_id': 1, 'vehicle_id': 1}
+    for reservation in db['reservations'].find(query, projection):
+        interval = {
+            'start': reservation['pickup']['date'],
+            'end': reservation['dropoff']['estimated_date'],
+            'source': SOURCE_RESERVATIONS,
+            'id': str(reservation['_id']),
+            'code': reservation.get('code'),
+            'driver_id': str(reservation['driver_id']) if reservation.get('driver_id') else None,
+            'vehicle_id': str(reservation['vehicle_id']) if reservation.get('vehicle_id') else None
+        }
+        if interval['driver_id']:
+            result['drivers'].setdefault(interval['driver_id'], []).append(interval)
+        if interval['vehicle_id']:
+            result['vehicles'].setdefault(interval['vehicle_id'], []).append(interval)
+    return result
+
+
+def _extra_schedule_intervals(db, driver_id: Any, start: datetime, end: datetime,
+                              exclude_ids: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+    query = {
+        'driver_id': {'$in': id_variants(driver_id)},
+        'status': 'active',
+        **overlap_filter('start_datetime', 'end_datetime', start, end)
+    }
+    excluded = [ObjectId(str(value)) for value in exclude_ids if ObjectId.is_valid(str(value))]
+    if excluded:
+        query['_id'] = {'$nin': excluded}
+
+    return [
+        {
+            'start': schedule['start_datetime'],
+            'end': schedule['end_datetime'],
+            'source': SOURCE_EXTRA_SCHEDULES,
+            'id': str(schedule['_id']),
+            'driver_id': str(driver_id)
+        }
+        for schedule in db['driver_extra_schedules'].find(query, {'start_datetime': 1, 'end_datetime': 1})
+    ]
+
+
+def _agenda_block_intervals(db, driver_id: Any, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    block_filter = {
+        'status': {'$in': AGENDA_BLOCK_STATUSES},
+        **overlap_filter('start_date', 'end_date', start, end)
+    }
+    intervals = []
+    for agenda in db['drivers_agenda'].find(
+        {
+            'driver_id': {'$in': id_variants(driver_id)},
+            '$or': [{'availability': {'$elemMatch': block_filter}}, {'recurrence.weekly.0': {'$exists': True}}]
+        },
+        {
+            'availability': {'$filter': {
+                'input': {'$ifNull': ['$availability', []]},
+                'as': 'slot',
+                'cond': {'$in': ['$$slot.status', AGENDA_BLOCK_STATUSES]}
+            }},
+            'recurrence': 1,
+            'updated_at': 1
+        }
+    ):
+        # Bloques explícitos y bloques de las reglas de recurrencia de la ventana
+        for slot in expand_agenda(agenda, start, end):
+            if slot.get('status') in AGENDA_BLOCK_STATUSES and slot['start_date'] < end and slot['end_date'] > start:
+                intervals.append({
+                    'start': slot['start_date'],
+                    'end': slot['end_date'],
+                    'source': SOURCE_AGENDA_BLOCKS,
+                    'id': str(agenda['_id']),
+                    'status': slot.get('status'),
+                    'driver_id': str(driver_id)
+                })
+
+    # Bloques guardados en los cubos diarios (una consulta por rango de días)
+    seen = set()
+    for bucket in db['drivers_agenda_days'].find(
+        {
+            'driver_id': {'$in': id_variants(driver_id)},
+            'day': {'$gte': bucket_day(start), '$lt': end},
+            'slots': {'$elemMatch': block_filter}
+        },
+        {'slots': 1}
+    ):
+        for slot in bucket.get('slots', []):
+            if (slot.get('status') in AGENDA_BLOCK_STATUSES and slot['start_date'] < end
+                    and slot['end_date'] > start and slot.get('slot_id') not in seen):
+                seen.add(slot.get('slot_id'))
+                intervals.append({
+                    'start': slot['start_date'],
+                    'end': slot['end_date'],
+                    'source': SOURCE_AGENDA_BLOCKS,
+                    'id': str(bucket['_id']),
+                    'status': slot.get('status'),
+                    'driver_id': str(driver_id)
+                })
+    return intervals
+
+
+def find_conflicts(db, start: datetime, end: datetime, driver_id: Any = None, vehicle_id: Any = None,
+                   sources: Iterable[str] = ALL_SOURCES,
+                   exclude_ids: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+    """
+    Devuelve todos los intervalos ocupados que se solapan con [start, end)
+
+    Args:
+        db: Conexión a la base de datos
+        start: Inicio del intervalo solicitado
+        end: Fin del intervalo solicitado
+        driver_id: Chófer a comprobar (str u ObjectId)
+        vehicle_id: Vehículo a comprobar; solo aplica a las reservas
+        sources: Fuentes a consultar (ALL_SOURCES por defecto)
+        exclude_ids: Ids de documentos a ignorar (p. ej. la reserva que se está editando)
+
+    Returns:
+        List[Dict[str, Any]]: Conflictos ordenados por inicio, con start, end, source e id
+    """
+    sources = set(sources)
+    exclude_ids = list(exclude_ids)
+    conflicts = []
+
+    if SOURCE_RESERVATIONS in sources:
+        conflicts.extend(_reservation_intervals(db, start, end, driver_id, vehicle_id, exclude_ids))
+    if driver_id is not None and SOURCE_EXTRA_SCHEDULES in sources:
+        conflicts.extend(_extra_schedule_intervals(db, driver_id, start, end, exclude_ids))
+    if driver_id is not None and SOURCE_AGENDA_BLOCKS in sources:
+        conflicts.extend(_agenda_block_intervals(db, driver_id, start, end))
+
+    conflicts.sort(key=lambda interval: (interval['start'], interval['end']))
+    return conflicts
+
+
+def merge_intervals(intervals: Iterable[Dict[str, Any]], gap: timedelta = timedelta(0)) -> List[Dict[str, Any]]:
+    """
+    Fusiona intervalos solapados (o separados por menos de gap) en un conjunto ordenado
+
+    Returns:
+        List[Dict[str, Any]]: Intervalos disjuntos {start, end, sources} ordenados por inicio
+    """
+    merged = []
+    for interval in sorted(intervals, key=lambda item: (item['start'], item['end'])):
+        if merged and interval['start'] <= merged[-1]['end'] + gap:
+            last = merged[-1]
+            last['end'] = max(last['end'], interval['end'])
+            if interval['source'] not in last['sources']:
+                last['sources'].append(interval['source'])
+        else:
+            merged.append({'start': interval['start'], 'end': interval['end'], 'sources': [interval['source']]})
+    return merged
+
+
+def get_busy_timeline(db, driver_id: Any, window_start: datetime, window_end: datetime,
+                      sources: Iterable[str] = ALL_SOURCES) -> List[Dict[str, Any]]:
+    """
+    Tiempo ocupado de un chófer en una ventana, fusionado en intervalos disjuntos
+
+    Returns:
+        List[Dict[str, Any]]: Intervalos {start, end, sources} ordenados por inicio
+    """
+    return merge_intervals(find_conflicts(db, window_start, window_end, driver_id=driver_id, sources=sources))
+
+
+def describe_conflicts(conflicts: List[Dict[str, Any]]) -> str:
+    """Resumen legible de una lista de conflictos para mensajes de error"""
+    labels = {
+        SOURCE_RESERVATIONS: 'reserva',
+        SOURCE_EXTRA_SCHEDULES: 'horario extra',
+        SOURCE_AGENDA_BLOCKS: 'bloqueo de agenda'
+    }
+    parts = [
+        f"{labels.get(conflict['source'], conflict['source'])} {conflict.get('code') or conflict['id']} "
+        f"({conflict['start'].strftime('%Y-%m-%d %H:%M')} - {conflict['end'].strftime('%H:%M')})"
+        for conflict in conflicts
+    ]
+    return '; '.join(parts)
@@ -0,0 +1,355 @@
+"""
+Índice de cobertura precalculado: celda geohash → zonas y vehículos flexibles.
+
+Cada documento de ``coverage_tiles`` es una celda geohash de precisión
+TILE_PRECISION (unos 4,9 x 4,9 km en el ecuador) con los ids de las zonas
+(``fixed_routes`` con centro y radio) y de los vehículos de ruta flexible
+cuyo círculo de cobertura la corta. El descubrimiento de candidatos de una
+búsqueda de disponibilidad es una lectura por _id de la celda del punto de
+recogida; después se comprueba la distancia exacta sobre esos candidatos.
+
+``coverage_tile_owners`` guarda, por zona o vehículo, las celdas que ocupa,
+de modo que un cambio de ubicación o de radio solo toca las celdas que
+entran o salen. Los propietarios con un radio mayor que MAX_TILE_RADIUS_KM no
+se reparten en celdas: se marcan como 'wide' y se añaden a todas las
+búsquedas (son pocos y la comprobación exacta los descarta).
+
+Mientras el índice no se haya construido con rebuild_all, candidates()
+devuelve None y las búsquedas usan las consultas geoespaciales. rebuild_all
+construye el índice nuevo aparte y lo sustituye de una vez, sin dejar a las
+búsquedas ante un índice vacío o a medias. Los cambios de zonas y vehículos
+se registran en ``coverage_tile_changes``; los que llegan durante la
+reconstrucción se aplicaron al índice anterior, así que rebuild_all los
+repite sobre el nuevo después de sustituirlo.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import DeleteOne, UpdateOne
+from pymongo.collection import Collection
+
+from utils.cache import TTLCache
+from utils.geohash import cell_polygon, cells_covering_circle, cells_in_bbox, encode
+from utils.geo_utils import DEFAULT_AVAILABILITY_RADIUS_KM, FLEXIBLE_ROUTE_TYPE
+
+# Precisión de las celdas del índice
+TILE_PRECISION = 5
+
+# Radio a partir del cual un propietario no se reparte en celdas
+MAX_TILE_RADIUS_KM = 100.0
+
+# Celdas máximas de una exportación
+MAX_EXPORT_TILES = 5000
+
+KIND_ZONE = 'zone'
+KIND_VEHICLE = 'vehicle'
+_TILE_FIELDS = {KIND_ZONE: 'zone_ids', KIND_VEHICLE: 'vehicle_ids'}
+_SOURCE_COLLECTIONS = {KIND_ZONE: 'fixed_routes', KIND_VEHICLE: 'vehicles'}
+
+# Documento de coverage_tile_owners que marca el índice como construido
+INDEX_STATE_ID = 'index_state'
+
+# Sufijo de las colecciones en las que rebuild_all construye el índice nuevo
+STAGING_SUFFIX = '_staging'
+
+# Conservación del registro de cambios (solo hace falta mientras dura una reconstrucción)
+CHANGES_RETENTION_SECONDS = 24 * 3600
+
+# Margen al repetir cambios tras reconstruir (relojes de procesos distintos)
+REPLAY_MARGIN = timedelta(minutes=1)
+
+tiles_collection: Optional[Collection] = None
+owners_collection: Optional[Collection] = None
+changes_collection: Optional[Collection] = None
+_db = None
+
+# Estado del índice y propietarios 'wide' (se invalidan al escribir en este proceso)
+_index_cache = TTLCache(ttl_seconds=60, max_entries=4)
+
+
+def setup_collections(db):
+    """Inicializa las colecciones del índice de cobertura"""
+    global tiles_collection, owners_collection, changes_collection, _db
+
+    _db = db
+    tiles_collection = db['coverage_tiles']
+    owners_collection = db['coverage_tile_owners']
+    changes_collection = db['coverage_tile_changes']
+
+    owners_collection.create_index([('kind', 1), ('wide', 1)])
+    changes_collection.create_index('at', expireAfterSeconds=CHANGES_RETENTION_SECONDS)
+
+
+def _owner_id(kind: str, owner_id: Any) -> str:
+    return f"{kind}:{owner_id}"
+
+
+def owner_circle(kind: str, document: Dict[str, Any]) -> Optional[Tuple[List[float], float]]:
+    """
+    Círculo de cobertura de una zona o de un vehículo
+
+    Returns:
+        Optional[Tuple[List[float], float]]: (centro [longitud, latitud], radio en km)
+        o None si no debe estar en el índice
+    """
+    if kind == KIND_ZONE:
+        coordinates = ((document.get('center') or {}).get('location') or {}).get('coordinates')
+        radius_km = document.get('radius')
+    else:
+        if document.get('availabilityType') != FLEXIBLE_ROUTE_TYPE:
+            return None
+        coordinates = (document.get('location') or {}).get('coordinates')
+        radius_km = document.get('availability_radius')
+        if radius_km is None:
+            radius_km = DEFAULT_AVAILABILITY_RADIUS_KM
+
+    if not coordinates or len(coordinates) != 2 or not isinstance(radius_km, (int, float)) or radius_km <= 0:
+        return None
+    return [float(coordinates[0]), float(coordinates[1])], float(radius_km)
+
+
+def _owner_document(kind: str, owner_id: str, circle: Tuple[List[float], float]) -> Dict[str, Any]:
+    center, radius_km = circle
+    wide = radius_km > MAX_TILE_RADIUS_KM
+    return {
+        '_id': _owner_id(kind, owner_id),
+        'kind': kind,
+        'owner_id': owner_id,
+        'center': center,
+        'radius_km': radius_km,
+        'wide': wide,
+        'cells': [] if wide else cells_covering_circle(center, radius_km, TILE_PRECISION),
+        'updated_at': datetime.utcnow()
+    }
+
+
+def _sync_owners(kind: str, documents: Dict[str, Optional[Dict[str, Any]]]):
+    """Aplica el cambio de celdas de varios propietarios (documento None = eliminado)"""
+    field = _TILE_FIELDS[kind]
+    previous = {
+        owner['owner_id']: owner
+        for owner in owners_collection.find(
+            {'_id': {'$in': [_owner_id(kind, owner_id) for owner_id in documents]}},
+            {'owner_id': 1, 'cells': 1, 'center': 1, 'radius_km': 1}
+        )
+    }
+
+    tile_operations = []
+    owner_operations = []
+    now = datetime.utcnow()
+    for owner_id, document in documents.items():
+        circle = owner_circle(kind, document) if document else None
+        old = previous.get(owner_id)
+        if old and circle and old.get('center') == circle[0] and old.get('radius_km') == circle[1]:
+            continue
+
+        old_cells = set(old.get('cells', [])) if old else set()
+        if circle:
+            owner = _owner_document(kind, owner_id, circle)
+            new_cells = set(owner['cells'])
+            owner_operations.append(UpdateOne({'_id': owner['_id']}, {'$set': owner}, upsert=True))
+        else:
+            new_cells = set()
+            if old:
+                owner_operations.append(DeleteOne({'_id': _owner_id(kind, owner_id)}))
+
+        for cell in new_cells - old_cells:
+            tile_operations.append(UpdateOne(
+                {'_id': cell}, {'$addToSet': {field: owner_id}, '$set': {'updated_at': now}}, upsert=True
+            ))
+        for cell in old_cells - new_cells:
+            tile_operations.append(UpdateOne({'_id': cell}, {'$pull': {field: owner_id}, '$set': {'updated_at': now}}))
+
+    if tile_operations:
+        tiles_collection.bulk_write(tile_operations, ordered=False)
+    if owner_operations:
+        owners_collection.bulk_write(owner_operations, ordered=False)
+        _index_cache.clear()
+
+
+def _sync_from_sources(kind: str, owner_ids: List[str]):
+    """Relee las zonas o vehículos indicados y actualiza sus celdas"""
+    documents: Dict[str, Optional[Dict[str, Any]]] = {owner_id: None for owner_id in owner_ids}
+    for document in _db[_SOURCE_COLLECTIONS[kind]].find(
+        {'_id': {'$in': [ObjectId(owner_id) for owner_id in owner_ids]}},
+        {'center': 1, 'radius': 1, 'location': 1, 'availability_radius': 1, 'availabilityType': 1}
+    ):
+        documents[str(document['_id'])] = document
+    _sync_owners(kind, documents)
+
+
+def _on_owners_changed(kind: str, owner_ids: Iterable[Any]):
+    # Se mantiene aunque el índice no esté construido: una reconstrucción en
+    # curso en otro proceso lo sustituirá y repetirá los cambios registrados
+    if tiles_collection is None:
+        return
+    ids = list(dict.fromkeys(str(owner_id) for owner_id in owner_ids if owner_id and ObjectId.is_valid(str(owner_id))))
+    if not ids:
+        return
+    try:
+        changes_collection.insert_one({'kind': kind, 'owner_ids': ids, 'at': datetime.utcnow()})
+        _sync_from_sources(kind, ids)
+    except Exception as e:
+        print(f"[COVERAGE_TILES] Error al actualizar el índice ({kind}): {str(e)}")
+
+
+def on_zones_changed(zone_ids: Iterable[Any]):
+    """Actualiza las celdas de las zonas creadas, modificadas o eliminadas"""
+    _on_owners_changed(KIND_ZONE, zone_ids)
+
+
+def on_vehicles_changed(vehicle_ids: Iterable[Any]):
+    """Actualiza las celdas de los vehículos cuya ubicación, radio o tipo ha cambiado"""
+    _on_owners_changed(KIND_VEHICLE, vehicle_ids)
+
+
+def rebuild_all() -> Dict[str, int]:
+    """
+    Reconstruye el índice completo a partir de las zonas y los vehículos
+
+    Returns:
+        Dict[str, int]: Zonas, vehículos, propietarios 'wide', celdas del índice y
+        propietarios cuyos cambios durante la reconstrucción se han repetido
+    """
+    started = datetime.utcnow()
+    tiles: Dict[str, Dict[str, List[str]]] = {}
+    owners = []
+    counts = {KIND_ZONE: 0, KIND_VEHICLE: 0, 'wide': 0}
+    sources = [
+        (KIND_ZONE, _db[_SOURCE_COLLECTIONS[KIND_ZONE]].find(
+            {'center.location.coordinates': {'$exists': True}, 'radius': {'$exists': True}},
+            {'center': 1, 'radius': 1}
+        )),
+        (KIND_VEHICLE, _db[_SOURCE_COLLECTIONS[KIND_VEHICLE]].find(
+            {'availabilityType': FLEXIBLE_ROUTE_TYPE},
+            {'location': 1, 'availability_radius': 1, 'availabilityType': 1}
+        ))
+    ]
+    for kind, documents in sources:
+        field = _TILE_FIELDS[kind]
+        for document in documents:
+            circle = owner_circle(kind, document)
+            if not circle:
+                continue
+            owner = _owner_document(kind, str(document['_id']), circle)
+            owners.append(owner)
+            counts[kind] += 1
+            counts['wide'] += owner['wide']
+            for cell in owner['cells']:
+                tiles.setdefault(cell, {'zone_ids': [], 'vehicle_ids': []})[field].append(owner['owner_id'])
+
+    # Se construye en colecciones auxiliares y se sustituye con rename: las
+    # búsquedas siguen leyendo el índice anterior completo hasta el cambio
+    now = datetime.utcnow()
+    staging_tiles = _db[tiles_collection.name + STAGING_SUFFIX]
+    staging_owners = _db[owners_collection.name + STAGING_SUFFIX]
+    staging_tiles.drop()
+    staging_owners.drop()
+
+    tile_documents = [{'_id': cell, **ids, 'updated_at': now} for cell, ids in tiles.items()]
+    if not tile_documents:
+        _db.create_collection(staging_tiles.name)
+    for index in range(0, len(tile_documents), 1000):
+        staging_tiles.insert_many(tile_documents[index:index + 1000], ordered=False)
+    staging_owners.create_index([('kind', 1), ('wide', 1)])
+    for index in range(0, len(owners), 1000):
+        staging_owners.insert_many(owners[index:index + 1000], ordered=False)
+    staging_owners.insert_one({'_id': INDEX_STATE_ID, 'kind': 'state', 'built_at': now, 'precision': TILE_PRECISION})
+
+    staging_tiles.rename(tiles_collection.name, dropTarget=True)
+    staging_owners.rename(owners_collection.name, dropTarget=True)
+    _index_cache.clear()
+
+    # Los cambios llegados mientras se construía se aplicaron al índice anterior
+    replay: Dict[str, set] = {}
+    for change in changes_collection.find({'at': {'$gte': started - REPLAY_MARGIN}}, {'kind': 1, 'owner_ids': 1}):
+        replay.setdefault(change['kind'], set()).update(change['owner_ids'])
+    for kind, owner_ids in replay.items():
+        _sync_from_sources(kind, list(owner_ids))
+
+    return {
+        'zones': counts[KIND_ZONE],
+        'vehicles': counts[KIND_VEHICLE],
+        'wide': counts['wide'],
+        'tiles': len(tiles),
+        'replayed': sum(len(owner_ids) for owner_ids in replay.values())
+    }
+
+
+def _index_built() -> bool:
+    return _index_cache.get_or_set(
+        'built', lambda: owners_collection.count_documents({'_id': INDEX_STATE_ID}, limit=1) > 0
+    )
+
+
+def _wide_owners() -> Dict[str, List[str]]:
+    def load():
+        wide = {'zone_ids': [], 'vehicle_ids': []}
+        for owner in owners_collection.find({'wide': True}, {'kind': 1, 'owner_id': 1}):
+            wide[_TILE_FIELDS[owner['kind']]].append(owner['owner_id'])
+        return wide
+    return _index_cache.get_or_set('wide', load)
+
+
+def candidates(coordinates: List[float]) -> Optional[Dict[str, List[str]]]:
+    """
+    Zonas y vehículos flexibles cuya cobertura puede incluir un punto
+
+    Args:
+        coordinates: Punto de recogida [longitud, latitud]
+
+    Returns:
+        Optional[Dict[str, List[str]]]: {'zone_ids', 'vehicle_ids'} (superconjunto:
+        falta comprobar la distancia exacta) o None si el índice no está construido
+    """
+    if tiles_collection is None or not _index_built():
+        return None
+
+    tile = tiles_collection.find_one({'_id': encode(coordinates, TILE_PRECISION)}) or {}
+    wide = _wide_owners()
+    return {
+        field: list(dict.fromkeys(tile.get(field, []) + wide[field]))
+        for field in ('zone_ids', 'vehicle_ids')
+    }
+
+
+def export_tiles(lon_min: float, lat_min: float, lon_max: float, lat_max: float) -> Dict[str, Any]:
+    """
+    Celdas del índice en un rectángulo como GeoJSON (vista de cobertura del panel)
+
+    Raises:
+        ValueError: Si el rectángulo tiene más de MAX_EXPORT_TILES celdas
+
+    Returns:
+        Dict[str, Any]: FeatureCollection con una celda por feature y sus zonas y vehículos
+    """
+    cells = cells_in_bbox(lon_min, lat_min, lon_max, lat_max, TILE_PRECISION)
+    if len(cells) > MAX_EXPORT_TILES:
+        raise ValueError(f"El área solicitada tiene {len(cells)} celdas (máximo {MAX_EXPORT_TILES})")
+
+    features = []
+    for tile in tiles_collection.find({'_id': {'$in': cells}}):
+        zone_ids, vehicle_ids = tile.get('zone_ids', []), tile.get('vehicle_ids', [])
+        if not zone_ids and not vehicle_ids:
+            continue
+        features.append({
+            'type': 'Feature',
+            'id': tile['_id'],
+            'geometry': cell_polygon(tile['_id']),
+            'properties': {
+                'geohash': tile['_id'],
+                'zone_ids': zone_ids,
+                'vehicle_ids': vehicle_ids,
+                'zone_count': len(zone_ids),
+                'vehicle_count': len(vehicle_ids)
+            }
+        })
+
+    wide = _wide_owners() if _index_built() else {'zone_ids': [], 'vehicle_ids': []}
+    return {
+        'type': 'FeatureCollection',
+        'features': features,
+        'properties': {'precision': TILE_PRECISION, 'wide_zone_ids': wide['zone_ids'], 'wide_vehicle_ids': wide['vehicle_ids']}
+    }
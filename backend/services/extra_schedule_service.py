@@ -1,6 +1,8 @@
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 from bson import ObjectId
+from services import busy_time_service, availability_bitmap_service, next_available_service
+from models.drivers_agenda import slot_bucket_operations, bucket_days
 
 def create_extra_schedule_slot(db, extra_schedule_data: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -69,6 +71,8 @@ def create_extra_schedule_slot(db, extra_schedule_data: Dict[str, Any]) -> Dict[
         
         # También actualizar la agenda regular del conductor si es necesario
         update_driver_agenda_with_extra_slot(db, driver_id, extra_schedule_record)
+        availability_bitmap_service.on_interval_changed(driver_id, start_datetime, end_datetime)
+        next_available_service.on_drivers_changed([driver_id])
         
         return {
             "success": True,
@@ -90,6 +94,9 @@ def check_schedule_conflicts(db, driver_id: str, start_datetime: datetime, end_d
     """
     Verifica si hay conflictos con horarios existentes del conductor
     
+    Consulta reservas, horarios extra y bloqueos de agenda con el motor de
+    tiempo ocupado y devuelve todos los conflictos, no solo el primero.
+    
     Args:
         db: Conexión a la base de datos
         driver_id: ID del conductor
@@ -97,85 +104,31 @@ def check_schedule_conflicts(db, driver_id: str, start_datetime: datetime, end_d
         end_datetime: Fecha y hora de fin
     
     Returns:
-        Dict indicando si hay conflicto y la razón
+        Dict indicando si hay conflicto, la razón y la lista de conflictos
     """
     try:
-        # Verificar conflictos con reservas existentes
-        existing_reservations = db["reservations"].find({
-            "driver_id": driver_id,
-            "status": {"$in": ["confirmed", "in_progress"]},
-            "$or": [
-                {
-                    "$and": [
-                        {"pickup_datetime": {"$lte": start_datetime}},
-                        {"estimated_dropoff_datetime": {"$gte": start_datetime}}
-                    ]
-                },
-                {
-                    "$and": [
-                        {"pickup_datetime": {"$lte": end_datetime}},
-                        {"estimated_dropoff_datetime": {"$gte": end_datetime}}
-                    ]
-                },
-                {
-                    "$and": [
-                        {"pickup_datetime": {"$gte": start_datetime}},
-                        {"pickup_datetime": {"$lte": end_datetime}}
-                    ]
-                }
-            ]
-        })
-        
-        reservation_conflict = list(existing_reservations)
-        if reservation_conflict:
-            return {
-                "has_conflict": True,
-                "reason": f"Ya existe una reserva confirmada en ese horario (ID: {reservation_conflict[0]['_id']})"
-            }
-        
-        # Verificar conflictos con otros horarios extras
-        existing_extra_schedules = db["driver_extra_schedules"].find({
-            "driver_id": driver_id,
-            "status": "active",
-            "$or": [
-                {
-                    "$and": [
-                        {"start_datetime": {"$lte": start_datetime}},
-                        {"end_datetime": {"$gte": start_datetime}}
-                    ]
-                },
-                {
-                    "$and": [
-                        {"start_datetime": {"$lte": end_datetime}},
-                        {"end_datetime": {"$gte": end_datetime}}
-                    ]
-                },
-                {
-                    "$and": [
-                        {"start_datetime": {"$gte": start_datetime}},
-                        {"start_datetime": {"$lte": end_datetime}}
-                    ]
-                }
-            ]
-        })
+        conflicts = busy_time_service.find_conflicts(db, start_datetime, end_datetime, driver_id=driver_id)
         
-        extra_schedule_conflict = list(existing_extra_schedules)
-        if extra_schedule_conflict:
+        if conflicts:
             return {
                 "has_conflict": True,
-                "reason": f"Ya existe un horario extra en ese período (ID: {extra_schedule_conflict[0]['_id']})"
+                "reason": f"{len(conflicts)} conflicto(s) en ese período: {busy_time_service.describe_conflicts(conflicts)}",
+                "conflicts": conflicts
             }
         
-        return {"has_conflict": False, "reason": ""}
+        return {"has_conflict": False, "reason": "", "conflicts": []}
         
     except Exception as e:
         print(f"Error verificando conflictos de horario: {str(e)}")
-        return {"has_conflict": True, "reason": f"Error verificando conflictos: {str(e)}"}
+        return {"has_conflict": True, "reason": f"Error verificando conflictos: {str(e)}", "conflicts": []}
 
 def update_driver_agenda_with_extra_slot(db, driver_id: str, extra_schedule: Dict[str, Any]) -> bool:
     """
     Actualiza la agenda del conductor agregando el horario extra
     
+    El horario extra se guarda como un slot disponible en los cubos diarios de
+    drivers_agenda_days, que son los que leen las comprobaciones de disponibilidad.
+    
     Args:
         db: Conexión a la base de datos
         driver_id: ID del conductor
@@ -185,51 +138,17 @@ def update_driver_agenda_with_extra_slot(db, driver_id: str, extra_schedule: Dic
         bool: True si se actualizó correctamente
     """
     try:
-        # Buscar la agenda del conductor para la fecha
-        agenda_date = extra_schedule["date"]
-        
-        # Buscar agenda existente para esa fecha
-        existing_agenda = db["drivers_agenda"].find_one({
-            "driver_id": driver_id,
-            "date": agenda_date
-        })
+        extra_slot = {
+            "start_date": extra_schedule["start_datetime"],
+            "end_date": extra_schedule["end_datetime"],
+            "status": "available",
+            "type": "extra",
+            "created_by_admin": True,
+            "extra_schedule_id": str(extra_schedule.get("_id"))
+        }
         
-        if existing_agenda:
-            # Agregar el horario extra a los horarios disponibles
-            extra_slot = {
-                "start_time": extra_schedule["start_time"],
-                "end_time": extra_schedule["end_time"],
-                "type": "extra",
-                "created_by_admin": True,
-                "extra_schedule_id": str(extra_schedule.get("_id"))
-            }
-            
-            # Actualizar la agenda existente
-            db["drivers_agenda"].update_one(
-                {"_id": existing_agenda["_id"]},
-                {
-                    "$push": {"available_time_slots": extra_slot},
-                    "$set": {"updated_at": datetime.utcnow()}
-                }
-            )
-        else:
-            # Crear nueva entrada de agenda con solo el horario extra
-            new_agenda = {
-                "driver_id": driver_id,
-                "date": agenda_date,
-                "available_time_slots": [{
-                    "start_time": extra_schedule["start_time"],
-                    "end_time": extra_schedule["end_time"],
-                    "type": "extra",
-                    "created_by_admin": True,
-                    "extra_schedule_id": str(extra_schedule.get("_id"))
-                }],
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow(),
-                "created_by_admin": True
-            }
-            
-            db["drivers_agenda"].insert_one(new_agenda)
+        operations = slot_bucket_operations(ObjectId(str(driver_id)), [extra_slot])
+        db["drivers_agenda_days"].bulk_write(operations, ordered=False)
         
         return True
         
@@ -317,6 +236,10 @@ def cancel_extra_schedule(db, extra_schedule_id: str, admin_id: str, reason: str
         
         # Remover de la agenda del conductor
         remove_extra_slot_from_agenda(db, extra_schedule["driver_id"], extra_schedule)
+        availability_bitmap_service.on_interval_changed(
+            extra_schedule["driver_id"], extra_schedule["start_datetime"], extra_schedule["end_datetime"]
+        )
+        next_available_service.on_drivers_changed([extra_schedule["driver_id"]])
         
         return {
             "success": True,
@@ -340,20 +263,17 @@ def remove_extra_slot_from_agenda(db, driver_id: str, extra_schedule: Dict[str,
         bool: True si se removió correctamente
     """
     try:
-        db["drivers_agenda"].update_one(
-            {
-                "driver_id": driver_id,
-                "date": extra_schedule["date"]
-            },
+        driver_id_obj = ObjectId(str(driver_id))
+        days = bucket_days(extra_schedule["start_datetime"], extra_schedule["end_datetime"])
+        
+        db["drivers_agenda_days"].update_many(
+            {"driver_id": driver_id_obj, "day": {"$in": days}},
             {
-                "$pull": {
-                    "available_time_slots": {
-                        "extra_schedule_id": str(extra_schedule["_id"])
-                    }
-                },
+                "$pull": {"slots": {"extra_schedule_id": str(extra_schedule["_id"])}},
                 "$set": {"updated_at": datetime.utcnow()}
             }
         )
+        db["drivers_agenda_days"].delete_many({"driver_id": driver_id_obj, "day": {"$in": days}, "slots": {"$size": 0}})
         
         return True
         
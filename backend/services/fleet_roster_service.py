@@ -0,0 +1,324 @@
+"""
+Modelo de lectura de la flota (fleet_roster) para rutas fijas y listados.
+
+Cada documento de ``fleet_roster`` es la instantánea de un vehículo tal como
+se muestra en las rutas fijas (matrícula, modelo, imagen) junto con su chófer
+principal (el primero de ``associatedDrivers``). Se construye con dos
+consultas ``$in`` (vehículos y chóferes) por lote en lugar de una consulta por
+vehículo y otra por chófer.
+
+Cuando cambia un vehículo, sus chóferes asociados o los datos de un chófer, la
+instantánea se recalcula y se propaga a todas las rutas fijas que la
+referencian con ``arrayFilters``, de modo que ``vehicles[]`` de las rutas no
+queda desactualizado. ``drivers[]`` y ``driver`` solo se recalculan en las
+rutas que los derivan de sus vehículos (``driversSource: 'roster'``); los
+fijados a mano con la API de rutas no se tocan.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateMany, UpdateOne
+from pymongo.collection import Collection
+
+from utils.http_cache import invalidate_tags
+
+# Vehículos por lote al reconstruir el modelo
+ROSTER_BATCH_SIZE = 500
+
+# Origen de drivers[]/driver de una ruta fija: derivados de sus vehículos o fijados a mano
+DRIVERS_SOURCE_FIELD = 'driversSource'
+DRIVERS_SOURCE_ROSTER = 'roster'
+DRIVERS_SOURCE_MANUAL = 'manual'
+
+VEHICLE_PROJECTION = {'licensePlate': 1, 'details': 1, 'name': 1, 'image': 1,
+                      'associatedDrivers': 1, 'collaboratorId': 1}
+DRIVER_PROJECTION = {'first_name': 1, 'last_name': 1, 'profile_image': 1}
+
+fleet_roster_collection: Optional[Collection] = None
+vehicles_collection: Optional[Collection] = None
+drivers_collection: Optional[Collection] = None
+fixed_routes_collection: Optional[Collection] = None
+
+
+def setup_collections(db):
+    """Inicializa la colección fleet_roster y la construye si está vacía"""
+    global fleet_roster_collection, vehicles_collection, drivers_collection, fixed_routes_collection
+
+    fleet_roster_collection = db['fleet_roster']
+    vehicles_collection = db['vehicles']
+    drivers_collection = db['drivers']
+    fixed_routes_collection = db['fixed_routes']
+
+    fleet_roster_collection.create_index('driver_ids')
+    fleet_roster_collection.create_index('collaboratorId')
+
+    if fleet_roster_collection.estimated_document_count() == 0:
+        rebuild_roster()
+
+
+def _object_ids(ids: Iterable[Any]) -> List[ObjectId]:
+    result = []
+    for value in ids:
+        if isinstance(value, ObjectId):
+            result.append(value)
+        elif value and ObjectId.is_valid(str(value)):
+            result.append(ObjectId(str(value)))
+    return result
+
+
+def driver_snapshot(driver: Dict[str, Any]) -> Dict[str, Any]:
+    """Datos del chófer que se incrustan en las rutas fijas"""
+    full_name = f"{driver.get('first_name', '')} {driver.get('last_name', '')}".strip()
+    return {
+        "id": str(driver['_id']),
+        "name": full_name or 'Sin nombre',
+        "photo": driver.get('profile_image', '')
+    }
+
+
+def vehicle_model_display(vehicle: Dict[str, Any]) -> str:
+    """Modelo y año del vehículo (o su nombre), como en el listado por colaborador"""
+    details = vehicle.get('details') or {}
+    model_display = f"{details.get('model', '')} {details.get('year', '')}".strip()
+    return model_display or vehicle.get('name', 'Vehículo sin modelo')
+
+
+def _roster_entry(vehicle: Dict[str, Any], drivers_by_id: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    driver_ids = [str(driver_id) for driver_id in vehicle.get('associatedDrivers') or []]
+    driver = drivers_by_id.get(driver_ids[0]) if driver_ids else None
+    return {
+        '_id': vehicle['_id'],
+        'vehicle_id': str(vehicle['_id']),
+        'licensePlate': vehicle.get('licensePlate', ''),
+        'model': vehicle_model_display(vehicle),
+        'imageUrl': vehicle.get('image', ''),
+        'collaboratorId': vehicle.get('collaboratorId'),
+        'driver_ids': driver_ids,
+        'driver': driver_snapshot(driver) if driver else None,
+        'updated_at': datetime.utcnow()
+    }
+
+
+def _build_entries(vehicles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Construye las entradas de un lote de vehículos con una sola consulta de chóferes"""
+    first_driver_ids = _object_ids(
+        (vehicle.get('associatedDrivers') or [None])[0] for vehicle in vehicles
+    )
+    drivers_by_id = {}
+    if first_driver_ids:
+        drivers_by_id = {
+            str(driver['_id']): driver
+            for driver in drivers_collection.find({'_id': {'$in': first_driver_ids}}, DRIVER_PROJECTION)
+        }
+    return [_roster_entry(vehicle, drivers_by_id) for vehicle in vehicles]
+
+
+def _store_entries(entries: List[Dict[str, Any]]):
+    if entries:
+        fleet_roster_collection.bulk_write(
+            [ReplaceOne({'_id': entry['_id']}, entry, upsert=True) for entry in entries],
+            ordered=False
+        )
+
+
+def rebuild_roster(vehicle_ids: Optional[Iterable[Any]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Reconstruye las entradas del modelo de lectura
+
+    Args:
+        vehicle_ids: Vehículos a reconstruir (todos si es None)
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Entradas reconstruidas por id de vehículo
+    """
+    query = {}
+    requested = None
+    if vehicle_ids is not None:
+        requested = _object_ids(vehicle_ids)
+        if not requested:
+            return {}
+        query = {'_id': {'$in': requested}}
+
+    rebuilt = {}
+    batch = []
+    for vehicle in vehicles_collection.find(query, VEHICLE_PROJECTION).batch_size(ROSTER_BATCH_SIZE):
+        batch.append(vehicle)
+        if len(batch) >= ROSTER_BATCH_SIZE:
+            entries = _build_entries(batch)
+            _store_entries(entries)
+            rebuilt.update((entry['vehicle_id'], entry) for entry in entries)
+            batch = []
+    if batch:
+        entries = _build_entries(batch)
+        _store_entries(entries)
+        rebuilt.update((entry['vehicle_id'], entry) for entry in entries)
+
+    # Vehículos eliminados: sacarlos del modelo
+    if requested is not None:
+        missing = [vehicle_id for vehicle_id in requested if str(vehicle_id) not in rebuilt]
+        if missing:
+            fleet_roster_collection.delete_many({'_id': {'$in': missing}})
+
+    return rebuilt
+
+
+def get_roster(vehicle_ids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Obtiene las entradas del modelo de lectura de varios vehículos en una consulta
+
+    Las entradas que falten se construyen y guardan en ese momento.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Entradas por id de vehículo (str)
+    """
+    object_ids = _object_ids(vehicle_ids)
+    if not object_ids:
+        return {}
+
+    roster = {entry['vehicle_id']: entry for entry in fleet_roster_collection.find({'_id': {'$in': object_ids}})}
+    missing = [vehicle_id for vehicle_id in object_ids if str(vehicle_id) not in roster]
+    if missing:
+        roster.update(rebuild_roster(missing))
+    return roster
+
+
+def attach_roster_to_vehicles(vehicles_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Adjunta el chófer principal a los vehículos de una ruta fija
+
+    Args:
+        vehicles_data: Vehículos de la ruta ({id, licensePlate, model, imageUrl})
+
+    Returns:
+        List[Dict[str, Any]]: Los mismos vehículos con 'driver' cuando tienen chófer asociado
+    """
+    roster = get_roster(vehicle.get('id') for vehicle in vehicles_data)
+    for vehicle in vehicles_data:
+        entry = roster.get(str(vehicle.get('id')))
+        if entry and entry.get('driver'):
+            vehicle['driver'] = entry['driver']
+    return vehicles_data
+
+
+def _derived_drivers(vehicles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [vehicle['driver'] for vehicle in vehicles if vehicle.get('driver')]
+
+
+def _drivers_from_roster(route: Dict[str, Any]) -> bool:
+    """Indica si drivers[]/driver de la ruta se derivan de sus vehículos"""
+    source = route.get(DRIVERS_SOURCE_FIELD)
+    if source:
+        return source == DRIVERS_SOURCE_ROSTER
+    # Rutas anteriores al marcador: derivadas si todos sus chóferes son chóferes de sus vehículos
+    vehicle_driver_ids = {str(driver.get('id')) for driver in _derived_drivers(route.get('vehicles') or [])}
+    route_drivers = list(route.get('drivers') or [])
+    if route.get('driver'):
+        route_drivers.append(route['driver'])
+    return all(isinstance(driver, dict) and str(driver.get('id')) in vehicle_driver_ids
+               for driver in route_drivers)
+
+
+def _propagate_vehicles(entries: List[Dict[str, Any]], removed_ids: List[str]):
+    """Actualiza la instantánea de los vehículos en las rutas fijas que los incluyen"""
+    vehicle_ids = [entry['vehicle_id'] for entry in entries] + removed_ids
+    if not vehicle_ids:
+        return
+
+    # Se decide antes de cambiar los vehículos, con los chóferes que tenían hasta ahora
+    derived_route_ids = [
+        route['_id'] for route in fixed_routes_collection.find(
+            {'vehicles.id': {'$in': vehicle_ids}},
+            {'vehicles': 1, 'drivers': 1, 'driver': 1, DRIVERS_SOURCE_FIELD: 1}
+        )
+        if _drivers_from_roster(route)
+    ]
+
+    operations = []
+    for entry in entries:
+        update = {'$set': {
+            'vehicles.$[v].licensePlate': entry['licensePlate'],
+            'vehicles.$[v].model': entry['model'],
+            'vehicles.$[v].imageUrl': entry['imageUrl']
+        }}
+        if entry.get('driver'):
+            update['$set']['vehicles.$[v].driver'] = entry['driver']
+        else:
+            update['$unset'] = {'vehicles.$[v].driver': ''}
+        operations.append(UpdateMany(
+            {'vehicles.id': entry['vehicle_id']}, update,
+            array_filters=[{'v.id': entry['vehicle_id']}]
+        ))
+    for vehicle_id in removed_ids:
+        operations.append(UpdateMany(
+            {'vehicles.id': vehicle_id},
+            {'$unset': {'vehicles.$[v].driver': ''}},
+            array_filters=[{'v.id': vehicle_id}]
+        ))
+    fixed_routes_collection.bulk_write(operations, ordered=False)
+
+    # drivers[] y driver solo se recalculan en las rutas que los derivan de sus vehículos
+    route_operations = []
+    routes = fixed_routes_collection.find({'_id': {'$in': derived_route_ids}}, {'vehicles': 1}) if derived_route_ids else []
+    for route in routes:
+        drivers = _derived_drivers(route.get('vehicles') or [])
+        if drivers:
+            update = {'$set': {'drivers': drivers, 'driver': drivers[0], DRIVERS_SOURCE_FIELD: DRIVERS_SOURCE_ROSTER}}
+        else:
+            update = {'$set': {DRIVERS_SOURCE_FIELD: DRIVERS_SOURCE_ROSTER},
+                      '$unset': {'drivers': '', 'driver': ''}}
+        route_operations.append(UpdateOne({'_id': route['_id']}, update))
+    if route_operations:
+        fixed_routes_collection.bulk_write(route_operations, ordered=False)
+
+    invalidate_tags('fixed_routes')
+
+
+def on_vehicles_changed(vehicle_ids: Iterable[Any]):
+    """
+    Recalcula y propaga la instantánea de vehículos modificados, eliminados o
+    cuyos chóferes asociados han cambiado
+    """
+    requested = [str(vehicle_id) for vehicle_id in vehicle_ids]
+    try:
+        rebuilt = rebuild_roster(requested)
+        removed = [vehicle_id for vehicle_id in requested if vehicle_id not in rebuilt]
+        _propagate_vehicles(list(rebuilt.values()), removed)
+    except Exception as e:
+        print(f"[FLEET_ROSTER] Error al actualizar vehículos {requested}: {str(e)}")
+
+
+def on_driver_changed(driver_id: Any):
+    """
+    Recalcula y propaga los datos de un chófer modificado o eliminado
+
+    Actualiza los vehículos de los que es chófer asociado y las rutas que lo
+    incluyen de forma explícita en drivers[] o driver.
+    """
+    driver_id = str(driver_id)
+    try:
+        vehicle_ids = [entry['vehicle_id'] for entry in fleet_roster_collection.find({'driver_ids': driver_id}, {'vehicle_id': 1})]
+        if vehicle_ids:
+            on_vehicles_changed(vehicle_ids)
+
+        driver = None
+        if ObjectId.is_valid(driver_id):
+            driver = drivers_collection.find_one({'_id': ObjectId(driver_id)}, DRIVER_PROJECTION)
+
+        if driver:
+            snapshot = driver_snapshot(driver)
+            operations = [
+                UpdateMany({'drivers.id': driver_id}, {'$set': {'drivers.$[d]': snapshot}},
+                           array_filters=[{'d.id': driver_id}]),
+                UpdateMany({'driver.id': driver_id}, {'$set': {'driver': snapshot}})
+            ]
+        else:
+            operations = [
+                UpdateMany({'drivers.id': driver_id}, {'$pull': {'drivers': {'id': driver_id}}}),
+                UpdateMany({'driver.id': driver_id}, {'$unset': {'driver': ''}})
+            ]
+        fixed_routes_collection.bulk_write(operations, ordered=False)
+        invalidate_tags('fixed_routes')
+    except Exception as e:
+        print(f"[FLEET_ROSTER] Error al actualizar el chófer {driver_id}: {str(e)}")
@@ -0,0 +1,174 @@
+"""
+Índice de próximas ventanas libres por chófer (colección driver_next_available).
+
+Cada documento guarda, para un chófer, las ventanas libres de los próximos
+días (UTC): la disponibilidad de la agenda (slots explícitos, reglas de
+recurrencia y horarios extra) menos las reservas activas y los bloqueos
+``busy``/``off``. Las sugerencias de horario alternativo leen un documento
+por ``_id`` en lugar de expandir la agenda del día y volver a interpretar
+horas ``"%H:%M"``.
+
+El índice se recalcula al escribir agendas, reservas y horarios extra, y al
+leerlo si ha caducado o si la hora pedida queda fuera de su horizonte.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo.collection import Collection
+
+from models.drivers_agenda import expand_agenda, find_agenda_for_window, merge_available_slots
+from services import busy_time_service
+
+# Días hacia delante que cubre el índice
+HORIZON_DAYS = 7
+
+# Antigüedad máxima del índice antes de recalcularlo al leerlo
+MAX_INDEX_AGE = timedelta(hours=6)
+
+# Ventanas libres más cortas que esto no se sugieren
+MIN_WINDOW_MINUTES = 15
+
+# Ventanas guardadas por chófer
+MAX_STORED_WINDOWS = 50
+
+next_available_collection: Optional[Collection] = None
+_db = None
+
+
+def setup_collections(db):
+    """Inicializa la colección del índice de próximas ventanas libres"""
+    global next_available_collection, _db
+    _db = db
+    next_available_collection = db['driver_next_available']
+
+
+def compute_free_windows(driver_id: Any, window_start: datetime, window_end: datetime) -> List[Dict[str, datetime]]:
+    """
+    Calcula las ventanas libres de un chófer en [window_start, window_end)
+
+    Returns:
+        List[Dict[str, datetime]]: Ventanas {start, end} disjuntas y ordenadas (UTC naive)
+    """
+    if not ObjectId.is_valid(str(driver_id)):
+        return []
+
+    agenda = find_agenda_for_window(ObjectId(str(driver_id)), window_start, window_end)
+    available = merge_available_slots(expand_agenda(agenda, window_start, window_end))
+    busy = busy_time_service.get_busy_timeline(
+        _db, driver_id, window_start, window_end,
+        sources=(busy_time_service.SOURCE_RESERVATIONS, busy_time_service.SOURCE_AGENDA_BLOCKS)
+    )
+
+    windows = []
+    busy_index = 0
+    min_length = timedelta(minutes=MIN_WINDOW_MINUTES)
+    for slot in available:
+        start = max(slot['start_date'], window_start)
+        end = min(slot['end_date'], window_end)
+        # Los intervalos ocupados están ordenados: se avanza sobre ellos una sola vez
+        while busy_index < len(busy) and busy[busy_index]['end'] <= start:
+            busy_index += 1
+        index = busy_index
+        while start < end and index < len(busy) and busy[index]['start'] < end:
+            if busy[index]['start'] - start >= min_length:
+                windows.append({'start': start, 'end': busy[index]['start']})
+            start = max(start, busy[index]['end'])
+            index += 1
+        if end - start >= min_length:
+            windows.append({'start': start, 'end': end})
+    return windows
+
+
+def refresh_driver(driver_id: Any) -> Dict[str, Any]:
+    """Recalcula y guarda el índice de un chófer desde ahora hasta el horizonte"""
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    horizon_end = now + timedelta(days=HORIZON_DAYS)
+    windows = compute_free_windows(driver_id, now, horizon_end)
+    if len(windows) > MAX_STORED_WINDOWS:
+        # Índice recortado: solo cubre hasta el final de la última ventana guardada
+        windows = windows[:MAX_STORED_WINDOWS]
+        horizon_end = windows[-1]['end']
+    document = {
+        '_id': str(driver_id),
+        'windows': windows,
+        'computed_at': now,
+        'horizon_end': horizon_end
+    }
+    next_available_collection.replace_one({'_id': document['_id']}, document, upsert=True)
+    return document
+
+
+def _windows_from(driver_id: Any, after: datetime) -> tuple:
+    """
+    Ventanas libres desde after leídas del índice (o calculadas sin guardar si quedan fuera)
+
+    Returns:
+        tuple: (ventanas {start, end} con start >= after, tramo (inicio, fin) del horizonte
+        que el índice recortado no cubre o None)
+    """
+    document = next_available_collection.find_one({'_id': str(driver_id)})
+    now = datetime.utcnow()
+    if document is None or now - document['computed_at'] > MAX_INDEX_AGE:
+        document = refresh_driver(driver_id)
+
+    uncovered = None
+    if after < document['computed_at'] or after >= document['horizon_end']:
+        # Fuera del horizonte guardado: se calcula sin guardar
+        windows = compute_free_windows(driver_id, after, after + timedelta(days=HORIZON_DAYS))
+    else:
+        windows = document['windows']
+        full_horizon_end = document['computed_at'] + timedelta(days=HORIZON_DAYS)
+        if document['horizon_end'] < full_horizon_end:
+            uncovered = (document['horizon_end'], full_horizon_end)
+
+    return [
+        {'start': max(window['start'], after), 'end': window['end']}
+        for window in windows if window['end'] > after
+    ], uncovered
+
+
+def get_free_windows(driver_id: Any, after: datetime) -> List[Dict[str, datetime]]:
+    """
+    Ventanas libres de un chófer a partir de after, leídas del índice
+
+    Returns:
+        List[Dict[str, datetime]]: Ventanas {start, end} con start >= after
+    """
+    return _windows_from(driver_id, after)[0]
+
+
+def next_available(driver_id: Any, after: datetime, duration_minutes: int = MIN_WINDOW_MINUTES) -> Optional[Dict[str, datetime]]:
+    """
+    Primera ventana libre desde after en la que cabe un servicio de duration_minutes
+
+    Returns:
+        Optional[Dict[str, datetime]]: Ventana {start, end} o None si no hay hueco en el horizonte
+    """
+    duration = timedelta(minutes=duration_minutes)
+    windows, uncovered = _windows_from(driver_id, after)
+    for window in windows:
+        if window['end'] - window['start'] >= duration:
+            return window
+
+    # Índice recortado a MAX_STORED_WINDOWS: el resto del horizonte se calcula sin guardar
+    if uncovered is not None:
+        for window in compute_free_windows(driver_id, *uncovered):
+            if window['end'] - window['start'] >= duration:
+                return window
+    return None
+
+
+def on_drivers_changed(driver_ids: Iterable[Any]):
+    """Recalcula el índice de los chóferes cuya agenda, reservas u horarios extra han cambiado"""
+    for driver_id in dict.fromkeys(str(driver_id) for driver_id in driver_ids if driver_id):
+        try:
+            refresh_driver(driver_id)
+        except Exception as e:
+            print(f"[NEXT_AVAILABLE] Error al recalcular el chófer {driver_id}: {str(e)}")
+
+
+def on_reservation_changed(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+    """Recalcula el índice de los chóferes de una reserva antes y después del cambio"""
+    on_drivers_changed((reservation or {}).get('driver_id') for reservation in (before, after))
@@ -0,0 +1,202 @@
+"""
+Hash y verificación de contraseñas fuera del proceso web.
+
+bcrypt consume cientos de milisegundos de CPU por operación. Ejecutarlo dentro
+del worker bloquea el resto de peticiones (reservas, panel...) mientras dura
+una avalancha de inicios de sesión. Este servicio:
+
+- ejecuta bcrypt en un pool de procesos acotado (PASSWORD_HASH_WORKERS) y
+  rechaza con PasswordServiceBusy cuando la cola supera PASSWORD_HASH_MAX_PENDING,
+  en lugar de acumular trabajo sin límite,
+- limita los intentos simultáneos por cuenta (PASSWORD_MAX_CONCURRENT_PER_ACCOUNT),
+- y vuelve a calcular en segundo plano los hashes cuyo coste no coincide con
+  BCRYPT_LOG_ROUNDS tras un inicio de sesión correcto.
+
+Con PASSWORD_HASH_MODE=inline el cálculo se hace en el propio hilo (desarrollo).
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import bcrypt
+
+# Coste de bcrypt para los hashes nuevos (mismo valor por defecto que Flask-Bcrypt)
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+
+# 'process' (pool de procesos) o 'inline' (en el hilo de la petición)
+PASSWORD_HASH_MODE = os.getenv('PASSWORD_HASH_MODE', 'process')
+
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', max(1, min(4, (os.cpu_count() or 2) // 2))))
+
+# Operaciones en curso o en cola a partir de las cuales se rechazan nuevas
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', PASSWORD_HASH_WORKERS * 8))
+
+# Verificaciones simultáneas permitidas para una misma cuenta
+PASSWORD_MAX_CONCURRENT_PER_ACCOUNT = int(os.getenv('PASSWORD_MAX_CONCURRENT_PER_ACCOUNT', 2))
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+_account_slots: Dict[str, int] = {}
+_account_lock = threading.Lock()
+
+
+class PasswordServiceBusy(Exception):
+    """El pool de hash está saturado; el cliente debe reintentar más tarde"""
+
+
+class TooManyConcurrentAttempts(Exception):
+    """Demasiados intentos simultáneos para la misma cuenta"""
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(hashed: str, password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # fork evita que los hijos vuelvan a ejecutar app.py (como haría spawn);
+            # los hijos solo ejecutan bcrypt
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=context)
+        return _executor
+
+
+def start_pool():
+    """
+    Arranca los procesos del pool de hash
+
+    Debe llamarse al iniciar la aplicación, antes de abrir conexiones a MongoDB
+    y de lanzar hilos, para que los procesos hijos se creen desde un estado limpio.
+    """
+    if PASSWORD_HASH_MODE == 'inline':
+        return
+    executor = _get_executor()
+    # Con fork, el pool crea todos sus procesos en el primer envío
+    executor.submit(abs, 0).result()
+
+
+def _submit(fn, *args):
+    """Ejecuta fn en el pool respetando el límite de operaciones pendientes"""
+    if PASSWORD_HASH_MODE == 'inline':
+        return fn(*args)
+
+    if not _pending.acquire(blocking=False):
+        raise PasswordServiceBusy("Demasiadas operaciones de autenticación en curso")
+    try:
+        future = _get_executor().submit(fn, *args)
+    except Exception:
+        _pending.release()
+        raise
+    future.add_done_callback(lambda _: _pending.release())
+    return future.result()
+
+
+def hash_password(password: str) -> str:
+    """
+    Calcula el hash bcrypt de una contraseña con el coste configurado
+
+    Raises:
+        PasswordServiceBusy: Si el pool de hash está saturado
+    """
+    return _submit(_hash, password, BCRYPT_LOG_ROUNDS)
+
+
+def verify_password(hashed: str, password: str) -> bool:
+    """
+    Comprueba una contraseña contra su hash bcrypt
+
+    Args:
+        hashed: Hash almacenado (vacío en cuentas creadas con Google)
+        password: Contraseña recibida
+
+    Returns:
+        bool: True si la contraseña es correcta
+
+    Raises:
+        PasswordServiceBusy: Si el pool de hash está saturado
+    """
+    if not hashed or not password or not hashed.startswith('$2'):
+        return False
+    try:
+        return _submit(_check, hashed, password)
+    except ValueError:
+        # Hash mal formado
+        return False
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """Devuelve el coste de un hash bcrypt ('$2b$12$...' -> 12)"""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed: str) -> bool:
+    """Indica si el hash se calculó con un coste distinto del configurado"""
+    rounds = hash_rounds(hashed)
+    return rounds is not None and rounds != BCRYPT_LOG_ROUNDS
+
+
+def rehash_in_background(users_collection, user_id, old_hash: str, password: str):
+    """
+    Recalcula el hash de un usuario con el coste actual sin retrasar la respuesta
+
+    La actualización solo se aplica si el hash almacenado no ha cambiado entre
+    tanto (por ejemplo, por un cambio de contraseña).
+    """
+    def rehash():
+        try:
+            new_hash = hash_password(password)
+            users_collection.update_one(
+                {'_id': user_id, 'password': old_hash},
+                {'$set': {'password': new_hash}}
+            )
+        except PasswordServiceBusy:
+            # Se volverá a intentar en el próximo inicio de sesión
+            pass
+        except Exception as e:
+            print(f"[PASSWORD] Error al recalcular el hash del usuario {user_id}: {str(e)}")
+
+    threading.Thread(target=rehash, daemon=True).start()
+
+
+@contextmanager
+def account_slot(account: str):
+    """
+    Reserva uno de los intentos simultáneos permitidos para una cuenta
+
+    Args:
+        account: Identificador de la cuenta (email)
+
+    Raises:
+        TooManyConcurrentAttempts: Si la cuenta ya tiene el máximo de intentos en curso
+    """
+    key = (account or '').strip().lower()
+    with _account_lock:
+        in_flight = _account_slots.get(key, 0)
+        if in_flight >= PASSWORD_MAX_CONCURRENT_PER_ACCOUNT:
+            raise TooManyConcurrentAttempts("Demasiados intentos simultáneos para esta cuenta")
+        _account_slots[key] = in_flight + 1
+    try:
+        yield
+    finally:
+        with _account_lock:
+            remaining = _account_slots.get(key, 1) - 1
+            if remaining > 0:
+                _account_slots[key] = remaining
+            else:
+                _account_slots.pop(key, None)
@@ -0,0 +1,338 @@
+"""
+Importación masiva de reservas (manifiestos de eventos en CSV o NDJSON).
+
+En lugar de repetir por cada fila el flujo de /create (código, geocodificación,
+disponibilidad, conflictos, inserción y relectura), la importación:
+
+- geocodifica una sola vez cada dirección distinta (en paralelo),
+- carga las agendas de todos los choferes implicados con una única consulta $in,
+- comprueba en memoria, como /create, las reservas y bloqueos de agenda que se
+  solapan (las reservas de todos los choferes y vehículos en una consulta),
+- reserva los códigos de reserva en un solo bloque del contador,
+- reclama las franjas de chofer/vehículo (lo que detecta también conflictos
+  entre filas del propio fichero) e inserta por lotes con insert_many,
+- y va devolviendo el resultado de cada fila a medida que se procesa.
+"""
+
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from models.reservations import validate_reservation, reserve_reservation_numbers, RESERVATION_CODE_PREFIX
+from models.drivers_agenda import get_driver_agendas, agenda_covers_interval, expand_agenda
+from models.slot_claims import claim_slots, release_slots, reservation_window, reservation_resources
+from services.search_service import search_fields_update
+from services import availability_bitmap_service, busy_time_service, next_available_service
+from utils.geo_utils import get_coordinates_from_address
+
+# Límite de filas por importación
+MAX_IMPORT_ROWS = 2000
+
+# Filas por lote de inserción (y por bloque de resultados devueltos)
+IMPORT_BATCH_SIZE = 100
+
+# Peticiones simultáneas a la API de geocodificación
+GEOCODE_WORKERS = 8
+
+ID_FIELDS = ['user_id', 'vehicle_id', 'driver_id', 'collaborator_id', 'created_by', 'route_id']
+
+
+def parse_import_rows(stream: io.TextIOBase, file_format: str) -> List[Dict[str, Any]]:
+    """
+    Lee las filas del fichero de importación
+
+    Args:
+        stream: Contenido del fichero como texto
+        file_format: 'csv' o 'ndjson'
+
+    Returns:
+        List[Dict[str, Any]]: Filas leídas (en NDJSON, una fila inválida se devuelve con la clave '_parse_error')
+
+    Raises:
+        ValueError: Si el formato no es válido o se supera MAX_IMPORT_ROWS
+    """
+    if file_format == 'csv':
+        rows = list(csv.DictReader(stream))
+    elif file_format == 'ndjson':
+        rows = []
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                rows.append({'_parse_error': f"JSON inválido: {str(e)}"})
+                continue
+            if not isinstance(row, dict):
+                rows.append({'_parse_error': "Cada línea debe ser un objeto JSON"})
+                continue
+            rows.append(row)
+    else:
+        raise ValueError("Formato no soportado. Use 'csv' o 'ndjson'")
+
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise ValueError(f"La importación admite como máximo {MAX_IMPORT_ROWS} filas")
+    return rows
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    """Convierte una fecha ISO 8601 a datetime UTC sin zona horaria"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None) - parsed.utcoffset()
+    return parsed
+
+
+def _coordinates(lng: Any, lat: Any) -> Optional[List[float]]:
+    if lng in (None, '') or lat in (None, ''):
+        return None
+    return [float(lng), float(lat)]
+
+
+def row_to_reservation(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convierte una fila del manifiesto en un documento de reserva
+
+    Admite dos formas: el documento anidado que acepta /create (pickup, dropoff
+    y payment como objetos) o columnas planas (pickup_location, pickup_date,
+    pickup_lng, pickup_lat, dropoff_location, dropoff_date, payment_amount...).
+    """
+    if isinstance(row.get('pickup'), dict):
+        reservation = dict(row)
+        reservation['pickup'] = dict(row['pickup'])
+        reservation['dropoff'] = dict(row.get('dropoff') or {})
+    else:
+        reservation = {
+            'client_name': row.get('client_name'),
+            'user_id': row.get('user_id'),
+            'service_type': row.get('service_type') or 'one_way',
+            'status': row.get('status') or 'pending',
+            'passengers': int(row.get('passengers') or 1),
+            'driver_id': row.get('driver_id'),
+            'vehicle_id': row.get('vehicle_id'),
+            'collaborator_id': row.get('collaborator_id'),
+            'notes': row.get('notes', ''),
+            'pickup': {
+                'location': row.get('pickup_location'),
+                'date': row.get('pickup_date'),
+                'coordinates': _coordinates(row.get('pickup_lng'), row.get('pickup_lat'))
+            },
+            'dropoff': {
+                'location': row.get('dropoff_location'),
+                'estimated_date': row.get('dropoff_date'),
+                'coordinates': _coordinates(row.get('dropoff_lng'), row.get('dropoff_lat'))
+            },
+            'payment': {
+                'method': row.get('payment_method') or 'invoice',
+                'status': row.get('payment_status') or 'pending',
+                'amount': float(row.get('payment_amount') or 0),
+                'currency': row.get('payment_currency') or 'EUR'
+            }
+        }
+        if row.get('estimated_duration'):
+            reservation['estimated_duration'] = int(row['estimated_duration'])
+
+    # Limpiar valores vacíos de las columnas planas
+    reservation = {key: value for key, value in reservation.items() if value not in (None, '')}
+    for section in ('pickup', 'dropoff'):
+        if section in reservation:
+            reservation[section] = {k: v for k, v in reservation[section].items() if v not in (None, '')}
+    if not reservation.get('dropoff'):
+        reservation.pop('dropoff', None)
+
+    reservation['pickup']['date'] = _parse_datetime(reservation.get('pickup', {}).get('date'))
+    if 'dropoff' in reservation and 'estimated_date' in reservation['dropoff']:
+        reservation['dropoff']['estimated_date'] = _parse_datetime(reservation['dropoff']['estimated_date'])
+
+    for id_field in ID_FIELDS:
+        if reservation.get(id_field):
+            try:
+                reservation[id_field] = ObjectId(reservation[id_field])
+            except Exception:
+                # Si la conversión falla, dejar como estaba (igual que /create)
+                pass
+
+    return reservation
+
+
+def _geocode_unique(addresses: List[str]) -> Dict[str, Optional[List[float]]]:
+    """Geocodifica cada dirección distinta una sola vez"""
+    unique = sorted(set(addresses))
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=GEOCODE_WORKERS) as executor:
+        return dict(zip(unique, executor.map(get_coordinates_from_address, unique)))
+
+
+def _row_conflicts(booked: Dict[str, Dict[str, List[Dict[str, Any]]]], agenda: Optional[Dict[str, Any]],
+                   driver_id: Any, vehicle_id: Any, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Reservas y bloqueos de agenda precargados que se solapan con [start, end)"""
+    conflicts = {}
+    for interval in booked['drivers'].get(str(driver_id), []) + booked['vehicles'].get(str(vehicle_id), []):
+        if interval['start'] < end and interval['end'] > start:
+            conflicts[interval['id']] = interval
+    conflicts = list(conflicts.values())
+    for slot in expand_agenda(agenda, start, end):
+        if slot.get('status') in busy_time_service.AGENDA_BLOCK_STATUSES and slot['start_date'] < end and slot['end_date'] > start:
+            conflicts.append({
+                'start': slot['start_date'],
+                'end': slot['end_date'],
+                'source': busy_time_service.SOURCE_AGENDA_BLOCKS,
+                'id': str(agenda['_id']) if agenda.get('_id') else None,
+                'status': slot.get('status'),
+                'driver_id': str(driver_id)
+            })
+    conflicts.sort(key=lambda interval: (interval['start'], interval['end']))
+    return conflicts
+
+
+def _result(index: int, status: str, **extra) -> str:
+    return json.dumps({'row': index + 1, 'status': status, **extra}, ensure_ascii=False, default=str) + '\n'
+
+
+def import_reservations(reservations_collection, rows: List[Dict[str, Any]], created_by: Any = None) -> Iterator[str]:
+    """
+    Importa las filas y genera una línea NDJSON de resultado por fila, más un resumen final
+
+    Args:
+        reservations_collection: Colección de reservas
+        rows: Filas devueltas por parse_import_rows
+        created_by: Usuario que realiza la importación
+
+    Yields:
+        str: Líneas NDJSON ({"row", "status": "created"|"error", ...} y {"summary": {...}})
+    """
+    created = 0
+    failed = 0
+    prepared: List[Tuple[int, Dict[str, Any]]] = []
+
+    # 1. Conversión y validación de todas las filas
+    for index, row in enumerate(rows):
+        try:
+            if '_parse_error' in row:
+                failed += 1
+                yield _result(index, 'error', error=row['_parse_error'])
+                continue
+            reservation = row_to_reservation(row)
+        except (TypeError, ValueError, AttributeError) as e:
+            failed += 1
+            yield _result(index, 'error', error=f"Fila inválida: {str(e)}")
+            continue
+
+        # El código se asigna después, en bloque, solo a las filas válidas
+        is_valid, message = validate_reservation({**reservation, 'code': RESERVATION_CODE_PREFIX})
+        if is_valid and not isinstance(reservation['pickup'].get('date'), datetime):
+            is_valid, message = False, "pickup.date debe ser una fecha ISO 8601"
+        if not is_valid:
+            failed += 1
+            yield _result(index, 'error', error=message)
+            continue
+        prepared.append((index, reservation))
+
+    # 2. Geocodificación de direcciones únicas sin coordenadas
+    missing = [r['pickup']['location'] for _, r in prepared if not r['pickup'].get('coordinates')]
+    geocoded = _geocode_unique(missing)
+    for _, reservation in prepared:
+        if not reservation['pickup'].get('coordinates'):
+            coordinates = geocoded.get(reservation['pickup']['location'])
+            if coordinates:
+                reservation['pickup']['coordinates'] = coordinates
+
+    # 3. Disponibilidad de choferes con una sola consulta de agendas
+    windows = [reservation_window(r) for _, r in prepared if r.get('driver_id')]
+    windows = [window for window in windows if window[0] is not None]
+    window_start = min((start for start, _ in windows), default=None)
+    window_end = max((end for _, end in windows), default=None)
+    agendas = get_driver_agendas([r['driver_id'] for _, r in prepared if r.get('driver_id')], window_start, window_end)
+    # Reservas existentes de todos los choferes y vehículos de la ventana, en una consulta
+    booked = busy_time_service.load_reservation_intervals(
+        reservations_collection.database, window_start, window_end,
+        driver_ids=[r['driver_id'] for _, r in prepared if r.get('driver_id') and r.get('vehicle_id')],
+        vehicle_ids=[r['vehicle_id'] for _, r in prepared if r.get('driver_id') and r.get('vehicle_id')]
+    ) if windows else {'drivers': {}, 'vehicles': {}}
+    available: List[Tuple[int, Dict[str, Any]]] = []
+    for index, reservation in prepared:
+        if reservation.get('driver_id') and reservation.get('vehicle_id'):
+            start, end = reservation_window(reservation)
+            if not agenda_covers_interval(agendas.get(str(reservation['driver_id'])), start, end):
+                failed += 1
+                yield _result(index, 'error',
+                              error="El chofer seleccionado no está disponible para el horario solicitado",
+                              driver_id=reservation['driver_id'])
+                continue
+
+            # Mismas fuentes que /create (reservas y bloqueos busy/off), comprobadas en memoria
+            conflicts = _row_conflicts(booked, agendas.get(str(reservation['driver_id'])),
+                                       reservation['driver_id'], reservation['vehicle_id'], start, end)
+            if conflicts:
+                failed += 1
+                yield _result(index, 'error',
+                              error="El chofer o vehículo seleccionado ya tiene una reserva para el horario solicitado",
+                              conflicts=[{**conflict, 'start': conflict['start'].isoformat(), 'end': conflict['end'].isoformat()}
+                                         for conflict in conflicts])
+                continue
+        available.append((index, reservation))
+
+    # 4. Códigos reservados en un único bloque
+    numbers = iter(reserve_reservation_numbers(len(available))) if available else iter(())
+    now = datetime.utcnow()
+
+    # 5. Reclamación de franjas e inserción por lotes
+    for batch_start in range(0, len(available), IMPORT_BATCH_SIZE):
+        batch = []
+        for index, reservation in available[batch_start:batch_start + IMPORT_BATCH_SIZE]:
+            reservation['_id'] = ObjectId()
+            reservation['code'] = f"{RESERVATION_CODE_PREFIX}{next(numbers)}"
+            reservation['created_at'] = now
+            reservation['updated_at'] = now
+            if created_by:
+                reservation.setdefault('created_by', ObjectId(created_by) if ObjectId.is_valid(created_by) else created_by)
+            reservation.update(search_fields_update('reservations', reservation))
+
+            start, end = reservation_window(reservation)
+            conflict = claim_slots('reservation', reservation['_id'], reservation_resources(reservation), start, end)
+            if conflict:
+                failed += 1
+                yield _result(index, 'error',
+                              error="El chofer o vehículo seleccionado ya tiene una reserva para el horario solicitado",
+                              resource_type=conflict['resource_type'],
+                              conflicting_reservation_id=conflict['held_by'])
+                continue
+            batch.append((index, reservation))
+
+        if not batch:
+            continue
+
+        failed_positions = {}
+        try:
+            reservations_collection.insert_many([reservation for _, reservation in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                failed_positions[error['index']] = error.get('errmsg', 'Error de inserción')
+
+        inserted = [reservation for position, (_, reservation) in enumerate(batch) if position not in failed_positions]
+        availability_bitmap_service.on_reservations_created(inserted)
+        next_available_service.on_drivers_changed(reservation.get('driver_id') for reservation in inserted)
+
+        for position, (index, reservation) in enumerate(batch):
+            if position in failed_positions:
+                release_slots(reservation['_id'])
+                failed += 1
+                yield _result(index, 'error', error=failed_positions[position])
+            else:
+                created += 1
+                yield _result(index, 'created', reservation_id=str(reservation['_id']), code=reservation['code'])
+
+    yield json.dumps({'summary': {'total': len(rows), 'created': created, 'failed': failed}}) + '\n'
@@ -0,0 +1,192 @@
+"""
+Búsqueda indexada para los listados del panel de administración.
+
+Cada documento buscable guarda en ``search_terms`` los prefijos (edge n-grams)
+de las palabras de sus campos de búsqueda, normalizadas a minúsculas y sin
+acentos. El campo tiene un índice multiclave, de modo que una búsqueda se
+resuelve con ``{'search_terms': {'$all': [...]}}`` recorriendo solo las
+entradas del índice del término más largo, en lugar de evaluar varias
+expresiones $regex sin anclar sobre toda la colección.
+
+Los resultados se ordenan por relevancia en memoria (coincidencia exacta de
+palabra > prefijo, ponderada por campo).
+"""
+
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+# Longitud máxima de prefijo indexado; los términos de búsqueda más largos se truncan
+MAX_PREFIX_LENGTH = 15
+
+# Campos de búsqueda por entidad y su peso en el ranking
+SEARCH_FIELDS = {
+    'reservations': {'code': 5, 'client_name': 3},
+    'drivers': {'first_name': 4, 'last_name': 4, 'email': 3, 'phone': 2},
+    'users': {'name': 4, 'email': 3},
+    'collaborators': {'name': 5, 'contactName': 3, 'contactEmail': 2, 'city': 1, 'country': 1},
+    'fixed_routes': {'name': 5, 'origin.name': 3, 'destination.name': 3}
+}
+
+# Proyección para no devolver el campo interno en las respuestas
+EXCLUDE_SEARCH_TERMS = {'search_terms': 0}
+
+_TOKEN_SPLIT = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_text(value: Any) -> str:
+    """
+    Normaliza un texto para búsqueda: minúsculas, sin acentos ni diacríticos
+
+    Args:
+        value: Valor a normalizar (se convierte a str)
+
+    Returns:
+        str: Texto normalizado
+    """
+    if value is None:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(value).lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(value: Any) -> List[str]:
+    """Divide un texto normalizado en palabras alfanuméricas"""
+    return [token for token in _TOKEN_SPLIT.split(normalize_text(value)) if token]
+
+
+def _get_field(document: Dict[str, Any], path: str) -> Any:
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _field_tokens(field: str, value: Any) -> List[str]:
+    tokens = tokenize(value)
+    # Los teléfonos se indexan también con todos sus dígitos juntos
+    if field == 'phone' and value:
+        digits = ''.join(char for char in str(value) if char.isdigit())
+        if digits:
+            tokens.append(digits)
+    return tokens
+
+
+def build_search_terms(entity: str, document: Dict[str, Any]) -> List[str]:
+    """
+    Genera los prefijos indexables de un documento
+
+    Args:
+        entity: Nombre de la entidad en SEARCH_FIELDS
+        document: Documento (o datos completos) de la entidad
+
+    Returns:
+        List[str]: Prefijos únicos ordenados
+    """
+    terms = set()
+    for field in SEARCH_FIELDS[entity]:
+        for token in _field_tokens(field, _get_field(document, field)):
+            for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1):
+                terms.add(token[:length])
+    return sorted(terms)
+
+
+def _query_tokens(search_query: str) -> List[str]:
+    tokens = {token[:MAX_PREFIX_LENGTH] for token in tokenize(search_query)}
+    # El término más largo primero: es el más selectivo para el recorrido del índice
+    return sorted(tokens, key=len, reverse=True)
+
+
+def search_filter(search_query: str) -> Optional[Dict[str, Any]]:
+    """
+    Construye el filtro indexado para un texto de búsqueda
+
+    Args:
+        search_query: Texto introducido por el usuario
+
+    Returns:
+        Optional[Dict[str, Any]]: Filtro de MongoDB, o None si el texto no contiene palabras
+    """
+    tokens = _query_tokens(search_query)
+    if not tokens:
+        return None
+    return {'search_terms': {'$all': tokens}}
+
+
+def score_document(entity: str, document: Dict[str, Any], search_query: str) -> float:
+    """Puntúa la relevancia de un documento para el texto de búsqueda"""
+    query_tokens = tokenize(search_query)
+    score = 0.0
+    for field, weight in SEARCH_FIELDS[entity].items():
+        field_tokens = _field_tokens(field, _get_field(document, field))
+        if not field_tokens:
+            continue
+        for query_token in query_tokens:
+            if query_token in field_tokens:
+                score += weight * 2
+            elif any(token.startswith(query_token) for token in field_tokens):
+                score += weight
+        # Bonificación si el campo completo empieza por la búsqueda
+        if normalize_text(_get_field(document, field)).startswith(normalize_text(search_query).strip()):
+            score += weight
+    return score
+
+
+def rank_documents(entity: str, documents: Iterable[Dict[str, Any]], search_query: str) -> List[Dict[str, Any]]:
+    """Ordena documentos por relevancia descendente (orden estable ante empates)"""
+    return sorted(documents, key=lambda doc: score_document(entity, doc, search_query), reverse=True)
+
+
+def search_fields_update(entity: str, document: Dict[str, Any]) -> Dict[str, Any]:
+    """Devuelve el $set con los términos de búsqueda de un documento completo"""
+    return {'search_terms': build_search_terms(entity, document)}
+
+
+def refresh_search_terms(collection, entity: str, document_id):
+    """
+    Recalcula los términos de búsqueda de un documento tras una actualización parcial
+
+    Args:
+        collection: Colección de MongoDB de la entidad
+        entity: Nombre de la entidad en SEARCH_FIELDS
+        document_id: _id del documento
+    """
+    try:
+        projection = {field: 1 for field in SEARCH_FIELDS[entity]}
+        document = collection.find_one({'_id': document_id}, projection)
+        if document:
+            collection.update_one({'_id': document_id}, {'$set': search_fields_update(entity, document)})
+    except Exception as e:
+        print(f"[SEARCH] Error al actualizar términos de búsqueda ({entity}): {str(e)}")
+
+
+def ensure_search_index(collection, entity: str, batch_size: int = 500):
+    """
+    Crea el índice de búsqueda y rellena los documentos que aún no tienen términos
+
+    Args:
+        collection: Colección de MongoDB de la entidad
+        entity: Nombre de la entidad en SEARCH_FIELDS
+        batch_size: Número de actualizaciones por bulk_write
+    """
+    try:
+        collection.create_index('search_terms')
+
+        projection = {field: 1 for field in SEARCH_FIELDS[entity]}
+        operations = []
+        for document in collection.find({'search_terms': {'$exists': False}}, projection):
+            operations.append(UpdateOne(
+                {'_id': document['_id']},
+                {'$set': search_fields_update(entity, document)}
+            ))
+            if len(operations) >= batch_size:
+                collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+    except Exception as e:
+        print(f"[SEARCH] Error al preparar el índice de búsqueda ({entity}): {str(e)}")
@@ -0,0 +1,318 @@
+"""
+Procesamiento idempotente de los webhooks de Stripe mediante una bandeja de entrada.
+
+El endpoint solo verifica la firma, guarda el evento en ``stripe_events``
+(con el id del evento como ``_id``, de modo que los reintentos de Stripe se
+descartan por clave duplicada) y responde de inmediato. Un pool de hilos
+reclama los eventos pendientes por lotes y aplica sus efectos sobre sesiones
+y reservas con ``bulk_write``.
+
+Los efectos son idempotentes: cada escritura guarda el ``created`` del evento
+que la produjo y solo se aplica si no hay ya un evento más reciente, así que
+reprocesar un evento o recibirlos desordenados no deja un estado antiguo.
+"""
+
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+from services import booking_session_store
+
+# Hilos que procesan la bandeja de entrada
+WEBHOOK_WORKERS = int(os.getenv('STRIPE_WEBHOOK_WORKERS', 2))
+
+# Eventos reclamados por cada lote
+WEBHOOK_BATCH_SIZE = int(os.getenv('STRIPE_WEBHOOK_BATCH_SIZE', 100))
+
+# Intervalo de sondeo para eventos recibidos por otros procesos o que quedaron sin procesar
+POLL_SECONDS = 5
+
+# Tiempo tras el que un lote reclamado por un worker caído vuelve a estar disponible
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+# Intentos antes de marcar un evento como fallido
+MAX_ATTEMPTS = 5
+
+# Tiempo que se conservan los eventos procesados (cubre la ventana de reintentos de Stripe)
+EVENT_RETENTION = timedelta(days=30)
+
+PAYMENT_EVENT_TYPES = ['payment_intent.succeeded', 'payment_intent.payment_failed']
+
+stripe_events_collection: Optional[Collection] = None
+booking_sessions_collection: Optional[Collection] = None
+bookings_collection: Optional[Collection] = None
+
+_wakeup = queue.Queue()
+_workers: List[threading.Thread] = []
+
+
+def setup_collections(db):
+    """Inicializa la bandeja de entrada de eventos y sus índices"""
+    global stripe_events_collection, booking_sessions_collection, bookings_collection
+
+    stripe_events_collection = db['stripe_events']
+    booking_sessions_collection = db['booking_sessions']
+    bookings_collection = db['bookings']
+
+    # _id es el id del evento de Stripe: la unicidad del _id deduplica los reintentos
+    stripe_events_collection.create_index([('status', 1), ('available_at', 1)])
+    stripe_events_collection.create_index('claim_token')
+    stripe_events_collection.create_index('expires_at', expireAfterSeconds=0)
+
+
+def record_event(event: Dict[str, Any]) -> bool:
+    """
+    Guarda un evento verificado en la bandeja de entrada
+
+    Args:
+        event: Evento de Stripe ya verificado
+
+    Returns:
+        bool: True si el evento es nuevo, False si ya se había recibido
+    """
+    now = datetime.utcnow()
+    try:
+        stripe_events_collection.insert_one({
+            '_id': event['id'],
+            'type': event['type'],
+            'created': event.get('created'),
+            'payload': event,
+            'status': 'pending',
+            'attempts': 0,
+            'received_at': now,
+            'available_at': now
+        })
+    except DuplicateKeyError:
+        return False
+
+    _wakeup.put_nowait(None)
+    return True
+
+
+def claim_batch(limit: int = WEBHOOK_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """
+    Reclama un lote de eventos pendientes para este worker
+
+    La reclamación es un update_many condicionado al estado, así que dos
+    workers (o dos procesos) nunca procesan el mismo evento a la vez.
+    """
+    now = datetime.utcnow()
+    candidates = [
+        event['_id'] for event in stripe_events_collection.find(
+            {'$or': [
+                {'status': 'pending', 'available_at': {'$lte': now}},
+                {'status': 'processing', 'available_at': {'$lte': now}}
+            ]},
+            {'_id': 1}
+        ).sort('available_at', 1).limit(limit)
+    ]
+    if not candidates:
+        return []
+
+    token = uuid.uuid4().hex
+    stripe_events_collection.update_many(
+        {
+            '_id': {'$in': candidates},
+            'status': {'$in': ['pending', 'processing']},
+            'available_at': {'$lte': now}
+        },
+        {
+            '$set': {'status': 'processing', 'claim_token': token, 'available_at': now + CLAIM_TIMEOUT},
+            '$inc': {'attempts': 1}
+        }
+    )
+    return list(stripe_events_collection.find({'claim_token': token}).sort('created', 1))
+
+
+def _payment_updates(event: Dict[str, Any]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Devuelve los campos a escribir en la sesión y en la reserva para un evento de pago"""
+    payment_intent = event['data']['object']
+    now = datetime.utcnow()
+
+    if event['type'] == 'payment_intent.succeeded':
+        session_fields = {
+            'payment_status': 'succeeded',
+            'stripe_payment_id': payment_intent['id']
+        }
+        booking_fields = {
+            'payment.status': 'succeeded',
+            'payment.stripe_payment_id': payment_intent['id'],
+            'payment.payment_method_details': payment_intent.get('payment_method_details')
+        }
+    elif event['type'] == 'payment_intent.payment_failed':
+        session_fields = {
+            'payment_status': 'failed',
+            'payment_error': payment_intent.get('last_payment_error')
+        }
+        booking_fields = {
+            'payment.status': 'failed',
+            'payment.error': payment_intent.get('last_payment_error')
+        }
+    else:
+        return None
+
+    session_fields.update({'payment_event_created': event.get('created'), 'updated_at': now})
+    booking_fields.update({'payment.event_created': event.get('created'), 'updated_at': now})
+    return {'session': session_fields, 'booking': booking_fields}
+
+
+def _newer_than(field: str, created: Any) -> Dict[str, Any]:
+    """Filtro que evita que un evento antiguo sobrescriba el efecto de uno más reciente"""
+    return {'$or': [{field: {'$exists': False}}, {field: None}, {field: {'$lte': created}}]}
+
+
+def process_batch(events: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """
+    Aplica los efectos de un lote de eventos con escrituras agrupadas
+
+    Args:
+        events: Documentos de stripe_events reclamados (ordenados por created)
+
+    Returns:
+        Dict[str, List[str]]: Ids de eventos procesados ('done') y con error ('failed')
+    """
+    done, failed = [], []
+
+    # Sesiones afectadas, resueltas con una única consulta
+    by_session = {}
+    for stored in events:
+        payload = stored['payload']
+        if payload.get('type') not in PAYMENT_EVENT_TYPES:
+            # Evento sin efectos para nosotros: basta con registrarlo
+            done.append(stored['_id'])
+            continue
+        session_id = (payload['data']['object'].get('metadata') or {}).get('session_id')
+        if not session_id:
+            done.append(stored['_id'])
+            continue
+        by_session.setdefault(session_id, []).append(stored)
+
+    if not by_session:
+        return {'done': done, 'failed': failed}
+
+    booking_ids = {
+        session['session_id']: session.get('booking_id')
+        for session in booking_sessions_collection.find(
+            {'session_id': {'$in': list(by_session)}},
+            {'session_id': 1, 'booking_id': 1}
+        )
+    }
+
+    session_operations = []
+    booking_operations = []
+    for session_id, stored_events in by_session.items():
+        for stored in stored_events:
+            try:
+                updates = _payment_updates(stored['payload'])
+            except (KeyError, TypeError) as e:
+                print(f"[STRIPE_WEBHOOK] Evento {stored['_id']} mal formado: {str(e)}")
+                failed.append(stored['_id'])
+                continue
+
+            created = stored['payload'].get('created')
+            session_operations.append(UpdateOne(
+                {'session_id': session_id, **_newer_than('payment_event_created', created)},
+                {'$set': updates['session']}
+            ))
+            if booking_ids.get(session_id):
+                booking_operations.append(UpdateOne(
+                    {'booking_id': booking_ids[session_id], **_newer_than('payment.event_created', created)},
+                    {'$set': updates['booking']}
+                ))
+            done.append(stored['_id'])
+
+    # Ordenadas: los eventos de una misma sesión se aplican en el orden en que se crearon.
+    # Con escritura diferida, los cambios pendientes de las sesiones se escriben antes
+    # (para que un flush posterior no pise payment_*) y su copia en memoria se relee después
+    if session_operations:
+        booking_session_store.flush_sessions(by_session)
+        booking_sessions_collection.bulk_write(session_operations, ordered=True)
+        booking_session_store.reload_sessions(by_session)
+    if booking_operations:
+        bookings_collection.bulk_write(booking_operations, ordered=True)
+
+    return {'done': done, 'failed': failed}
+
+
+def _finish_batch(events: List[Dict[str, Any]], result: Dict[str, List[str]]):
+    now = datetime.utcnow()
+    if result['done']:
+        stripe_events_collection.update_many(
+            {'_id': {'$in': result['done']}},
+            {'$set': {'status': 'done', 'processed_at': now, 'expires_at': now + EVENT_RETENTION},
+             '$unset': {'claim_token': ''}}
+        )
+    if result['failed']:
+        attempts = {event['_id']: event.get('attempts', 1) for event in events}
+        operations = []
+        for event_id in result['failed']:
+            if attempts.get(event_id, 1) >= MAX_ATTEMPTS:
+                update = {'status': 'failed', 'expires_at': now + EVENT_RETENTION}
+            else:
+                # Reintento con espera exponencial
+                update = {'status': 'pending', 'available_at': now + timedelta(seconds=2 ** attempts.get(event_id, 1))}
+            operations.append(UpdateOne({'_id': event_id}, {'$set': update, '$unset': {'claim_token': ''}}))
+        stripe_events_collection.bulk_write(operations, ordered=False)
+
+
+def _retry_later(events: List[Dict[str, Any]]):
+    """Devuelve un lote a la cola tras un error general (p. ej. de conexión)"""
+    now = datetime.utcnow()
+    stripe_events_collection.update_many(
+        {'_id': {'$in': [event['_id'] for event in events]}, 'status': 'processing'},
+        {'$set': {'status': 'pending', 'available_at': now + timedelta(seconds=POLL_SECONDS)},
+         '$unset': {'claim_token': ''}}
+    )
+
+
+def process_pending() -> int:
+    """
+    Procesa lotes de eventos pendientes hasta vaciar la cola
+
+    Returns:
+        int: Número de eventos procesados
+    """
+    processed = 0
+    while True:
+        events = claim_batch()
+        if not events:
+            return processed
+        try:
+            result = process_batch(events)
+        except Exception as e:
+            print(f"[STRIPE_WEBHOOK] Error al procesar un lote de {len(events)} eventos: {str(e)}")
+            _retry_later(events)
+            return processed
+        _finish_batch(events, result)
+        processed += len(result['done'])
+
+
+def _worker_loop():
+    while True:
+        try:
+            _wakeup.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            pass
+        try:
+            process_pending()
+        except Exception as e:
+            print(f"[STRIPE_WEBHOOK] Error en el worker: {str(e)}")
+            time.sleep(POLL_SECONDS)
+
+
+def start_workers(count: int = WEBHOOK_WORKERS):
+    """Arranca los hilos que procesan la bandeja de entrada (una sola vez por proceso)"""
+    if _workers:
+        return
+    for index in range(count):
+        worker = threading.Thread(target=_worker_loop, daemon=True, name=f'stripe-webhook-{index}')
+        worker.start()
+        _workers.append(worker)
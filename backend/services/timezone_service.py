@@ -1,8 +1,10 @@
 import pytz
-from datetime import datetime
-from typing import Optional, Tuple, Dict, Any
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, Dict, Any, Iterable, List
 import requests
 import json
+from utils.cache import TTLCache
 
 class TimezoneService:
     """Servicio para manejar conversiones de zonas horarias basado en ubicación"""
@@ -58,6 +60,78 @@ class TimezoneService:
         'lima': 'America/Lima',
     }
     
+    # Zona horaria resuelta por dirección: evita recorrer el mapa (o llamar a
+    # Google Maps) y crear el objeto pytz en cada conversión
+    _address_timezones = TTLCache(ttl_seconds=24 * 3600, max_entries=4096)
+    
+    # Tablas de transiciones UTC por zona: (instantes, desfases, tzinfo de cada tramo)
+    _transition_tables: Dict[str, Tuple[List[datetime], List[timedelta], List[Any]]] = {}
+    
+    @classmethod
+    def resolve_timezone(cls, address: str):
+        """
+        Obtiene el objeto pytz de la zona horaria de una dirección, resuelto una vez por dirección
+        
+        Args:
+            address: Dirección para determinar zona horaria
+        
+        Returns:
+            pytz.BaseTzInfo: Zona horaria (UTC si no se puede determinar)
+        """
+        key = address or ''
+        timezone = cls._address_timezones.get(key)
+        if timezone is None:
+            timezone = pytz.timezone(cls.get_timezone_from_address(address))
+            cls._address_timezones.set(key, timezone)
+        return timezone
+    
+    @classmethod
+    def _transition_table(cls, timezone) -> Tuple[List[datetime], List[timedelta], List[Any]]:
+        table = cls._transition_tables.get(timezone.zone)
+        if table is None:
+            if hasattr(timezone, '_utc_transition_times'):
+                # Zonas con horario de verano: un tramo por transición
+                tzinfos = [timezone._tzinfos[info] for info in timezone._transition_info]
+                table = (list(timezone._utc_transition_times), [tzinfo._utcoffset for tzinfo in tzinfos], tzinfos)
+            else:
+                # UTC y zonas de desfase fijo
+                table = ([datetime.min], [timezone.utcoffset(None) or timedelta(0)], [timezone])
+            cls._transition_tables[timezone.zone] = table
+        return table
+    
+    @classmethod
+    def convert_utc_to_local_many(cls, utc_datetimes: Iterable[Optional[datetime]], address: str) -> List[Optional[datetime]]:
+        """
+        Convierte varias fechas UTC a la zona horaria local de una dirección en una pasada
+        
+        La zona se resuelve una sola vez y cada fecha se sitúa en la tabla de
+        transiciones de la zona; con fechas ordenadas se reutiliza el tramo de
+        la anterior sin volver a buscar.
+        
+        Args:
+            utc_datetimes: Fechas en UTC (naive o con zona); los valores vacíos se devuelven tal cual
+            address: Dirección para determinar zona horaria
+        
+        Returns:
+            List[Optional[datetime]]: Fechas con la zona horaria local, en el mismo orden
+        """
+        times, offsets, tzinfos = cls._transition_table(cls.resolve_timezone(address))
+        last = len(times) - 1
+        index = 0
+        local_datetimes = []
+        
+        for value in utc_datetimes:
+            if not value:
+                local_datetimes.append(value)
+                continue
+            if value.tzinfo is not None:
+                value = value.astimezone(pytz.UTC).replace(tzinfo=None)
+            if not (times[index] <= value and (index == last or value < times[index + 1])):
+                index = max(bisect_right(times, value) - 1, 0)
+            local_datetimes.append((value + offsets[index]).replace(tzinfo=tzinfos[index]))
+        
+        return local_datetimes
+    
     @classmethod
     def get_timezone_from_address(cls, address: str) -> str:
         """
@@ -152,20 +226,7 @@ class TimezoneService:
             return utc_datetime
         
         try:
-            # Obtener zona horaria
-            timezone_str = cls.get_timezone_from_address(address)
-            timezone = pytz.timezone(timezone_str)
-            
-            # Asegurar que la fecha está en UTC
-            if utc_datetime.tzinfo is None:
-                utc_datetime = pytz.UTC.localize(utc_datetime)
-            elif utc_datetime.tzinfo != pytz.UTC:
-                utc_datetime = utc_datetime.astimezone(pytz.UTC)
-            
-            # Convertir a zona horaria local
-            local_datetime = utc_datetime.astimezone(timezone)
-            
-            return local_datetime
+            return cls.convert_utc_to_local_many([utc_datetime], address)[0]
             
         except Exception as e:
             print(f"Error convirtiendo zona horaria: {str(e)}")
@@ -187,9 +248,8 @@ class TimezoneService:
             return local_datetime
         
         try:
-            # Obtener zona horaria
-            timezone_str = cls.get_timezone_from_address(address)
-            timezone = pytz.timezone(timezone_str)
+            # Obtener zona horaria (resuelta una vez por dirección)
+            timezone = cls.resolve_timezone(address)
             
             # Si la fecha no tiene zona horaria, asumimos que está en la zona local
             if local_datetime.tzinfo is None:
@@ -226,15 +286,21 @@ class TimezoneService:
             local_agenda = driver_agenda.copy()
             local_agenda['availability'] = []
             
-            for slot in driver_agenda['availability']:
+            # Convertir todas las fechas de inicio y fin en una sola pasada
+            slots = driver_agenda['availability']
+            local_dates = cls.convert_utc_to_local_many(
+                (date for slot in slots for date in (slot.get('start_date'), slot.get('end_date'))),
+                address
+            )
+            
+            for index, slot in enumerate(slots):
                 local_slot = slot.copy()
                 
-                # Convertir fechas de inicio y fin
-                if 'start_date' in slot and slot['start_date']:
-                    local_slot['start_date'] = cls.convert_utc_to_local(slot['start_date'], address)
+                if slot.get('start_date'):
+                    local_slot['start_date'] = local_dates[2 * index]
                 
-                if 'end_date' in slot and slot['end_date']:
-                    local_slot['end_date'] = cls.convert_utc_to_local(slot['end_date'], address)
+                if slot.get('end_date'):
+                    local_slot['end_date'] = local_dates[2 * index + 1]
                 
                 local_agenda['availability'].append(local_slot)
             
@@ -260,14 +326,8 @@ class TimezoneService:
             return ""
         
         try:
-            local_dt = cls.convert_utc_to_local(dt, address)
-            
-            # Obtener información de zona horaria
-            timezone_str = cls.get_timezone_from_address(address)
-            timezone = pytz.timezone(timezone_str)
-            
             # Formatear con información de zona horaria
-            return local_dt.strftime('%H:%M %Z')
+            return cls.convert_utc_to_local_many([dt], address)[0].strftime('%H:%M %Z')
             
         except Exception as e:
             print(f"Error formateando fecha: {str(e)}")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga: latencia de endpoints no relacionados durante una avalancha de logins.
+
+Mide la latencia (p50/p99) de un endpoint ajeno a la autenticación en reposo
+y mientras muchos clientes inician sesión a la vez. Con el hash de contraseñas
+en el pool de procesos, el p99 del endpoint sondeado debe mantenerse estable.
+Los logins rechazados con 429/503 (límite por cuenta o pool saturado) se
+cuentan aparte.
+
+Requiere el servidor en marcha y cuentas de prueba con la misma contraseña:
+    LOAD_TEST_EMAIL (uno o varios emails separados por comas), LOAD_TEST_PASSWORD
+Con una sola cuenta la mayoría de los logins se rechazarán con 429 por el
+límite de intentos simultáneos por cuenta; use varias para cargar el pool.
+
+Uso:
+    python test_login_burst.py [clientes_login] [segundos] [ruta_sondeo]
+"""
+
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+API_BASE_URL = os.getenv('API_BASE_URL', 'http://localhost:5001')
+LOAD_TEST_EMAILS = [email.strip() for email in os.getenv('LOAD_TEST_EMAIL', '').split(',') if email.strip()]
+LOAD_TEST_PASSWORD = os.getenv('LOAD_TEST_PASSWORD')
+
+if not LOAD_TEST_EMAILS or not LOAD_TEST_PASSWORD:
+    print("Error: Defina LOAD_TEST_EMAIL y LOAD_TEST_PASSWORD con una cuenta de prueba")
+    sys.exit(1)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def probe(path, seconds):
+    """Consulta el endpoint de sondeo de forma continua y devuelve las latencias en ms"""
+    latencies = []
+    session = requests.Session()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        session.get(f"{API_BASE_URL}{path}", timeout=30)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def login_storm(clients, stop_event):
+    """Lanza inicios de sesión en bucle hasta que se activa stop_event"""
+    counts = {'ok': 0, 'limited': 0, 'error': 0}
+    counts_lock = threading.Lock()
+
+    def worker(index):
+        session = requests.Session()
+        email = LOAD_TEST_EMAILS[index % len(LOAD_TEST_EMAILS)]
+        while not stop_event.is_set():
+            response = session.post(
+                f"{API_BASE_URL}/api/auth/login",
+                json={'email': email, 'password': LOAD_TEST_PASSWORD},
+                timeout=60
+            )
+            key = 'ok' if response.status_code == 200 else 'limited' if response.status_code in (429, 503) else 'error'
+            with counts_lock:
+                counts[key] += 1
+
+    executor = ThreadPoolExecutor(max_workers=clients)
+    futures = [executor.submit(worker, i) for i in range(clients)]
+    return executor, futures, counts
+
+
+def report(label, latencies):
+    print(f"{label}: {len(latencies)} peticiones | "
+          f"p50 {statistics.median(latencies):.1f} ms | p99 {percentile(latencies, 99):.1f} ms")
+
+
+def run(clients=50, seconds=20, probe_path='/api/blog/posts'):
+    print(f"🌐 Servidor: {API_BASE_URL} | sondeo: {probe_path}")
+
+    print(f"📏 Midiendo {probe_path} en reposo ({seconds} s)...")
+    baseline = probe(probe_path, seconds)
+    report("   En reposo", baseline)
+
+    print(f"🚀 Avalancha de {clients} clientes iniciando sesión ({seconds} s)...")
+    stop_event = threading.Event()
+    executor, _, counts = login_storm(clients, stop_event)
+    try:
+        burst = probe(probe_path, seconds)
+    finally:
+        stop_event.set()
+        executor.shutdown(wait=True)
+    report("   Durante la avalancha", burst)
+
+    print(f"🔐 Logins correctos: {counts['ok']} | limitados (429/503): {counts['limited']} | errores: {counts['error']}")
+
+    ratio = percentile(burst, 99) / max(percentile(baseline, 99), 0.001)
+    print(f"📈 p99 durante la avalancha / p99 en reposo: x{ratio:.2f}")
+    if ratio <= 2:
+        print("✅ La latencia de los endpoints no relacionados se mantiene estable")
+        return True
+
+    print("❌ Los logins degradan la latencia del resto de endpoints")
+    return False
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    probe_path = sys.argv[3] if len(sys.argv) > 3 else '/api/blog/posts'
+    ok = run(clients, seconds, probe_path)
+    sys.exit(0 if ok else 1)
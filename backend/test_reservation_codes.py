@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Prueba de concurrencia del asignador de códigos de reserva.
+
+Lanza muchos hilos que generan códigos e insertan documentos en una colección
+temporal con índice único sobre ``code``. Con el contador atómico no debe
+producirse ningún DuplicateKeyError. Usa un contador propio para no consumir
+códigos reales y limpia todo al terminar.
+
+Uso:
+    python test_reservation_codes.py [hilos] [codigos_por_hilo] [tamaño_bloque]
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+
+# Cargar variables de entorno
+load_dotenv()
+
+MONGO_URI = os.getenv('MONGO_URI')
+if not MONGO_URI:
+    print("Error: No se encontró la variable de entorno MONGO_URI")
+    sys.exit(1)
+
+print("Conectando a MongoDB...")
+client = MongoClient(MONGO_URI)
+db = client['operiq']
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import models.reservations as reservations_model
+from models.reservations import ReservationCodeAllocator
+
+TEST_COUNTER_ID = 'reservation_code_concurrency_test'
+TEST_COLLECTION = 'reservation_codes_concurrency_test'
+
+
+def run(threads=32, codes_per_thread=200, block_size=1):
+    # Solo se necesita la colección de contadores; no se tocan las reservas reales
+    reservations_model.counters_collection = db['counters']
+    db['counters'].delete_one({'_id': TEST_COUNTER_ID})
+
+    target = db[TEST_COLLECTION]
+    target.drop()
+    target.create_index('code', unique=True)
+
+    # Cada hilo simula un worker distinto con su propio asignador
+    allocators = [ReservationCodeAllocator(block_size=block_size, counter_id=TEST_COUNTER_ID) for _ in range(threads)]
+
+    def worker(index):
+        duplicates = 0
+        allocator = allocators[index]
+        for _ in range(codes_per_thread):
+            try:
+                target.insert_one({'code': allocator.next_code()})
+            except DuplicateKeyError:
+                duplicates += 1
+        return duplicates
+
+    print(f"🚀 {threads} hilos x {codes_per_thread} códigos (bloque={block_size})...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        duplicates = sum(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - start
+
+    inserted = target.count_documents({})
+    expected = threads * codes_per_thread
+
+    print(f"⏱️  Tiempo total: {elapsed:.2f} s ({expected / elapsed:.0f} códigos/s)")
+    print(f"📄 Documentos insertados: {inserted} de {expected}")
+    print(f"🔁 Errores de clave duplicada: {duplicates}")
+
+    target.drop()
+    db['counters'].delete_one({'_id': TEST_COUNTER_ID})
+
+    if duplicates == 0 and inserted == expected:
+        print("✅ Sin colisiones de código bajo carga concurrente")
+        return True
+
+    print("❌ Se detectaron colisiones de código")
+    return False
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:4]]
+    ok = run(*args)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Prueba de estrés de las reclamaciones de franjas (slot claims).
+
+Muchos hilos intentan reservar al mismo chofer y vehículo en intervalos
+solapados al mismo tiempo. Al terminar se comprueba que ningún par de
+reservas aceptadas se solapa, es decir, que no hubo doble reserva.
+Usa recursos ficticios y libera todas las franjas al terminar.
+
+Uso:
+    python test_slot_claims.py [hilos] [intentos_por_hilo]
+"""
+
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+# Cargar variables de entorno
+load_dotenv()
+
+MONGO_URI = os.getenv('MONGO_URI')
+if not MONGO_URI:
+    print("Error: No se encontró la variable de entorno MONGO_URI")
+    sys.exit(1)
+
+print("Conectando a MongoDB...")
+client = MongoClient(MONGO_URI)
+db = client['operiq']
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from models.slot_claims import setup_collection, claim_slots, release_slots
+
+setup_collection(db)
+
+# Recursos ficticios para no interferir con datos reales
+TEST_DRIVER_ID = str(ObjectId())
+TEST_VEHICLE_ID = str(ObjectId())
+BASE_TIME = (datetime.utcnow() + timedelta(days=30)).replace(hour=8, minute=0, second=0, microsecond=0)
+
+
+def run(threads=32, attempts_per_thread=20):
+    def worker(_):
+        accepted = []
+        rejected = 0
+        for _ in range(attempts_per_thread):
+            # Servicios de 20-120 minutos en una ventana de 6 horas, con inicios cada 5 minutos
+            # (no alineados a las franjas): muchos solapes y servicios seguidos en la misma franja
+            start = BASE_TIME + timedelta(minutes=5 * random.randint(0, 72))
+            end = start + timedelta(minutes=random.choice([20, 30, 45, 60, 90, 120]))
+            owner_id = str(ObjectId())
+            conflict = claim_slots(
+                'reservation', owner_id,
+                [('driver', TEST_DRIVER_ID), ('vehicle', TEST_VEHICLE_ID)],
+                start, end
+            )
+            if conflict:
+                rejected += 1
+            else:
+                accepted.append((start, end, owner_id))
+        return accepted, rejected
+
+    print(f"🚀 {threads} hilos x {attempts_per_thread} intentos de reserva simultáneos...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+
+    accepted = sorted((item for result in results for item in result[0]), key=lambda item: item[0])
+    rejected = sum(result[1] for result in results)
+
+    # Con los intervalos ordenados por inicio, hay solape si alguno empieza antes del mayor fin visto
+    overlaps = 0
+    latest_end = None
+    for start, end, _ in accepted:
+        if latest_end and start < latest_end:
+            overlaps += 1
+        latest_end = max(latest_end, end) if latest_end else end
+
+    print(f"⏱️  Tiempo total: {elapsed:.2f} s")
+    print(f"✅ Reservas aceptadas: {len(accepted)}")
+    print(f"⛔ Reservas rechazadas por conflicto: {rejected}")
+    print(f"🔁 Solapes entre reservas aceptadas: {overlaps}")
+
+    for _, _, owner_id in accepted:
+        release_slots(owner_id)
+
+    if overlaps == 0:
+        print("✅ Ninguna doble reserva bajo carga concurrente")
+        return True
+
+    print("❌ Se detectaron dobles reservas")
+    return False
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    ok = run(*args)
+    sys.exit(0 if ok else 1)
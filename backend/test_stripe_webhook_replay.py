@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Reproductor local de eventos de Stripe para probar el webhook bajo carga.
+
+Genera eventos payment_intent.succeeded / payment_intent.payment_failed
+sintéticos, los firma con STRIPE_WEBHOOK_SECRET igual que Stripe (cabecera
+Stripe-Signature con HMAC-SHA256) y los envía al webhook en paralelo, cada uno
+varias veces para simular los reintentos de Stripe. Después comprueba en
+MongoDB que cada evento se guardó una sola vez y que todos se procesaron.
+
+Los eventos apuntan a sesiones inexistentes (no modifican reservas reales);
+al terminar se eliminan de stripe_events.
+
+Uso:
+    python test_stripe_webhook_replay.py [eventos] [envios_por_evento] [hilos]
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+# Cargar variables de entorno
+load_dotenv()
+
+API_BASE_URL = os.getenv('API_BASE_URL', 'http://localhost:5001')
+MONGO_URI = os.getenv('MONGO_URI')
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+
+if not MONGO_URI or not STRIPE_WEBHOOK_SECRET:
+    print("Error: Se requieren las variables de entorno MONGO_URI y STRIPE_WEBHOOK_SECRET")
+    sys.exit(1)
+
+print("Conectando a MongoDB...")
+client = MongoClient(MONGO_URI)
+db = client['operiq']
+
+RUN_ID = uuid.uuid4().hex[:8]
+
+
+def build_event(index):
+    """Crea un evento de pago sintético"""
+    succeeded = index % 5 != 0
+    payment_intent = {
+        'id': f'pi_replay_{RUN_ID}_{index}',
+        'object': 'payment_intent',
+        'metadata': {'session_id': f'replay-{RUN_ID}-{index % 50}'},
+        'payment_method_details': {'type': 'card'},
+        'last_payment_error': None if succeeded else {'message': 'Tarjeta rechazada'}
+    }
+    return {
+        'id': f'evt_replay_{RUN_ID}_{index}',
+        'object': 'event',
+        'api_version': '2023-10-16',
+        'created': int(time.time()) + index,
+        'type': 'payment_intent.succeeded' if succeeded else 'payment_intent.payment_failed',
+        'data': {'object': payment_intent}
+    }
+
+
+def sign(payload):
+    """Firma el payload con el mismo esquema que Stripe (t=...,v1=...)"""
+    timestamp = int(time.time())
+    signed = f"{timestamp}.{payload}".encode('utf-8')
+    signature = hmac.new(STRIPE_WEBHOOK_SECRET.encode('utf-8'), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def send(payload):
+    session = requests.Session()
+    start = time.perf_counter()
+    response = session.post(
+        f"{API_BASE_URL}/api/payment/webhook",
+        data=payload,
+        headers={'Content-Type': 'application/json', 'Stripe-Signature': sign(payload)},
+        timeout=30
+    )
+    return (time.perf_counter() - start) * 1000, response.status_code, response.json().get('status')
+
+
+def run(events=500, deliveries=3, threads=32):
+    payloads = [json.dumps(build_event(i)) for i in range(events)]
+    # Cada evento se envía varias veces, intercalado con el resto
+    jobs = [payload for _ in range(deliveries) for payload in payloads]
+
+    print(f"🚀 Enviando {events} eventos x {deliveries} entregas con {threads} hilos a {API_BASE_URL}...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(send, jobs))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(result[0] for result in results)
+    errors = sum(1 for result in results if result[1] != 200)
+    received = sum(1 for result in results if result[2] == 'received')
+    duplicates = sum(1 for result in results if result[2] == 'duplicate')
+
+    print(f"⏱️  {len(jobs)} peticiones en {elapsed:.1f} s ({len(jobs) / elapsed:.0f} req/s)")
+    print(f"📶 Latencia de confirmación: p50 {statistics.median(latencies):.1f} ms | "
+          f"p99 {latencies[int(0.99 * (len(latencies) - 1))]:.1f} ms")
+    print(f"📥 Nuevos: {received} | duplicados descartados: {duplicates} | errores HTTP: {errors}")
+
+    # Esperar a que los workers vacíen la bandeja de entrada
+    event_filter = {'_id': {'$regex': f'^evt_replay_{RUN_ID}_'}}
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        pending = db['stripe_events'].count_documents({**event_filter, 'status': {'$in': ['pending', 'processing']}})
+        if pending == 0:
+            break
+        time.sleep(1)
+
+    stored = db['stripe_events'].count_documents(event_filter)
+    done = db['stripe_events'].count_documents({**event_filter, 'status': 'done'})
+    print(f"🗃️  Eventos guardados: {stored} de {events} | procesados: {done}")
+
+    db['stripe_events'].delete_many(event_filter)
+
+    if errors == 0 and received == events and stored == events and done == events:
+        print("✅ Cada evento se registró y procesó exactamente una vez")
+        return True
+
+    print("❌ El webhook no deduplicó o no procesó todos los eventos")
+    return False
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:4]]
+    ok = run(*args)
+    sys.exit(0 if ok else 1)
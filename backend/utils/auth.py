@@ -0,0 +1,145 @@
+"""
+Autorización de administradores sin consultar MongoDB en cada petición.
+
+El rol del usuario viaja como claim firmado en el JWT (``role_claims`` se pasa
+como ``additional_claims`` al emitir el token) y se respalda con una caché en
+memoria de roles con TTL corto. El orden de resolución es:
+
+1. Caché de roles del proceso (ROLE_CACHE_TTL segundos).
+2. Claim ``role`` del token, si el token tiene menos de ROLE_CLAIM_MAX_AGE
+   segundos y no es anterior a un cambio de rol conocido en este proceso.
+3. Consulta a la colección de usuarios (que vuelve a llenar la caché).
+
+Un cambio de rol (``invalidate_user_role``) se aplica de inmediato en el
+proceso que lo realiza; en el resto de workers tarda como máximo
+ROLE_CLAIM_MAX_AGE segundos en hacerse efectivo.
+"""
+
+import functools
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+from flask import jsonify
+from flask_jwt_extended import get_jwt, get_jwt_identity
+
+from utils.cache import TTLCache
+
+# Segundos que se conserva en memoria el rol de un usuario
+ROLE_CACHE_TTL = int(os.getenv('ROLE_CACHE_TTL', 60))
+
+# Antigüedad máxima de un token para confiar en su claim de rol sin comprobarlo
+ROLE_CLAIM_MAX_AGE = int(os.getenv('ROLE_CLAIM_MAX_AGE', 300))
+
+users_collection = None
+
+_role_cache = TTLCache(ttl_seconds=ROLE_CACHE_TTL, max_entries=10000)
+# Momento del último cambio de rol por usuario (para descartar claims anteriores)
+_role_changes: Dict[str, float] = {}
+_role_changes_lock = threading.Lock()
+
+
+def setup_collections(db):
+    """Inicializa la colección de usuarios usada como respaldo de la caché"""
+    global users_collection
+    users_collection = db['users']
+
+
+def role_claims(user: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Claims adicionales que se firman en el token de acceso
+
+    Args:
+        user: Documento del usuario
+
+    Returns:
+        Dict[str, Any]: Claims para ``create_access_token(additional_claims=...)``
+    """
+    return {'role': user.get('role', 'user')}
+
+
+def get_current_user_id() -> Optional[str]:
+    """Obtiene el id del usuario del token, sea cual sea el formato de la identidad"""
+    identity = get_jwt_identity()
+    if isinstance(identity, dict):
+        identity = identity.get('id') or identity.get('_id') or identity.get('sub')
+    return str(identity) if identity else None
+
+
+def _load_role(user_id: str) -> Optional[str]:
+    if not ObjectId.is_valid(user_id):
+        return None
+    user = users_collection.find_one({'_id': ObjectId(user_id)}, {'role': 1})
+    return user.get('role', 'user') if user else None
+
+
+def _claim_role(user_id: str) -> Optional[str]:
+    """Devuelve el rol del claim si el token es reciente y posterior al último cambio de rol"""
+    claims = get_jwt()
+    role = claims.get('role')
+    issued_at = claims.get('iat')
+    if not role or not issued_at:
+        return None
+    if time.time() - issued_at > ROLE_CLAIM_MAX_AGE:
+        return None
+    with _role_changes_lock:
+        changed_at = _role_changes.get(user_id)
+    if changed_at and issued_at <= changed_at:
+        return None
+    return role
+
+
+def get_user_role(user_id: str) -> Optional[str]:
+    """
+    Obtiene el rol del usuario autenticado sin ir a MongoDB si es posible
+
+    Args:
+        user_id: Id del usuario del token actual
+
+    Returns:
+        Optional[str]: Rol del usuario, o None si el usuario no existe
+    """
+    role = _role_cache.get(user_id)
+    if role is not None:
+        return role
+
+    role = _claim_role(user_id) or _load_role(user_id)
+    if role is not None:
+        _role_cache.set(user_id, role)
+    return role
+
+
+def invalidate_user_role(user_id: Any):
+    """
+    Descarta el rol en caché de un usuario tras cambiar su rol o eliminarlo
+
+    Args:
+        user_id: Id del usuario modificado
+    """
+    user_id = str(user_id)
+    with _role_changes_lock:
+        _role_changes[user_id] = time.time()
+    _role_cache.invalidate(lambda key: key == user_id)
+
+
+def is_admin() -> bool:
+    """Indica si el usuario del token actual es administrador"""
+    user_id = get_current_user_id()
+    return bool(user_id) and get_user_role(user_id) == 'admin'
+
+
+def admin_required(fn):
+    """
+    Decorador que exige rol de administrador (usar después de @jwt_required())
+
+    Devuelve 403 si el usuario del token no es administrador.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            return jsonify({'error': 'No autorizado. Se requieren permisos de administrador'}), 403
+        return fn(*args, **kwargs)
+
+    return wrapper
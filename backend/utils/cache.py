@@ -0,0 +1,82 @@
+"""
+Caché en memoria del proceso con caducidad (TTL) y tamaño máximo.
+
+Pensada para respuestas de lectura frecuente y baja tasa de cambio (listados
+públicos). Cada worker tiene su propia copia: las invalidaciones explícitas
+solo afectan al proceso que las ejecuta y el TTL acota la antigüedad de los
+datos en el resto.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """Caché LRU con caducidad por entrada, segura entre hilos"""
+
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 512):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Devuelve el valor guardado o None si no existe o ha caducado"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """Guarda un valor, descartando la entrada menos usada si se supera el tamaño máximo"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key: Hashable, loader: Callable[[], Any], ttl_seconds: Optional[float] = None) -> Any:
+        """
+        Devuelve el valor en caché o lo calcula con loader y lo guarda
+
+        Args:
+            key: Clave de la entrada
+            loader: Función sin argumentos que calcula el valor
+            ttl_seconds: Caducidad específica para esta entrada
+
+        Returns:
+            Any: Valor en caché o recién calculado
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value, ttl_seconds)
+        return value
+
+    def live_keys(self) -> set:
+        """Claves guardadas que no han caducado (sin alterar el orden LRU)"""
+        now = time.monotonic()
+        with self._lock:
+            return {key for key, (expires_at, _) in self._entries.items() if expires_at >= now}
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None):
+        """Elimina las entradas cuya clave cumple predicate (o todas si no se indica)"""
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        """Vacía la caché"""
+        self.invalidate()
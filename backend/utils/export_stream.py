@@ -0,0 +1,165 @@
+"""
+Exportación en streaming de documentos de MongoDB a CSV o NDJSON.
+
+Los documentos se leen de un cursor y se escriben en bloques a medida que
+llegan, de modo que la memoria usada no depende del número de filas. La
+respuesta puede comprimirse con gzip también en streaming.
+"""
+
+import csv
+import io
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from flask import Response, stream_with_context
+
+from utils.json_utils import dumps, bson_default
+
+# Tamaño aproximado de cada bloque enviado al cliente
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Documentos pedidos a MongoDB en cada lote del cursor
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+# Columnas de la exportación CSV de reservas
+RESERVATION_EXPORT_COLUMNS = [
+    '_id', 'code', 'status', 'service_type', 'client_name', 'user_id',
+    'pickup.location', 'pickup.date', 'dropoff.location', 'dropoff.estimated_date',
+    'passengers', 'driver_id', 'vehicle_id', 'collaborator_id',
+    'payment.method', 'payment.status', 'payment.amount', 'payment.currency',
+    'created_at', 'updated_at'
+]
+
+
+def _field_value(document: Dict[str, Any], path: str) -> Any:
+    """Obtiene un campo anidado con notación de puntos ('pickup.date')"""
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _csv_cell(value: Any) -> Any:
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return dumps(value)
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return bson_default(value)
+
+
+def ndjson_lines(documents: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Genera una línea JSON por documento"""
+    for document in documents:
+        yield dumps(document) + '\n'
+
+
+def csv_lines(documents: Iterable[Dict[str, Any]], columns: List[str]) -> Iterator[str]:
+    """
+    Genera las líneas CSV (cabecera incluida) de los documentos
+
+    Args:
+        documents: Documentos a exportar
+        columns: Campos a exportar, con notación de puntos para los anidados
+
+    Yields:
+        str: Cabecera y una línea por documento
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return line
+
+    writer.writerow(columns)
+    yield flush()
+    for document in documents:
+        writer.writerow([_csv_cell(_field_value(document, column)) for column in columns])
+        yield flush()
+
+
+def chunked(lines: Iterable[str], chunk_bytes: int = EXPORT_CHUNK_BYTES) -> Iterator[bytes]:
+    """Agrupa las líneas en bloques de unos chunk_bytes bytes"""
+    parts = []
+    size = 0
+    for line in lines:
+        encoded = line.encode('utf-8')
+        parts.append(encoded)
+        size += len(encoded)
+        if size >= chunk_bytes:
+            yield b''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b''.join(parts)
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Comprime en streaming los bloques con formato gzip"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(documents: Iterable[Dict[str, Any]], export_format: str,
+                  columns: Optional[List[str]] = None, compress: bool = False) -> Iterator[bytes]:
+    """
+    Genera los bloques de bytes de una exportación
+
+    Args:
+        documents: Documentos a exportar (normalmente un cursor de MongoDB)
+        export_format: 'csv' o 'ndjson'
+        columns: Columnas del CSV (obligatorio con export_format='csv')
+        compress: Si es True, los bloques se comprimen con gzip
+
+    Returns:
+        Iterator[bytes]: Bloques listos para enviar
+    """
+    if export_format == 'csv':
+        lines = csv_lines(documents, columns or [])
+    else:
+        lines = ndjson_lines(documents)
+    chunks = chunked(lines)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_response(cursor, export_format: str, filename: str,
+                    columns: Optional[List[str]] = None, compress: bool = False) -> Response:
+    """
+    Crea una respuesta HTTP en streaming con los documentos del cursor
+
+    Args:
+        cursor: Cursor de MongoDB con la consulta ya filtrada y ordenada
+        export_format: 'csv' o 'ndjson'
+        filename: Nombre base del fichero descargado (sin extensión)
+        columns: Columnas del CSV
+        compress: Si es True, el cuerpo se envía comprimido con gzip
+
+    Returns:
+        Response: Respuesta con transferencia por bloques
+    """
+    cursor = cursor.batch_size(EXPORT_BATCH_SIZE)
+    extension = export_format + ('.gz' if compress else '')
+
+    response = Response(
+        stream_with_context(export_chunks(cursor, export_format, columns, compress)),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[export_format]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    # La respuesta se genera sobre la marcha: sin longitud conocida ni buffering en el proxy
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -3,6 +3,19 @@ import os
 import requests
 from typing import List, Dict, Tuple, Any, Optional
 from bson import ObjectId
+from pymongo import UpdateOne
+from services.busy_time_service import find_conflicts, SOURCE_RESERVATIONS
+
+# Tipo de disponibilidad de los vehículos de ruta flexible
+FLEXIBLE_ROUTE_TYPE = "flexible_route"
+
+# Radio usado para los vehículos flexibles sin availability_radius
+DEFAULT_AVAILABILITY_RADIUS_KM = 10.0
+
+# Lados del polígono que aproxima el círculo de cobertura de cada vehículo
+COVERAGE_POLYGON_SIDES = 64
+
+EARTH_RADIUS_KM = 6371.0
 
 def calculate_distance(point1: List[float], point2: List[float]) -> float:
     """
@@ -50,6 +63,16 @@ def is_point_in_circle(point: List[float], center: List[float], radius_km: float
     distance = calculate_distance(point, center)
     return distance <= radius_km
 
+def _tile_candidates(coordinates: List[float]) -> Optional[Dict[str, List[str]]]:
+    """Candidatos del índice de cobertura por celdas, o None si no está disponible"""
+    from services import coverage_tiles_service
+    
+    try:
+        return coverage_tiles_service.candidates(coordinates)
+    except Exception as e:
+        print(f"Error al consultar el índice de cobertura: {str(e)}")
+        return None
+
 def find_zones_for_location(db, coordinates: List[float]) -> List[Dict[str, Any]]:
     """
     Encuentra zonas fijas que incluyen las coordenadas dadas
@@ -63,6 +86,23 @@ def find_zones_for_location(db, coordinates: List[float]) -> List[Dict[str, Any]
     """
     fixed_routes_collection = db['fixed_routes']
     
+    # Candidatos desde el índice de celdas geohash (si está construido)
+    candidates = _tile_candidates(coordinates)
+    if candidates is not None:
+        try:
+            zone_ids = [ObjectId(zone_id) for zone_id in candidates["zone_ids"]]
+            zones = list(fixed_routes_collection.find({"_id": {"$in": zone_ids}, "status": "active"})) if zone_ids else []
+            return [
+                zone for zone in zones
+                if is_point_in_circle(
+                    coordinates,
+                    zone.get("center", {}).get("location", {}).get("coordinates", [0, 0]),
+                    zone.get("radius", 0)
+                )
+            ]
+        except Exception as e:
+            print(f"Error al buscar zonas en el índice de cobertura: {str(e)}")
+    
     try:
         # Método 1: Utilizar consulta geoespacial $geoWithin con $centerSphere
         zones = list(fixed_routes_collection.find({
@@ -114,59 +154,169 @@ def find_zones_for_location(db, coordinates: List[float]) -> List[Dict[str, Any]
             print(f"Error en método alternativo para buscar zonas: {str(e2)}")
             return []
 
-def find_nearby_vehicles(db, coordinates: List[float], max_distance_km: float = 10) -> List[Dict[str, Any]]:
+def coverage_polygon(center: List[float], radius_km: float, sides: int = COVERAGE_POLYGON_SIDES) -> Dict[str, Any]:
+    """
+    Polígono GeoJSON que contiene el círculo de cobertura de un vehículo
+
+    Los vértices se colocan en el círculo circunscrito (tan(R') = tan(R) / cos(pi/n)),
+    de modo que cada arista geodésica queda fuera del círculo de radio R y el
+    polígono nunca deja fuera un punto cubierto. Las esquinas sobrantes se
+    descartan después con la distancia exacta.
+
+    Args:
+        center: Centro del círculo [longitud, latitud]
+        radius_km: Radio en kilómetros
+        sides: Número de lados del polígono
+
+    Returns:
+        Dict[str, Any]: Geometría GeoJSON de tipo Polygon
+    """
+    angular_radius = min(radius_km / EARTH_RADIUS_KM, math.pi / 4)
+    vertex_radius = math.atan(math.tan(angular_radius) / math.cos(math.pi / sides)) * 1.001
+
+    lon = math.radians(center[0])
+    lat = math.radians(center[1])
+    ring = []
+    for index in range(sides):
+        bearing = 2 * math.pi * index / sides
+        vertex_lat = math.asin(
+            math.sin(lat) * math.cos(vertex_radius) + math.cos(lat) * math.sin(vertex_radius) * math.cos(bearing)
+        )
+        vertex_lon = lon + math.atan2(
+            math.sin(bearing) * math.sin(vertex_radius) * math.cos(lat),
+            math.cos(vertex_radius) - math.sin(lat) * math.sin(vertex_lat)
+        )
+        # Normalizar la longitud a [-180, 180)
+        vertex_lon = (math.degrees(vertex_lon) + 540) % 360 - 180
+        ring.append([round(vertex_lon, 7), round(math.degrees(vertex_lat), 7)])
+    ring.append(ring[0])
+
+    return {"type": "Polygon", "coordinates": [ring]}
+
+def availability_radius_km(vehicle: Dict[str, Any], default: float = DEFAULT_AVAILABILITY_RADIUS_KM) -> float:
+    """Radio de disponibilidad de un vehículo; default solo si no tiene (un 0 se respeta)"""
+    radius_km = vehicle.get("availability_radius")
+    return float(default if radius_km is None else radius_km)
+
+def vehicle_coverage_area(vehicle: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Área de cobertura que debe guardarse en un vehículo (None si no debe tener)
+
+    Solo los vehículos de ruta flexible con ubicación y radio positivo tienen
+    área de cobertura.
+    """
+    if vehicle.get("availabilityType") != FLEXIBLE_ROUTE_TYPE:
+        return None
+    coordinates = (vehicle.get("location") or {}).get("coordinates")
+    if not coordinates or len(coordinates) != 2:
+        return None
+    radius_km = availability_radius_km(vehicle)
+    if radius_km <= 0:
+        return None
+    return coverage_polygon(coordinates, radius_km)
+
+def refresh_vehicle_coverage(db, vehicle_ids: List[Any]) -> int:
+    """
+    Recalcula el área de cobertura de los vehículos indicados
+
+    Se llama tras cualquier escritura que cambie la ubicación, el radio o el
+    tipo de disponibilidad de un vehículo.
+
+    Returns:
+        int: Número de vehículos actualizados
+    """
+    object_ids = [ObjectId(str(vehicle_id)) for vehicle_id in vehicle_ids if ObjectId.is_valid(str(vehicle_id))]
+    if not object_ids:
+        return 0
+
+    operations = []
+    for vehicle in db['vehicles'].find(
+        {"_id": {"$in": object_ids}},
+        {"location": 1, "availability_radius": 1, "availabilityType": 1}
+    ):
+        area = vehicle_coverage_area(vehicle)
+        update = {"$set": {"coverage_area": area}} if area else {"$unset": {"coverage_area": ""}}
+        operations.append(UpdateOne({"_id": vehicle["_id"]}, update))
+
+    if not operations:
+        return 0
+    try:
+        return db['vehicles'].bulk_write(operations, ordered=False).modified_count
+    except Exception as e:
+        print(f"Error al actualizar el área de cobertura de los vehículos: {str(e)}")
+        return 0
+
+def find_nearby_vehicles(db, coordinates: List[float], max_distance_km: float = DEFAULT_AVAILABILITY_RADIUS_KM) -> List[Dict[str, Any]]:
     """
-    Encuentra vehículos cercanos a las coordenadas dadas dentro de un radio específico
+    Encuentra los vehículos de ruta flexible cuyo radio de disponibilidad cubre las coordenadas dadas
+    
+    Los candidatos salen de la celda geohash del punto en el índice de
+    cobertura (coverage_tiles_service) o, si el índice no está construido, de
+    una consulta $geoIntersects sobre el índice 2dsphere de 'coverage_area'.
+    En ese caso, los vehículos que aún no tienen 'coverage_area' (antes de
+    ejecutar migrate_vehicle_coverage.py) se buscan con la consulta por punto
+    de siempre ($nearSphere sobre 'location'). La distancia exacta descarta
+    los que no cubren el punto.
     
     Args:
         db: Conexión a la base de datos
         coordinates: Coordenadas a buscar [longitud, latitud]
-        max_distance_km: Distancia máxima en kilómetros (default: 10km)
+        max_distance_km: Distancia máxima de la consulta por punto de los vehículos
+            sin 'coverage_area' y radio de los que no tienen availability_radius
+            en el método alternativo (default: 10km)
     
     Returns:
-        List[Dict[str, Any]]: Lista de documentos de vehículos cercanos
+        List[Dict[str, Any]]: Lista de documentos de vehículos, ordenados por distancia
     """
     vehicles_collection = db['vehicles']
     
     try:
-        # Convertir km a metros para la consulta
-        max_distance_m = max_distance_km * 1000
-        
-        # Utilizar $nearSphere para encontrar vehículos cercanos
-        vehicles = list(vehicles_collection.find({
-            "location": {
-                "$nearSphere": {
-                    "$geometry": {
-                        "type": "Point",
-                        "coordinates": coordinates
-                    },
-                    "$maxDistance": max_distance_m
-                }
-            },
-            "available": True,
-            "availabilityType": "flexible_route"
-        }))
+        # Candidatos desde el índice de celdas geohash; si no está construido, $geoIntersects
+        candidates = _tile_candidates(coordinates)
+        if candidates is not None:
+            vehicle_ids = [ObjectId(vehicle_id) for vehicle_id in candidates["vehicle_ids"]]
+            vehicles = list(vehicles_collection.find({
+                "_id": {"$in": vehicle_ids},
+                "available": True,
+                "availabilityType": FLEXIBLE_ROUTE_TYPE
+            }, {"coverage_area": 0})) if vehicle_ids else []
+        else:
+            point = {"type": "Point", "coordinates": coordinates}
+            vehicles = list(vehicles_collection.find({
+                "coverage_area": {"$geoIntersects": {"$geometry": point}},
+                "available": True,
+                "availabilityType": FLEXIBLE_ROUTE_TYPE
+            }, {"coverage_area": 0}))
+            # Vehículos sin migrar: consulta por punto sobre el índice de 'location'
+            vehicles.extend(vehicles_collection.find({
+                "location": {"$nearSphere": {"$geometry": point, "$maxDistance": max_distance_km * 1000}},
+                "coverage_area": {"$exists": False},
+                "available": True,
+                "availabilityType": FLEXIBLE_ROUTE_TYPE
+            }))
         
-        # Calcular y añadir la distancia exacta a cada vehículo
+        # Distancia exacta: el polígono circunscrito cubre algo más que el círculo
+        filtered_vehicles = []
         for vehicle in vehicles:
             vehicle_coordinates = vehicle.get("location", {}).get("coordinates", coordinates)
             distance = calculate_distance(coordinates, vehicle_coordinates)
-            vehicle["distance_calculated"] = distance
+            if distance <= availability_radius_km(vehicle):
+                vehicle["distance_calculated"] = distance
+                filtered_vehicles.append(vehicle)
         
-        # Filtrar vehículos que están dentro del radio de disponibilidad específico del vehículo
-        vehicles = [v for v in vehicles if v.get("distance_calculated", 0) <= v.get("availability_radius", max_distance_km)]
+        filtered_vehicles.sort(key=lambda v: v["distance_calculated"])
         
-        return vehicles
+        return filtered_vehicles
     except Exception as e:
-        print(f"Error al buscar vehículos cercanos con $nearSphere: {str(e)}")
+        print(f"Error al buscar vehículos por área de cobertura: {str(e)}")
         
         # Método alternativo si falla la consulta geoespacial
         try:
             # Obtener todos los vehículos disponibles
             vehicles = list(vehicles_collection.find({
                 "available": True,
-                "availabilityType": "flexible_route"
-            }))
+                "availabilityType": FLEXIBLE_ROUTE_TYPE
+            }, {"coverage_area": 0}))
             
             # Filtrar por distancia manualmente
             filtered_vehicles = []
@@ -179,7 +329,7 @@ def find_nearby_vehicles(db, coordinates: List[float], max_distance_km: float =
                 distance = calculate_distance(coordinates, vehicle_coordinates)
                 
                 # Verificar si está dentro del radio de disponibilidad
-                vehicle_radius = vehicle.get("availability_radius", max_distance_km)
+                vehicle_radius = availability_radius_km(vehicle, max_distance_km)
                 if distance <= vehicle_radius:
                     vehicle["distance_calculated"] = distance
                     filtered_vehicles.append(vehicle)
@@ -206,39 +356,16 @@ def check_reservation_conflicts(db, driver_id: str, vehicle_id: str, start_date,
     Returns:
         bool: True si hay conflictos, False si está disponible
     """
-    reservations_collection = db['reservations']
-    
     try:
-        # Convertir IDs a ObjectId si no son ya ObjectId
-        if isinstance(driver_id, str):
-            driver_id = ObjectId(driver_id)
-        if isinstance(vehicle_id, str):
-            vehicle_id = ObjectId(vehicle_id)
-            
-        # Verificar reservas existentes que se solapan con el período solicitado
-        conflicts = reservations_collection.find_one({
-            "$or": [
-                {"driver_id": driver_id},
-                {"vehicle_id": vehicle_id}
-            ],
-            "$or": [
-                {
-                    "pickup.date": {"$lte": start_date},
-                    "dropoff.estimated_date": {"$gte": start_date}
-                },
-                {
-                    "pickup.date": {"$lte": end_date},
-                    "dropoff.estimated_date": {"$gte": end_date}
-                },
-                {
-                    "pickup.date": {"$gte": start_date},
-                    "dropoff.estimated_date": {"$lte": end_date}
-                }
-            ],
-            "status": {"$nin": ["cancelled", "rejected"]}
-        })
+        # Chófer O vehículo ocupados: una sola condición $or sobre el propietario
+        # y la condición canónica de solapamiento sobre las fechas
+        conflicts = find_conflicts(
+            db, start_date, end_date,
+            driver_id=driver_id, vehicle_id=vehicle_id,
+            sources=[SOURCE_RESERVATIONS]
+        )
         
-        return conflicts is not None
+        return len(conflicts) > 0
     except Exception as e:
         print(f"Error al verificar conflictos de reservas: {str(e)}")
         return True  # Por seguridad, considerar que hay conflicto si hay error 
@@ -0,0 +1,168 @@
+"""
+Codificación geohash y recubrimiento de áreas con celdas geohash.
+
+Todas las funciones reciben coordenadas como el resto del proyecto:
+[longitud, latitud].
+"""
+
+import math
+from typing import List, Tuple
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {character: index for index, character in enumerate(BASE32)}
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """
+    Tamaño de una celda en grados
+
+    Returns:
+        Tuple[float, float]: (ancho en longitud, alto en latitud)
+    """
+    bits = 5 * precision
+    return 360.0 / (1 << ((bits + 1) // 2)), 180.0 / (1 << (bits // 2))
+
+
+def encode(coordinates: List[float], precision: int) -> str:
+    """
+    Geohash de un punto
+
+    Args:
+        coordinates: Punto [longitud, latitud]
+        precision: Número de caracteres
+
+    Returns:
+        str: Geohash de la celda que contiene el punto
+    """
+    lon = (coordinates[0] + 180.0) % 360.0 - 180.0
+    lat = min(max(coordinates[1], -90.0), 90.0)
+    lon_range = [-180.0, 180.0]
+    lat_range = [-90.0, 90.0]
+
+    characters = []
+    value = bit_count = 0
+    use_lon = True
+    while len(characters) < precision:
+        interval, target = (lon_range, lon) if use_lon else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if target >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        use_lon = not use_lon
+        bit_count += 1
+        if bit_count == 5:
+            characters.append(BASE32[value])
+            value = bit_count = 0
+    return "".join(characters)
+
+
+def bounds(geohash: str) -> Tuple[float, float, float, float]:
+    """
+    Rectángulo de una celda
+
+    Returns:
+        Tuple[float, float, float, float]: (lon_min, lat_min, lon_max, lat_max)
+    """
+    lon_range = [-180.0, 180.0]
+    lat_range = [-90.0, 90.0]
+    use_lon = True
+    for character in geohash:
+        value = _DECODE[character]
+        for shift in range(4, -1, -1):
+            interval = lon_range if use_lon else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            use_lon = not use_lon
+    return lon_range[0], lat_range[0], lon_range[1], lat_range[1]
+
+
+def cell_polygon(geohash: str) -> dict:
+    """Geometría GeoJSON (Polygon) de una celda"""
+    lon_min, lat_min, lon_max, lat_max = bounds(geohash)
+    return {
+        "type": "Polygon",
+        "coordinates": [[
+            [lon_min, lat_min], [lon_max, lat_min], [lon_max, lat_max], [lon_min, lat_max], [lon_min, lat_min]
+        ]]
+    }
+
+
+def cells_in_bbox(lon_min: float, lat_min: float, lon_max: float, lat_max: float, precision: int) -> List[str]:
+    """
+    Celdas que cortan un rectángulo (lon_min > lon_max si cruza el antimeridiano)
+
+    Returns:
+        List[str]: Geohashes de las celdas, sin repetir
+    """
+    width, height = cell_size(precision)
+    lat_min, lat_max = max(lat_min, -90.0), min(lat_max, 90.0)
+    if lon_max < lon_min:
+        lon_max += 360.0
+
+    rows = range(int(math.floor((lat_min + 90.0) / height)), int(math.floor((lat_max + 90.0) / height)) + 1)
+    first_column = int(math.floor((lon_min + 180.0) / width))
+    columns = min(int(math.floor((lon_max + 180.0) / width)) - first_column + 1, int(round(360.0 / width)))
+
+    cells = []
+    for row in rows:
+        lat = min(-90.0 + (row + 0.5) * height, 90.0)
+        for column in range(first_column, first_column + columns):
+            cells.append(encode([-180.0 + (column + 0.5) * width, lat], precision))
+    return list(dict.fromkeys(cells))
+
+
+def _distance_km(point1: List[float], point2: List[float]) -> float:
+    lon1, lat1, lon2, lat2 = map(math.radians, (point1[0], point1[1], point2[0], point2[1]))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cells_covering_circle(center: List[float], radius_km: float, precision: int) -> List[str]:
+    """
+    Celdas que cortan un círculo
+
+    Recorre las celdas del rectángulo que envuelve el círculo y conserva las
+    que tienen algún punto a menos de radius_km del centro (con un pequeño
+    margen: puede sobrar alguna celda del borde, nunca faltar).
+
+    Args:
+        center: Centro [longitud, latitud]
+        radius_km: Radio en kilómetros
+        precision: Precisión de las celdas
+
+    Returns:
+        List[str]: Geohashes de las celdas
+    """
+    lon, lat = center
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    lat_min, lat_max = lat - lat_delta, lat + lat_delta
+    if lat_min <= -90.0 or lat_max >= 90.0:
+        lon_min, lon_max = -180.0, 180.0
+    else:
+        cos_lat = max(math.cos(math.radians(max(abs(lat_min), abs(lat_max)))), 1e-6)
+        lon_delta = min(lat_delta / cos_lat, 180.0)
+        lon_min = (lon - lon_delta + 180.0) % 360.0 - 180.0
+        lon_max = (lon + lon_delta + 180.0) % 360.0 - 180.0
+        if lon_delta >= 180.0:
+            lon_min, lon_max = -180.0, 180.0
+
+    width, height = cell_size(precision)
+    tolerance_km = radius_km * 0.005 + 0.01
+    cells = []
+    for geohash in cells_in_bbox(lon_min, lat_min, lon_max, lat_max, precision):
+        cell_lon_min, cell_lat_min, cell_lon_max, cell_lat_max = bounds(geohash)
+        # Punto de la celda más cercano al centro (longitud relativa al centro)
+        offset = (lon - cell_lon_min + 180.0) % 360.0 - 180.0
+        nearest_lon = cell_lon_min + min(max(offset, 0.0), width)
+        nearest_lat = min(max(lat, cell_lat_min), cell_lat_max)
+        if _distance_km(center, [nearest_lon, nearest_lat]) <= radius_km + tolerance_km:
+            cells.append(geohash)
+    return cells
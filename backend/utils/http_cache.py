@@ -0,0 +1,160 @@
+"""
+GET condicional y caché de respuestas para endpoints de lectura.
+
+El decorador ``cached_response`` guarda en memoria el cuerpo ya serializado de
+las respuestas 200, calcula un ETag fuerte (SHA-256 del cuerpo) y responde 304
+cuando el cliente o la CDN envían un ``If-None-Match`` coincidente. Cada
+respuesta se asocia a etiquetas (por ejemplo ``vehicle:<id>``) que los
+endpoints de escritura invalidan con ``invalidate_tags``.
+
+La caché es local a cada proceso; ``ttl_seconds`` acota cuánto puede tardar
+en verse un cambio hecho desde otro worker.
+"""
+
+import functools
+import hashlib
+import threading
+from typing import Callable, Iterable, List, Optional
+
+from flask import request, make_response
+
+from utils.cache import TTLCache
+
+_response_cache = TTLCache(ttl_seconds=300, max_entries=2048)
+_tag_index = {}
+_tag_lock = threading.Lock()
+# Claves registradas en el índice de etiquetas y tamaño con el que se vuelve a podar
+_indexed_keys = 0
+_prune_at = 2 * _response_cache.max_entries
+# Se incrementa en cada invalidación para no guardar respuestas calculadas antes de ella
+_generation = 0
+
+
+def compute_etag(body: bytes) -> str:
+    """Calcula un ETag fuerte a partir del cuerpo de la respuesta"""
+    return '"' + hashlib.sha256(body).hexdigest() + '"'
+
+
+def _etag_matches(etag: str) -> bool:
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+def _not_modified(etag: str, cache_control: str):
+    response = make_response('', 304)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def _cache_key():
+    return (request.path, tuple(sorted(request.args.items(multi=True))))
+
+
+def _prune_tag_index():
+    """Quita del índice las claves que la caché ya ha expulsado o dado por caducadas (con _tag_lock)"""
+    global _indexed_keys, _prune_at
+    live = _response_cache.live_keys()
+    for tag in list(_tag_index):
+        keys = _tag_index[tag] & live
+        if keys:
+            _tag_index[tag] = keys
+        else:
+            del _tag_index[tag]
+    _indexed_keys = sum(len(keys) for keys in _tag_index.values())
+    # Con varias etiquetas por respuesta el índice vivo supera max_entries: podar al doblarse
+    _prune_at = max(2 * _response_cache.max_entries, 2 * _indexed_keys)
+
+
+def _register_tags(key, tags: Iterable[str]):
+    global _indexed_keys
+    with _tag_lock:
+        for tag in tags:
+            keys = _tag_index.setdefault(tag, set())
+            if key not in keys:
+                keys.add(key)
+                _indexed_keys += 1
+        # Las claves expulsadas o caducadas no se quedan en el índice indefinidamente
+        if _indexed_keys > _prune_at:
+            _prune_tag_index()
+
+
+def invalidate_tags(*tags: str):
+    """
+    Elimina de la caché todas las respuestas asociadas a las etiquetas indicadas
+
+    Args:
+        tags: Etiquetas a invalidar (por ejemplo 'blog' o f'vehicle:{vehicle_id}')
+    """
+    global _generation, _indexed_keys
+    keys = set()
+    with _tag_lock:
+        _generation += 1
+        for tag in tags:
+            removed = _tag_index.pop(tag, set())
+            _indexed_keys -= len(removed)
+            keys.update(removed)
+    if keys:
+        _response_cache.invalidate(lambda key: key in keys)
+
+
+def cached_response(tags: Callable[..., List[str]],
+                    cache_control: str = 'public, max-age=0, must-revalidate',
+                    ttl_seconds: Optional[float] = None,
+                    bypass: Optional[Callable[[], bool]] = None):
+    """
+    Decorador de caché de respuestas GET con ETag y Cache-Control
+
+    Args:
+        tags: Función que recibe los argumentos de la vista y devuelve sus etiquetas de invalidación
+        cache_control: Valor de la cabecera Cache-Control para esta ruta
+        ttl_seconds: Caducidad de la respuesta en la caché del proceso
+        bypass: Función sin argumentos; si devuelve True no se usa la caché (p. ej. vistas de administración)
+
+    Returns:
+        Callable: Vista decorada
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or (bypass and bypass()):
+                return view(*args, **kwargs)
+
+            key = _cache_key()
+            cached = _response_cache.get(key)
+            if cached is not None:
+                body, mimetype, etag = cached
+                if _etag_matches(etag):
+                    return _not_modified(etag, cache_control)
+                response = make_response(body, 200)
+                response.mimetype = mimetype
+                response.headers['ETag'] = etag
+                response.headers['Cache-Control'] = cache_control
+                return response
+
+            generation = _generation
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+
+            body = response.get_data()
+            etag = compute_etag(body)
+
+            with _tag_lock:
+                still_valid = generation == _generation
+            if still_valid:
+                _response_cache.set(key, (body, response.mimetype, etag), ttl_seconds)
+                _register_tags(key, tags(*args, **kwargs))
+
+            if _etag_matches(etag):
+                return _not_modified(etag, cache_control)
+
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = cache_control
+            return response
+
+        return wrapper
+    return decorator
@@ -0,0 +1,50 @@
+"""
+Serialización JSON de documentos de MongoDB.
+
+El codificador recorre el documento una sola vez (dentro del codificador C de
+la librería estándar) y solo llama a ``bson_default`` para los tipos que JSON
+no conoce, en lugar de copiar cada documento con funciones recursivas en Python.
+"""
+
+import json
+from datetime import datetime, date
+from typing import Any
+
+from bson import ObjectId
+from flask import Response
+
+
+def bson_default(value: Any) -> Any:
+    """
+    Convierte los tipos BSON no serializables a tipos JSON
+
+    Args:
+        value: Valor que el codificador JSON no sabe serializar
+
+    Returns:
+        Any: Representación JSON del valor (ObjectId -> str, datetime -> ISO 8601)
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Objeto de tipo {type(value).__name__} no serializable a JSON")
+
+
+def dumps(payload: Any) -> str:
+    """Serializa un documento (o lista de documentos) de MongoDB a texto JSON en una sola pasada"""
+    return json.dumps(payload, default=bson_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def json_response(payload: Any, status: int = 200) -> Response:
+    """
+    Crea una respuesta Flask a partir de documentos de MongoDB sin convertirlos previamente
+
+    Args:
+        payload: Documento, lista o diccionario de respuesta (puede contener ObjectId y datetime a cualquier profundidad)
+        status: Código HTTP de la respuesta
+
+    Returns:
+        Response: Respuesta con el cuerpo JSON ya codificado
+    """
+    return Response(dumps(payload), status=status, mimetype='application/json')
@@ -0,0 +1,73 @@
+"""
+Paginación por cursor (keyset) para listados ordenados por (created_at, _id) descendente.
+
+A diferencia de ``skip``, el coste de obtener una página no depende de su
+profundidad: cada página continúa a partir del último (created_at, _id) visto
+usando el índice compuesto de la colección.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId
+
+
+def encode_cursor(document: Dict[str, Any]) -> str:
+    """
+    Genera un cursor opaco a partir del último documento de una página
+
+    Args:
+        document: Documento con los campos created_at y _id
+
+    Returns:
+        str: Cursor codificado en base64 (seguro para URLs)
+    """
+    created_at = document.get('created_at')
+    raw = json.dumps({
+        'c': created_at.isoformat() if isinstance(created_at, datetime) else None,
+        'i': str(document['_id'])
+    }, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], ObjectId]:
+    """
+    Decodifica un cursor generado por encode_cursor
+
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        created_at = datetime.fromisoformat(data['c']) if data.get('c') else None
+        return created_at, ObjectId(data['i'])
+    except Exception:
+        raise ValueError("Cursor de paginación inválido")
+
+
+def keyset_filter(created_at: Optional[datetime], last_id: ObjectId) -> Dict[str, Any]:
+    """
+    Construye el filtro que devuelve los documentos posteriores al cursor
+    en el orden (created_at desc, _id desc)
+
+    Los documentos sin created_at se ordenan al final, por lo que se incluyen
+    explícitamente mientras el cursor aún apunte a un documento con fecha.
+    """
+    if created_at is None:
+        return {'created_at': None, '_id': {'$lt': last_id}}
+
+    return {'$or': [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, '_id': {'$lt': last_id}},
+        {'created_at': None}
+    ]}
+
+
+def merge_filters(query: Dict[str, Any], extra: Dict[str, Any]) -> Dict[str, Any]:
+    """Combina dos filtros de MongoDB sin pisar operadores de nivel superior como $or"""
+    if not query:
+        return extra
+    return {'$and': [query, extra]}
@@ -157,7 +157,7 @@ const BlogSection = () => {
               keywords: []
             }
           });
-          setMarkdownContent(localPost.content || "");
+          setMarkdownContent(localPost.content ?? "");
           setEditingPost(localPost);
           setShowEditor(true);
           setShowAIGenerator(false);
@@ -182,7 +182,7 @@ const BlogSection = () => {
         }
       });
       
-      setMarkdownContent(post.content || "");
+      setMarkdownContent(post.content ?? "");
       setEditingPost(post);
       setShowEditor(true);
       setShowAIGenerator(false);
@@ -586,7 +586,7 @@ const BlogSection = () => {
   // Filtrar posts por búsqueda
   const filteredPosts = posts.filter(post => 
     post.title.toLowerCase().includes(searchQuery.toLowerCase()) ||
-    post.content.toLowerCase().includes(searchQuery.toLowerCase()) ||
+    (post.content ?? '').toLowerCase().includes(searchQuery.toLowerCase()) ||
     post.categories.some(cat => cat.toLowerCase().includes(searchQuery.toLowerCase())) ||
     post.tags.some(tag => tag.toLowerCase().includes(searchQuery.toLowerCase()))
   );
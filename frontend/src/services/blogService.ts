@@ -165,8 +165,8 @@ export const blogService = {
    */
   getAllPosts: async (): Promise<BlogPost[]> => {
     try {
-      console.log(`Fetching posts from: ${BLOG_API_URL}/posts`);
-      const response = await axios.get(`${BLOG_API_URL}/posts`);
+      console.log(`Fetching posts from: ${BLOG_API_URL}/posts?fields=summary`);
+      const response = await axios.get(`${BLOG_API_URL}/posts?fields=summary`);
       console.log("Posts API response:", response.data);
       
       // Verificar si la respuesta tiene el formato nuevo (con paginación)
@@ -184,32 +184,10 @@ export const blogService = {
    */
   getPostById: async (id: string): Promise<BlogPost | null> => {
     try {
-      console.log(`Attempting to fetch post with ID ${id}`);
-      
-      // Primero intentamos obtener todos los posts
-      const allPosts = await blogService.getAllPosts();
-      
-      // Buscar el post por ID en la lista de posts
-      const post = allPosts.find(p => p._id === id || p.id === id);
-      
-      if (post) {
-        console.log("Post encontrado en la lista:", post);
-        return post;
-      }
-      
-      // Si no se encuentra, intentamos con el endpoint específico por slug
-      console.log("Post no encontrado en la lista, buscando por slug");
-      const response = await axios.get(`${BLOG_API_URL}/posts`);
-      const postsData = response.data.posts ? response.data.posts : response.data;
-      const foundPost = postsData.find((p: any) => p._id === id || p.id === id);
-      
-      if (foundPost) {
-        console.log("Post encontrado por ID:", foundPost);
-        return mapApiPostToLocal(foundPost);
-      }
-      
-      console.log("Post no encontrado");
-      return null;
+      // El listado público no trae el cuerpo del artículo: se pide el post completo
+      console.log(`Fetching post with ID ${id} from: ${BLOG_API_URL}/posts/id/${id}`);
+      const response = await axios.get(`${BLOG_API_URL}/posts/id/${id}`);
+      return mapApiPostToLocal(response.data);
     } catch (error) {
       console.error(`Error fetching post with ID ${id}:`, error);
       return null;
@@ -254,7 +232,7 @@ export const blogService = {
   getPostsByCategory: async (category: string): Promise<BlogPost[]> => {
     try {
       console.log(`Fetching posts for category ${category} from: ${BLOG_API_URL}/posts?category=${category}`);
-      const response = await axios.get(`${BLOG_API_URL}/posts?category=${category}`);
+      const response = await axios.get(`${BLOG_API_URL}/posts?category=${category}&fields=summary`);
       console.log("Category posts API response:", response.data);
       
       // Verificar si la respuesta tiene el formato nuevo (con paginación)
@@ -273,7 +251,7 @@ export const blogService = {
   getPostsByTag: async (tag: string): Promise<BlogPost[]> => {
     try {
       console.log(`Fetching posts for tag ${tag} from: ${BLOG_API_URL}/posts?tag=${tag}`);
-      const response = await axios.get(`${BLOG_API_URL}/posts?tag=${tag}`);
+      const response = await axios.get(`${BLOG_API_URL}/posts?tag=${tag}&fields=summary`);
       console.log("Tag posts API response:", response.data);
       
       // Verificar si la respuesta tiene el formato nuevo (con paginación)
@@ -292,7 +270,7 @@ export const blogService = {
   searchPosts: async (query: string): Promise<BlogPost[]> => {
     try {
       console.log(`Searching posts with query ${query} from: ${BLOG_API_URL}/posts?q=${query}`);
-      const response = await axios.get(`${BLOG_API_URL}/posts?q=${query}`);
+      const response = await axios.get(`${BLOG_API_URL}/posts?q=${query}&fields=summary`);
       console.log("Search posts API response:", response.data);
       
       // Verificar si la respuesta tiene el formato nuevo (con paginación)
@@ -341,7 +319,7 @@ export const blogService = {
   getFeaturedPosts: async (): Promise<BlogPost[]> => {
     try {
       console.log(`Fetching featured posts from: ${BLOG_API_URL}/posts/featured`);
-      const response = await axios.get(`${BLOG_API_URL}/posts/featured`);
+      const response = await axios.get(`${BLOG_API_URL}/posts/featured?fields=summary`);
       console.log("Featured posts API response:", response.data);
       
       // La ruta de posts destacados podría no tener paginación, pero verificamos por si acaso